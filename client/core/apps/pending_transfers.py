@@ -0,0 +1,106 @@
+"""Credit transfers waiting for their sender to confirm them.
+
+Copyright (c) 2016-present, Facebook, Inc.
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree. An additional grant
+of patent rights can be found in the PATENTS file in the same directory.
+"""
+
+import threading
+import time
+
+from ccm.common import logger
+from core.db import ConnectorFactory
+
+
+class PendingTransferDB(object):
+    """Pending credit transfers, keyed by sender and confirmation code.
+
+    A transfer can be confirmed for ttl seconds after it is added. Expired
+    transfers are never returned, and are deleted by sweep(), which add()
+    runs at most once every sweep_interval seconds rather than on every
+    request. Use PendingTransferDB.shared() to get the instance a process
+    shares.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, ttl=600, sweep_interval=60, connector=None,
+                 clock=time.time):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.clock = clock
+        # Passing in a connector argument is intended to be used for testing
+        # purposes only (but works more generally).
+        self._connector = (connector if connector else
+                           ConnectorFactory.get_default_connector())
+        self._last_sweep = clock()
+        self._sweep_lock = threading.Lock()
+        self._createdb()
+
+    @classmethod
+    def shared(cls):
+        """Gets the process-wide PendingTransferDB."""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def _createdb(self):
+        # The primary key is the index confirmations are looked up by.
+        self._connector.exec_stmt(
+            "CREATE TABLE IF NOT EXISTS endaga_pending_transfer(from_acct"
+            " text NOT NULL, code text NOT NULL, time double precision NOT"
+            " NULL, to_acct text NOT NULL, amount bigint NOT NULL, PRIMARY"
+            " KEY (from_acct, code));")
+
+    def add(self, from_imsi, to_imsi, amount, code):
+        """Adds a pending transfer, replacing any the sender has pending
+        with the same code.
+        """
+        self._maybe_sweep()
+
+        def insert(cur):
+            cur.execute("DELETE FROM endaga_pending_transfer WHERE"
+                        " from_acct=%s AND code=%s;", (from_imsi, code))
+            cur.execute("INSERT INTO endaga_pending_transfer (from_acct,"
+                        " code, time, to_acct, amount) VALUES (%s, %s, %s,"
+                        " %s, %s);",
+                        (from_imsi, code, self.clock(), to_imsi, amount))
+        self._connector.with_cursor(insert)
+
+    def pop(self, from_imsi, code):
+        """Removes a pending transfer, returning its (to_imsi, amount), or
+        None if the sender has no unexpired transfer with that code.
+
+        Since the transfer is deleted as it is read, only one of several
+        concurrent confirmations of it gets it.
+        """
+        res = self._connector.exec_and_get_option(
+            "DELETE FROM endaga_pending_transfer WHERE from_acct=%s AND"
+            " code=%s RETURNING to_acct, amount, time;", (from_imsi, code))
+        if not res:
+            return None
+        to_imsi, amount, added = res
+        if self.clock() - added > self.ttl:
+            return None
+        return to_imsi, amount
+
+    def sweep(self):
+        """Deletes the expired transfers."""
+        self._connector.exec_stmt(
+            "DELETE FROM endaga_pending_transfer WHERE time < %s;",
+            (self.clock() - self.ttl, ))
+
+    def _maybe_sweep(self):
+        with self._sweep_lock:
+            if self.clock() - self._last_sweep < self.sweep_interval:
+                return
+            self._last_sweep = self.clock()
+        try:
+            self.sweep()
+        except Exception as e:
+            logger.error("PendingTransferDB: sweep failed: %s" % e)
@@ -0,0 +1,300 @@
+"""A local queue of broadcast SMS, fed to FreeSwitch at the radio's pace.
+
+The cloud sends a network-wide broadcast to each tower as a single signed
+batch of recipients. Federer adds the batch to the BroadcastQueue and answers
+straight away; endagad runs the one BroadcastSender, which delivers the queue
+no faster than the tower has SDCCHs to carry it, and bills what it delivers a
+batch at a time.
+
+Copyright (c) 2016-present, Facebook, Inc.
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree. An additional grant
+of patent rights can be found in the PATENTS file in the same directory.
+"""
+
+import threading
+import time
+
+from smspdu import concat
+
+from ccm.common import logger
+from core import billing
+from core import events
+from core.db import ConnectorFactory
+from core.exceptions import BSSError, SubscriberNotFound
+from core.subscriber import subscriber
+
+
+class BroadcastQueue(object):
+    """SMS waiting to be sent, oldest first.
+
+    The queue is a table, so that it is shared by every federer process and
+    survives restarts. Each message records how many parts it will be sent
+    in, the service type it is billed as, and how many times FreeSwitch has
+    refused it. Messages refused too often are moved to the
+    endaga_broadcast_failed table, rather than retried forever.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, connector=None):
+        # Passing in a connector argument is intended to be used for testing
+        # purposes only (but works more generally).
+        self._connector = (connector if connector else
+                           ConnectorFactory.get_default_connector())
+        self._createdb()
+
+    @classmethod
+    def shared(cls):
+        """Gets the process-wide BroadcastQueue."""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def __len__(self):
+        return self._connector.exec_and_fetch_one(
+            "SELECT count(*) FROM endaga_broadcast;")[0]
+
+    def _createdb(self):
+        self._connector.exec_stmt(
+            "CREATE TABLE IF NOT EXISTS endaga_broadcast(id serial PRIMARY"
+            " KEY, to_number text NOT NULL, from_number text NOT NULL,"
+            " body text NOT NULL, parts integer NOT NULL,"
+            " service_type text NOT NULL, attempts integer NOT NULL"
+            " DEFAULT 0);")
+        self._connector.exec_stmt(
+            "CREATE TABLE IF NOT EXISTS endaga_broadcast_failed(id integer"
+            " PRIMARY KEY, to_number text NOT NULL, from_number text NOT"
+            " NULL, body text NOT NULL, parts integer NOT NULL,"
+            " service_type text NOT NULL, attempts integer NOT NULL);")
+
+    def add(self, recipients, from_number, body, service_type):
+        """Queues the body to be sent to each of the recipients.
+
+        Raises:
+            ValueError if the body is too long to send
+        """
+        parts = len(concat.segment(body)[1])
+        rows = [(to, from_number, body, parts, service_type)
+                for to in recipients]
+
+        def insert(cur):
+            cur.executemany(
+                "INSERT INTO endaga_broadcast (to_number, from_number, body,"
+                " parts, service_type) VALUES (%s, %s, %s, %s, %s);", rows)
+        self._connector.with_cursor(insert)
+
+    def peek(self, num):
+        """The oldest num messages, as (id, to_number, from_number, body,
+        parts, service_type) tuples.
+        """
+        return self._connector.exec_and_fetch(
+            "SELECT id, to_number, from_number, body, parts, service_type"
+            " FROM endaga_broadcast ORDER BY id LIMIT %s;", (num,))
+
+    def remove(self, ids):
+        """Drops the messages with the given ids."""
+        if not ids:
+            return
+        self._connector.exec_stmt(
+            "DELETE FROM endaga_broadcast WHERE id IN (%s);" %
+            ', '.join(['%s'] * len(ids)), tuple(ids))
+
+    def fail(self, ids, max_attempts):
+        """Counts a failed attempt to send each of the messages with the given
+        ids, and moves those that have failed max_attempts times to
+        endaga_broadcast_failed.
+
+        Returns the number of messages moved.
+        """
+        if not ids:
+            return 0
+        in_ids = ', '.join(['%s'] * len(ids))
+
+        def update(cur):
+            cur.execute("UPDATE endaga_broadcast SET attempts = attempts + 1"
+                        " WHERE id IN (%s);" % in_ids, tuple(ids))
+            failed = (max_attempts, ) + tuple(ids)
+            cur.execute(
+                "INSERT INTO endaga_broadcast_failed (id, to_number,"
+                " from_number, body, parts, service_type, attempts) SELECT"
+                " id, to_number, from_number, body, parts, service_type,"
+                " attempts FROM endaga_broadcast WHERE attempts >= %%s AND"
+                " id IN (%s);" % in_ids, failed)
+            cur.execute("DELETE FROM endaga_broadcast WHERE attempts >= %%s"
+                        " AND id IN (%s);" % in_ids, failed)
+            return cur.rowcount
+        return self._connector.with_cursor(update)
+
+
+class BroadcastSender(object):
+    """Sends the BroadcastQueue to FreeSwitch as fast as the radio allows.
+
+    Every message part is delivered on an SDCCH, which it holds for a few
+    seconds. Each round we read the tower's load, send as many parts as there
+    are idle SDCCHs (less broadcast.sdcch_reserve, kept back for subscribers'
+    own traffic) and wait broadcast.interval seconds for them to be
+    released. If the load can't be read, one message is sent per round.
+    Messages FreeSwitch refuses stay queued, until they have been refused
+    broadcast.max_attempts times.
+
+    There must be only one sender per tower, so it runs in endagad.
+    """
+
+    def __init__(self, queue, fs_ic, bts, conf, clock=time.time):
+        self.queue = queue
+        self.fs_ic = fs_ic
+        self.bts = bts
+        self.conf = conf
+        self.clock = clock
+        self._stats_lock = threading.Lock()
+        self._sent = 0
+        self._stats_since = clock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def budget(self):
+        """The number of message parts we can send this round."""
+        try:
+            idle = self.idle_sdcchs(self.bts.get_load())
+        except BSSError as e:
+            logger.error("Broadcast: bts get_load error: %s" % e)
+            return 1
+        except KeyError as e:
+            logger.error("Broadcast: no SDCCH load in %s" % e)
+            return 1
+        return idle - self.conf.get('broadcast.sdcch_reserve', 1)
+
+    @staticmethod
+    def idle_sdcchs(load):
+        """The number of idle SDCCHs in a BTS get_load() result.
+
+        OpenBTS reports its SDCCHs as a whole, while Osmocom reports those
+        on the combined CCCH+SDCCH/4 timeslot and on SDCCH/8 timeslots
+        separately.
+
+        Raises:
+            KeyError if the load has neither
+        """
+        if 'sdcch_available' in load:
+            return load['sdcch_available'] - load['sdcch_load']
+        return (load['ccch_sdcch4_max'] - load['ccch_sdcch4_load'] +
+                load['sdcch8_max'] - load['sdcch8_load'])
+
+    def send_next(self):
+        """Sends and bills one round of queued messages.
+
+        Returns the number of messages sent.
+        """
+        budget = self.budget()
+        if budget <= 0:
+            return 0
+        batch = []
+        for row in self.queue.peek(budget):
+            budget -= row[4]
+            # A message longer than a whole round's budget still goes out on
+            # its own, or it would never be sent.
+            if budget < 0 and batch:
+                break
+            batch.append(row)
+        if not batch:
+            return 0
+        accepted = self.fs_ic.send_to_numbers(
+            [(to, from_, body) for _, to, from_, body, _, _ in batch])
+        if accepted is None:
+            logger.error("Broadcast: FreeSwitch couldn't be reached")
+            return 0
+        sent = [row for row, ok in zip(batch, accepted) if ok]
+        refused = [row[0] for row, ok in zip(batch, accepted) if not ok]
+        self.queue.remove([row[0] for row in sent])
+        if refused:
+            dropped = self.queue.fail(
+                refused, self.conf.get('broadcast.max_attempts', 3))
+            logger.error("Broadcast: FreeSwitch refused %d messages, %d"
+                         " given up on" % (len(refused), dropped))
+        self.bill([(to, from_, service_type)
+                   for _, to, from_, _, _, service_type in sent])
+        with self._stats_lock:
+            self._sent += len(sent)
+        return len(sent)
+
+    def bill(self, messages):
+        """Bills each sent (to_number, from_number, service_type) message to
+        its recipient, with one balance update and one EventStore write.
+        """
+        try:
+            charges = []
+            for to, from_, service_type in messages:
+                try:
+                    imsi = subscriber.get_imsi_from_number(to)
+                except SubscriberNotFound:
+                    imsi = None
+                if not imsi:
+                    continue
+                tariff = billing.get_sms_cost(service_type,
+                                              destination_number=to)
+                charges.append((imsi, to, from_, tariff))
+            results = subscriber.adjust_credits(
+                [(imsi, -int(tariff)) for imsi, _, _, tariff in charges])
+            events.create_sms_events([{
+                'owner_imsi': imsi,
+                'old_balance': old_balance,
+                'cost': tariff,
+                'reason': 'SMS from %s to %s (incoming_sms)' % (from_, imsi),
+                'to_number': to,
+                'from_number': from_,
+            } for (imsi, to, from_, tariff), (_, old_balance, _) in
+                zip(charges, results)])
+        except Exception as e:
+            logger.error("Broadcast: bill error: %s" % e)
+
+    def take_stats(self):
+        """Delivery stats since the last call, for the checkin.
+
+        broadcast.sms_per_min is the delivery rate over that time, and
+        broadcast.queue_depth is the number of messages still to send.
+        """
+        # read the queue first, so that a database error doesn't lose the
+        # counts
+        queue_depth = len(self.queue)
+        with self._stats_lock:
+            now = self.clock()
+            sent, elapsed = self._sent, now - self._stats_since
+            self._sent, self._stats_since = 0, now
+        return {
+            'broadcast.sent': sent,
+            'broadcast.sms_per_min': 60.0 * sent / elapsed if elapsed else 0,
+            'broadcast.queue_depth': queue_depth,
+        }
+
+    def start(self):
+        """Sends the queue in a daemon thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                sent = self.send_next()
+            except Exception as e:
+                logger.error("Broadcast: send failed: %s" % e)
+                sent = 0
+            # Poll an idle queue less often.
+            interval = self.conf.get('broadcast.interval', 4)
+            if self._stop.wait(interval if sent else 2 * interval):
+                return
@@ -60,9 +60,9 @@ class OsmocomBTS(BaseBTS):
         pass
 
     def get_camped_subscribers(self, access_period=0, auth=1):
+        # Reads the HLR database directly, no VTY connection needed
         try:
-            with self.subscribers as s:
-                return s.camped_subscribers(access_period, auth)
+            return self.subscribers.camped_subscribers(access_period, auth)
         except Exception:
             exc_type, exc_value, exc_trace = sys.exc_info()
             raise BSSError("%s: %s" % (exc_type, exc_value)).with_traceback(exc_trace)
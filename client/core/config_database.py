@@ -97,7 +97,6 @@ def set_defaults(force_replace=False):
         'subscriber_registry': "/var/lib/asterisk/sqlite3dir/sqlite3.db",
         'db_location': "/var/lib/asterisk/sqlite3dir/eventbuf.db",
         # Credit transfer options
-        'pending_transfer_db_path': "/tmp/vbts_pending_transfer.sqlite",
         'app_number': 102,
         'credit_check_number': 103,
         'number_check_number': 104,
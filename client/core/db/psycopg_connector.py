@@ -13,6 +13,7 @@ of patent rights can be found in the PATENTS file in the same directory.
 """
 
 import os
+import threading
 
 import psycopg2
 
@@ -20,6 +21,10 @@ from .connector import BaseConnector
 
 
 class PsycopgConnector(BaseConnector):
+    """
+    Each thread that uses the connector gets a connection of its own, so
+    that the threads of a server don't share (and interleave) transactions.
+    """
 
     db_errors = (psycopg2.Error, psycopg2.Warning)
     db_restart_errors = (psycopg2.InterfaceError, psycopg2.OperationalError)
@@ -35,8 +40,17 @@ class PsycopgConnector(BaseConnector):
         self._host = host
         self._password = password
         self._user = user
+        self._local = threading.local()
         super(PsycopgConnector, self).__init__()
 
+    @property
+    def _connection(self):
+        return getattr(self._local, 'connection', None)
+
+    @_connection.setter
+    def _connection(self, connection):
+        self._local.connection = connection
+
     def connect(self):
 
         self._connection = psycopg2.connect(host=self._host,
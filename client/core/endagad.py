@@ -18,9 +18,12 @@ import time
 from requests.exceptions import ConnectionError, Timeout
 
 from ccm.common import logger
-from core import interconnect, system_utilities
+from core import freeswitch_interconnect, interconnect, system_utilities
+from core import outbound_sms
+from core.broadcast_queue import BroadcastQueue, BroadcastSender
 from core.bts import bts
 from core.config_database import ConfigDB
+from core.db.connector import ConnectorError, DatabaseError
 from core.exceptions import BSSError
 from core import registration
 from core.service import Service
@@ -39,6 +42,7 @@ class EndagaD(object):
         log_level = self._conf.get("logger.global.log_level", "warning")
         logger.DefaultLogger.update_handler(level=log_level)
         logger.notice("EndagaD started")
+        self._broadcast = None
 
     def _reset_bts_config(self):
         logger.notice("Performing set_factory")
@@ -53,6 +57,16 @@ class EndagaD(object):
             # OSError, IOError or whatever envoy will raise
             logger.critical("something unexpected happened: %s" % e)
 
+    def _report_stats(self, eapi):
+        """Adds the broadcast and outbound SMS stats to the next checkin.
+        If the database fails, the checkin goes without them.
+        """
+        try:
+            eapi.report_load_stats(self._broadcast.take_stats())
+            eapi.report_load_stats(outbound_sms.collect_stats())
+        except (ConnectorError, DatabaseError) as e:
+            logger.error("stats not reported: %s" % e)
+
     def run(self):
         """
         Main loop for endagad. This moves the system through the various
@@ -98,6 +112,15 @@ class EndagaD(object):
             # additional configuration.
             self._reset_bts_config()
 
+            # Services are up, so broadcasts can be sent.
+            if self._broadcast is None:
+                logger.notice("Performing broadcast sender start")
+                self._broadcast = BroadcastSender(
+                    BroadcastQueue(),
+                    freeswitch_interconnect.freeswitch_ic(self._conf), bts,
+                    self._conf)
+                self._broadcast.start()
+
             # Update the inbound_url if the VPN is up.
             if system_utilities.get_vpn_ip() is not None:
                 logger.notice("Performing register_update")
@@ -109,6 +132,7 @@ class EndagaD(object):
             try:
                 # Sends events, tries to get config info. Can proceed w/o VPN.
                 logger.notice("Performing checkin.")
+                self._report_stats(eapi)
                 checkin_data = eapi.checkin(timeout=30)
                 logger.notice("Performing system health check.")
                 if not registration.system_healthcheck(checkin_data):
@@ -0,0 +1,249 @@
+"""A pooled client for the FreeSwitch event socket (ESL).
+
+Only what we use of the inbound ESL protocol is implemented: authenticating,
+and running api and bgapi commands. Connections are kept open in an ESLPool
+and reused, rather than connected and authenticated for every command.
+
+Copyright (c) 2016-present, Facebook, Inc.
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree. An additional grant
+of patent rights can be found in the PATENTS file in the same directory.
+"""
+
+import contextlib
+import select
+import socket
+import threading
+
+from ccm.common import logger
+
+
+class ESLError(Exception):
+    """An ESL command failed, or FreeSwitch couldn't be reached."""
+    pass
+
+
+class ESLConnectionClosed(ESLError):
+    """FreeSwitch closed the connection.
+
+    sent is False if it was closed before the commands were written, so none
+    of them can have run.
+    """
+
+    def __init__(self, message, sent=True):
+        ESLError.__init__(self, message)
+        self.sent = sent
+
+
+class ESLConnection(object):
+    """An authenticated inbound connection to FreeSwitch.
+
+    Every read and write times out after timeout seconds. A connection that
+    has raised ESLError is in an unknown state, and must be closed.
+    """
+
+    def __init__(self, host, port, password, timeout=5):
+        try:
+            self._sock = socket.create_connection((host, int(port)), timeout)
+        except (OSError, ValueError) as e:
+            raise ESLError("connect to %s:%s failed: %s" % (host, port, e))
+        self._file = self._sock.makefile('rb')
+        try:
+            headers, _ = self._recv()
+            if headers.get('Content-Type') != 'auth/request':
+                raise ESLError("unexpected greeting: %s" % headers)
+            self._reply("auth %s" % password)
+        except ESLError:
+            self.close()
+            raise
+
+    def close(self):
+        for closeable in (self._file, self._sock):
+            try:
+                closeable.close()
+            except OSError:
+                pass
+
+    def stale(self):
+        """Whether an idle connection can't be used: FreeSwitch closed it,
+        or sent something we didn't ask for.
+        """
+        try:
+            readable, _, _ = select.select([self._sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def _send(self, *cmds):
+        # A line break would end the command early, and start another with
+        # whatever follows it.
+        for cmd in cmds:
+            if '\n' in cmd or '\r' in cmd:
+                raise ESLError("line break in command: %r" % cmd)
+        data = ''.join('%s\n\n' % cmd for cmd in cmds).encode('utf-8')
+        try:
+            self._sock.sendall(data)
+        except (BrokenPipeError, ConnectionResetError) as e:
+            raise ESLConnectionClosed("send failed: %s" % e, sent=False)
+        except OSError as e:
+            raise ESLError("send failed: %s" % e)
+
+    def _recv(self):
+        """Reads a message, returning its headers and body."""
+        headers = {}
+        try:
+            while True:
+                line = self._file.readline()
+                if not line:
+                    raise ESLConnectionClosed("connection closed")
+                line = line.decode('utf-8').rstrip('\n')
+                if not line:
+                    if headers:
+                        break
+                    continue
+                key, _, value = line.partition(': ')
+                headers[key] = value
+            body = b''
+            if 'Content-Length' in headers:
+                body = self._file.read(int(headers['Content-Length']))
+        except ConnectionResetError as e:
+            raise ESLConnectionClosed("receive failed: %s" % e)
+        except OSError as e:
+            raise ESLError("receive failed: %s" % e)
+        return headers, body.decode('utf-8')
+
+    def _read_reply(self):
+        headers, _ = self._recv()
+        reply = headers.get('Reply-Text', '')
+        if not reply.startswith('+OK'):
+            raise ESLError(reply or "unexpected reply: %s" % headers)
+        return headers
+
+    def _reply(self, cmd):
+        self._send(cmd)
+        return self._read_reply()
+
+    def api(self, cmd):
+        """Runs a command and waits for its output."""
+        self._send("api %s" % cmd)
+        headers, body = self._recv()
+        if headers.get('Content-Type') != 'api/response':
+            raise ESLError("unexpected reply: %s" % headers)
+        return body
+
+    def bgapi(self, *cmds):
+        """Starts commands in the background, and returns the job id of each
+        command, or None for those FreeSwitch refused.
+
+        The commands are all sent before any reply is read. Every reply is
+        read, so the connection can be reused even if some were refused.
+        """
+        self._send(*["bgapi %s" % cmd for cmd in cmds])
+        jobs = []
+        for cmd in cmds:
+            headers, _ = self._recv()
+            reply = headers.get('Reply-Text', '')
+            if reply.startswith('+OK'):
+                jobs.append(headers.get('Job-UUID', ''))
+            else:
+                logger.warning("ESL: bgapi %s refused: %s" % (cmd, reply))
+                jobs.append(None)
+        return jobs
+
+
+class ESLPool(object):
+    """Up to size open ESLConnections, shared by the threads of a process.
+
+    A connection that fails is dropped. Idle connections may have been
+    closed by a FreeSwitch restart: those found closed are dropped before
+    use, and a command that couldn't be written to a reused connection is
+    retried once on a new one. Once the commands are written they may have
+    run, so a connection closed while we wait for the replies is an error
+    for the caller to handle, rather than a retry that could run them twice.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, host, port, password, size=4, timeout=5,
+                 connect=ESLConnection):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.timeout = timeout
+        self._connect = connect
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @classmethod
+    def shared(cls, conf):
+        """Gets the process-wide ESLPool for the FreeSwitch in conf."""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls(conf['fs_esl_ip'], conf['fs_esl_port'],
+                                  conf['fs_esl_pass'],
+                                  size=conf.get('fs_esl.pool_size', 4),
+                                  timeout=conf.get('fs_esl.timeout', 5))
+            return cls._shared
+
+    def close(self):
+        """Closes the idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for con in idle:
+            con.close()
+
+    @contextlib.contextmanager
+    def _connection(self, reuse=True):
+        """Yields (connection, whether it was reused), returning the
+        connection to the pool afterwards unless it raised.
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise ESLError("no ESL connection free")
+        try:
+            con = None
+            if reuse:
+                with self._lock:
+                    while self._idle and con is None:
+                        con = self._idle.pop()
+                        if con.stale():
+                            con.close()
+                            con = None
+            reused = con is not None
+            if not reused:
+                con = self._connect(self.host, self.port, self.password,
+                                    self.timeout)
+            try:
+                yield con, reused
+            except BaseException:
+                con.close()
+                raise
+            with self._lock:
+                self._idle.append(con)
+        finally:
+            self._slots.release()
+
+    def _run(self, method, *args):
+        reused = False
+        try:
+            with self._connection() as (con, reused):
+                return getattr(con, method)(*args)
+        except ESLConnectionClosed as e:
+            if e.sent or not reused:
+                raise
+            logger.notice("ESL: reconnecting (%s)" % e)
+        with self._connection(reuse=False) as (con, _):
+            return getattr(con, method)(*args)
+
+    def api(self, cmd):
+        """Runs a command and waits for its output."""
+        return self._run('api', cmd)
+
+    def bgapi(self, *cmds):
+        """Starts commands in the background on one connection, and returns
+        their job ids, or None for those FreeSwitch refused.
+        """
+        return self._run('bgapi', *cmds)
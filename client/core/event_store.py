@@ -95,6 +95,13 @@ class EventStore(object):
                     (json.dumps(event_dict),))
         self.conn.commit()
 
+    def add_many(self, event_dicts):
+        """Add several event-describing dictionaries in one transaction."""
+        cur = self.conn.cursor()
+        cur.executemany("INSERT INTO endaga_events (data) VALUES (%s);",
+                        [(json.dumps(e),) for e in event_dicts])
+        self.conn.commit()
+
     def get_events(self, num=100):
         """Get the selected number of events from the event store."""
         cur = self.conn.cursor()
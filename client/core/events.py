@@ -82,7 +82,7 @@ def create_call_event(owner_imsi, from_imsi, from_number, to_imsi, to_number,
 
 
 def create_sms_event(owner_imsi, old_balance, cost, reason, to_number,
-                     from_imsi=None, from_number=None):
+                     from_imsi=None, from_number=None, write=True):
     """Creates an SMS-related event with data attached to the owner_imsi."""
     new_balance = old_balance - int(cost)
     # Clamp the new_balance to a min of zero.
@@ -92,9 +92,21 @@ def create_sms_event(owner_imsi, old_balance, cost, reason, to_number,
             owner_imsi, old_balance, cost, reason)
         logger.warning(message)
         new_balance = 0
-    _create_event(owner_imsi, old_balance, new_balance, reason,
-                  from_imsi=from_imsi, from_number=from_number,
-                  to_number=to_number, tariff=cost)
+    return _create_event(owner_imsi, old_balance, new_balance, reason,
+                         from_imsi=from_imsi, from_number=from_number,
+                         to_number=to_number, tariff=cost, write=write)
+
+
+def create_sms_events(sms_events):
+    """Creates several SMS-related events with a single EventStore write.
+
+    Args:
+      sms_events: a list of dicts of create_sms_event arguments
+    """
+    data = [create_sms_event(write=False, **e) for e in sms_events]
+    if data:
+        EventStore().add_many(data)
+    return data
 
 
 def create_gprs_event(imsi, cost, reason, up_bytes, down_bytes, timespan):
@@ -18,10 +18,12 @@ import web
 import traceback
 
 from ccm.common import logger
+from core.config_database import ConfigDB
 
 
 urls = (
     "/endaga_sms", "core.federer_handlers.sms.endaga_sms",
+    "/broadcast_sms", "core.federer_handlers.sms.broadcast_sms",
     "/out_endaga_sms", "core.federer_handlers.sms.OutgoingSMSHandler",
     "/endaga_registration",
         "core.federer_handlers.registration.endaga_registration",
@@ -57,5 +59,40 @@ web.application.handle_with_processors = handle_with_logging
 app = web.application(urls, locals())
 
 
+def serve(bind_address=None):
+    """Serves the app over FastCGI with a bounded pool of worker threads.
+
+    lighttpd starts a few federer processes (see 10-federer-fastcgi.conf),
+    each serving up to federer.max_threads requests at once. The threads of
+    a process share its database connector, ESL pool and outbound SMS pool.
+    With no bind_address, we serve on the socket lighttpd passes us.
+
+    Connections aren't multiplexed, since flup starts a thread for every
+    request on a multiplexed connection, past maxThreads. A connection that
+    arrives while every thread is busy waits for one to be free. flup would
+    close it instead, which lighttpd answers with a 5xx, and the cloud doesn't
+    resend requests that get one, so they would be lost.
+    """
+    # flup is installed alongside us, not as a pip dependency (see setup.py)
+    from flup.server.fcgi import WSGIServer
+    from flup.server.threadpool import ThreadPool
+
+    class QueueingThreadPool(ThreadPool):
+        def addJob(self, job, allowQueuing=True):
+            return ThreadPool.addJob(self, job, allowQueuing=True)
+
+    conf = ConfigDB()
+    max_threads = int(conf.get('federer.max_threads', 8))
+    server = WSGIServer(app.wsgifunc(), bindAddress=bind_address,
+                        multiplexed=False, debug=False, minSpare=1,
+                        maxSpare=max_threads, maxThreads=max_threads)
+    # flup has no option for this, so swap in a pool that queues.
+    server._threadPool.shutdown()
+    server._threadPool = QueueingThreadPool(
+        minSpare=1, maxSpare=max_threads, maxThreads=max_threads)
+    server.run()
+
+
 if __name__ == "__main__":
+    # the web.py development server
     app.run()
@@ -8,8 +8,11 @@ LICENSE file in the root directory of this source tree. An additional grant
 of patent rights can be found in the PATENTS file in the same directory.
 """
 
+from collections import defaultdict
+import io
+import xml.etree.ElementTree as ElementTree
+
 import web
-import xml.dom.minidom as xml
 
 from ccm.common import logger
 from core import events
@@ -18,28 +21,59 @@ from core.subscriber import subscriber
 
 IMSI_PREFIX = "IMSI"
 
-def get_tag_text(nodelist):
-    """ Get the text value of an XML tag (from the minidom doc)
+# The tags of an XML CDR we bill from.
+CDR_TAGS = frozenset([
+    "billsec", "callee_id_number", "caller_id_name", "destination_number",
+    "duration", "hangup_cause", "origination", "service_type", "username",
+])
+
+
+def parse_cdr(cdr_xml):
+    """ Reads the tags we bill from out of an XML CDR, in a single streaming
+        pass. Each element is dropped once it has been read, so the CDR's
+        tree (most of it channel variables we don't use) is never built.
+
+        Returns a dict of tag name -> list of (parent tag name, text) for
+        each tag in CDR_TAGS, in document order.
+    """
+    tags = defaultdict(list)
+    path = []
+    for event, elem in ElementTree.iterparse(io.StringIO(cdr_xml),
+                                             events=("start", "end")):
+        if event == "start":
+            path.append(elem)
+            continue
+        path.pop()
+        parent = path[-1] if path else None
+        if elem.tag in CDR_TAGS:
+            tags[elem.tag].append(
+                (parent.tag if parent is not None else None,
+                 elem.text or ''))
+        elem.clear()
+        if parent is not None:
+            parent.remove(elem)
+    return tags
+
+
+def get_tag_text(cdr_tags, tag, parent=None):
+    """ Get the text of the first instance of a tag in the parsed CDR, only
+        counting those under the given parent tag if there is one. Returns
+        None if there is no such tag.
     """
-    rc = []
-    for node in nodelist:
-        if node.nodeType == node.TEXT_NODE:
-            rc.append(node.data)
-    return ''.join(rc)
+    for parent_tag, text in cdr_tags[tag]:
+        if parent is None or parent_tag == parent:
+            return text
+    return None
 
 
-def get_hangup_cause(cdr_dom):
+def get_hangup_cause(cdr_tags):
     """ Get the FS hangup cause from the XML CDR
         Returns a text string indicating the hangup cause as documented in
         https://freeswitch.org/confluence/display/FREESWITCH/Hangup+Cause+Code+Table
         or 'UNKOWN' if tag does not exists
     """
-    try:
-        hangup = get_tag_text(
-            cdr_dom.getElementsByTagName("hangup_cause")[0].childNodes)
-    except IndexError:
-        hangup = 'UNKNOWN'
-    return hangup
+    hangup = get_tag_text(cdr_tags, "hangup_cause")
+    return hangup if hangup is not None else 'UNKNOWN'
 
 
 class cdr(object):
@@ -59,10 +93,9 @@ class cdr(object):
 
     def process_cdr(self, cdr_xml):
         """Processes the XML CDR for the caller."""
-        cdr_dom = xml.parseString(cdr_xml)
+        cdr_tags = parse_cdr(cdr_xml)
         # Handle only b-legs for billing.
-        origin = cdr_dom.getElementsByTagName("origination")
-        if origin:
+        if cdr_tags["origination"]:
             return
         # Handle only b-legs for billing.
         # For our purposes, billsec is how long the call lasted. call_duration
@@ -70,27 +103,22 @@ class cdr(object):
         # so don't include here. Caller and callee are just used for logging
         # and reason statements.
         # TODO(matt): what happens if the tag does not exist?
-        call_duration = int(get_tag_text(
-            cdr_dom.getElementsByTagName("duration")[0].childNodes))
-        billsec = int(get_tag_text(
-            cdr_dom.getElementsByTagName("billsec")[0].childNodes))
+        call_duration = int(get_tag_text(cdr_tags, "duration"))
+        billsec = int(get_tag_text(cdr_tags, "billsec"))
         # In b-leg cdrs, there are multiple destinations -- the sip one (IMSI)
         # and the dialed one (MSISDN).  We want the latter.
-        callees = cdr_dom.getElementsByTagName("destination_number")
         callee = ''
-        for c in callees:
-            c = get_tag_text(c.childNodes)
+        for _, c in cdr_tags["destination_number"]:
             # NOT THE IMSI
             if c[0:4] != IMSI_PREFIX:
                 callee = c
                 break
         if callee[0] == "+":
             callee = callee[1:]
-        hangupcause = get_hangup_cause(cdr_dom)
+        hangupcause = get_hangup_cause(cdr_tags)
         # This is where we get the info we need to do billing.
-        if len(cdr_dom.getElementsByTagName("service_type")) > 0:
-            service_type = get_tag_text(
-                cdr_dom.getElementsByTagName("service_type")[0].childNodes)
+        service_type = get_tag_text(cdr_tags, "service_type")
+        if service_type is not None:
             # Get caller / callee info.  See the 'CDR notes' doc in drive for
             # more info.
             from_imsi, from_number, to_imsi, to_number = 4 * [None]
@@ -98,46 +126,32 @@ class cdr(object):
             # <caller_profile> parent element. If it's a BTS-originated call,
             # this will be an IMSI; otherwise, it'll be an MSISDN.
             if service_type not in ['incoming_call']:
-                elements = cdr_dom.getElementsByTagName('username')
-                for element in elements:
-                    if element.parentNode.nodeName == 'caller_profile':
-                        username = get_tag_text(element.childNodes)
-                        from_imsi = subscriber.get_imsi_from_username(username)
-                        break
+                username = get_tag_text(cdr_tags, 'username',
+                                        parent='caller_profile')
+                if username is not None:
+                    from_imsi = subscriber.get_imsi_from_username(username)
             # Get 'from_number' (only available for outside and local calls).
             if service_type in ['outside_call', 'local_call', 'incoming_call']:
-                elements = cdr_dom.getElementsByTagName('caller_id_name')
-                for element in elements:
-                    if element.parentNode.nodeName == 'caller_profile':
-                        from_number = get_tag_text(element.childNodes)
-                        break
+                from_number = get_tag_text(cdr_tags, 'caller_id_name',
+                                           parent='caller_profile')
             # Get 'to_imsi' (only available for local/incoming calls).
             if service_type in ['local_call', 'incoming_call']:
-                elements = cdr_dom.getElementsByTagName('callee_id_number')
-                for element in elements:
-                    if element.parentNode.nodeName == 'caller_profile':
-                        callee_id = get_tag_text(element.childNodes)
-                        if callee_id[0:4] == IMSI_PREFIX:
-                            to_imsi = callee_id
-                        else:
-                            # callee_id_number in the CDR is MSISDN.
-                            to_imsi = subscriber.get_imsi_from_number(callee_id)
-                        break
+                callee_id = get_tag_text(cdr_tags, 'callee_id_number',
+                                         parent='caller_profile')
+                if callee_id is not None:
+                    if callee_id[0:4] == IMSI_PREFIX:
+                        to_imsi = callee_id
+                    else:
+                        # callee_id_number in the CDR is MSISDN.
+                        to_imsi = subscriber.get_imsi_from_number(callee_id)
 
             # Get 'to_number' (slightly different for local/incoming calls).
             if service_type in ['outside_call', 'free_call', 'error_call']:
-                elements = cdr_dom.getElementsByTagName('destination_number')
-                for element in elements:
-                    if element.parentNode.nodeName == 'caller_profile':
-                        to_number = get_tag_text(element.childNodes)
-                        break
+                to_number = get_tag_text(cdr_tags, 'destination_number',
+                                         parent='caller_profile')
             elif service_type in ['local_call', 'incoming_call']:
-                elements = cdr_dom.getElementsByTagName('destination_number')
-                for element in elements:
-                    if (element.parentNode.nodeName ==
-                            'originator_caller_profile'):
-                        to_number = get_tag_text(element.childNodes)
-                        break
+                to_number = get_tag_text(cdr_tags, 'destination_number',
+                                         parent='originator_caller_profile')
             # Generate billing information for the caller, if the caller is
             # local to the BTS.
             if service_type != 'incoming_call':
@@ -176,8 +190,7 @@ class cdr(object):
                     billsec)
 
         else:
-            username = get_tag_text(
-                cdr_dom.getElementsByTagName("username")[0].childNodes)
+            username = get_tag_text(cdr_tags, "username")
             from_imsi = subscriber.get_imsi_from_username(username)
             message = "No rate info for this call. (from: %s, billsec: %s)" % (
                 from_imsi, billsec)
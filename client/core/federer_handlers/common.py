@@ -34,7 +34,7 @@ class incoming(object):
         self.conf = cdb
         self.fs_ic = freeswitch_interconnect.freeswitch_ic(self.conf)
         self.tariff_type = "off_network_receive"
-        self.msgid_db = MessageDB()
+        self.msgid_db = MessageDB.shared()
 
     def bill(self, to_number, from_number):
         try:
@@ -53,6 +53,17 @@ class incoming(object):
         except Exception as e:
             logger.error("Endaga bill error:" + traceback.format_exc(e))
 
+    def load_signed_params(self, jwt_data):
+        """Decodes the params, raising a ValueError if they don't pass
+        signature.
+        """
+        s = itsdangerous.JSONWebSignatureSerializer(self.conf['bts_secret'])
+        try:
+            return s.loads(jwt_data)
+        except itsdangerous.BadSignature:
+            logger.error("Bad jwt signature for request, ignoring.")
+            raise ValueError("Bad signature")
+
     def check_signed_params(self, jwt_data):
         """
         Decodes the params, makes sure they pass signature (i.e., are valid),
@@ -62,12 +73,7 @@ class incoming(object):
         TODO(matt): this particular method seems to be unused (not so the one
                     in federer_handlers.config.config).
         """
-        s = itsdangerous.JSONWebSignatureSerializer(self.conf['bts_secret'])
-        try:
-            data = s.loads(jwt_data)
-        except itsdangerous.BadSignature:
-            logger.error("Bad jwt signature for request, ignoring.")
-            raise ValueError("Bad signature")
+        data = self.load_signed_params(jwt_data)
 
         # make sure the msg hasn't been seen before, if so, discard it
         if "msgid" in data:
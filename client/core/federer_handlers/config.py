@@ -37,7 +37,7 @@ class config(object):
     """
     def __init__(self):
         self.conf = ConfigDB()
-        self.msgid_db = MessageDB()
+        self.msgid_db = MessageDB.shared()
         self.ic = interconnect.endaga_ic(self.conf)
 
     def GET(self, command):
@@ -72,9 +72,20 @@ class config(object):
             'Content-type': 'text/plain'
         }
         # Validate the exact endpoint.
-        valid_post_commands = ('deactivate_number', 'deactivate_subscriber')
+        valid_post_commands = ('deactivate_number', 'deactivate_subscriber',
+                               'add_credits')
         if command not in valid_post_commands:
             return web.NotFound()
+        if command == 'add_credits':
+            # Credit batches carry a msgid and are checked like GET commands.
+            jwt = web.input().get('jwt', None)
+            if not jwt:
+                return web.BadRequest()
+            try:
+                data = self.check_signed_params(jwt)
+            except ValueError as e:
+                return web.BadRequest(str(e))
+            return self.adjust_credits_batch(data)
         # Get the posted data and validate.  There should be a 'jwt' key with
         # signed data.  That dict should contain a 'number' key -- the one we
         # want to deactivate.
@@ -103,6 +114,17 @@ class config(object):
                 return web.BadRequest()
             return web.ok(None, headers)
         elif command == 'deactivate_subscriber':
+            if 'imsis' in jwt:
+                # A batch from the cloud's subscriber vacuum.  The batch may
+                # be resent, so subscribers already gone are skipped.
+                if not isinstance(jwt['imsis'], list):
+                    return web.BadRequest()
+                for imsi in jwt['imsis']:
+                    try:
+                        subscriber.delete_subscriber(imsi)
+                    except SubscriberNotFound:
+                        pass
+                return web.ok(None, headers)
             if 'imsi' not in jwt:
                 return web.BadRequest()
             # The number should correspond to an IMSI.
@@ -194,7 +216,50 @@ class config(object):
             subscriber.subtract_credit(imsi, str(abs(change)))
 
         new_credit = subscriber.get_account_balance(imsi)
+        self._notify_credit_adjustment(imsi, change, old_credit, new_credit)
+        return web.ok()
 
+    def adjust_credits_batch(self, data):
+        """Applies a batch of credit updates from the cloud.
+
+        The cloud coalesces all of a BTS's pending credit updates into one
+        request, and resends the whole batch if it doesn't hear back from us.
+        Updates are deduplicated by their own msgid, so resent updates are
+        skipped; the rest are applied in a single DB transaction.  Updates for
+        unknown subscribers are dropped (and acked) as they can never apply.
+        """
+        updates = data.get('updates')
+        if not isinstance(updates, list):
+            return web.BadRequest()
+        deltas, msgids = [], []
+        try:
+            for update in updates:
+                msgid = str(update['msgid'])
+                if msgid in self.msgid_db or msgid in msgids:
+                    continue
+                deltas.append((update['imsi'], int(update['change'])))
+                msgids.append(msgid)
+        except (KeyError, TypeError, ValueError):
+            return web.BadRequest()
+        known = set(imsi for imsi, _ in
+                    subscriber.get_multiple([imsi for imsi, _ in deltas]))
+        for imsi, change in deltas:
+            if imsi not in known:
+                logger.error("Endaga: credit update for unknown sub %s (%s)" %
+                             (imsi, change))
+        applied = [(imsi, change) for imsi, change in deltas if imsi in known]
+        results = subscriber.adjust_credits(applied)
+        # Only mark updates seen once they have been applied.
+        for msgid in msgids:
+            self.msgid_db.seen(msgid)
+        for (imsi, change), (_, old_credit, new_credit) in zip(applied,
+                                                               results):
+            self._notify_credit_adjustment(imsi, change, old_credit,
+                                           new_credit)
+        return web.ok()
+
+    def _notify_credit_adjustment(self, imsi, change, old_credit, new_credit):
+        """Confirms a credit adjustment to the sub and logs the event."""
         # Codeship is stupid. These imports break CI and this is an untested
         # method :)
         from core import freeswitch_interconnect, freeswitch_strings
@@ -217,7 +282,6 @@ class config(object):
         reason = 'Update from web UI (add_money)'
         events.create_add_money_event(imsi, old_credit, new_credit, reason,
                                       to_number=number)
-        return web.ok()
 
     def check_signed_params(self, jwt_data):
         """Checks a JWT signature and message ID.
@@ -8,16 +8,13 @@ LICENSE file in the root directory of this source tree. An additional grant
 of patent rights can be found in the PATENTS file in the same directory.
 """
 
-import threading
-import traceback
-
-import requests
 import web
 
 from ccm.common import logger
-from core import interconnect
+from core.broadcast_queue import BroadcastQueue
 from core.config_database import ConfigDB
 from core.federer_handlers import common
+from core.outbound_sms import OutboundSMSPool
 
 
 class endaga_sms(common.incoming):
@@ -51,18 +48,60 @@ class endaga_sms(common.incoming):
             return web.badrequest(None, headers)
 
 
+class broadcast_sms(common.incoming):
+    """
+    Class for handling broadcasts from Endaga.
+
+    The cloud posts one signed batch per broadcast, with a 'msgid', the
+    'sender', the 'text' and a list of 'recipients' numbers. The batch is
+    queued for the BroadcastSender in endagad, which sends and bills it as
+    the radio allows. A batch we have already queued is acked again, since
+    the cloud resends batches it didn't hear back about.
+    """
+    def __init__(self):
+        common.incoming.__init__(self)
+        self.queue = BroadcastQueue.shared()
+
+    def POST(self):
+        headers = {
+            'Content-type': 'text/plain'
+        }
+        jwt = web.input().get('jwt', None)
+        if not jwt:
+            return web.BadRequest()
+        try:
+            data = self.load_signed_params(jwt)
+            msgid = str(data['msgid'])
+            if msgid in self.msgid_db:
+                return web.ok(None, headers)
+            from_ = str(data['sender'])
+            recipients = [str(to) for to in data['recipients']]
+            if from_ == common.DASHBOARD_FROM_NUMBER:
+                service_type = 'free_sms'
+            else:
+                service_type = self.tariff_type
+            self.queue.add(recipients, from_, data['text'], service_type)
+        except (KeyError, TypeError, ValueError) as e:
+            return web.BadRequest(str(e))
+        # Only mark the batch seen once it is queued.
+        self.msgid_db.seen(msgid)
+        return web.ok(None, headers)
+
+
 class OutgoingSMSHandler(object):
     """Class for handling outgoing SMS messages.
 
-    FS sends message data to this handler via POST.  We will start a thread to
-    send the actual request.  If the request succeeds, we'll issue the billing
-    request.
+    FS sends message data to this handler via POST. We queue it on the
+    process's OutboundSMSPool, whose workers send the actual request and,
+    if the request succeeds, queue the billing request.
 
     This is needed due to poor chatplan performance.
 
-    Returns response code 202 once we launch a thread to make the request to
-    our API. Caller receives no further status updates, and there is no
-    guarantee the SMS will actually be sent to our API.
+    Returns response code 202 once the message is queued. Caller receives no
+    further status updates, and there is no guarantee the SMS will actually
+    be sent to our API.
+
+    Returns a 503 with a Retry-After header if the queue is full.
 
     Returns a 404 if the request parameters are malformed.
     TODO(matt): make this return 400 instead, but first verify that nothing
@@ -71,14 +110,12 @@ class OutgoingSMSHandler(object):
 
     Attributes:
         conf: a ConfigDB
-        interconnect_client: the endaga interconnect client
-        worker: a method that will be in its own thread and send the message
+        pool: the OutboundSMSPool that sends the message
     """
 
     def __init__(self):
         self.conf = ConfigDB()
-        self.interconnect_client = interconnect.endaga_ic(self.conf)
-        self.worker = self.sms_worker
+        self.pool = OutboundSMSPool.shared()
 
     def POST(self):
         """Handles POST requests."""
@@ -86,37 +123,13 @@ class OutgoingSMSHandler(object):
         needed_fields = ["to", "from_number", "from_name", "body",
                          "service_type"]
         if all(i in data for i in needed_fields):
-            params = {
-                "to": str(data.to),
-                "from_num": str(data.from_number),
-                "from_name": str(data.from_name),
-                "body": str(data.body),
-                "service_type": str(data.service_type)
-            }
-            t = threading.Thread(target=self.worker, kwargs=params)
-            t.start()
+            if not self.pool.submit(str(data.to), str(data.from_number),
+                                    str(data.from_name), str(data.body),
+                                    str(data.service_type)):
+                logger.warning("Endaga: outbound SMS queue full")
+                retry_after = self.conf.get('outbound_sms.retry_after', 5)
+                raise web.HTTPError('503 Service Unavailable',
+                                    {'Retry-After': str(retry_after)})
             raise web.Accepted()
         else:
             raise web.NotFound()
-
-    def sms_worker(self, to, from_num, from_name, body, service_type):
-        """The SMS worker that runs in its own thread.
-
-        Fails with a logger entry if we fail to post to the billing endpoint.
-
-        Args:
-            message params
-        """
-        try:
-            # TODO(matt): handle else (message failed to send).
-            if self.interconnect_client.send(to, from_num, body):
-                billing_url = self.conf['billing_url']
-                params = {
-                    "from_name": from_name,
-                    "from_number": from_num,
-                    "destination": to,
-                    "service_type": service_type
-                }
-                requests.post(billing_url, data=params)
-        except Exception as e:
-            logger.error("Endaga " + traceback.format_exc(e))
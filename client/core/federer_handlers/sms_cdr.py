@@ -8,53 +8,83 @@ LICENSE file in the root directory of this source tree. An additional grant
 of patent rights can be found in the PATENTS file in the same directory.
 """
 
+import json
+
 import web
 
+from ccm.common import logger
 from core import billing
 from core import events
 from core.subscriber import subscriber
 from core.exceptions import SubscriberNotFound
 
+
+def bill_sms(cdr):
+    """Bills an SMS CDR to its sender, and a local SMS to its recipient.
+
+    Args:
+        cdr: a web.Storage with the from_name, from_number, service_type and
+             destination of the SMS
+    """
+    cost_in_credits = billing.get_sms_cost(
+        cdr.service_type, destination_number=cdr.destination)
+    try:
+        old_balance = subscriber.get_account_balance(cdr.from_name)
+        subscriber.subtract_credit(cdr.from_name, str(cost_in_credits))
+    except SubscriberNotFound:
+        # The subscriber does not exist yet but has sent an SMS
+        if cdr.service_type == 'free_sms':
+            # But that is OK for a free service like provisioning
+            old_balance = 0
+        else:
+            raise
+    reason = "SMS sent to %s (%s)" % (cdr.destination, cdr.service_type)
+    events.create_sms_event(
+        cdr.from_name, old_balance, cost_in_credits, reason,
+        cdr.destination, from_imsi=cdr.from_name,
+        from_number=cdr.from_number)
+    # If this was an in-network event, find the cost for the recipient.  We
+    # can lookup the recipient by cdr.destination (the "to number").
+    if 'local' in cdr.service_type:
+        recipient_imsi = subscriber.get_imsi_from_number(cdr.destination)
+        old_balance = subscriber.get_account_balance(recipient_imsi)
+        cost_in_credits = billing.get_sms_cost(
+            'local_recv_sms', destination_number=cdr.destination)
+        subscriber.subtract_credit(recipient_imsi, str(cost_in_credits))
+        reason = "SMS received from %s (local_recv_sms)" % cdr.from_name
+        events.create_sms_event(
+            recipient_imsi, old_balance, cost_in_credits, reason,
+            cdr.destination, from_imsi=cdr.from_name,
+            from_number=cdr.from_number)
+
+
 class smscdr(object):
-    """Handles SMS CDRs."""
+    """Handles SMS CDRs.
+
+    Either a single CDR, or a batch of them as a JSON list in the cdrs param.
+    A CDR in a batch that can't be billed is logged and skipped, since the
+    sender retries a batch that fails, and the rest are already billed.
+    """
 
     def POST(self):
         """Handles POST requests."""
         data = web.input()
-        if ('from_name' not in data or 'service_type' not in data or
+        if 'cdrs' in data:
+            try:
+                cdrs = [web.Storage(cdr) for cdr in json.loads(data.cdrs)]
+            except (TypeError, ValueError):
+                raise web.BadRequest()
+            for cdr in cdrs:
+                try:
+                    bill_sms(cdr)
+                except Exception as e:
+                    logger.error("smscdr: couldn't bill %s: %s" % (cdr, e))
+        elif ('from_name' not in data or 'service_type' not in data or
                 'destination' not in data):
             raise web.BadRequest()
-        # Process the CDR data.
-        cost_in_credits = billing.get_sms_cost(
-            data.service_type, destination_number=data.destination)
-        try:
-            old_balance = subscriber.get_account_balance(data.from_name)
-            subscriber.subtract_credit(data.from_name, str(cost_in_credits))
-        except SubscriberNotFound:
-            # The subscriber does not exist yet but has sent an SMS
-            if data.service_type == 'free_sms':
-                # But that is OK for a free service like provisioning
-                old_balance = 0
-            else:
-                raise
-        reason = "SMS sent to %s (%s)" % (data.destination, data.service_type)
-        events.create_sms_event(
-            data.from_name, old_balance, cost_in_credits, reason,
-            data.destination, from_imsi=data.from_name,
-            from_number=data.from_number)
-        # If this was an in-network event, find the cost for the recipient.  We
-        # can lookup the recipient by data.destination (the "to number").
-        if 'local' in data.service_type:
-            recipient_imsi = subscriber.get_imsi_from_number(data.destination)
-            old_balance = subscriber.get_account_balance(recipient_imsi)
-            cost_in_credits = billing.get_sms_cost(
-                'local_recv_sms', destination_number=data.destination)
-            subscriber.subtract_credit(recipient_imsi, str(cost_in_credits))
-            reason = "SMS received from %s (local_recv_sms)" % data.from_name
-            events.create_sms_event(
-                recipient_imsi, old_balance, cost_in_credits, reason,
-                data.destination, from_imsi=data.from_name,
-                from_number=data.from_number)
+        else:
+            # Process the CDR data.
+            bill_sms(data)
         # Return 200 OK.
         headers = {
             'Content-type': 'text/plain'
@@ -1,7 +1,7 @@
 """FS interconnect.
 
-Note that this module imports freeswitch and will thus only work in certain
-environments.
+Commands are sent over the event socket connections of the process's shared
+ESLPool.
 
 Copyright (c) 2016-present, Facebook, Inc.
 All rights reserved.
@@ -11,9 +11,11 @@ LICENSE file in the root directory of this source tree. An additional grant
 of patent rights can be found in the PATENTS file in the same directory.
 """
 
-from ESL import ESLconnection
+import re
 
+from ccm.common import logger
 from core import number_utilities
+from core.esl import ESLError, ESLPool
 
 
 class freeswitch_ic(object):
@@ -21,34 +23,71 @@ class freeswitch_ic(object):
 
     def __init__(self, conf):
         self.conf = conf
+        self.esl = ESLPool.shared(conf)
 
-    def _send_raw_to_freeswitch_cli(self, cmd):
-        con = ESLconnection(self.conf['fs_esl_ip'], self.conf['fs_esl_port'],
-                            self.conf['fs_esl_pass'])
-        if con.connected():
-            con.api(cmd)
-            return True
-        return False
+    def _bgapi(self, *cmds):
+        """Starts the commands in the background, in order.
 
-    def send_to_number(self, to, from_, body, to_country=None,
-            from_country=None):
-        """Send properly-formatted numbers to FreeSwitch.
+        Returns whether FreeSwitch accepted each command, or None if it
+        couldn't be reached.
+        """
+        try:
+            jobs = self.esl.bgapi(*cmds)
+        except ESLError as e:
+            logger.error("FreeSwitch ESL error: %s" % e)
+            return None
+        return [job is not None for job in jobs]
 
-        Internally, our canonical format is E.164 without the leading plus (due
-        to OpenBTS's inability to handle the + symbol).
+    def _send_raw_to_freeswitch_cli(self, *cmds):
+        """Starts the commands in the background, in order.
+
+        Returns False if FreeSwitch didn't accept them all.
+        """
+        accepted = self._bgapi(*cmds)
+        return bool(accepted) and all(accepted)
+
+    @staticmethod
+    def _esl_arg(text):
+        """An ESL command ends at a line break, so line breaks in a command's
+        arguments (e.g. an SMS body) are sent as spaces.
         """
+        return re.sub(r'[\r\n]+', ' ', text)
+
+    @classmethod
+    def _send_sms_cmd(cls, to, from_, body, to_country=None,
+                      from_country=None):
         if to_country:
             to = number_utilities.convert_to_e164(to, to_country)
         if from_country:
             from_ = number_utilities.convert_to_e164(from_, from_country)
         to = number_utilities.strip_number(to)
         from_ = number_utilities.strip_number(from_)
+        return cls._esl_arg(
+            str("python VBTS_Send_SMS %s|%s|%s" % (to, from_, body)))
+
+    def send_to_number(self, to, from_, body, to_country=None,
+            from_country=None):
+        """Send properly-formatted numbers to FreeSwitch.
+
+        Internally, our canonical format is E.164 without the leading plus (due
+        to OpenBTS's inability to handle the + symbol).
+        """
         return self._send_raw_to_freeswitch_cli(
-                   str("python VBTS_Send_SMS %s|%s|%s" % (to, from_, body)))
+                   self._send_sms_cmd(to, from_, body, to_country,
+                                      from_country))
+
+    def send_to_numbers(self, messages):
+        """Send several (to, from_, body) messages over one ESL connection.
+
+        Returns whether FreeSwitch accepted each message, or None if it
+        couldn't be reached.
+        """
+        return self._bgapi(*[self._send_sms_cmd(to, from_, body)
+                             for to, from_, body in messages])
 
     def send_to_imsi(self, to, ipaddr, port, from_, body):
         """Send a message directly to an IMSI. These messages will go directly to
         BTS, so if the message fails to send, it will not be retried."""
-        return self._send_raw_to_freeswitch_cli(
+        return self._send_raw_to_freeswitch_cli(self._esl_arg(
                    str("python VBTS_Send_SMS_Direct %s|%s|%s|%s|%s" %
-                       (to, ipaddr, port, from_, body)))
+                       (to, ipaddr, port, from_, body))))
@@ -32,6 +32,7 @@ class endaga_ic(object):
         self.token = conf['endaga_token']
         self.utilization_tracker = system_utilities.SystemUtilizationTracker()
         self._checkin_load_stats = {}
+        self._load_stats = {}  # reported by other components
         self._session = None  # use persistent connection when possible
         self._session_cookies = None
 
@@ -105,13 +106,19 @@ class endaga_ic(object):
         # TODO(matt): use urlparse.urljoin here?
         endpoint = self.conf['registry'] + "/send/"
         try:
-            r = requests.post(endpoint, headers=self.auth_header, data=message)
+            r = self.session.post(endpoint, headers=self.auth_header,
+                                  data=message)
         except BaseException as e:  # log and rethrow as it was before
             logger.error("Endaga: Send SMS network error: %s." % e)
+            self._cleanup_session()
             raise
 
         return r.status_code == 202
 
+    def report_load_stats(self, stats):
+        """Adds stats to the load section of the next checkin."""
+        self._load_stats.update(stats)
+
     def checkin(self, timeout=11):
         """Gather system status."""
 
@@ -149,6 +156,8 @@ class endaga_ic(object):
         for key, val in list(self._checkin_load_stats.items()):
             status['openbts_load']['checkin.' + key] = val
         self._checkin_load_stats.clear()
+        status['openbts_load'].update(self._load_stats)
+        self._load_stats.clear()
 
         try:
             status['openbts_noise'] = bts.get_noise()
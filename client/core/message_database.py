@@ -1,4 +1,4 @@
-"""A circular buffer for storing inbound message identifiers.
+"""A window of recent inbound message identifiers.
 
 This is used to avoid processing duplicate inbound messages.
 
@@ -6,67 +6,147 @@ Copyright (c) 2016-present, Facebook, Inc.
 All rights reserved.
 
 This source code is licensed under the BSD-style license found in the
-LICENSE file in the root directory of this source tree. An additional grant 
+LICENSE file in the root directory of this source tree. An additional grant
 of patent rights can be found in the PATENTS file in the same directory.
 """
 
-import os
+import threading
+from collections import OrderedDict
 
-import psycopg2
+from ccm.common import logger
+from core.db import ConnectorFactory
 
 
-# In our CI system, Postgres credentials are stored in env vars.
-PG_USER = os.environ.get('PG_USER', 'endaga')
-PG_PASSWORD = os.environ.get('PG_PASSWORD', 'endaga')
+class MessageDB(object):
+    """Remembers the ids of recent inbound messages.
 
+    A new msgid is recorded with a single INSERT that does nothing if the
+    msgid is already there; whether it returned a row tells us if the msgid
+    was new. The most recent cache_size msgids are also kept in memory, so a
+    repeat of one of them needs no query at all.
 
-class MessageDB(object):
-    def __init__(self, max_len=5000):
+    The table is trimmed to the most recent max_len msgids by prune(), which
+    start_pruning() runs in a background thread, rather than on every
+    insert. Use MessageDB.shared() to get the instance all the handlers of a
+    process share.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, max_len=5000, cache_size=1000, connector=None):
         self.max_len = max_len
-        self.conn = psycopg2.connect(host='localhost', database='endaga',
-                                     user=PG_USER, password=PG_PASSWORD)
+        self.cache_size = cache_size
+        # Passing in a connector argument is intended to be used for testing
+        # purposes only (but works more generally).
+        self._connector = (connector if connector else
+                           ConnectorFactory.get_default_connector())
+        # msgid -> None, least recently seen first
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._insert = None
+        self._pruner = None
+        self._stop = threading.Event()
         self._createdb()
 
+    @classmethod
+    def shared(cls):
+        """Gets the process-wide MessageDB, pruning in the background."""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+                cls._shared.start_pruning()
+            return cls._shared
+
     def __contains__(self, msgid):
-        cur = self.conn.cursor()
-        try:
-            cur.execute("SELECT msgid FROM endaga_msgid WHERE msgid=%s;",
-                        (msgid,))
-            if cur.fetchone() is None:
-                return False
+        if self._cached(msgid):
             return True
-        except (psycopg2.ProgrammingError, IndexError):
-            return False
+        return bool(self._connector.exec_and_get_option(
+            "SELECT msgid FROM endaga_msgid WHERE msgid=%s;", (msgid,)))
 
     def _createdb(self):
-        cur = self.conn.cursor()
-        cur.execute("CREATE TABLE IF NOT EXISTS endaga_msgid(id serial PRIMARY"
-                    " KEY, msgid text UNIQUE NOT NULL);")
-        self.conn.commit()
+        self._connector.exec_stmt(
+            "CREATE TABLE IF NOT EXISTS endaga_msgid(id serial PRIMARY"
+            " KEY, msgid text UNIQUE NOT NULL);")
 
-    def resize(self, most_recent_id, commit=False):
-        """Drops any records with ids at least max_len less than the current
-        highest id.
+    def _insert_stmt(self, cur):
+        """The INSERT for a new msgid, returning its id if it is new.
+
+        ON CONFLICT needs Postgres 9.5; older servers get an INSERT ...
+        SELECT, which can still raise on two concurrent inserts of a msgid.
         """
-        cur = self.conn.cursor()
-        cur.execute("DELETE FROM endaga_msgid WHERE id <= %s;",
-                    (most_recent_id - self.max_len,))
-        if commit:
-            self.conn.commit()
+        if self._insert is None:
+            version = getattr(cur.connection, 'server_version', None)
+            if version is not None and version < 90500:
+                self._insert = (
+                    "INSERT INTO endaga_msgid (msgid) SELECT %s"
+                    " WHERE NOT EXISTS (SELECT 1 FROM endaga_msgid"
+                    " WHERE msgid=%s) RETURNING id;")
+            else:
+                self._insert = (
+                    "INSERT INTO endaga_msgid (msgid) VALUES (%s)"
+                    " ON CONFLICT (msgid) DO NOTHING RETURNING id;")
+        return self._insert
+
+    def _cached(self, msgid):
+        with self._cache_lock:
+            if msgid not in self._cache:
+                return False
+            self._cache.move_to_end(msgid)
+            return True
+
+    def _remember(self, msgid):
+        with self._cache_lock:
+            self._cache[msgid] = None
+            self._cache.move_to_end(msgid)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
 
     def seen(self, msgid):
         """Returns True if the msgid has been seen before and False otherwise.
 
         As a side effect, adds the msgid to the DB if it hasn't been seen
-        before and calls resize.
+        before.
         """
-        if self.__contains__(msgid):
+        if self._cached(msgid):
             return True
-        else:
-            cur = self.conn.cursor()
-            cur.execute("INSERT INTO endaga_msgid (msgid) VALUES(%s) RETURNING"
-                        " id;", (msgid,))
-            max_id = int(cur.fetchone()[0])
-            self.resize(max_id)
-            self.conn.commit()
-            return False
+
+        def insert(cur):
+            stmt = self._insert_stmt(cur)
+            cur.execute(stmt, (msgid,) * stmt.count('%s'))
+            return cur.fetchone() is None
+        seen = self._connector.with_cursor(insert)
+        self._remember(msgid)
+        return seen
+
+    def prune(self):
+        """Drops any records with ids at least max_len less than the current
+        highest id.
+        """
+        self._connector.exec_stmt(
+            "DELETE FROM endaga_msgid WHERE id <="
+            " (SELECT max(id) FROM endaga_msgid) - %s;", (self.max_len,))
+
+    def start_pruning(self, interval=60):
+        """Prunes the table every interval seconds in a daemon thread."""
+        if self._pruner is not None:
+            return
+        self._stop.clear()
+        self._pruner = threading.Thread(target=self._prune_loop,
+                                        args=(interval,))
+        self._pruner.daemon = True
+        self._pruner.start()
+
+    def stop_pruning(self):
+        if self._pruner is None:
+            return
+        self._stop.set()
+        self._pruner.join()
+        self._pruner = None
+
+    def _prune_loop(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.prune()
+            except Exception as e:
+                logger.error("MessageDB: prune failed: %s" % e)
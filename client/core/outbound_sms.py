@@ -0,0 +1,328 @@
+"""A bounded pool of workers sending outbound SMS to the cloud.
+
+Federer queues each outbound SMS that the chatplan hands it and answers at
+once; a fixed set of worker threads sends the queue to our API, each over
+its own keep-alive connection. The queue is the endaga_outbound_sms table,
+shared by every federer process, so that SMS we have accepted survive a
+restart. When the queue is full, the SMS is refused, and the handler tells
+the caller when to retry. The billing requests for sent SMS are posted to
+the billing URL in batches.
+
+Each federer process records its send latency in the
+endaga_outbound_sms_stats table, which collect_stats() drains for the checkin.
+
+Copyright (c) 2016-present, Facebook, Inc.
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree. An additional grant
+of patent rights can be found in the PATENTS file in the same directory.
+"""
+
+import json
+import os
+import threading
+import time
+
+import requests
+
+from ccm.common import logger
+from core import interconnect
+from core.config_database import ConfigDB
+from core.db import ConnectorFactory
+
+
+def _create_tables(connector):
+    connector.exec_stmt(
+        "CREATE TABLE IF NOT EXISTS endaga_outbound_sms(id serial PRIMARY"
+        " KEY, queued double precision NOT NULL, to_number text NOT NULL,"
+        " from_number text NOT NULL, from_name text NOT NULL, body text NOT"
+        " NULL, service_type text NOT NULL);")
+    connector.exec_stmt(
+        "CREATE TABLE IF NOT EXISTS endaga_outbound_sms_stats(id serial"
+        " PRIMARY KEY, pid integer NOT NULL, queue_depth integer NOT NULL,"
+        " sent integer NOT NULL, failed integer NOT NULL, rejected integer"
+        " NOT NULL, latency_total real NOT NULL, latency_max real NOT"
+        " NULL);")
+
+
+class OutboundSMSPool(object):
+    """Sends queued outbound SMS with a fixed number of worker threads.
+
+    The workers of every federer process take SMS from the same table, and
+    each SMS is deleted as it is taken, so only one of them sends it. An SMS
+    that fails to send is dropped, not retried. max_queue bounds the table,
+    not the process. Latency is measured from when an SMS is queued to when
+    our API has answered for it.
+
+    Billing requests that fail to post are kept for the next batch, up to
+    max_billing of them; past that, the oldest are logged and dropped.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, conf, workers=4, max_queue=200, billing_batch=20,
+                 max_billing=1000, billing_timeout=10, interval=1,
+                 stats_interval=60, connector=None, clock=time.time):
+        self.conf = conf
+        self.workers = workers
+        self.max_queue = max_queue
+        self.billing_batch = billing_batch
+        self.max_billing = max_billing
+        self.billing_timeout = billing_timeout
+        self.interval = interval
+        self.stats_interval = stats_interval
+        self.clock = clock
+        # Passing in a connector argument is intended to be used for testing
+        # purposes only (but works more generally).
+        self._connector = (connector if connector else
+                           ConnectorFactory.get_default_connector())
+        _create_tables(self._connector)
+        self._queued = threading.Condition()
+        self._lock = threading.Lock()
+        self._billing = []
+        self._billing_ready = threading.Event()
+        self._stats = self._new_stats()
+        self._threads = []
+        self._stop = threading.Event()
+
+    @classmethod
+    def shared(cls):
+        """Gets the process-wide pool, with its workers running."""
+        with cls._shared_lock:
+            if cls._shared is None:
+                conf = ConfigDB()
+                cls._shared = cls(
+                    conf, workers=conf.get('outbound_sms.workers', 4),
+                    max_queue=conf.get('outbound_sms.max_queue', 200),
+                    max_billing=conf.get('outbound_sms.max_billing', 1000),
+                    billing_timeout=conf.get('outbound_sms.billing_timeout',
+                                             10))
+                cls._shared.start()
+            return cls._shared
+
+    @staticmethod
+    def _new_stats():
+        return {'sent': 0, 'failed': 0, 'rejected': 0, 'latency_total': 0.0,
+                'latency_max': 0.0}
+
+    def __len__(self):
+        return self._connector.exec_and_fetch_one(
+            "SELECT count(*) FROM endaga_outbound_sms;")[0]
+
+    def submit(self, to, from_num, from_name, body, service_type):
+        """Queues an SMS to be sent and billed.
+
+        Returns False, and drops the SMS, if the queue is full.
+        """
+        def insert(cur):
+            # Checking the length in the insert keeps the check and the
+            # insert in one statement.
+            cur.execute(
+                "INSERT INTO endaga_outbound_sms (queued, to_number,"
+                " from_number, from_name, body, service_type) SELECT %s, %s,"
+                " %s, %s, %s, %s WHERE (SELECT count(*) FROM"
+                " endaga_outbound_sms) < %s;",
+                (self.clock(), to, from_num, from_name, body, service_type,
+                 self.max_queue))
+            return cur.rowcount
+        if not self._connector.with_cursor(insert):
+            with self._lock:
+                self._stats['rejected'] += 1
+            return False
+        with self._queued:
+            self._queued.notify()
+        return True
+
+    def take(self):
+        """Takes the oldest SMS off the queue.
+
+        Returns:
+            A (queued, sms) tuple, where queued is the time the SMS was
+            queued, or None if the queue is empty.
+        """
+        while True:
+            ids = self._connector.exec_and_fetch(
+                "SELECT id FROM endaga_outbound_sms ORDER BY id LIMIT %s;",
+                (self.workers, ))
+            if not ids:
+                return None
+            for (id_, ) in ids:
+                # Another worker may have taken it since we looked.
+                row = self._connector.exec_and_get_option(
+                    "DELETE FROM endaga_outbound_sms WHERE id=%s RETURNING"
+                    " queued, to_number, from_number, from_name, body,"
+                    " service_type;", (id_, ))
+                if row:
+                    return row[0], dict(zip(
+                        ('to', 'from_num', 'from_name', 'body',
+                         'service_type'), row[1:]))
+
+    def send(self, ic, sms):
+        """Sends a queued SMS, and queues its billing if it was sent."""
+        try:
+            sent = ic.send(sms['to'], sms['from_num'], sms['body'])
+        except Exception as e:
+            logger.error("Endaga: outbound SMS error: %s" % e)
+            sent = False
+        if not sent:
+            return False
+        with self._lock:
+            self._billing.append({
+                "from_name": sms['from_name'],
+                "from_number": sms['from_num'],
+                "destination": sms['to'],
+                "service_type": sms['service_type'],
+            })
+            if len(self._billing) >= self.billing_batch:
+                self._billing_ready.set()
+        return True
+
+    def flush_billing(self, session):
+        """Posts the queued billing requests in one batch.
+
+        A batch that fails to post is kept, and tried again with the next,
+        unless that would keep more than max_billing requests.
+        """
+        with self._lock:
+            batch, self._billing = self._billing, []
+            self._billing_ready.clear()
+        if not batch:
+            return
+        try:
+            r = session.post(self.conf['billing_url'],
+                             data={'cdrs': json.dumps(batch)},
+                             timeout=self.billing_timeout)
+            r.raise_for_status()
+        except requests.RequestException as e:
+            logger.error("Endaga: billing batch of %d failed: %s" %
+                         (len(batch), e))
+            with self._lock:
+                self._billing = batch + self._billing
+                dropped = self._billing[:-self.max_billing]
+                self._billing = self._billing[-self.max_billing:]
+            if dropped:
+                logger.error("Endaga: dropped %d unbilled SMS: %s" %
+                             (len(dropped), json.dumps(dropped)))
+
+    def record_stats(self):
+        """Adds the stats since the last call to the stats table."""
+        with self._lock:
+            stats, self._stats = self._stats, self._new_stats()
+        self._connector.exec_stmt(
+            "INSERT INTO endaga_outbound_sms_stats (pid, queue_depth, sent,"
+            " failed, rejected, latency_total, latency_max) VALUES (%s, %s,"
+            " %s, %s, %s, %s, %s);",
+            (os.getpid(), len(self), stats['sent'], stats['failed'],
+             stats['rejected'], stats['latency_total'],
+             stats['latency_max']))
+
+    def start(self):
+        """Starts the workers, and a thread that posts billing batches and
+        records stats.
+        """
+        if self._threads:
+            return
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._work)
+                         for _ in range(self.workers)]
+        self._threads.append(threading.Thread(target=self._report))
+        for t in self._threads:
+            t.daemon = True
+            t.start()
+
+    def stop(self):
+        """Stops the threads once the SMS already queued are sent."""
+        if not self._threads:
+            return
+        self._stop.set()
+        with self._queued:
+            self._queued.notify_all()
+        self._billing_ready.set()
+        for t in self._threads:
+            t.join()
+        self._threads = []
+
+    def _work(self):
+        # Each worker has its own interconnect, and so its own session.
+        ic = interconnect.endaga_ic(self.conf)
+        while True:
+            try:
+                item = self.take()
+            except Exception as e:
+                logger.error("Endaga: outbound SMS queue error: %s" % e)
+                item = None
+            if item is None:
+                if self._stop.is_set():
+                    return
+                # Other processes' SMS and those left from before a restart
+                # are picked up within an interval.
+                with self._queued:
+                    self._queued.wait(self.interval)
+                continue
+            queued, sms = item
+            sent = self.send(ic, sms)
+            latency = self.clock() - queued
+            with self._lock:
+                self._stats['sent' if sent else 'failed'] += 1
+                self._stats['latency_total'] += latency
+                self._stats['latency_max'] = max(self._stats['latency_max'],
+                                                 latency)
+
+    def _report(self):
+        session = requests.Session()
+        last_stats = self.clock()
+        while True:
+            stopping = self._stop.is_set()
+            self._billing_ready.wait(self.interval)
+            try:
+                self.flush_billing(session)
+                if stopping or self.clock() - last_stats >= \
+                        self.stats_interval:
+                    last_stats = self.clock()
+                    self.record_stats()
+            except Exception as e:
+                logger.error("Endaga: outbound SMS report failed: %s" % e)
+            if stopping:
+                return
+
+
+def collect_stats(connector=None):
+    """Drains the outbound SMS stats recorded by the federer processes.
+
+    Returns the totals for the checkin: SMS sent, failed and refused since
+    the last call, their average and maximum latency in seconds, and the
+    current queue depth.
+    """
+    connector = (connector if connector else
+                 ConnectorFactory.get_default_connector())
+    _create_tables(connector)
+
+    def drain(cur):
+        cur.execute("SELECT id, sent, failed, rejected, latency_total,"
+                    " latency_max FROM endaga_outbound_sms_stats ORDER BY"
+                    " id;")
+        rows = cur.fetchall()
+        if rows:
+            cur.execute("DELETE FROM endaga_outbound_sms_stats WHERE"
+                        " id <= %s;", (rows[-1][0],))
+        cur.execute("SELECT count(*) FROM endaga_outbound_sms;")
+        return rows, cur.fetchone()[0]
+    rows, depth = connector.with_cursor(drain)
+    sent = failed = rejected = 0
+    latency_total = latency_max = 0.0
+    for _, s, f, r, total, max_ in rows:
+        sent, failed, rejected = sent + s, failed + f, rejected + r
+        latency_total += total
+        latency_max = max(latency_max, max_)
+    handled = sent + failed
+    return {
+        'outbound_sms.sent': sent,
+        'outbound_sms.failed': failed,
+        'outbound_sms.rejected': rejected,
+        'outbound_sms.latency_avg': (latency_total / handled if handled
+                                     else 0),
+        'outbound_sms.latency_max': latency_max,
+        'outbound_sms.queue_depth': depth,
+    }
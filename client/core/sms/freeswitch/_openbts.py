@@ -9,19 +9,11 @@ import freeswitch
 import openbts
 import sms_utilities
 
+from smspdu import concat
+
 from core.config_database import ConfigDB
 from core.sms.base import BaseSMS
 
-SMS_LENGTH = 160
-
-def chunk_sms(body):
-    res = []
-    i = 0
-    while (i + SMS_LENGTH) < len(body):
-        res.append(body[i:i+SMS_LENGTH])
-        i += SMS_LENGTH
-    res.append(body[i:])
-    return res
 
 class OpenBTSSMS(BaseSMS):
     def __init__(self):
@@ -29,6 +21,8 @@ class OpenBTSSMS(BaseSMS):
         self.smqueue = openbts.components.SMQueue(
             socket_timeout=self.conf['bss_timeout'],
             cli_timeout=self.conf['bss_timeout'])
+        # Parts of MO concatenated messages, until the whole message is in.
+        self.reassembler = concat.Reassembler()
 
     def parse_message(self, message):
         """Take a FS message and return a dictionary with the keys:
@@ -44,13 +38,28 @@ class OpenBTSSMS(BaseSMS):
               vbts_rp_originator_address_type
               vbts_rp_message_reference
               vbts_rp_message_type
+              vbts_concat_pending
+
+        The parts of a concatenated message are collected until the last
+        one arrives: vbts_concat_pending is 'true' for the others, and
+        vbts_text is the whole message for the last.
         """
-        content = sms_utilities.SMS_Parse.parse(message.getBody())
-        return dict(content)
+        parsed = sms_utilities.SMS_Parse.ParsedSMS(message.getBody())
+        content = dict(parsed)
+        text = self.reassembler.add(message.getHeader("from_user"),
+                                    parsed.sms_submit)
+        if text is None:
+            content['vbts_concat_pending'] = 'true'
+        else:
+            content['vbts_text'] = sms_utilities.SMS_Helper.clean(text)
+            content['vbts_concat_pending'] = 'false'
+        return content
 
     def send(self, to, fromm, body, empty=False):
         """Send a message via the SMSC addressed using MSISDNs"""
-        for chunk in chunk_sms(body):
+        sip_my_ip = self.smqueue.read_config('SIP.myIP').data['value']
+        sip_my_port = self.smqueue.read_config('SIP.myPort').data['value']
+        for rp_message in sms_utilities.SMS_Submit.gen_msgs(to, body, empty):
             event = freeswitch.Event("CUSTOM", "SMS::SEND_MESSAGE")
             event.addHeader("proto", "sip")
             event.addHeader("dest_proto", "sip")
@@ -58,8 +67,6 @@ class OpenBTSSMS(BaseSMS):
             from_full = ("sip:" + fromm + "@" +
                          freeswitch.getGlobalVariable("domain"))
             event.addHeader("from_full", from_full)
-            sip_my_ip = self.smqueue.read_config('SIP.myIP').data['value']
-            sip_my_port = self.smqueue.read_config('SIP.myPort').data['value']
             to_full = str(freeswitch.getGlobalVariable("smqueue_profile") +
                           "/sip:smsc@" + sip_my_ip + ":" + sip_my_port)
             event.addHeader("to", to_full)
@@ -67,20 +74,19 @@ class OpenBTSSMS(BaseSMS):
             event.addHeader("type", "application/vnd.3gpp.sms")
             event.addHeader("hint", "the hint")
             event.addHeader("replying", "false")
-            event.addBody(sms_utilities.SMS_Submit.gen_msg(to, chunk, empty))
+            event.addBody(rp_message)
             event.fire()
 
 
     def send_direct(self, to, fromm, body, empty=False):
         """Send a message directly via the BTS addressed using IMSIs"""
-        for chunk in chunk_sms(body):
-            imsi = to[0]
-            ipaddr = to[1]
-            port = to[2]
-            body = (sms_utilities.SMS_Deliver.gen_msg(
-                to, fromm, chunk, empty).upper())
-            freeswitch.consoleLog(
-                'info', 'Message body is: \'' + str(chunk) + '\'\n')
+        imsi = to[0]
+        ipaddr = to[1]
+        port = to[2]
+        freeswitch.consoleLog(
+            'info', 'Message body is: \'' + str(body) + '\'\n')
+        for rp_message in sms_utilities.SMS_Deliver.gen_msgs(
+                to, fromm, body, empty):
             event = freeswitch.Event("CUSTOM", "SMS::SEND_MESSAGE")
             event.addHeader("proto", "sip")
             event.addHeader("dest_proto", "sip")
@@ -95,5 +101,5 @@ class OpenBTSSMS(BaseSMS):
             event.addHeader("type", "application/vnd.3gpp.sms")
             event.addHeader("hint", "the hint")
             event.addHeader("replying", "false")
-            event.addBody(body)
+            event.addBody(rp_message.upper())
             event.fire()
@@ -42,7 +42,7 @@ class OsmocomSubscriber(BaseSubscriber):
         self.subscribers = Subscribers(host=self.conf['bts.osmocom.ip'],
             port=self.conf['bts.osmocom.bsc_vty_port'],
             hlr_loc=self.conf['bts.osmocom.hlr_loc'],
-            timeout=self.conf['bss_timeout'])
+            timeout=self.conf['bss_timeout'], persistent=True)
 
     def add_subscriber_to_hlr(self, imsi, number, ip, port):
         """Adds a subscriber to the system.
@@ -66,7 +66,12 @@ class OsmocomSubscriber(BaseSubscriber):
             raise BSSError("%s: %s" % (exc_type, exc_value)).with_traceback(exc_trace)
 
     def get_subscribers(self, imsi=''):
-        """Get subscriber by imsi."""
+        """Get subscriber by imsi.
+
+        The HLR is read in bulk straight from its database, and joined with
+        the balances in memory, rather than asking the VTY for each
+        subscriber.
+        """
         imsi = imsi + "%"
         subscribers = []
         with psycopg2.connect(host='localhost', database='endaga', user=PG_USER,
@@ -74,21 +79,26 @@ class OsmocomSubscriber(BaseSubscriber):
             with connection.cursor() as cursor:
                 cursor.execute(
                     "SELECT imsi, balance FROM subscribers WHERE imsi LIKE %s", (imsi,))
-                try:
-                    with self.subscribers as s:
-                        for row in cursor.fetchall():
-                            sub_record = s.show('imsi', row[0])
-                            if len(sub_record):
-                                subscribers.append({
-                                    'account_balance': row[1],
-                                    'name': row[0], # interface describes name as IMSI
-                                    'port': self.get_port(row[0]),
-                                    'ipaddr': self.get_ip(row[0]),
-                                    'caller_id': sub_record['extension'],
-                                    'numbers': [sub_record['extension']]})
-                except Exception:
-                    exc_type, exc_value, exc_trace = sys.exc_info()
-                    raise BSSError("%s: %s" % (exc_type, exc_value)).with_traceback(exc_trace)
+                rows = cursor.fetchall()
+        try:
+            hlr = {'IMSI' + sub['imsi']: sub
+                   for sub in self.subscribers.hlr_subscribers()}
+        except Exception:
+            exc_type, exc_value, exc_trace = sys.exc_info()
+            raise BSSError("%s: %s" % (exc_type, exc_value)).with_traceback(exc_trace)
+        # Osmocom subscribers all share the BTS's SIP endpoint
+        port = self.conf['bts.osmocom.sip_port']
+        ipaddr = self.conf['bts.osmocom.ip']
+        for (imsi, balance) in rows:
+            sub_record = hlr.get(imsi)
+            if sub_record:
+                subscribers.append({
+                    'account_balance': balance,
+                    'name': imsi, # interface describes name as IMSI
+                    'port': port,
+                    'ipaddr': ipaddr,
+                    'caller_id': sub_record['extension'],
+                    'numbers': [sub_record['extension']]})
         return subscribers
 
     def get_subscriber_imsis(self):
@@ -246,6 +246,91 @@ class BaseSubscriber(KVStore):
 
         self._connector.with_cursor(_inc_or_dec)
 
+    def adjust_credits(self, deltas):
+        """
+        Adjusts several subscribers' balances in a single transaction.
+
+        Deltas are applied with the same clamping as adjust_credit(); if any
+        subscriber is missing, none of the adjustments are applied. On
+        Postgres the balances are locked until the adjustments commit.
+
+        Arguments:
+            deltas: a list of (imsi, integer delta) tuples
+
+        Returns:
+            a list of (imsi, old balance, new balance) tuples, in order
+
+        Raises:
+            SubscriberNotFound if any of the subscribers doesn't exist
+        """
+        def _inc_or_dec_all(cur):
+            self._lock_balances(cur, set(imsi for imsi, _ in deltas))
+            results = []
+            for imsi, credit_delta in deltas:
+                bal = self._get_balance(cur, imsi)
+                old = int(bal.value())
+                if credit_delta > 0:
+                    bal.increment(amount=credit_delta)
+                elif credit_delta < 0:
+                    bal.decrement(amount=min(-credit_delta, bal.value()))
+                if credit_delta != 0:
+                    # update with this cursor, so all the balances commit
+                    # together
+                    cur.execute(self._update_item, (bal.serialize(), imsi))
+                results.append((imsi, old, int(bal.value())))
+            return results
+
+        return self._connector.with_cursor(_inc_or_dec_all)
+
+    def _lock_balances(self, cur, imsis):
+        """
+        Locks the subscribers' balance rows until the end of the current
+        transaction. Only Postgres supports row locks; elsewhere this does
+        nothing.
+        """
+        if not imsis or getattr(cur.connection, 'server_version',
+                                None) is None:
+            return
+        # always lock in the same order, so that two transfers between the
+        # same subscribers can't deadlock
+        cur.execute("SELECT %(key)s FROM %(table)s WHERE %(key)s IN %%s"
+                    " ORDER BY %(key)s FOR UPDATE;" % self._query_args,
+                    (tuple(sorted(imsis)), ))
+
+    def transfer_credit(self, from_imsi, to_imsi, amount):
+        """
+        Moves credit from one subscriber to another in a single transaction.
+
+        Each balance is read once, and on Postgres both are locked until the
+        transfer commits, so concurrent transfers from one subscriber can't
+        spend the same credit twice.
+
+        Returns:
+            a list of (imsi, old balance, new balance) tuples, sender first
+
+        Raises:
+            SubscriberNotFound if either subscriber doesn't exist
+            ValueError if the sender has less than amount
+        """
+        amount = self._get_credit_delta(amount)
+
+        def _transfer(cur):
+            self._lock_balances(cur, [from_imsi, to_imsi])
+            from_bal = self._get_balance(cur, from_imsi)
+            to_bal = self._get_balance(cur, to_imsi)
+            from_old, to_old = int(from_bal.value()), int(to_bal.value())
+            if from_old < amount:
+                raise ValueError('insufficient balance for %s' % from_imsi)
+            from_bal.decrement(amount=amount)
+            to_bal.increment(amount=amount)
+            # update with this cursor, so both balances commit together
+            cur.execute(self._update_item, (from_bal.serialize(), from_imsi))
+            cur.execute(self._update_item, (to_bal.serialize(), to_imsi))
+            return [(from_imsi, from_old, int(from_bal.value())),
+                    (to_imsi, to_old, int(to_bal.value()))]
+
+        return self._connector.with_cursor(_transfer)
+
     @staticmethod
     def _get_credit_delta(amount):
         """ Convert to int, should always be positive. """
@@ -0,0 +1,245 @@
+"""Tests for the broadcast SMS queue and its paced sender.
+
+Usage:
+    $ nosetests core.tests.broadcast_queue_tests
+
+Copyright (c) 2016-present, Facebook, Inc.
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree. An additional grant
+of patent rights can be found in the PATENTS file in the same directory.
+"""
+
+import unittest
+
+import mock
+
+from core.broadcast_queue import BroadcastQueue, BroadcastSender
+from core.db.connector import DatabaseError
+from core.exceptions import BSSError
+from core.subscriber import subscriber
+from core.tests import mocks
+from .sqlite3_connector import Sqlite3Connector
+
+
+class FakeFreeSwitch(object):
+    def __init__(self):
+        self.connected = True
+        self.refused = set()
+        self.sent = []
+
+    def send_to_numbers(self, messages):
+        if not self.connected:
+            return None
+        accepted = [to not in self.refused for to, _, _ in messages]
+        self.sent.extend(m for m, ok in zip(messages, accepted) if ok)
+        return accepted
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def create_broadcast_table(connector):
+    # sqlite has no serial type, so create the table with the
+    # autoincrementing id Postgres would give it.
+    connector.exec_stmt(
+        "CREATE TABLE endaga_broadcast(id INTEGER PRIMARY KEY"
+        " AUTOINCREMENT, to_number text NOT NULL, from_number text NOT"
+        " NULL, body text NOT NULL, parts integer NOT NULL, service_type"
+        " text NOT NULL, attempts integer NOT NULL DEFAULT 0);")
+
+
+class BroadcastQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connector = Sqlite3Connector()
+        create_broadcast_table(self.connector)
+        self.queue = BroadcastQueue(connector=self.connector)
+
+    def test_fifo(self):
+        """Messages are kept in the order they were queued."""
+        self.queue.add(['1', '2'], '0000', 'hi', 'free_sms')
+        self.queue.add(['3'], '5551234', 'x' * 200, 'off_network_receive')
+        self.assertEqual(len(self.queue), 3)
+        rows = self.queue.peek(10)
+        self.assertEqual([row[1] for row in rows], ['1', '2', '3'])
+        self.assertEqual(rows[0][2:], ('0000', 'hi', 1, 'free_sms'))
+        self.assertEqual(rows[2][4], 2)
+        self.queue.remove([rows[0][0], rows[2][0]])
+        self.assertEqual([row[1] for row in self.queue.peek(10)], ['2'])
+
+    def test_fail(self):
+        """Messages that fail max_attempts times are dead-lettered."""
+        self.queue.add(['1', '2'], '0000', 'hi', 'free_sms')
+        ids = [row[0] for row in self.queue.peek(10)]
+        self.assertEqual(self.queue.fail(ids, 2), 0)
+        self.assertEqual(self.queue.fail(ids[:1], 2), 1)
+        self.assertEqual([row[1] for row in self.queue.peek(10)], ['2'])
+        self.assertEqual(self.connector.exec_and_fetch(
+            "SELECT id, to_number, attempts FROM endaga_broadcast_failed;"),
+            [(ids[0], '1', 2)])
+
+    def test_too_long(self):
+        """A body that can't be sent isn't queued."""
+        with self.assertRaises(ValueError):
+            self.queue.add(['1'], '0000', 'x' * 153 * 256, 'free_sms')
+        self.assertEqual(len(self.queue), 0)
+
+
+class BroadcastSenderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connector = Sqlite3Connector()
+        create_broadcast_table(self.connector)
+        self.queue = BroadcastQueue(connector=self.connector)
+        self.fs = FakeFreeSwitch()
+        # the mock BTS has 2 of 4 SDCCHs in use
+        self.bts = mocks.MockBTS()
+        self.clock = FakeClock()
+        self.conf = {'broadcast.sdcch_reserve': 0}
+        self.sender = BroadcastSender(self.queue, self.fs, self.bts,
+                                      self.conf, clock=self.clock)
+        self.bill = mock.patch.object(self.sender, 'bill').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_paced_by_sdcch(self):
+        """Each round sends as many parts as there are idle SDCCHs."""
+        self.queue.add(['1', '2', '3'], '0000', 'hi', 'free_sms')
+        self.assertEqual(self.sender.send_next(), 2)
+        self.assertEqual(self.fs.sent, [('1', '0000', 'hi'),
+                                        ('2', '0000', 'hi')])
+        self.bill.assert_called_once_with([('1', '0000', 'free_sms'),
+                                           ('2', '0000', 'free_sms')])
+        self.assertEqual(len(self.queue), 1)
+        self.assertEqual(self.sender.send_next(), 1)
+        self.assertEqual(self.sender.send_next(), 0)
+
+    def test_reserve(self):
+        """Reserved SDCCHs are left for subscribers' own traffic."""
+        self.conf['broadcast.sdcch_reserve'] = 2
+        self.queue.add(['1'], '0000', 'hi', 'free_sms')
+        self.assertEqual(self.sender.send_next(), 0)
+        self.assertEqual(len(self.queue), 1)
+
+    def test_multipart(self):
+        """Parts count against the budget, but a long message still goes."""
+        self.queue.add(['1', '2'], '0000', 'x' * 400, 'free_sms')
+        self.assertEqual(self.sender.send_next(), 1)
+        self.assertEqual(self.sender.send_next(), 1)
+
+    def test_load_unavailable(self):
+        """Without the load, messages trickle out one at a time."""
+        self.bts.get_load = mock.Mock(side_effect=BSSError)
+        self.queue.add(['1', '2'], '0000', 'hi', 'free_sms')
+        self.assertEqual(self.sender.send_next(), 1)
+
+    def test_osmocom_load(self):
+        """Osmocom's load counts the SDCCH/4 and SDCCH/8 channels apart."""
+        self.bts.get_load = mock.Mock(return_value={
+            'ccch_sdcch4_load': 3, 'ccch_sdcch4_max': 4,
+            'sdcch8_load': 6, 'sdcch8_max': 8,
+            'tch_f_load': 0, 'tch_f_max': 8,
+        })
+        self.assertEqual(self.sender.budget(), 3)
+        # a load we can't read SDCCHs from
+        self.bts.get_load = mock.Mock(return_value={'tch_f_load': 0})
+        self.assertEqual(self.sender.budget(), 1)
+
+    def test_freeswitch_down(self):
+        """Messages stay queued if FreeSwitch can't be reached."""
+        self.fs.connected = False
+        self.queue.add(['1'], '0000', 'hi', 'free_sms')
+        self.assertEqual(self.sender.send_next(), 0)
+        self.assertEqual(len(self.queue), 1)
+        self.assertFalse(self.bill.called)
+
+    def test_refused(self):
+        """Messages FreeSwitch refuses stay queued, and aren't billed, until
+        they have been refused broadcast.max_attempts times.
+        """
+        self.conf['broadcast.max_attempts'] = 2
+        self.fs.refused.add('1')
+        self.queue.add(['1', '2'], '0000', 'hi', 'free_sms')
+        self.assertEqual(self.sender.send_next(), 1)
+        self.bill.assert_called_once_with([('2', '0000', 'free_sms')])
+        self.assertEqual(len(self.queue), 1)
+        self.assertEqual(self.sender.send_next(), 0)
+        self.assertEqual(len(self.queue), 0)
+        self.assertEqual(self.fs.sent, [('2', '0000', 'hi')])
+
+    def test_stats(self):
+        """Stats report the delivery rate and queue depth."""
+        self.queue.add(['1', '2', '3'], '0000', 'hi', 'free_sms')
+        self.sender.send_next()
+        self.clock.now += 30
+        self.assertEqual(self.sender.take_stats(), {
+            'broadcast.sent': 2,
+            'broadcast.sms_per_min': 4.0,
+            'broadcast.queue_depth': 1,
+        })
+        self.clock.now += 30
+        self.assertEqual(self.sender.take_stats()['broadcast.sent'], 0)
+
+    def test_stats_db_error(self):
+        """Counts aren't lost if the queue depth can't be read."""
+        self.queue.add(['1', '2', '3'], '0000', 'hi', 'free_sms')
+        self.sender.send_next()
+        with mock.patch.object(BroadcastQueue, '__len__',
+                               side_effect=DatabaseError('down')):
+            with self.assertRaises(DatabaseError):
+                self.sender.take_stats()
+        self.assertEqual(self.sender.take_stats()['broadcast.sent'], 2)
+
+    def test_background(self):
+        """The sender thread starts and stops."""
+        self.conf['broadcast.interval'] = 3600
+        self.sender.start()
+        thread = self.sender._thread
+        self.assertTrue(thread.is_alive())
+        self.sender.stop()
+        self.assertFalse(thread.is_alive())
+
+
+class BroadcastBillingTest(unittest.TestCase):
+
+    TEST_IMSI = 'IMSI901559000001234'
+    TEST_NUMBER = '15555551234'
+
+    @classmethod
+    def setUpClass(cls):
+        subscriber.create_subscriber(cls.TEST_IMSI, cls.TEST_NUMBER)
+
+    @classmethod
+    def tearDownClass(cls):
+        subscriber.delete_subscriber(cls.TEST_IMSI)
+
+    def setUp(self):
+        self.sender = BroadcastSender(None, None, None, {})
+        mock.patch('core.broadcast_queue.billing.get_sms_cost',
+                   return_value=10).start()
+        self.event_store = mock.patch('core.events.EventStore').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_bill(self):
+        """Recipients are billed together, and unknown numbers skipped."""
+        subscriber.add_credit(self.TEST_IMSI, 100)
+        prior = subscriber.get_account_balance(self.TEST_IMSI)
+        sent = (self.TEST_NUMBER, '5550000', 'off_network_receive')
+        unknown = ('15555559999', '5550000', 'off_network_receive')
+        self.sender.bill([sent, unknown, sent])
+        self.assertEqual(prior - 20,
+                         subscriber.get_account_balance(self.TEST_IMSI))
+        add_many = self.event_store.return_value.add_many
+        self.assertEqual(1, add_many.call_count)
+        written = add_many.call_args[0][0]
+        self.assertEqual([(e['imsi'], e['oldamt'], e['newamt'], e['kind'])
+                          for e in written],
+                         [(self.TEST_IMSI, prior, prior - 10, 'incoming_sms'),
+                          (self.TEST_IMSI, prior - 10, prior - 20,
+                           'incoming_sms')])
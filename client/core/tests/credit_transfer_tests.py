@@ -0,0 +1,166 @@
+"""Tests for the pending credit transfer store and atomic transfers.
+
+Usage:
+    $ nosetests core.tests.credit_transfer_tests
+
+Copyright (c) 2016-present, Facebook, Inc.
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree. An additional grant
+of patent rights can be found in the PATENTS file in the same directory.
+"""
+
+import threading
+import time
+import unittest
+
+from core.apps.pending_transfers import PendingTransferDB
+from core.exceptions import SubscriberNotFound
+from core.subscriber.base import BaseSubscriber
+from .sqlite3_connector import SharedSqlite3Connector, Sqlite3Connector
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class PendingTransferDBTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connector = Sqlite3Connector()
+        self.clock = FakeClock()
+        self.db = PendingTransferDB(ttl=600, sweep_interval=60,
+                                    connector=self.connector,
+                                    clock=self.clock)
+
+    def count(self):
+        return self.connector.exec_and_fetch_one(
+            "SELECT count(*) FROM endaga_pending_transfer;")[0]
+
+    def test_pop(self):
+        """A transfer is confirmed once, and only by its sender."""
+        self.db.add('IMSI001', 'IMSI002', 100, '1234')
+        self.assertEqual(self.db.pop('IMSI002', '1234'), None)
+        self.assertEqual(self.db.pop('IMSI001', '1234'), ('IMSI002', 100))
+        self.assertEqual(self.db.pop('IMSI001', '1234'), None)
+
+    def test_same_code(self):
+        """Senders can have the same code pending, but each only once."""
+        self.db.add('IMSI001', 'IMSI002', 100, '1234')
+        self.db.add('IMSI003', 'IMSI002', 200, '1234')
+        self.db.add('IMSI001', 'IMSI004', 300, '1234')
+        self.assertEqual(self.count(), 2)
+        self.assertEqual(self.db.pop('IMSI001', '1234'), ('IMSI004', 300))
+        self.assertEqual(self.db.pop('IMSI003', '1234'), ('IMSI002', 200))
+
+    def test_expired(self):
+        """An expired transfer can't be confirmed."""
+        self.db.add('IMSI001', 'IMSI002', 100, '1234')
+        self.clock.now += 601
+        self.assertEqual(self.db.pop('IMSI001', '1234'), None)
+        self.assertEqual(self.count(), 0)
+
+    def test_sweep(self):
+        """Expired transfers are swept when a transfer is added, at most
+        once per sweep interval.
+        """
+        self.db.add('IMSI001', 'IMSI002', 100, '1111')
+        self.clock.now += 601
+        self.db.add('IMSI001', 'IMSI002', 100, '2222')
+        self.assertEqual(self.count(), 1)
+        # '2222' expires, but it's too soon to sweep again
+        self.clock.now += 599
+        self.db.add('IMSI001', 'IMSI002', 100, '3333')
+        self.clock.now += 2
+        self.db.add('IMSI001', 'IMSI002', 100, '4444')
+        self.assertEqual(self.count(), 3)
+        self.db.sweep()
+        self.assertEqual(self.count(), 2)
+
+
+class TransferCreditTest(unittest.TestCase):
+
+    def setUp(self):
+        self.subscriber = BaseSubscriber(connector=Sqlite3Connector())
+        self.subscriber.create_subscriber('IMSI001', '5551111')
+        self.subscriber.create_subscriber('IMSI002', '5552222')
+        self.subscriber.add_credit('IMSI001', 500)
+
+    def balances(self):
+        return (self.subscriber.get_account_balance('IMSI001'),
+                self.subscriber.get_account_balance('IMSI002'))
+
+    def test_transfer(self):
+        self.assertEqual(
+            self.subscriber.transfer_credit('IMSI001', 'IMSI002', 200),
+            [('IMSI001', 500, 300), ('IMSI002', 0, 200)])
+        self.assertEqual(self.balances(), (300, 200))
+
+    def test_insufficient(self):
+        """A transfer of more than the sender has changes nothing."""
+        with self.assertRaises(ValueError):
+            self.subscriber.transfer_credit('IMSI001', 'IMSI002', 501)
+        self.assertEqual(self.balances(), (500, 0))
+
+    def test_missing_recipient(self):
+        with self.assertRaises(SubscriberNotFound):
+            self.subscriber.transfer_credit('IMSI001', 'IMSI003', 100)
+        self.assertEqual(self.balances(), (500, 0))
+
+
+class ConcurrentTransferTest(unittest.TestCase):
+
+    # generous, so that a slow test machine doesn't fail the test
+    MAX_LATENCY = 1.0
+
+    def setUp(self):
+        connector = SharedSqlite3Connector()
+        self.subscriber = BaseSubscriber(connector=connector)
+        self.subscriber.create_subscriber('IMSI001', '5551111')
+        self.subscriber.create_subscriber('IMSI002', '5552222')
+        self.subscriber.add_credit('IMSI001', 500)
+        self.db = PendingTransferDB(connector=connector)
+
+    def confirm(self, code, results, latencies):
+        start = time.time()
+        pending = self.db.pop('IMSI001', code)
+        if pending is None:
+            result = 'expired'
+        else:
+            to_imsi, amount = pending
+            try:
+                self.subscriber.transfer_credit('IMSI001', to_imsi, amount)
+                result = 'sent'
+            except ValueError:
+                result = 'insufficient'
+        latencies.append(time.time() - start)
+        results.append(result)
+
+    def test_concurrent_confirms(self):
+        """Concurrent confirmations each move credit at most once, never
+        overdraw the sender, and stay fast.
+        """
+        codes = ['%04d' % i for i in range(10)]
+        for code in codes:
+            self.db.add('IMSI001', 'IMSI002', 100, code)
+        results, latencies = [], []
+        # every code is confirmed twice at once
+        threads = [threading.Thread(target=self.confirm,
+                                    args=(code, results, latencies))
+                   for code in codes * 2]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(sorted(results),
+                         ['expired'] * 10 + ['insufficient'] * 5 +
+                         ['sent'] * 5)
+        self.assertEqual(self.subscriber.get_account_balance('IMSI001'), 0)
+        self.assertEqual(self.subscriber.get_account_balance('IMSI002'), 500)
+        self.assertEqual(len(latencies), 20)
+        self.assertLess(max(latencies), self.MAX_LATENCY)
@@ -0,0 +1,234 @@
+"""Tests for the pooled ESL client, against a stand-in ESL server.
+
+Usage:
+    $ nosetests core.tests.esl_tests
+
+Copyright (c) 2016-present, Facebook, Inc.
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree. An additional grant
+of patent rights can be found in the PATENTS file in the same directory.
+"""
+
+import socketserver
+import threading
+import time
+import unittest
+
+from core.esl import ESLConnection, ESLConnectionClosed, ESLError, ESLPool
+from core.freeswitch_interconnect import freeswitch_ic
+
+
+class FakeESLHandler(socketserver.StreamRequestHandler):
+    """Speaks just enough of the inbound ESL protocol to FreeSwitch's side.
+
+    'api' commands echo the command back; 'api sleep' and 'bgapi sleep'
+    don't reply at all, 'bgapi bad' is refused and 'bgapi drop' closes the
+    connection without replying.
+    """
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            self.serve()
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def serve(self):
+        server = self.server
+        self.wfile.write(b"Content-Type: auth/request\n\n")
+        while True:
+            cmd = self.read_command()
+            if cmd is None:
+                return
+            with server.lock:
+                server.commands.append(cmd)
+            if cmd.startswith('auth '):
+                if cmd[5:] == server.password:
+                    self.reply('+OK accepted')
+                else:
+                    self.reply('-ERR invalid')
+                    return
+            elif cmd.endswith(' sleep'):
+                continue
+            elif cmd == 'bgapi drop':
+                return
+            elif cmd.startswith('api '):
+                body = ('+OK %s\n' % cmd[4:]).encode('utf-8')
+                self.wfile.write(("Content-Type: api/response\n"
+                                  "Content-Length: %d\n\n" % len(body)
+                                  ).encode('utf-8') + body)
+            elif cmd == 'bgapi bad':
+                self.reply('-ERR bad')
+            elif cmd.startswith('bgapi '):
+                job = 'job-%d' % len(server.commands)
+                self.reply('+OK Job-UUID: %s' % job, 'Job-UUID: %s\n' % job)
+            if server.hangup and not cmd.startswith('auth '):
+                return
+
+    def read_command(self):
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return None
+            line = line.decode('utf-8').rstrip('\n')
+            if not line and lines:
+                return ' '.join(lines)
+            if line:
+                lines.append(line)
+
+    def reply(self, text, extra=''):
+        self.wfile.write(("Content-Type: command/reply\nReply-Text: %s\n%s\n"
+                          % (text, extra)).encode('utf-8'))
+
+
+class FakeESLServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, password='ClueCon'):
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0),
+                                                 FakeESLHandler)
+        self.password = password
+        self.lock = threading.Lock()
+        self.commands = []
+        self.connections = 0
+        self.active = 0
+        self.max_active = 0
+        # close each connection after its first command after auth
+        self.hangup = False
+
+
+class ESLTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeESLServer()
+        self.port = self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.pool = ESLPool('127.0.0.1', self.port, 'ClueCon', size=2,
+                            timeout=0.5)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_auth(self):
+        """A bad password or an unreachable server is an ESLError."""
+        with self.assertRaises(ESLError):
+            ESLConnection('127.0.0.1', self.port, 'wrong', timeout=0.5)
+        self.server.server_close()
+        with self.assertRaises(ESLError):
+            ESLConnection('127.0.0.1', self.port, 'ClueCon', timeout=0.5)
+
+    def test_api(self):
+        self.assertEqual(self.pool.api('status'), '+OK status\n')
+
+    def test_reuse(self):
+        """Commands share one authenticated connection."""
+        for _ in range(5):
+            self.pool.bgapi('python VBTS_Send_SMS 1|2|hi')
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(len([c for c in self.server.commands
+                              if c.startswith('auth')]), 1)
+
+    def test_bgapi_pipelined(self):
+        """Every command gets its own job, in the order sent."""
+        jobs = self.pool.bgapi('a', 'b', 'c')
+        self.assertEqual(jobs, ['job-2', 'job-3', 'job-4'])
+        self.assertEqual(self.server.commands[1:],
+                         ['bgapi a', 'bgapi b', 'bgapi c'])
+
+    def test_bgapi_refused(self):
+        """A refused command doesn't stop the rest, or lose the
+        connection.
+        """
+        self.assertEqual(self.pool.bgapi('a', 'bad', 'c'),
+                         ['job-2', None, 'job-4'])
+        self.assertEqual(self.pool.bgapi('d'), ['job-5'])
+        self.assertEqual(self.server.connections, 1)
+
+    def test_line_break(self):
+        """A command with a line break in it isn't sent."""
+        with self.assertRaises(ESLError):
+            self.pool.bgapi('a', 'b\n\nbgapi c')
+        self.assertEqual(self.server.commands, ['auth ClueCon'])
+        # SMS bodies are sent with their line breaks as spaces
+        self.assertEqual(
+            freeswitch_ic._send_sms_cmd('1', '2', 'hi\r\n\nbgapi c'),
+            'python VBTS_Send_SMS 1|2|hi bgapi c')
+
+    def test_reconnect(self):
+        """A pooled connection the server closed is replaced."""
+        self.server.hangup = True
+        self.pool.bgapi('a')
+        # wait for the server to hang up on the idle connection
+        time.sleep(0.1)
+        self.assertEqual(self.pool.bgapi('b'), ['job-4'])
+        self.assertEqual(self.server.connections, 2)
+
+    def test_closed_after_send(self):
+        """Commands that were written aren't retried if the connection
+        closes before they are answered, as they may have run.
+        """
+        self.pool.bgapi('a')
+        with self.assertRaises(ESLConnectionClosed):
+            self.pool.bgapi('drop')
+        self.assertEqual(self.server.commands.count('bgapi drop'), 1)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_timeout(self):
+        """A command that gets no reply times out, and its connection is
+        dropped.
+        """
+        start = time.time()
+        with self.assertRaises(ESLError):
+            self.pool.api('sleep')
+        self.assertTrue(time.time() - start < 2)
+        self.assertEqual(self.pool._idle, [])
+        self.assertEqual(self.pool.api('status'), '+OK status\n')
+        self.assertEqual(self.server.connections, 2)
+
+    def test_pool_bounded(self):
+        """No more than size connections are open at once."""
+        open_cons = []
+        peak = []
+
+        class CountedConnection(ESLConnection):
+            def __init__(self, *args):
+                ESLConnection.__init__(self, *args)
+                open_cons.append(self)
+                peak.append(len(open_cons))
+
+            def close(self):
+                if self in open_cons:
+                    open_cons.remove(self)
+                ESLConnection.close(self)
+
+        pool = ESLPool('127.0.0.1', self.port, 'ClueCon', size=2,
+                       timeout=0.5, connect=CountedConnection)
+        results = []
+
+        def worker(cmd):
+            try:
+                results.append(pool.api(cmd))
+            except ESLError as e:
+                results.append(e)
+        workers = [threading.Thread(target=worker, args=(cmd,))
+                   for cmd in ('sleep', 'sleep', 'status', 'status')]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        pool.close()
+        self.assertEqual(len(results), 4)
+        self.assertEqual(max(peak), 2)
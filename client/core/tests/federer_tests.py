@@ -15,6 +15,7 @@ of patent rights can be found in the PATENTS file in the same directory.
 
 
 
+import json
 import unittest
 
 import itsdangerous
@@ -261,6 +262,35 @@ class CallCDRTestCase(unittest.TestCase):
 
 
 
+class ParseCDRTestCase(unittest.TestCase):
+    """Reading the tags we bill from out of an XML CDR."""
+
+    def test_parse_cdr(self):
+        """Tags are read in order, with their parent tags."""
+        with open('core/tests/fixtures/local-call-cdr.xml') as cdr_file:
+            cdr_tags = core.federer_handlers.cdr.parse_cdr(cdr_file.read())
+        self.assertEqual([], cdr_tags['origination'])
+        self.assertEqual([('variables', 'local_call')],
+                         cdr_tags['service_type'])
+        self.assertEqual(
+            [('caller_profile', 'IMSI510555550000081'),
+             ('originator_caller_profile', '6285574719944')],
+            cdr_tags['destination_number'][:2])
+        # tags we don't bill from aren't kept
+        self.assertNotIn('dialplan', cdr_tags)
+
+    def test_get_tag_text(self):
+        with open('core/tests/fixtures/local-call-cdr.xml') as cdr_file:
+            cdr_tags = core.federer_handlers.cdr.parse_cdr(cdr_file.read())
+        get_tag_text = core.federer_handlers.cdr.get_tag_text
+        self.assertEqual('23', get_tag_text(cdr_tags, 'duration'))
+        self.assertEqual('6285574719944', get_tag_text(
+            cdr_tags, 'destination_number',
+            parent='originator_caller_profile'))
+        self.assertEqual(None, get_tag_text(cdr_tags, 'billsec',
+                                            parent='caller_profile'))
+
+
 class SMSCDRTestCase(unittest.TestCase):
     """Handling SMS CDRs."""
 
@@ -344,6 +374,30 @@ class SMSCDRTestCase(unittest.TestCase):
         # one for the recipient.
         self.assertEqual(2, len(self.event_store.get_events()))
 
+    def test_post_batch(self):
+        """A batch of CDRs is billed in one request."""
+        cdrs = [{
+            'from_name': 'IMSI901550000000084',
+            'from_number': '12345',
+            'service_type': 'outside_sms',
+            'destination': '7895551234',
+        }, {
+            'from_name': 'IMSI901550000000084',
+            'from_number': '12345',
+            'service_type': 'free_sms',
+            'destination': '5552888',
+        }]
+        response = self.test_app.post(self.endpoint,
+                                      params={'cdrs': json.dumps(cdrs)})
+        self.assertEqual(200, response.status)
+        events = self.event_store.get_events()
+        self.assertEqual([300, 0], [e['tariff'] for e in events[-2:]])
+
+    def test_post_bad_batch_raises_400(self):
+        response = self.test_app.post(self.endpoint, params={'cdrs': '['},
+                                      expect_errors=True)
+        self.assertEqual(400, response.status)
+
     def test_local_sms(self):
         """We should set event info when sending local_sms."""
         data = {
@@ -640,3 +694,31 @@ class DeactivateSubscriberTest(unittest.TestCase):
         self.assertEqual(200, response.status)
         # Repair the monkeypatch.
         core.federer_handlers.config.subscriber.get_caller_id = original_lookup
+
+    def test_deactivate_batch(self):
+        """A batch of imsis is deactivated, skipping those already gone."""
+        data = {
+            'imsis': ['IMSI901550000000084', 'IMSI000555',
+                      'IMSI901550000000085'],
+        }
+        signed_data = {
+            'jwt': self.serializer.dumps(data),
+        }
+        def mock_delete(imsi):
+            if imsi == 'IMSI000555':
+                raise SubscriberNotFound
+        with mock.patch('core.federer_handlers.config.subscriber.delete_subscriber',
+                        side_effect=mock_delete) as mocked_delete:
+            response = self.test_app.post(self.endpoint, params=signed_data)
+        self.assertEqual(200, response.status)
+        self.assertEqual(data['imsis'],
+                         [args[0] for args, _ in mocked_delete.call_args_list])
+
+    def test_deactivate_batch_not_list(self):
+        """The batch must be a list."""
+        signed_data = {
+            'jwt': self.serializer.dumps({'imsis': 'IMSI901550000000084'}),
+        }
+        response = self.test_app.post(self.endpoint, params=signed_data,
+                                      expect_errors=True)
+        self.assertEqual(400, response.status)
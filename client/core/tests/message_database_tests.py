@@ -0,0 +1,95 @@
+"""Tests for the inbound message id window.
+
+Usage:
+    $ nosetests core.tests.message_database_tests
+
+Copyright (c) 2016-present, Facebook, Inc.
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree. An additional grant
+of patent rights can be found in the PATENTS file in the same directory.
+"""
+
+import unittest
+
+from core.message_database import MessageDB
+from .sqlite3_connector import Sqlite3Connector
+
+
+class MessageDBTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connector = Sqlite3Connector()
+        # sqlite has no serial type, so create the table with the
+        # autoincrementing id Postgres would give it.
+        self.connector.exec_stmt(
+            "CREATE TABLE endaga_msgid(id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " msgid text UNIQUE NOT NULL);")
+        self.db = MessageDB(max_len=10, cache_size=3,
+                            connector=self.connector)
+
+    def count(self):
+        return self.connector.exec_and_fetch_one(
+            "SELECT count(*) FROM endaga_msgid;")[0]
+
+    def test_seen(self):
+        """A msgid is only new the first time."""
+        self.assertFalse(self.db.seen('a'))
+        self.assertTrue(self.db.seen('a'))
+        self.assertFalse(self.db.seen('b'))
+        self.assertEqual(self.count(), 2)
+
+    def test_seen_by_other_instance(self):
+        """Msgids recorded by another instance are seen, uncached."""
+        other = MessageDB(connector=self.connector)
+        self.assertFalse(other.seen('a'))
+        self.assertNotIn('a', self.db._cache)
+        self.assertTrue(self.db.seen('a'))
+        self.assertIn('a', self.db)
+        self.assertNotIn('b', self.db)
+
+    def test_cache_bounded(self):
+        """Only the most recently seen msgids are cached."""
+        for msgid in 'abcd':
+            self.db.seen(msgid)
+        self.assertEqual(list(self.db._cache), ['b', 'c', 'd'])
+        self.db.seen('b')
+        self.assertEqual(list(self.db._cache), ['c', 'd', 'b'])
+        # 'a' fell out of the cache, but is still in the table
+        self.assertTrue(self.db.seen('a'))
+
+    def test_cached_repeat_skips_db(self):
+        """A cached msgid is seen without querying the table."""
+        self.db.seen('a')
+        self.connector.exec_stmt("DELETE FROM endaga_msgid;")
+        self.assertTrue(self.db.seen('a'))
+        self.assertIn('a', self.db)
+
+    def test_prune(self):
+        """Pruning keeps the most recent max_len msgids."""
+        for i in range(25):
+            self.db.seen('msg-%d' % i)
+        self.assertEqual(self.count(), 25)
+        self.db.prune()
+        self.assertEqual(self.count(), 10)
+        self.assertFalse(self.db.seen('msg-0'))
+        self.assertTrue(self.db.seen('msg-24'))
+
+    def test_old_server(self):
+        """Servers without ON CONFLICT get an INSERT ... SELECT."""
+        self.connector._backend.server_version = 90300
+        db = MessageDB(connector=self.connector)
+        self.assertFalse(db.seen('a'))
+        self.assertIn('NOT EXISTS', db._insert)
+        db._cache.clear()
+        self.assertTrue(db.seen('a'))
+        self.assertEqual(self.count(), 1)
+
+    def test_background_pruning(self):
+        """The pruning thread starts and stops."""
+        self.db.start_pruning(interval=3600)
+        pruner = self.db._pruner
+        self.assertTrue(pruner.is_alive())
+        self.db.stop_pruning()
+        self.assertFalse(pruner.is_alive())
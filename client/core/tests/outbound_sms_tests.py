@@ -0,0 +1,233 @@
+"""Tests for the outbound SMS worker pool.
+
+Usage:
+    $ nosetests core.tests.outbound_sms_tests
+
+Copyright (c) 2016-present, Facebook, Inc.
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree. An additional grant
+of patent rights can be found in the PATENTS file in the same directory.
+"""
+
+import json
+import time
+import unittest
+
+import mock
+import requests
+
+from core import outbound_sms
+from core.outbound_sms import OutboundSMSPool
+from .sqlite3_connector import SharedSqlite3Connector, Sqlite3Connector
+
+
+class FakeInterconnect(object):
+    def __init__(self, accept=True):
+        self.accept = accept
+        self.sent = []
+
+    def send(self, to, from_, body):
+        if isinstance(self.accept, Exception):
+            raise self.accept
+        self.sent.append((to, from_, body))
+        return self.accept
+
+
+class FakeSession(object):
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.posts = []
+
+    def post(self, url, data=None, timeout=None):
+        self.posts.append((url, data))
+        self.timeout = timeout
+        response = requests.Response()
+        response.status_code = self.status_code
+        return response
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def create_tables(connector):
+    # sqlite has no serial type, so create the tables with the
+    # autoincrementing id Postgres would give them.
+    connector.exec_stmt(
+        "CREATE TABLE endaga_outbound_sms(id INTEGER PRIMARY KEY"
+        " AUTOINCREMENT, queued double precision NOT NULL, to_number text"
+        " NOT NULL, from_number text NOT NULL, from_name text NOT NULL, body"
+        " text NOT NULL, service_type text NOT NULL);")
+    connector.exec_stmt(
+        "CREATE TABLE endaga_outbound_sms_stats(id INTEGER PRIMARY KEY"
+        " AUTOINCREMENT, pid integer NOT NULL, queue_depth integer NOT NULL,"
+        " sent integer NOT NULL, failed integer NOT NULL, rejected integer"
+        " NOT NULL, latency_total real NOT NULL, latency_max real NOT"
+        " NULL);")
+
+
+class OutboundSMSPoolTest(unittest.TestCase):
+
+    SMS = ('5551234', '5550000', 'IMSI901550000000084', 'hi', 'outside_sms')
+
+    def setUp(self):
+        self.connector = Sqlite3Connector()
+        create_tables(self.connector)
+        self.conf = {'billing_url': 'http://127.0.0.1/smscdr'}
+        self.clock = FakeClock()
+        self.pool = OutboundSMSPool(self.conf, workers=2, max_queue=3,
+                                    billing_batch=2, connector=self.connector,
+                                    clock=self.clock)
+        self.addCleanup(self.pool.stop)
+
+    def queued_sms(self):
+        return self.pool.take()[1]
+
+    def test_bounded(self):
+        """A full queue refuses more SMS."""
+        for _ in range(3):
+            self.assertTrue(self.pool.submit(*self.SMS))
+        self.assertFalse(self.pool.submit(*self.SMS))
+        self.assertEqual(len(self.pool), 3)
+        self.assertEqual(self.pool._stats['rejected'], 1)
+
+    def test_restart(self):
+        """Queued SMS are kept for the next pool, oldest first, and each is
+        taken only once.
+        """
+        self.pool.submit('5551234', '5550000', 'IMSI001', 'first', 'sms')
+        self.clock.now += 1
+        self.pool.submit('5551234', '5550000', 'IMSI001', 'second', 'sms')
+        pool = OutboundSMSPool(self.conf, connector=self.connector,
+                               clock=self.clock)
+        self.assertEqual(len(pool), 2)
+        self.assertEqual(pool.take(), (1000.0, {
+            'to': '5551234',
+            'from_num': '5550000',
+            'from_name': 'IMSI001',
+            'body': 'first',
+            'service_type': 'sms',
+        }))
+        self.assertEqual(self.queued_sms()['body'], 'second')
+        self.assertEqual(pool.take(), None)
+
+    def test_send(self):
+        """A sent SMS is queued for billing."""
+        self.pool.submit(*self.SMS)
+        ic = FakeInterconnect()
+        self.assertTrue(self.pool.send(ic, self.queued_sms()))
+        self.assertEqual(ic.sent, [('5551234', '5550000', 'hi')])
+        self.assertEqual(self.pool._billing, [{
+            'from_name': 'IMSI901550000000084',
+            'from_number': '5550000',
+            'destination': '5551234',
+            'service_type': 'outside_sms',
+        }])
+
+    def test_send_failed(self):
+        """An SMS our API refuses, or that can't reach it, isn't billed."""
+        for accept in (False, requests.ConnectionError()):
+            self.pool.submit(*self.SMS)
+            self.assertFalse(self.pool.send(FakeInterconnect(accept),
+                                            self.queued_sms()))
+        self.assertEqual(self.pool._billing, [])
+
+    def test_flush_billing(self):
+        """Billing requests are posted in one batch."""
+        ic = FakeInterconnect()
+        for _ in range(2):
+            self.pool.submit(*self.SMS)
+            self.pool.send(ic, self.queued_sms())
+        self.assertTrue(self.pool._billing_ready.is_set())
+        session = FakeSession()
+        self.pool.flush_billing(session)
+        self.assertEqual(len(session.posts), 1)
+        url, data = session.posts[0]
+        self.assertEqual(url, 'http://127.0.0.1/smscdr')
+        self.assertEqual(session.timeout, 10)
+        self.assertEqual(len(json.loads(data['cdrs'])), 2)
+        self.assertEqual(self.pool._billing, [])
+        # nothing to post
+        self.pool.flush_billing(session)
+        self.assertEqual(len(session.posts), 1)
+
+    def test_flush_billing_failed(self):
+        """A batch that fails to post is kept for the next."""
+        self.pool.submit(*self.SMS)
+        self.pool.send(FakeInterconnect(), self.queued_sms())
+        self.pool.flush_billing(FakeSession(500))
+        self.assertEqual(len(self.pool._billing), 1)
+
+    def test_billing_backlog(self):
+        """Failed billing requests are kept up to max_billing, dropping the
+        oldest.
+        """
+        self.pool.max_billing = 3
+        ic = FakeInterconnect()
+        for to in ('5550001', '5550002', '5550003', '5550004'):
+            self.pool.submit(to, '5550000', 'IMSI001', 'hi', 'sms')
+            self.pool.send(ic, self.queued_sms())
+            self.pool.flush_billing(FakeSession(500))
+        self.assertEqual([cdr['destination'] for cdr in self.pool._billing],
+                         ['5550002', '5550003', '5550004'])
+
+    def test_workers(self):
+        """The workers send the queue, and stopping waits for them."""
+        ic = FakeInterconnect()
+        session = FakeSession()
+        connector = SharedSqlite3Connector()
+        create_tables(connector)
+        pool = OutboundSMSPool(self.conf, workers=2, interval=0.01,
+                               connector=connector)
+        with mock.patch('core.outbound_sms.interconnect.endaga_ic',
+                        return_value=ic), \
+                mock.patch('core.outbound_sms.requests.Session',
+                           return_value=session):
+            pool.start()
+            pool.submit(*self.SMS)
+            # the workers pick up SMS queued while they wait
+            time.sleep(0.05)
+            pool.submit(*self.SMS)
+            pool.stop()
+        self.assertEqual(len(ic.sent), 2)
+        self.assertEqual(len(pool), 0)
+        self.assertEqual(
+            sum(len(json.loads(data['cdrs'])) for _, data in session.posts),
+            2)
+        # stopping records the last stats
+        self.assertEqual(
+            outbound_sms.collect_stats(connector)['outbound_sms.sent'], 2)
+
+    def test_stats(self):
+        """Stats from each process are summed, and drained when collected."""
+        self.pool.submit(*self.SMS)
+        self.clock.now += 3
+        self.pool.submit(*self.SMS)
+        self.clock.now += 1
+        # run a worker in this thread until it has sent the queue
+        self.pool._stop.set()
+        with mock.patch('core.outbound_sms.interconnect.endaga_ic',
+                        return_value=FakeInterconnect()):
+            self.pool._work()
+        self.pool.record_stats()
+        # another process with a full queue
+        for _ in range(4):
+            self.pool.submit(*self.SMS)
+        with mock.patch('core.outbound_sms.os.getpid', return_value=1):
+            self.pool.record_stats()
+        self.assertEqual(outbound_sms.collect_stats(self.connector), {
+            'outbound_sms.sent': 2,
+            'outbound_sms.failed': 0,
+            'outbound_sms.rejected': 1,
+            'outbound_sms.latency_avg': 2.5,
+            'outbound_sms.latency_max': 4.0,
+            'outbound_sms.queue_depth': 3,
+        })
+        self.assertEqual(outbound_sms.collect_stats(self.connector)[
+            'outbound_sms.sent'], 0)
@@ -13,6 +13,7 @@ of patent rights can be found in the PATENTS file in the same directory.
 
 import re
 import sqlite3
+import threading
 
 from core.db.connector import BaseConnector
 
@@ -58,6 +59,23 @@ class Sqlite3Connector(BaseConnector):
         self._connection = self._backend
 
 
+class SharedSqlite3Connector(Sqlite3Connector):
+    """An in-memory database that several threads can use, one transaction
+    at a time.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._backend = sqlite3.connect(':memory:',
+                                        factory=Sqlite3Connection,
+                                        check_same_thread=False)
+        BaseConnector.__init__(self, 2)
+
+    def execute(self, txn, *args):
+        with self._lock:
+            return super(SharedSqlite3Connector, self).execute(txn, *args)
+
+
 class Sqlite3Cursor(sqlite3.Cursor):
     """
     sqlite3 uses simple '?' positional specifiers for param substitution
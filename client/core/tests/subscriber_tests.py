@@ -20,6 +20,7 @@ import json
 from random import randrange
 import unittest
 
+from core.exceptions import SubscriberNotFound
 from core.subscriber import subscriber
 
 
@@ -74,6 +75,31 @@ class CreditTest(unittest.TestCase):
         after = subscriber.get_account_balance(self.TEST_IMSI)
         self.assertEqual(prior - int(decrement), after)
 
+    def test_adjust_credits(self):
+        """ Batched adjustments apply in order, clamped at zero. """
+        subscriber.add_credit(self.TEST_IMSI, 100)
+        prior = subscriber.get_account_balance(self.TEST_IMSI)
+        results = subscriber.adjust_credits([
+            (self.TEST_IMSI, 50), (self.TEST_IMSI, -(prior + 1000))])
+        self.assertEqual([(self.TEST_IMSI, prior, prior + 50),
+                          (self.TEST_IMSI, prior + 50, 0)], results)
+        self.assertEqual(0, subscriber.get_account_balance(self.TEST_IMSI))
+
+    def test_adjust_credits_unknown_sub(self):
+        """ A batch with an unknown sub applies nothing, not even the
+        adjustments before it. """
+        subscriber.add_credit(self.TEST_IMSI, 100)
+        prior = subscriber.get_account_balance(self.TEST_IMSI)
+        with self.assertRaises(SubscriberNotFound):
+            subscriber.adjust_credits([(self.TEST_IMSI, 10),
+                                       (self.TEST_IMSI, -30),
+                                       ('IMSI901559999999999', 10)])
+        self.assertEqual(prior, subscriber.get_account_balance(self.TEST_IMSI))
+        # the balance is still adjusted normally afterwards
+        subscriber.adjust_credits([(self.TEST_IMSI, 10)])
+        self.assertEqual(prior + 10,
+                         subscriber.get_account_balance(self.TEST_IMSI))
+
     def test_add_existing_sub(self):
         """ Adding an existing IMSI should raise ValueError. """
         with self.assertRaises(ValueError):
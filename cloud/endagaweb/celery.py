@@ -42,5 +42,10 @@ app.conf.update(CELERYBEAT_SCHEDULE={
         'task': 'endagaweb.tasks.usageevents_to_sftp',
         # Run this at 15:00 UTC (10:00 PDT, 02:00 Papua time)
         'schedule': crontab(minute=0, hour=17),
+    },
+    'maintain-partitions': {
+        'task': 'endagaweb.tasks.maintain_partitions',
+        # Run this at 16:00 UTC, ahead of the other daily tasks.
+        'schedule': crontab(minute=0, hour=16),
     }
 })
@@ -18,10 +18,12 @@ from django.conf import settings
 import django.utils.timezone
 
 from ccm.common import crdt, delta
+from endagaweb import tasks
 from endagaweb.models import BillingTier
 from endagaweb.models import ClientRelease
 from endagaweb.models import ConfigurationKey
 from endagaweb.models import Destination
+from endagaweb.models import PendingCreditUpdate
 from endagaweb.models import Subscriber
 from endagaweb.models import TimeseriesStat
 from endagaweb.models import UsageEvent
@@ -221,6 +223,12 @@ class CheckinResponder(object):
             # Persist
             sub.save()
 
+        # Credit updates wait for their subscriber's tower, e.g. those made
+        # while the subscriber had none, or that we gave up sending.
+        pending = PendingCreditUpdate.objects.filter(subscriber__bts=self.bts)
+        if pending.exists():
+            tasks.schedule_credit_updates(self.bts)
+
     def uptime(self, uptime):
         """
         Process the reported uptime of the BTS.
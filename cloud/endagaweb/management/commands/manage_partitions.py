@@ -0,0 +1,37 @@
+"""Runs partition maintenance for UsageEvent and TimeseriesStat.
+
+This is the same work the maintain_partitions celery task does daily; see
+endagaweb.util.partitions for details.
+
+Usage:
+    python manage.py manage_partitions [--dry-run]
+
+Copyright (c) 2016-present, Facebook, Inc.
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree. An additional grant
+of patent rights can be found in the PATENTS file in the same directory.
+"""
+
+from django.core.management.base import BaseCommand
+
+from endagaweb.util import partitions
+
+
+class Command(BaseCommand):
+    """A custom management command."""
+
+    help = 'creates, downsamples and drops event table partitions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true', dest='dry_run', default=False,
+            help='only print what would be done')
+
+    def handle(self, *args, **options):
+        actions = partitions.maintain(dry_run=options['dry_run'])
+        for action, name in actions:
+            self.stdout.write('%s %s' % (action, name))
+        if not actions:
+            self.stdout.write('nothing to do')
@@ -28,7 +28,7 @@ from django.core.exceptions import ValidationError
 from django.db import connection
 from django.db import models
 from django.db import transaction
-from django.db.models import F
+from django.db.models import F, Max, Q
 from django.db.models.signals import post_save
 from guardian.shortcuts import (assign_perm, get_users_with_perms)
 from rest_framework.authtoken.models import Token
@@ -224,6 +224,18 @@ class Transaction(models.Model):
 post_save.connect(Ledger.transaction_save_handler, sender=Transaction)
 
 
+# The first client (endaga package) version with each of these features.
+# Older towers are sent what they understand instead.
+CLIENT_FEATURE_VERSIONS = {
+    # batched credit updates, posted to /config/add_credits
+    'add_credits': '0.9.0',
+    # lists of IMSIs in /config/deactivate_subscriber requests
+    'deactivate_subscribers': '0.9.0',
+    # batched SMS broadcasts, posted to /broadcast_sms
+    'broadcast_sms': '0.9.0',
+}
+
+
 class BTS(models.Model):
     """Model for our base stations."""
     network = models.ForeignKey('Network', on_delete=models.CASCADE)
@@ -398,6 +410,58 @@ class BTS(models.Model):
         serializer = itsdangerous.JSONWebSignatureSerializer(self.secret)
         return serializer.dumps(data_dict)
 
+    def supports(self, feature):
+        """Whether the tower's client has a feature.
+
+        A tower that hasn't reported its versions yet is assumed to run an
+        old client.
+
+        Args:
+          feature: a key of CLIENT_FEATURE_VERSIONS
+        """
+        try:
+            version = json.loads(self.package_versions)['endaga_version']
+        except (TypeError, ValueError, KeyError):
+            return False
+        if not version:
+            return False
+        return version >= self.sortable_version(
+            CLIENT_FEATURE_VERSIONS[feature])
+
+    def deactivate_subscribers(self, imsis, countdown=None):
+        """Sends an async post telling this BTS to deactivate subscribers.
+
+        Towers that support it get all the IMSIs as a list in 'imsis', in one
+        signed request.  Older towers only understand a single 'imsi', so they
+        get one request per IMSI.
+
+        Args:
+          imsis: the IMSIs to deactivate
+          countdown: optional delay in seconds before the BTS is notified, so
+                     that bulk deactivations can be paced
+        """
+        if len(imsis) > 1 and self.supports('deactivate_subscribers'):
+            self._send_deactivation({'imsis': list(imsis)}, countdown)
+        else:
+            for imsi in imsis:
+                self._send_deactivation({'imsi': imsi}, countdown)
+
+    def _send_deactivation(self, data, countdown):
+        """Signs and sends one /config/deactivate_subscriber request."""
+        url = '%s/config/deactivate_subscriber' % self.inbound_url
+        # Add a UUID as a nonce for the message.
+        data['msgid'] = str(uuid.uuid4())
+        signed_data = {
+            'jwt': self.generate_jwt(data),
+        }
+        # Retry the async_post for three months until it succeeds.
+        retry_delay = 60 * 10
+        three_months = 3 * 30 * 24 * 60 * 60.
+        max_retries = int(three_months / retry_delay)
+        celery_app.send_task(
+            'endagaweb.tasks.async_post', (url, signed_data),
+            max_retries=max_retries, countdown=countdown)
+
     def sortable_version(self, version):
         """Converts '1.2.3' into '00001.00002.00003'"""
         # Version must be a string to split it.
@@ -601,7 +665,7 @@ class Subscriber(models.Model):
             self.last_camped = last_camped
             self.bts = bts
 
-    def deactivate(self):
+    def deactivate(self, notify_bts=True):
         """Deactivate a subscriber.
 
         Send an async post to the BTS to deactivate the subscriber.  Sign the
@@ -609,26 +673,14 @@ class Subscriber(models.Model):
         commands -- the BTS will handle that on its own.  If the sub does not
         have an associated BTS, the sub's previous tower may have been deleted.
         We can still delete the sub we just do not have to notify a tower.
+
+        Args:
+          notify_bts: whether to notify the BTS; bulk deactivations pass False
+                      and notify each tower once, with
+                      BTS.deactivate_subscribers
         """
-        if self.bts:
-            url = '%s/config/deactivate_subscriber' % self.bts.inbound_url
-            data = {
-                'imsi': self.imsi,
-                # Add a UUID as a nonce for the message.
-                'msgid': str(uuid.uuid4()),
-            }
-            serializer = itsdangerous.JSONWebSignatureSerializer(
-                self.bts.secret)
-            signed_data = {
-                'jwt': serializer.dumps(data),
-            }
-            # Retry the async_post for three months until it succeeds.
-            retry_delay = 60 * 10
-            three_months = 3 * 30 * 24 * 60 * 60.
-            max_retries = int(three_months / retry_delay)
-            celery_app.send_task(
-                'endagaweb.tasks.async_post', (url, signed_data),
-                max_retries=max_retries)
+        if self.bts and notify_bts:
+            self.bts.deactivate_subscribers([self.imsi])
         # Deactivate all associated Numbers from this Sub.
         numbers = Number.objects.filter(subscriber=self)
         with transaction.atomic():
@@ -684,7 +736,7 @@ class Number(ChargingEntity):
                                    on_delete=models.SET_NULL)
     network = models.ForeignKey('Network', null=True, blank=True,
                                 on_delete=models.CASCADE)
-    number = models.CharField(max_length=1024)  # the number (msisdn)
+    number = models.CharField(max_length=1024, db_index=True)  # msisdn
     state = models.CharField(max_length=32)  # 'available', 'pending', 'inuse'
     country_id = models.TextField(null=True)  # country the number belongs to
 
@@ -768,7 +820,7 @@ class UsageEvent(models.Model):
     transaction_id = models.UUIDField(editable=False, default=uuid.uuid4)
     subscriber = models.ForeignKey(Subscriber, null=True,
                                    on_delete=models.SET_NULL)
-    subscriber_imsi = models.TextField(null=True)
+    subscriber_imsi = models.TextField(null=True, db_index=True)
     bts = models.ForeignKey(BTS, null=True, on_delete=models.SET_NULL)
     bts_uuid = models.TextField(null=True)
     network = models.ForeignKey('Network', null=True, on_delete=models.CASCADE)
@@ -792,6 +844,18 @@ class UsageEvent(models.Model):
     timespan = models.DecimalField(null=True, max_digits=7, decimal_places=1)
     date_synced = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Composite indexes for the hot query paths: the activity views and
+        # stats clients (network, kind and date), the checkin metrics (bts
+        # and date_synced) and subscriber inactivity (subscriber and date).
+        # test_query_plans checks that these are actually used.
+        index_together = [
+            ('network', 'date'),
+            ('network', 'kind', 'date'),
+            ('bts', 'date_synced'),
+            ('subscriber', 'date'),
+        ]
+
     def voice_sec(self):
         """Gets the number of seconds for this call.
 
@@ -1321,21 +1385,20 @@ class Network(models.Model):
         # while.
         threshold = (django.utils.timezone.now() -
                      datetime.timedelta(days=days))
-        outbound_inactive_subs = list(Subscriber.objects.filter(
-            network=self, last_outbound_activity__lt=threshold))
+        subscribers = Subscriber.objects.filter(network=self).select_related(
+            'bts')
+        outbound_inactive_subs = list(subscribers.filter(
+            last_outbound_activity__lt=threshold))
         # Also find subscribers that have never had outbound activity.  Return
-        # these subs too if they were registered before the threshold.
-        never_outbound_active_subs = Subscriber.objects.filter(
-            network=self, last_outbound_activity=None)
-        for sub in never_outbound_active_subs.iterator():
-            try:
-                last_event = UsageEvent.objects.filter(
-                    subscriber=sub).order_by('-date')[0]
-                if last_event.date < threshold:
-                    outbound_inactive_subs.append(sub)
-            except IndexError:
-                # These subs never had any UEs at all, strangely.
-                outbound_inactive_subs.append(sub)
+        # these subs too if their last UsageEvent (e.g. their registration)
+        # was before the threshold, or if they never had any UEs at all.  This
+        # is a single grouped query rather than one per subscriber.
+        never_outbound_active_subs = subscribers.filter(
+            last_outbound_activity=None).annotate(
+                last_event_date=Max('usageevent__date')).filter(
+                    Q(last_event_date__lt=threshold) |
+                    Q(last_event_date=None))
+        outbound_inactive_subs.extend(never_outbound_active_subs)
         return outbound_inactive_subs
 
     @staticmethod
@@ -1742,6 +1805,12 @@ class TimeseriesStat(models.Model):
     bts = models.ForeignKey(BTS, null=True, blank=True, on_delete=models.CASCADE)
     network = models.ForeignKey('Network', on_delete=models.CASCADE)
 
+    class Meta:
+        index_together = [
+            ('network', 'key', 'date'),
+            ('bts', 'date'),
+        ]
+
 class BTSLogfile(models.Model):
     """This model stores log file uploads that have come from client.
     Until we get S3 or something similar setup, we are storing file data
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2016-present, Facebook, Inc.
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree. An additional grant
+of patent rights can be found in the PATENTS file in the same directory.
+"""
+
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from endagaweb.util import partitions
+
+
+class Migration(migrations.Migration):
+    def partition_tables(apps, schema_editor):
+        cursor = schema_editor.connection.cursor()
+        for table, column in sorted(partitions.PARTITIONED_TABLES.items()):
+            if not partitions.is_partitioned(cursor, table):
+                partitions.convert_to_partitioned(cursor, table, column)
+        partitions.maintain()
+
+    dependencies = [
+        ('endagaweb', 'REPLACE_ME_WITH_DEPENDENCY'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_tables),
+    ]
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2016-present, Facebook, Inc.
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree. An additional grant
+of patent rights can be found in the PATENTS file in the same directory.
+"""
+
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+USAGE_EVENT_INDEXES = [
+    ('network', 'date'),
+    ('network', 'kind', 'date'),
+    ('bts', 'date_synced'),
+    ('subscriber', 'date'),
+]
+TIMESERIES_STAT_INDEXES = [
+    ('network', 'key', 'date'),
+    ('bts', 'date'),
+]
+FOREIGN_KEYS = ('network', 'bts', 'subscriber')
+
+
+def create_index(table, fields):
+    columns = ['%s_id' % f if f in FOREIGN_KEYS else f for f in fields]
+    name = '%s_%s_idx' % (table, '_'.join(columns))
+    return migrations.RunSQL(
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS %s ON %s (%s);' % (
+            name, table, ', '.join(columns)),
+        reverse_sql='DROP INDEX CONCURRENTLY IF EXISTS %s;' % name)
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('endagaweb', 'REPLACE_ME_WITH_DEPENDENCY'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=(
+                [create_index('endagaweb_usageevent', fields)
+                 for fields in USAGE_EVENT_INDEXES] +
+                [create_index('endagaweb_timeseriesstat', fields)
+                 for fields in TIMESERIES_STAT_INDEXES]),
+            state_operations=[
+                migrations.AlterIndexTogether(
+                    name='usageevent',
+                    index_together=set(USAGE_EVENT_INDEXES),
+                ),
+                migrations.AlterIndexTogether(
+                    name='timeseriesstat',
+                    index_together=set(TIMESERIES_STAT_INDEXES),
+                ),
+            ],
+        ),
+    ]
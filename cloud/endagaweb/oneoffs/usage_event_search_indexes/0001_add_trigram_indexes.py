@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2016-present, Facebook, Inc.
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree. An additional grant
+of patent rights can be found in the PATENTS file in the same directory.
+"""
+
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# (index name, table, column) for every column the activity search matches
+# with icontains.  Django renders icontains as UPPER("col"::text) LIKE ..., so
+# the indexes are built on that exact expression.
+TRIGRAM_INDEXES = [
+    ('endagaweb_usageevent_kind_trgm', 'endagaweb_usageevent', 'kind'),
+    ('endagaweb_usageevent_reason_trgm', 'endagaweb_usageevent', 'reason'),
+    ('endagaweb_usageevent_subscriber_imsi_trgm', 'endagaweb_usageevent',
+     'subscriber_imsi'),
+    ('endagaweb_subscriber_name_trgm', 'endagaweb_subscriber', 'name'),
+    ('endagaweb_subscriber_imsi_trgm', 'endagaweb_subscriber', 'imsi'),
+    ('endagaweb_number_number_trgm', 'endagaweb_number', 'number'),
+]
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('endagaweb', 'REPLACE_ME_WITH_DEPENDENCY'),
+    ]
+
+    operations = [
+        migrations.RunSQL('CREATE EXTENSION IF NOT EXISTS pg_trgm;',
+                          reverse_sql=migrations.RunSQL.noop),
+    ] + [
+        migrations.RunSQL(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS %s ON %s '
+            'USING gin (UPPER(%s::text) gin_trgm_ops);' % (name, table, col),
+            reverse_sql='DROP INDEX CONCURRENTLY IF EXISTS %s;' % name)
+        for name, table, col in TRIGRAM_INDEXES
+    ]
@@ -280,6 +280,14 @@ ENDAGA = {
 
     # Maximum permissible validity(in days) limit for denomination
     'MAX_VALIDITY_DAYS': 10000,
+
+    # Partition maintenance for UsageEvent and TimeseriesStat (see
+    # endagaweb.util.partitions).  TimeseriesStats are kept at full resolution
+    # for the raw retention period, then as hourly averages until the rollup
+    # retention period has passed.
+    'PARTITION_MONTHS_AHEAD': 3,
+    'TIMESERIES_RAW_RETENTION_MONTHS': 3,
+    'TIMESERIES_ROLLUP_RETENTION_MONTHS': 24,
 }
 
 STRIPE_API_KEY = os.environ.get("STRIPE_API_KEY",
@@ -10,12 +10,13 @@ of patent rights can be found in the PATENTS file in the same directory.
 
 from __future__ import absolute_import
 
+import collections
 import csv
 import datetime
 import json
-import time
 import os
 import paramiko
+import uuid
 import zipfile
 try:
     # we only import zlib here to check that it is available
@@ -29,6 +30,7 @@ except:
 from django.conf import settings
 from django.core.mail import send_mail
 from django.template.loader import render_to_string
+from django.db import transaction
 from django.db.models import Avg, Count
 import django.utils.timezone
 import requests
@@ -37,12 +39,35 @@ from endagaweb.celery import app
 from endagaweb.models import BTS
 from endagaweb.models import Network
 from endagaweb.models import PendingCreditUpdate
+from endagaweb.models import Number
 from endagaweb.models import ConfigurationKey
+from endagaweb.models import Lock
 from endagaweb.models import Subscriber
 from endagaweb.models import UsageEvent
 from endagaweb.models import SystemEvent
 from endagaweb.models import TimeseriesStat
 from endagaweb.ic_providers.nexmo import NexmoProvider
+from endagaweb.util import partitions
+
+
+# Inactive subscribers are deactivated on their BTS in batches of at most this
+# many, sent this many seconds apart.
+VACUUM_BATCH_SIZE = 50
+VACUUM_BTS_INTERVAL_SECS = 2
+# Credit updates for a BTS are held this long so that bulk top-ups coalesce
+# into one request, and at most this many are sent per request.
+CREDIT_UPDATE_COALESCE_SECS = 5
+CREDIT_UPDATE_BATCH_SIZE = 500
+# Failed credit update deliveries back off exponentially up to the max delay,
+# and are retried for roughly a day.
+CREDIT_UPDATE_MAX_RETRY_DELAY_SECS = 10 * 60
+CREDIT_UPDATE_MAX_RETRIES = 150
+# A delivery task holds its BTS's lock while it waits to run or retry, so the
+# TTL must exceed the longest of those waits.
+CREDIT_UPDATE_LOCK_TTL_SECS = 2 * CREDIT_UPDATE_MAX_RETRY_DELAY_SECS
+# Towers too old for batched broadcasts are sent one /endaga_sms request per
+# recipient, this many seconds apart.
+BROADCAST_SMS_INTERVAL_SECS = 1
 
 
 @app.task(bind=True)
@@ -235,6 +260,159 @@ def update_credit(self, imsi, update_id):
         raise
 
 
+def credit_update_lock_name(bts):
+    return 'credit-updates:%s' % bts.uuid
+
+
+def schedule_credit_updates(bts):
+    """Schedules delivery of a BTS's PendingCreditUpdates.
+
+    Only one update_credits task runs per BTS at a time: if one is already
+    waiting or retrying, it will pick up any new updates on its next attempt.
+    """
+    token = str(uuid.uuid4())
+    if Lock.grab(credit_update_lock_name(bts), token,
+                 ttl=CREDIT_UPDATE_LOCK_TTL_SECS):
+        update_credits.apply_async((bts.id, token),
+                                   countdown=CREDIT_UPDATE_COALESCE_SECS)
+
+
+@app.task(bind=True)
+def update_credits(self, bts_id, token):
+    """Send a BTS its PendingCreditUpdates in one signed batch request.
+
+    The task holds the BTS's credit update lock (see schedule_credit_updates)
+    until it has nothing left to send or gives up.  Each attempt sends every
+    pending update for the tower, so updates created while we are retrying
+    are coalesced into the next attempt.  If the BTS acks the batch we delete
+    those PendingCreditUpdates; the BTS ignores updates it has already applied,
+    so a batch can safely be resent.
+
+    If we cannot reach the BTS, or it doesn't ack the batch, we retry with
+    exponential backoff.  Towers whose client predates batched updates are
+    sent each update with update_credit instead.
+    """
+    bts = BTS.objects.get(id=bts_id)
+    lock_name = credit_update_lock_name(bts)
+    # Refresh the lock.  If it expired and another task took over, let that
+    # task do the work.
+    if not Lock.grab(lock_name, token, ttl=CREDIT_UPDATE_LOCK_TTL_SECS):
+        return
+    updates = list(PendingCreditUpdate.objects.filter(
+        subscriber__bts=bts).select_related('subscriber').order_by(
+            'date')[:CREDIT_UPDATE_BATCH_SIZE])
+    if not updates:
+        Lock.release(lock_name, token)
+        return
+    if not bts.supports('add_credits'):
+        for update in updates:
+            update_credit.delay(update.subscriber.imsi, update.uuid)
+        Lock.release(lock_name, token)
+        return
+
+    def retry_or_give_up():
+        # Raises a Retry, or releases the lock and returns False once we
+        # have retried enough.
+        if self.request.retries >= CREDIT_UPDATE_MAX_RETRIES:
+            Lock.release(lock_name, token)
+            return False
+        delay = min(10 * 2 ** self.request.retries,
+                    CREDIT_UPDATE_MAX_RETRY_DELAY_SECS)
+        raise self.retry(countdown=delay,
+                         max_retries=CREDIT_UPDATE_MAX_RETRIES)
+
+    url = bts.inbound_url + "/config/add_credits"
+    jwt = bts.generate_jwt({
+        'msgid': str(uuid.uuid4()),
+        'updates': [update.req_params() for update in updates],
+    })
+    try:
+        request = requests.post(
+            url, data={'jwt': jwt},
+            timeout=settings.ENDAGA['BTS_REQUEST_TIMEOUT_SECS'])
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+        print "update_credits ERROR. bts=%s, updates=%d. (RETRY %d)" % (
+            bts.uuid, len(updates), self.request.retries)
+        if not retry_or_give_up():
+            raise
+    except Exception as caught_exception:
+        print "update_credits ERROR. bts=%s, updates=%d. (%s)" % (
+            bts.uuid, len(updates), caught_exception)
+        Lock.release(lock_name, token)
+        raise
+    if request.status_code >= 200 and request.status_code < 300:
+        print "update_credits SUCCESS. bts=%s, updates=%d. (%d)" % (
+            bts.uuid, len(updates), request.status_code)
+        PendingCreditUpdate.objects.filter(
+            id__in=[update.id for update in updates]).delete()
+        bts.mark_active()
+        bts.save()
+        if len(updates) == CREDIT_UPDATE_BATCH_SIZE:
+            # There may be more; keep the lock and send the next batch.
+            update_credits.apply_async((bts_id, token))
+            return
+        Lock.release(lock_name, token)
+        # Updates created while our request was in flight could not schedule
+        # their own delivery because we held the lock.
+        if PendingCreditUpdate.objects.filter(subscriber__bts=bts).exists():
+            schedule_credit_updates(bts)
+        return
+    print "update_credits FAIL. bts=%s, updates=%d. (%d, RETRY %d)" % (
+        bts.uuid, len(updates), request.status_code, self.request.retries)
+    # The updates stay pending; the tower's next checkin schedules them
+    # again if we give up.
+    retry_or_give_up()
+
+
+@app.task(bind=True)
+def broadcast_sms(self, network_id, text, sender='0000'):
+    """Send an SMS to every camped subscriber in a network.
+
+    Rather than one /endaga_sms request per subscriber, each BTS gets a
+    single signed batch of its subscribers' numbers, which it queues and
+    delivers at the pace its radio allows.  Subscribers get the message at
+    their first number.  Each batch carries its own msgid, so async_post can
+    safely resend it.
+
+    Towers whose client predates /broadcast_sms get one /endaga_sms request
+    per recipient instead, paced BROADCAST_SMS_INTERVAL_SECS apart.
+    """
+    numbers = Number.objects.filter(
+        network_id=network_id, subscriber__bts__isnull=False).order_by(
+            'id').values_list('subscriber_id', 'subscriber__bts_id', 'number')
+    recipients = collections.defaultdict(list)
+    subscribers = set()
+    for subscriber_id, bts_id, number in numbers:
+        if subscriber_id in subscribers:
+            continue
+        subscribers.add(subscriber_id)
+        recipients[bts_id].append(number)
+    for bts in BTS.objects.filter(id__in=recipients.keys()):
+        if not bts.supports('broadcast_sms'):
+            print "broadcast_sms: bts=%s, recipients=%d (one by one)" % (
+                bts.uuid, len(recipients[bts.id]))
+            for index, number in enumerate(recipients[bts.id]):
+                params = {
+                    'to': number,
+                    'sender': sender,
+                    'text': text,
+                    'msgid': str(uuid.uuid4()),
+                }
+                async_post.apply_async(
+                    (bts.inbound_url + "/endaga_sms", params),
+                    countdown=index * BROADCAST_SMS_INTERVAL_SECS)
+            continue
+        jwt = bts.generate_jwt({
+            'msgid': str(uuid.uuid4()),
+            'sender': sender,
+            'text': text,
+            'recipients': recipients[bts.id],
+        })
+        print "broadcast_sms: bts=%s, recipients=%d" % (
+            bts.uuid, len(recipients[bts.id]))
+        async_post.delay(bts.inbound_url + "/broadcast_sms", {'jwt': jwt})
+
+
 @app.task(bind=True)
 def vacuum_inactive_subscribers(self):
     """Deletes subscribers with no outbound activity.
@@ -248,14 +426,41 @@ def vacuum_inactive_subscribers(self):
             continue
         inactives = network.get_outbound_inactive_subscribers(
             network.sub_vacuum_inactive_days)
+        # Group the subscribers by tower, so that each tower gets a batched
+        # request rather than one per subscriber.  Batches to the same tower
+        # are sent VACUUM_BTS_INTERVAL_SECS apart so we don't flood it, but
+        # the towers themselves are worked through in parallel.
+        by_bts = collections.defaultdict(list)
         for subscriber in inactives:
             if subscriber.prevent_automatic_deactivation:
                 continue
-            print 'vacuuming %s from network %s' % (subscriber.imsi, network)
-            subscriber.deactivate()
-            # Sleep a bit in between each deactivation so we don't flood the
-            # BTS.
-            time.sleep(2)
+            by_bts[subscriber.bts_id].append(subscriber)
+        for bts_id, subscribers in by_bts.items():
+            with transaction.atomic():
+                for subscriber in subscribers:
+                    print 'vacuuming %s from network %s' % (subscriber.imsi,
+                                                            network)
+                    subscriber.deactivate(notify_bts=False)
+            # Subscribers without a tower have none to notify.
+            if bts_id is None:
+                continue
+            bts = subscribers[0].bts
+            imsis = [subscriber.imsi for subscriber in subscribers]
+            for index, start in enumerate(
+                    range(0, len(imsis), VACUUM_BATCH_SIZE)):
+                bts.deactivate_subscribers(
+                    imsis[start:start + VACUUM_BATCH_SIZE],
+                    countdown=index * VACUUM_BTS_INTERVAL_SECS)
+
+@app.task(bind=True)
+def maintain_partitions(self):
+    """Creates upcoming partitions and expires old TimeseriesStat data.
+
+    This runs as a periodic task managed by celerybeat; see
+    endagaweb.util.partitions for the retention policy.
+    """
+    for action, name in partitions.maintain():
+        print 'partition maintenance: %s %s' % (action, name)
 
 @app.task(bind=True)
 def facebook_ods_checkin(self):
@@ -627,3 +627,53 @@ class SubscriberTest(TestCase):
         event_count = models.UsageEvent.objects.filter(
             subscriber_imsi=self.sub2.imsi, kind='delete_imsi').count()
         self.assertEqual(1, event_count)
+
+
+class BroadcastTest(TestCase):
+    """Testing the Broadcast API view."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.user = models.User(username='b', email='b@l.com')
+        cls.user.save()
+        cls.user_profile = models.UserProfile.objects.get(user=cls.user)
+
+    @classmethod
+    def tearDownClass(cls):
+        """Destroy the objects we created for the test."""
+        cls.user.delete()
+        cls.user_profile.delete()
+
+    def setUp(self):
+        self.client = Client()
+        self.url = '/api/v2/broadcast'
+        self.header = {
+            'HTTP_AUTHORIZATION': 'Token %s' % self.user_profile.network.api_token
+        }
+
+    def test_get(self):
+        """GET is not supported."""
+        response = self.client.get(self.url, **self.header)
+        self.assertEqual(405, response.status_code)
+
+    def test_post_sans_token(self):
+        """POST fails without a token."""
+        data = {'text': 'town meeting at 5'}
+        response = self.client.post(self.url, data=data)
+        self.assertEqual(403, response.status_code)
+
+    def test_post_sans_text(self):
+        """POST fails without the text to send."""
+        with mock.patch('endagaweb.tasks.broadcast_sms.delay') as mocked_task:
+            response = self.client.post(self.url, data={}, **self.header)
+        self.assertEqual(400, response.status_code)
+        self.assertFalse(mocked_task.called)
+
+    def test_broadcast(self):
+        """POST starts a broadcast to the token's network."""
+        data = {'text': 'town meeting at 5', 'sender': '5550000'}
+        with mock.patch('endagaweb.tasks.broadcast_sms.delay') as mocked_task:
+            response = self.client.post(self.url, data=data, **self.header)
+        self.assertEqual(202, response.status_code)
+        mocked_task.assert_called_once_with(
+            self.user_profile.network.id, 'town meeting at 5', '5550000')
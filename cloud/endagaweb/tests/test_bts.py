@@ -485,6 +485,22 @@ class SubsciberCheckinCampedTest(DjangoTestCase):
             self.sub.last_camped)
         self.assertEqual(self.bts2, self.sub.bts)
 
+    def test_checkin_schedules_credit_updates(self):
+        """A subscriber's pending credit updates are sent to the tower it
+        camps on.
+        """
+        models.PendingCreditUpdate(subscriber=self.sub, amount=1000,
+                                   uuid='camped-pcu').save()
+        responder = checkin.CheckinResponder(self.bts2)
+        self.bts2.last_active = django.utils.timezone.now()
+        with mock.patch('endagaweb.tasks.schedule_credit_updates') as (
+                mocked_schedule):
+            responder.camped_subscribers([{
+                'imsi': self.sub.imsi,
+                'last_seen_secs': '4',
+            }])
+        mocked_schedule.assert_called_once_with(self.bts2)
+
 
 class CheckinTest(DjangoTestCase):
     """A BTS can checkin.
@@ -1087,3 +1103,34 @@ class PrintableVersionTest(TestCase):
         sortable = '00001.00004.15~1-1~wheezy+1'
         self.assertEqual('1.4.15~1-1~wheezy+1',
                          self.bts.printable_version(sortable))
+
+
+class SupportsTest(DjangoTestCase):
+    """Tests models.BTS.supports."""
+
+    def setUp(self):
+        user = models.User(username="supports", email="s@s.com")
+        user.save()
+        network = models.UserProfile.objects.get(user=user).network
+        self.bts = models.BTS(uuid="supports-bts",
+                              inbound_url="http://localhost/supports",
+                              network=network)
+        self.bts.save()
+
+    def set_version(self, version):
+        self.bts.package_versions = json.dumps({
+            'endaga_version': self.bts.sortable_version(version)})
+
+    def test_no_versions(self):
+        """Towers that haven't checked in are assumed to be old."""
+        self.assertFalse(self.bts.supports('add_credits'))
+        self.bts.package_versions = None
+        self.assertFalse(self.bts.supports('add_credits'))
+
+    def test_versions(self):
+        self.set_version('0.8.1')
+        self.assertFalse(self.bts.supports('add_credits'))
+        self.set_version('0.9.0')
+        self.assertTrue(self.bts.supports('add_credits'))
+        self.set_version('0.10.0')
+        self.assertTrue(self.bts.supports('add_credits'))
@@ -0,0 +1,115 @@
+"""Tests for the UsageEvent keyword search in endagaweb.util.event_search.
+
+Copyright (c) 2016-present, Facebook, Inc.
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree. An additional grant
+of patent rights can be found in the PATENTS file in the same directory.
+"""
+
+import datetime
+
+from django import test
+import pytz
+
+from endagaweb import models
+from endagaweb.util import event_search
+
+
+class EventSearchTest(test.TestCase):
+    """Testing event_search.search_events."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.user = models.User(username="searcher", email="s@e.com")
+        cls.user.save()
+        cls.user_profile = models.UserProfile.objects.get(user=cls.user)
+        cls.network = cls.user_profile.network
+        cls.bts = models.BTS(uuid="9988776655", nickname="search-bts",
+                             inbound_url="http://localhost/9988776655/test",
+                             network=cls.network)
+        cls.bts.save()
+        cls.alice = models.Subscriber.objects.create(
+            balance=100, name='alice', imsi='IMSI901550000000001',
+            network=cls.network, bts=cls.bts)
+        cls.bob = models.Subscriber.objects.create(
+            balance=100, name='bob', imsi='IMSI901550000000002',
+            network=cls.network, bts=cls.bts)
+        cls.number = models.Number(number='6285550001', state='inuse',
+                                   network=cls.network, subscriber=cls.alice,
+                                   kind='number.nexmo.monthly')
+        cls.number.save()
+        now = datetime.datetime.now(pytz.utc)
+        cls.events = []
+        for sub, kind, reason in [
+                (cls.alice, 'local_sms', 'SMS sent to bob'),
+                (cls.alice, 'local_call', 'Call to bob'),
+                (cls.bob, 'local_sms', 'SMS sent to alice'),
+                (cls.bob, 'add_money', 'Operator top-up')]:
+            cls.events.append(models.UsageEvent.objects.create(
+                subscriber=sub, subscriber_imsi=sub.imsi, bts=cls.bts,
+                bts_uuid=cls.bts.uuid, network=cls.network, date=now,
+                kind=kind, reason=reason))
+
+    @classmethod
+    def tearDownClass(cls):
+        for event in cls.events:
+            event.delete()
+        cls.number.delete()
+        cls.alice.delete()
+        cls.bob.delete()
+        cls.bts.delete()
+        cls.user_profile.delete()
+        cls.user.delete()
+
+    def search(self, query):
+        events = models.UsageEvent.objects.filter(network=self.network)
+        return set(event_search.search_events(self.network, query, events))
+
+    def test_single_keyword(self):
+        self.assertEqual(set(self.events[1:2]), self.search('call'))
+
+    def test_keywords_are_anded(self):
+        self.assertEqual(set(self.events[2:3]),
+                         self.search('local_sms 901550000000002'))
+        self.assertEqual(set(), self.search('sms top-up'))
+
+    def test_subscriber_name(self):
+        self.assertEqual(set(self.events[3:4]), self.search('BOB top-up'))
+
+    def test_imsi_exact_match(self):
+        self.assertEqual(set(self.events[0:2]),
+                         self.search('901550000000001'))
+        self.assertEqual(set(self.events[2:4]),
+                         self.search('IMSI901550000000002'))
+
+    def test_imsi_substring(self):
+        self.assertEqual(set(self.events), self.search('90155'))
+
+    def test_number_exact_match(self):
+        self.assertEqual(set(self.events[0:2]), self.search('+6285550001'))
+
+    def test_number_in_reason(self):
+        """Events that mention a number match it, whoever they belong to."""
+        event = models.UsageEvent.objects.create(
+            subscriber=self.bob, subscriber_imsi=self.bob.imsi, bts=self.bts,
+            bts_uuid=self.bts.uuid, network=self.network,
+            date=datetime.datetime.now(pytz.utc), kind='local_sms',
+            reason='SMS sent to 6285550001')
+        self.assertEqual(set(self.events[0:2] + [event]),
+                         self.search('+6285550001'))
+
+    def test_number_substring(self):
+        self.assertEqual(set(self.events[0:2]), self.search('55500'))
+
+    def test_no_match(self):
+        self.assertEqual(set(), self.search('sms nomatch'))
+
+    def test_imsi_filter(self):
+        """Full IMSIs compile to an exact lookup, not a substring match."""
+        q = event_search.keyword_filter(self.network, '901550000000001')
+        self.assertEqual(
+            [('subscriber_imsi__in',
+              ['IMSI901550000000001', '901550000000001'])],
+            q.children)
@@ -0,0 +1,192 @@
+"""Tests for endagaweb.util.partitions.
+
+Copyright (c) 2016-present, Facebook, Inc.
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree. An additional grant
+of patent rights can be found in the PATENTS file in the same directory.
+"""
+
+from datetime import datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection
+from django.test import TestCase
+import mock
+import pytz
+
+from endagaweb import models
+from endagaweb.util import partitions
+
+
+class MonthArithmeticTest(TestCase):
+    """Partition boundaries are UTC calendar months."""
+
+    def test_month_start(self):
+        date = datetime(2016, 3, 17, 13, 5, tzinfo=pytz.utc)
+        self.assertEqual(datetime(2016, 3, 1, tzinfo=pytz.utc),
+                         partitions.month_start(date))
+
+    def test_month_start_converts_to_utc(self):
+        tz = pytz.timezone('Asia/Jayapura')
+        date = tz.localize(datetime(2016, 4, 1, 2, 0))
+        self.assertEqual(datetime(2016, 3, 1, tzinfo=pytz.utc),
+                         partitions.month_start(date))
+
+    def test_add_months(self):
+        month = datetime(2016, 11, 1, tzinfo=pytz.utc)
+        self.assertEqual(datetime(2017, 2, 1, tzinfo=pytz.utc),
+                         partitions.add_months(month, 3))
+        self.assertEqual(datetime(2015, 12, 1, tzinfo=pytz.utc),
+                         partitions.add_months(month, -11))
+
+    def test_partition_name(self):
+        month = datetime(2016, 3, 1, tzinfo=pytz.utc)
+        self.assertEqual('endagaweb_usageevent_y2016m03',
+                         partitions.partition_name('endagaweb_usageevent',
+                                                   month))
+
+
+class MaintainTest(TestCase):
+    """Maintenance leaves unpartitioned tables alone."""
+
+    def test_unpartitioned_tables_are_skipped(self):
+        self.assertEqual([], partitions.maintain())
+
+
+class PartitionedTableTest(TestCase):
+    """Converting TimeseriesStat to a partitioned table, and maintaining it.
+
+    The conversion happens in each test's transaction, so it is rolled back
+    with the rest of the test.
+    """
+
+    TABLE = 'endagaweb_timeseriesstat'
+
+    @classmethod
+    def setUpTestData(cls):
+        user = models.User(username='partitions', email='partitions@e.com')
+        user.save()
+        cls.network = models.UserProfile.objects.get(user=user).network
+        cls.bts = models.BTS(uuid='partitions-bts',
+                             inbound_url='http://localhost/partitions',
+                             network=cls.network)
+        cls.bts.save()
+
+    def setUp(self):
+        retention = mock.patch.dict(settings.ENDAGA, {
+            'PARTITION_MONTHS_AHEAD': 2,
+            'TIMESERIES_RAW_RETENTION_MONTHS': 1,
+            'TIMESERIES_ROLLUP_RETENTION_MONTHS': 2,
+        })
+        retention.start()
+        self.addCleanup(retention.stop)
+        self.add_stat(datetime(2015, 6, 1, tzinfo=pytz.utc), 1)
+        with connection.cursor() as cursor:
+            partitions.convert_to_partitioned(
+                cursor, self.TABLE, 'date',
+                now=datetime(2016, 1, 15, tzinfo=pytz.utc))
+
+    def add_stat(self, date, value):
+        models.TimeseriesStat.objects.create(
+            key='sdcch_load', value=value, date=date, bts=self.bts,
+            network=self.network)
+
+    def stats(self):
+        return list(models.TimeseriesStat.objects.filter(
+            bts=self.bts).order_by('date').values_list('date', 'value'))
+
+    def list_partitions(self):
+        with connection.cursor() as cursor:
+            return partitions.list_partitions(cursor, self.TABLE)
+
+    def partition(self, month):
+        return partitions.partition_name(
+            self.TABLE, datetime(2016, month, 1, tzinfo=pytz.utc))
+
+    def maintain(self, month, day):
+        return partitions.maintain(
+            now=datetime(2016, month, day, tzinfo=pytz.utc))
+
+    def test_convert_to_partitioned(self):
+        """The existing rows become the legacy partition."""
+        with connection.cursor() as cursor:
+            self.assertTrue(partitions.is_partitioned(cursor, self.TABLE))
+        (name, bound, upper), = self.list_partitions()
+        self.assertEqual('endagaweb_timeseriesstat_legacy', name)
+        self.assertIn('MINVALUE', bound)
+        self.assertEqual(datetime(2016, 2, 1, tzinfo=pytz.utc), upper)
+        self.add_stat(datetime(2016, 1, 20, tzinfo=pytz.utc), 2)
+        self.assertEqual([(datetime(2015, 6, 1, tzinfo=pytz.utc), 1),
+                          (datetime(2016, 1, 20, tzinfo=pytz.utc), 2)],
+                         self.stats())
+
+    def test_create_partitions(self):
+        """Partitions are created ahead, from the end of the legacy one."""
+        self.assertEqual([('create', self.partition(2)),
+                          ('create', self.partition(3))],
+                         self.maintain(1, 15))
+        self.assertEqual([], self.maintain(1, 16))
+        self.add_stat(datetime(2016, 3, 10, tzinfo=pytz.utc), 3)
+        self.assertEqual(3, self.stats()[-1][1])
+
+    def test_downsample_partition(self):
+        """A downsampled partition holds the hourly averages."""
+        self.maintain(1, 15)
+        name = self.partition(2)
+        self.add_stat(datetime(2016, 2, 3, 10, 5, tzinfo=pytz.utc), 1)
+        self.add_stat(datetime(2016, 2, 3, 10, 55, tzinfo=pytz.utc), 2)
+        self.add_stat(datetime(2016, 2, 3, 11, 0, tzinfo=pytz.utc), 4)
+        bound = dict((p[0], p[1]) for p in self.list_partitions())[name]
+        with connection.cursor() as cursor:
+            rollup = partitions.downsample_partition(
+                cursor, self.TABLE, name, bound)
+        self.assertEqual(name + '_hourly', rollup)
+        names = [p[0] for p in self.list_partitions()]
+        self.assertIn(rollup, names)
+        self.assertNotIn(name, names)
+        self.assertEqual([(datetime(2015, 6, 1, tzinfo=pytz.utc), 1),
+                          (datetime(2016, 2, 3, 10, tzinfo=pytz.utc), Decimal('1.5')),
+                          (datetime(2016, 2, 3, 11, tzinfo=pytz.utc), 4)],
+                         self.stats())
+
+    def test_drop_partition(self):
+        self.maintain(1, 15)
+        self.add_stat(datetime(2016, 2, 3, tzinfo=pytz.utc), 2)
+        with connection.cursor() as cursor:
+            partitions.drop_partition(cursor, self.TABLE, self.partition(2))
+        self.assertNotIn(self.partition(2), [p[0] for p in self.list_partitions()])
+        self.assertEqual([(datetime(2015, 6, 1, tzinfo=pytz.utc), 1)],
+                         self.stats())
+
+    def test_retention(self):
+        """Old partitions are downsampled, then dropped, but the legacy
+        partition is kept.
+        """
+        self.maintain(1, 15)
+        self.add_stat(datetime(2016, 2, 10, 12, tzinfo=pytz.utc), 2)
+        self.add_stat(datetime(2016, 3, 10, 12, 30, tzinfo=pytz.utc), 3)
+        self.assertEqual([('create', self.partition(4)),
+                          ('create', self.partition(5)),
+                          ('create', self.partition(6)),
+                          ('downsample', self.partition(2))],
+                         self.maintain(4, 10))
+        self.assertEqual([('create', self.partition(7)),
+                          ('drop', self.partition(2) + '_hourly'),
+                          ('downsample', self.partition(3))],
+                         self.maintain(5, 10))
+        self.assertEqual('endagaweb_timeseriesstat_legacy',
+                         self.list_partitions()[0][0])
+        self.assertEqual([(datetime(2015, 6, 1, tzinfo=pytz.utc), 1),
+                          (datetime(2016, 3, 10, 12, tzinfo=pytz.utc), 3)],
+                         self.stats())
+
+    def test_dry_run(self):
+        self.assertEqual([('create', self.partition(2)),
+                          ('create', self.partition(3))],
+                         partitions.maintain(
+                             now=datetime(2016, 1, 15, tzinfo=pytz.utc),
+                             dry_run=True))
+        self.assertEqual(1, len(self.list_partitions()))
@@ -0,0 +1,172 @@
+"""Query-plan regression tests for the UsageEvent and TimeseriesStat hot paths.
+
+Each test builds the queryset that a hot path runs against a small synthetic
+dataset, asks Postgres to EXPLAIN it and checks that the table is read through
+the expected composite index (see the index_together declarations in
+endagaweb.models) rather than with a sequential scan or a narrower index.
+Sequential scans are disabled while planning, since on a dataset this small
+the planner would otherwise rightly prefer them; the tests only need
+Postgres, and are skipped on other databases.
+
+Copyright (c) 2016-present, Facebook, Inc.
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree. An additional grant
+of patent rights can be found in the PATENTS file in the same directory.
+"""
+
+from datetime import datetime, timedelta
+import random
+from unittest import skipUnless
+
+from django.db import connection
+from django.db.models import Avg, Count, F, Q
+from django.test import TestCase
+import pytz
+
+from endagaweb import models
+from endagaweb.views import dashboard
+
+
+KINDS = ['local_call', 'local_sms', 'outside_call', 'outside_sms',
+         'incoming_sms', 'local_recv_sms', 'gprs', 'add_money']
+STAT_KEYS = ['sdcch_load', 'tch_load', 'noise_rssi_db', 'ber']
+
+
+@skipUnless(connection.vendor == 'postgresql', 'EXPLAIN output is Postgres')
+class QueryPlanTest(TestCase):
+    """EXPLAIN the hot-path queries against a synthetic dataset."""
+
+    NUM_NETWORKS = 2
+    TOWERS_PER_NETWORK = 2
+    SUBSCRIBERS_PER_TOWER = 10
+    NUM_EVENTS = 2000
+    NUM_STATS = 1000
+
+    @classmethod
+    def setUpTestData(cls):
+        rand = random.Random(1729)
+        cls.now = datetime.now(pytz.utc)
+        cls.networks, cls.towers, cls.subscribers = [], [], []
+        for n in range(cls.NUM_NETWORKS):
+            user = models.User(username='plans%d' % n,
+                               email='plans%d@e.com' % n)
+            user.save()
+            network = models.UserProfile.objects.get(user=user).network
+            cls.networks.append(network)
+            for t in range(cls.TOWERS_PER_NETWORK):
+                bts = models.BTS(uuid='plans-%d-%d' % (n, t),
+                                 inbound_url='http://localhost/%d/%d' % (n, t),
+                                 network=network)
+                bts.save()
+                cls.towers.append(bts)
+                for s in range(cls.SUBSCRIBERS_PER_TOWER):
+                    cls.subscribers.append(models.Subscriber.objects.create(
+                        imsi='IMSI0010%02d%02d%05d' % (n, t, s),
+                        network=network, bts=bts, balance=0))
+        cls.user_profile = models.UserProfile.objects.get(
+            network=cls.networks[0])
+        # Bulk-create a year of events; bulk_create skips the post_save hooks
+        # so we set the denormalized fields ourselves.
+        events = []
+        for _ in range(cls.NUM_EVENTS):
+            sub = rand.choice(cls.subscribers)
+            date = cls.now - timedelta(seconds=rand.randint(0, 365 * 86400))
+            events.append(models.UsageEvent(
+                subscriber=sub, subscriber_imsi=sub.imsi, bts=sub.bts,
+                bts_uuid=sub.bts.uuid, network=sub.network, date=date,
+                kind=rand.choice(KINDS), reason='synthetic'))
+        models.UsageEvent.objects.bulk_create(events, batch_size=500)
+        # date_synced is auto_now_add; spread it out like real checkins.
+        models.UsageEvent.objects.update(date_synced=F('date'))
+        stats = []
+        for _ in range(cls.NUM_STATS):
+            bts = rand.choice(cls.towers)
+            date = cls.now - timedelta(seconds=rand.randint(0, 365 * 86400))
+            stats.append(models.TimeseriesStat(
+                key=rand.choice(STAT_KEYS), value=rand.random(), date=date,
+                bts=bts, network=bts.network))
+        models.TimeseriesStat.objects.bulk_create(stats, batch_size=500)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE endagaweb_usageevent')
+            cursor.execute('ANALYZE endagaweb_timeseriesstat')
+
+    def explain(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            # Scoped to the test's transaction.
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + sql, params)
+            return '\n'.join(row[0] for row in cursor.fetchall())
+
+    def index_names(self, table, columns):
+        """Names of the indexes on exactly these columns, in order."""
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, table)
+        return [name for name, info in constraints.items()
+                if info['index'] and info['columns'] == columns]
+
+    def assertUsesIndex(self, queryset, columns):
+        table = queryset.model._meta.db_table
+        indexes = self.index_names(table, columns)
+        self.assertTrue(indexes, 'no index on %s%s' % (table, columns))
+        plan = self.explain(queryset)
+        self.assertNotIn('Seq Scan on %s' % table, plan)
+        self.assertTrue(any(name in plan for name in indexes),
+                        'expected a scan of %s in:\n%s' % (indexes, plan))
+
+    def test_activity_page(self):
+        """ActivityView._get_events, one page of the newest events."""
+        events = dashboard.ActivityView()._get_events(self.user_profile)
+        self.assertUsesIndex(events[:25], ['network_id', 'date'])
+
+    def test_activity_date_range(self):
+        view = dashboard.ActivityView()
+        start = (self.now - timedelta(days=7)).strftime(
+            view.datepicker_time_format)
+        events = view._get_events(self.user_profile, start_date=start)
+        self.assertUsesIndex(events, ['network_id', 'date'])
+
+    def test_checkin_usage_counts(self):
+        """facebook_ods_checkin's per-tower event counts."""
+        bts = self.towers[0]
+        events = models.UsageEvent.objects.filter(bts=bts).filter(
+            date_synced__gte=self.now - timedelta(minutes=1)).values(
+                'kind').annotate(count_kind=Count('id')).order_by()
+        self.assertUsesIndex(events, ['bts_id', 'date_synced'])
+
+    def test_checkin_timeseries_averages(self):
+        """facebook_ods_checkin's per-tower stat averages."""
+        bts = self.towers[0]
+        stats = models.TimeseriesStat.objects.filter(bts=bts).filter(
+            date__gte=self.now - timedelta(minutes=1)).values(
+                'key').annotate(average_value=Avg('value')).order_by()
+        self.assertUsesIndex(stats, ['bts_id', 'date'])
+
+    def test_subscriber_last_event(self):
+        """Network.get_outbound_inactive_subscribers's last-event lookup."""
+        sub = self.subscribers[0]
+        events = models.UsageEvent.objects.filter(
+            subscriber=sub).order_by('-date')[:1]
+        self.assertUsesIndex(events, ['subscriber_id', 'date'])
+
+    def test_margin_analysis_counts(self):
+        """MarginAnalysis.count_usage_events and NetworkEarnings."""
+        jul30_2014 = datetime(month=7, day=30, year=2014, tzinfo=pytz.utc)
+        events = models.UsageEvent.objects.filter(
+            Q(network=self.networks[0]) & Q(date__gte=jul30_2014) &
+            Q(kind='outside_sms'))
+        self.assertUsesIndex(events, ['network_id', 'kind', 'date'])
+
+    def test_stats_client_network_level(self):
+        """StatsClientBase.aggregate_timeseries at the network level."""
+        events = models.UsageEvent.objects.filter(
+            Q(kind='local_sms') & Q(network__id=self.networks[0].id)).filter(
+                date__range=(self.now - timedelta(days=1), self.now))
+        self.assertUsesIndex(events, ['network_id', 'kind', 'date'])
+        stats = models.TimeseriesStat.objects.filter(
+            Q(key='sdcch_load') & Q(network__id=self.networks[0].id)).filter(
+                date__range=(self.now - timedelta(days=1), self.now))
+        self.assertUsesIndex(stats, ['network_id', 'key', 'date'])
@@ -8,10 +8,14 @@ LICENSE file in the root directory of this source tree. An additional grant
 of patent rights can be found in the PATENTS file in the same directory.
 """
 
+import json
+
+from celery.exceptions import Retry
 from django import test
 import mock
 
 from endagaweb import models
+from endagaweb import tasks
 
 
 class SubscriberBaseTest(test.TestCase):
@@ -146,16 +150,33 @@ class SubscriberAdjustCreditTest(SubscriberBaseTest):
         data = {
             'amount': 3000
         }
-        with mock.patch('endagaweb.tasks.update_credit.delay') as mocked_task:
+        with mock.patch('endagaweb.tasks.update_credits.apply_async') as (
+                mocked_task):
             self.client.post(self.adjust_credit_endpoint, data)
             # There should now be one PCU.
             self.assertEqual(1, models.PendingCreditUpdate.objects.count())
             self.assertTrue(mocked_task.called)
             args, _ = mocked_task.call_args
-        task_imsi, task_msgid = args
-        self.assertEqual(self.subscriber_imsi, task_imsi)
-        pcu = models.PendingCreditUpdate.objects.all()[0]
-        self.assertEqual(pcu.uuid, task_msgid)
+        task_bts_id, task_token = args[0]
+        self.assertEqual(self.bts.id, task_bts_id)
+        # The delivery task holds the BTS's credit update lock.
+        self.assertFalse(models.Lock.grab(
+            tasks.credit_update_lock_name(self.bts), 'other'))
+        models.Lock.release(tasks.credit_update_lock_name(self.bts),
+                            task_token)
+
+    def test_post_coalesces(self):
+        """Several adjustments to one tower schedule a single delivery."""
+        with mock.patch('endagaweb.tasks.update_credits.apply_async') as (
+                mocked_task):
+            for amount in (1000, 2000, 3000):
+                self.client.post(self.adjust_credit_endpoint,
+                                 {'amount': amount})
+            self.assertEqual(3, models.PendingCreditUpdate.objects.count())
+            self.assertEqual(1, mocked_task.call_count)
+            args, _ = mocked_task.call_args
+        models.Lock.release(tasks.credit_update_lock_name(self.bts),
+                            args[0][1])
 
     def test_post_large_value(self):
         """If the amount is too large, we fail and tell the user."""
@@ -186,3 +207,81 @@ class SubscriberEditTest(SubscriberBaseTest):
         response = self.client.get('/dashboard/subscribers/%s/edit' %
                                    self.subscriber_imsi)
         self.assertEqual(200, response.status_code)
+
+
+class UpdateCreditsTest(SubscriberBaseTest):
+    """Testing endagaweb.tasks.update_credits."""
+
+    def setUp(self):
+        self.bts.package_versions = json.dumps({
+            'endaga_version': self.bts.sortable_version('0.9.0')})
+        self.bts.save()
+        self.lock_name = tasks.credit_update_lock_name(self.bts)
+        self.token = 'update-credits-test'
+        models.Lock.grab(self.lock_name, self.token)
+        for amount in (1000, 2000):
+            models.PendingCreditUpdate(
+                subscriber=self.subscriber, amount=amount,
+                uuid='pcu-%d' % amount).save()
+
+    def tearDown(self):
+        models.Lock.release(self.lock_name, self.token)
+        models.PendingCreditUpdate.objects.all().delete()
+
+    def test_batch_delivered(self):
+        """All pending updates go out in one request and are then deleted."""
+        with mock.patch('endagaweb.tasks.requests.post') as mocked_post:
+            mocked_post.return_value.status_code = 200
+            tasks.update_credits(self.bts.id, self.token)
+        self.assertEqual(1, mocked_post.call_count)
+        args, kwargs = mocked_post.call_args
+        self.assertEqual('%s/config/add_credits' % self.bts.inbound_url,
+                         args[0])
+        self.assertIn('jwt', kwargs['data'])
+        self.assertEqual(0, models.PendingCreditUpdate.objects.count())
+        # The lock is free again.
+        self.assertTrue(models.Lock.grab(self.lock_name, 'other'))
+        models.Lock.release(self.lock_name, 'other')
+
+    def test_batch_rejected(self):
+        """If the BTS rejects the batch, the updates stay pending and the
+        batch is retried with backoff.
+        """
+        with mock.patch('endagaweb.tasks.requests.post') as mocked_post, \
+                mock.patch.object(tasks.update_credits, 'retry',
+                                  return_value=Retry()) as mocked_retry:
+            mocked_post.return_value.status_code = 500
+            with self.assertRaises(Retry):
+                tasks.update_credits(self.bts.id, self.token)
+        self.assertEqual(2, models.PendingCreditUpdate.objects.count())
+        _, kwargs = mocked_retry.call_args
+        self.assertEqual(10, kwargs['countdown'])
+        # The retry keeps the lock.
+        self.assertFalse(models.Lock.grab(self.lock_name, 'other'))
+
+    def test_old_tower(self):
+        """A tower too old for batches is sent each update on its own."""
+        self.bts.package_versions = json.dumps({
+            'endaga_version': self.bts.sortable_version('0.8.1')})
+        self.bts.save()
+        with mock.patch('endagaweb.tasks.requests.post') as mocked_post, \
+                mock.patch('endagaweb.tasks.update_credit.delay') as (
+                    mocked_update):
+            tasks.update_credits(self.bts.id, self.token)
+        self.assertFalse(mocked_post.called)
+        self.assertItemsEqual(
+            [(self.subscriber_imsi, 'pcu-1000'),
+             (self.subscriber_imsi, 'pcu-2000')],
+            [args for args, _ in mocked_update.call_args_list])
+        self.assertTrue(models.Lock.grab(self.lock_name, 'other'))
+        models.Lock.release(self.lock_name, 'other')
+
+    def test_lost_lock(self):
+        """A task whose lock was taken over does nothing."""
+        models.Lock.release(self.lock_name, self.token)
+        models.Lock.grab(self.lock_name, 'other')
+        with mock.patch('endagaweb.tasks.requests.post') as mocked_post:
+            tasks.update_credits(self.bts.id, self.token)
+        self.assertFalse(mocked_post.called)
+        models.Lock.release(self.lock_name, 'other')
+
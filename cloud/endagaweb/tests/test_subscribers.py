@@ -17,12 +17,17 @@ from datetime import datetime
 from random import randrange
 import uuid
 
+import json
+
+import itsdangerous
+import mock
 import pytz
 
 from django.test import TestCase
 
 from ccm.common import crdt
 from endagaweb import models
+from endagaweb import tasks
 
 
 class TestBase(TestCase):
@@ -147,3 +152,172 @@ class ActiveSubscriberTests(TestBase):
         outbound_inactives = self.network.get_outbound_inactive_subscribers(
             days)
         self.assertFalse(sub in outbound_inactives)
+
+    def test_sub_sans_events(self):
+        """Subs that never had any UEs at all are inactive."""
+        sub = self.add_sub(self.gen_imsi())
+        outbound_inactives = self.network.get_outbound_inactive_subscribers(
+            90)
+        self.assertTrue(sub in outbound_inactives)
+
+    def test_sub_with_recent_registration(self):
+        """Subs registered within the window are not inactive."""
+        imsi = self.gen_imsi()
+        the_past = datetime(year=2014, month=8, day=10, tzinfo=pytz.utc)
+        sub = self.add_sub(imsi, 'Provisioned', 'Provisioned %s' % (imsi, ),
+                           ev_date=the_past)
+        ev = models.UsageEvent(
+            subscriber=sub, network=self.network, date=datetime.now(pytz.utc),
+            kind='Provisioned', reason='Provisioned %s' % (imsi, ))
+        ev.save()
+        outbound_inactives = self.network.get_outbound_inactive_subscribers(
+            90)
+        self.assertFalse(sub in outbound_inactives)
+
+
+class VacuumInactiveSubscribersTest(TestBase):
+    """Inactive subscribers are deactivated with one request per tower."""
+
+    def setUp(self):
+        self.network.sub_vacuum_enabled = True
+        self.network.save()
+        self.towers = []
+        self.imsis = {}
+        for uuid_ in ('vacuum-bts-1', 'vacuum-bts-2'):
+            bts = models.BTS(uuid=uuid_, secret=uuid_,
+                             inbound_url='http://localhost/%s' % uuid_,
+                             network=self.network)
+            bts.save()
+            bts.package_versions = json.dumps({
+                'endaga_version': bts.sortable_version('0.9.0')})
+            bts.save()
+            self.towers.append(bts)
+            self.imsis[bts.id] = []
+            for _ in range(3):
+                sub = self.add_sub(self.gen_imsi())
+                sub.bts = bts
+                sub.save()
+                self.imsis[bts.id].append(sub.imsi)
+        # a subscriber without a tower is deactivated without a request
+        self.towerless = self.add_sub(self.gen_imsi())
+        self.protected = self.add_sub(self.gen_imsi())
+        self.protected.prevent_automatic_deactivation = True
+        self.protected.save()
+
+    def vacuum(self):
+        """Runs the task, returning the (bts, imsis, countdown) of each
+        request it sent.
+        """
+        with mock.patch('endagaweb.celery.app.send_task') as mocked_task:
+            tasks.vacuum_inactive_subscribers()
+        towers = dict(('%s/config/deactivate_subscriber' % bts.inbound_url,
+                       bts) for bts in self.towers)
+        requests = []
+        for args, kwargs in mocked_task.call_args_list:
+            task_name, (url, data) = args
+            self.assertEqual('endagaweb.tasks.async_post', task_name)
+            bts = towers[url]
+            serializer = itsdangerous.JSONWebSignatureSerializer(bts.secret)
+            jwt = serializer.loads(data['jwt'])
+            # A single IMSI is sent the way older clients expect.
+            imsis = jwt['imsis'] if 'imsis' in jwt else [jwt['imsi']]
+            requests.append((bts.id, imsis, kwargs['countdown']))
+        return requests
+
+    def test_one_request_per_bts(self):
+        requests = self.vacuum()
+        self.assertItemsEqual(
+            [(bts.id, self.imsis[bts.id], 0) for bts in self.towers],
+            requests)
+        # everyone but the protected subscriber is gone
+        self.assertEqual([self.protected.imsi], list(
+            models.Subscriber.objects.filter(
+                network=self.network).values_list('imsi', flat=True)))
+
+    def test_batches_are_paced(self):
+        """Large batches are split, and sent to each tower
+        VACUUM_BTS_INTERVAL_SECS apart.
+        """
+        interval = tasks.VACUUM_BTS_INTERVAL_SECS
+        with mock.patch.object(tasks, 'VACUUM_BATCH_SIZE', 2):
+            requests = self.vacuum()
+        expected = []
+        for bts in self.towers:
+            imsis = self.imsis[bts.id]
+            expected.extend([(bts.id, imsis[:2], 0),
+                             (bts.id, imsis[2:], interval)])
+        self.assertItemsEqual(expected, requests)
+
+    def test_old_tower(self):
+        """A tower too old for lists of IMSIs gets one request per IMSI."""
+        old = self.towers[0]
+        old.package_versions = json.dumps({
+            'endaga_version': old.sortable_version('0.8.1')})
+        old.save()
+        requests = self.vacuum()
+        expected = [(old.id, [imsi], 0) for imsi in self.imsis[old.id]]
+        new = self.towers[1]
+        expected.append((new.id, self.imsis[new.id], 0))
+        self.assertItemsEqual(expected, requests)
+
+
+class BroadcastSMSTest(TestBase):
+    """Testing endagaweb.tasks.broadcast_sms."""
+
+    def add_number(self, number, sub):
+        return models.Number.objects.create(
+            number=number, state='inuse', network=self.network,
+            kind='number.nexmo.monthly', subscriber=sub)
+
+    def test_one_batch_per_tower(self):
+        """Each camped sub is sent the message once, in its tower's batch."""
+        bts = models.BTS(uuid='broadcast-bts', secret='broadcast-test-secret',
+                         inbound_url='http://localhost/test',
+                         network=self.network)
+        bts.save()
+        bts.package_versions = json.dumps({
+            'endaga_version': bts.sortable_version('0.9.0')})
+        bts.save()
+        sub = self.add_sub(self.gen_imsi())
+        sub.bts = bts
+        sub.save()
+        # A second number for the same sub, and a sub that isn't camped.
+        self.add_number('5551234', sub)
+        self.add_number('5559876', sub)
+        self.add_number('5554567', self.add_sub(self.gen_imsi()))
+        with mock.patch('endagaweb.tasks.async_post.delay') as mocked_task:
+            tasks.broadcast_sms(self.network.id, 'town meeting at 5')
+        self.assertEqual(1, mocked_task.call_count)
+        args, _ = mocked_task.call_args
+        task_endpoint, task_data = args
+        self.assertEqual('%s/broadcast_sms' % bts.inbound_url, task_endpoint)
+        serializer = itsdangerous.JSONWebSignatureSerializer(bts.secret)
+        batch = serializer.loads(task_data['jwt'])
+        self.assertEqual('0000', batch['sender'])
+        self.assertEqual('town meeting at 5', batch['text'])
+        self.assertEqual(['5551234'], batch['recipients'])
+        self.assertIn('msgid', batch)
+
+    def test_old_tower(self):
+        """A tower too old for batches gets one paced SMS per recipient."""
+        bts = models.BTS(uuid='broadcast-old-bts', secret='broadcast-old',
+                         inbound_url='http://localhost/old',
+                         network=self.network)
+        bts.save()
+        for number in ('5551234', '5559876'):
+            sub = self.add_sub(self.gen_imsi())
+            sub.bts = bts
+            sub.save()
+            self.add_number(number, sub)
+        with mock.patch('endagaweb.tasks.async_post.apply_async') as (
+                mocked_task):
+            tasks.broadcast_sms(self.network.id, 'town meeting at 5', '555')
+        self.assertEqual(2, mocked_task.call_count)
+        for index, (args, kwargs) in enumerate(mocked_task.call_args_list):
+            (task_endpoint, params), = args
+            self.assertEqual('%s/endaga_sms' % bts.inbound_url, task_endpoint)
+            self.assertEqual(['5551234', '5559876'][index], params['to'])
+            self.assertEqual('555', params['sender'])
+            self.assertEqual('town meeting at 5', params['text'])
+            self.assertEqual(index * tasks.BROADCAST_SMS_INTERVAL_SECS,
+                             kwargs['countdown'])
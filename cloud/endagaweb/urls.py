@@ -49,6 +49,9 @@ urlpatterns = [
     # /subscribers/<imsi> -- DELETE to start the sub-deactivation process.
     url(r'^api/v2/subscribers/(?P<imsi>[^/]+)$',
         endagaweb.views.api_v2.Subscriber.as_view(), name='v2_subscribers'),
+    # /broadcast -- POST to send an SMS to every camped subscriber.
+    url(r'^api/v2/broadcast$',
+        endagaweb.views.api_v2.Broadcast.as_view(), name='v2_broadcast'),
 
     # Routes for the new stats API, not to be confused with /stats (below).
     # Passes the infrastructure level in the URL (global, network, etc) and the
@@ -0,0 +1,91 @@
+"""Keyword search over UsageEvents.
+
+Every keyword in a query must match (keywords are ANDed), and each keyword is
+turned into a single filter that the database can answer from indexes:
+
+  - a full IMSI (with or without the "IMSI" prefix) is an exact match on
+    UsageEvent.subscriber_imsi, which has a btree index;
+  - a phone number that belongs to a subscriber on the network matches that
+    subscriber's events via the subscriber foreign key;
+  - anything else is a case-insensitive substring match on kind, reason and
+    subscriber_imsi, or on the events of any subscriber whose name, IMSI or
+    number contains the keyword.
+
+The substring matches compile to UPPER(col::text) LIKE UPPER('%kw%'), which
+Postgres can answer from the pg_trgm GIN indexes created by the
+oneoffs/usage_event_search_indexes migration, as long as the keyword is at
+least three characters long.
+
+Copyright (c) 2016-present, Facebook, Inc.
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree. An additional grant
+of patent rights can be found in the PATENTS file in the same directory.
+"""
+
+import re
+
+from django.db.models import Q
+
+from endagaweb.models import Number, Subscriber
+
+
+# IMSIs are 14-15 digits; we accept the "IMSI" prefix the towers send us.
+IMSI_RE = re.compile(r'^(?:IMSI)?(\d{14,15})$', re.IGNORECASE)
+# Numbers are stored without a leading '+'.
+NUMBER_RE = re.compile(r'^\+?(\d{5,13})$')
+
+
+def search_events(network, query_string, events):
+    """Filters a UsageEvent QuerySet by a space-separated keyword list.
+
+    Args:
+      network: the Network whose events we are searching
+      query_string: a space-separated query string
+      events: a QuerySet containing UsageEvents we want to search through
+
+    Returns:
+      a QuerySet of the events that match every keyword
+    """
+    for keyword in query_string.split():
+        events = events.filter(keyword_filter(network, keyword))
+    return events
+
+
+def keyword_filter(network, keyword):
+    """Builds the filter for a single search keyword.
+
+    Args:
+      network: the Network whose events we are searching
+      keyword: a single search term
+
+    Returns:
+      a Q object matching UsageEvents
+    """
+    imsi_match = IMSI_RE.match(keyword)
+    if imsi_match:
+        digits = imsi_match.group(1)
+        return Q(subscriber_imsi__in=['IMSI%s' % digits, digits])
+    number_match = NUMBER_RE.match(keyword)
+    if number_match:
+        owners = list(Number.objects.filter(
+            network=network, number=number_match.group(1),
+            subscriber__isnull=False).values_list('subscriber', flat=True))
+        if owners:
+            # Events of other subscribers can mention the number too.
+            return (Q(subscriber__in=owners)
+                    | Q(reason__icontains=number_match.group(1)))
+    # Resolve subscribers against the (much smaller) subscriber and number
+    # tables first so the event query does not have to join them.
+    subscribers = Subscriber.objects.filter(network=network).filter(
+        Q(name__icontains=keyword) | Q(imsi__icontains=keyword)
+    ).values('id')
+    numbered = Number.objects.filter(
+        network=network, number__icontains=keyword,
+        subscriber__isnull=False).values('subscriber')
+    return (Q(kind__icontains=keyword)
+            | Q(reason__icontains=keyword)
+            | Q(subscriber_imsi__icontains=keyword)
+            | Q(subscriber__in=subscribers)
+            | Q(subscriber__in=numbered))
@@ -0,0 +1,222 @@
+"""Monthly range partitioning for the large, append-only event tables.
+
+UsageEvent and TimeseriesStat are stored as native Postgres (11+) range
+partitioned tables with one partition per calendar month of `date`, so any
+query constrained by date only touches the relevant months.  The conversion
+from a plain table is done once by the oneoffs/partition_event_tables
+migration: the existing table becomes a single "legacy" partition holding
+everything before next month.
+
+Partition maintenance (the manage_partitions command and the
+maintain_partitions celery task) then:
+  - creates partitions ahead of time so inserts never miss a partition;
+  - downsamples TimeseriesStat partitions older than the raw retention period
+    into hourly averages (the partition is swapped for a "_hourly" one over
+    the same range, so stats queries keep working unchanged);
+  - drops TimeseriesStat partitions older than the rollup retention period.
+
+UsageEvents are billing records, so they are never downsampled or dropped.
+Nor is the legacy partition, which holds all of a table's history from before
+the conversion; expiring it is left to an operator.
+
+Copyright (c) 2016-present, Facebook, Inc.
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree. An additional grant
+of patent rights can be found in the PATENTS file in the same directory.
+"""
+
+import datetime
+import re
+
+from dateutil import parser as date_parser
+from django.conf import settings
+from django.db import connection, transaction
+import django.utils.timezone
+import pytz
+
+
+# Partitioned table -> partition key column.
+PARTITIONED_TABLES = {
+    'endagaweb_usageevent': 'date',
+    'endagaweb_timeseriesstat': 'date',
+}
+ROLLUP_SUFFIX = '_hourly'
+LEGACY_SUFFIX = '_legacy'
+RE_UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+def month_start(date):
+    """The first instant of the (UTC) month containing date."""
+    date = date.astimezone(pytz.utc)
+    return datetime.datetime(date.year, date.month, 1, tzinfo=pytz.utc)
+
+
+def add_months(date, months):
+    """Shifts a month_start datetime by a (possibly negative) month count."""
+    month = date.month - 1 + months
+    return date.replace(year=date.year + month // 12, month=month % 12 + 1)
+
+
+def partition_name(table, month):
+    return '%s_y%04dm%02d' % (table, month.year, month.month)
+
+
+def is_partitioned(cursor, table):
+    cursor.execute(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c "
+        "ON c.oid = p.partrelid WHERE c.relname = %s", [table])
+    return cursor.fetchone() is not None
+
+
+def list_partitions(cursor, table):
+    """Lists the partitions of a table.
+
+    Returns:
+      a list of (name, bound, upper) tuples sorted by upper bound, where bound
+      is the partition bound expression and upper is the exclusive upper bound
+      as a datetime
+    """
+    cursor.execute(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+        "FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = %s", [table])
+    partitions = []
+    for name, bound in cursor.fetchall():
+        upper = date_parser.parse(RE_UPPER_BOUND.search(bound).group(1))
+        partitions.append((name, bound, upper))
+    return sorted(partitions, key=lambda p: p[2])
+
+
+def convert_to_partitioned(cursor, table, column, now=None):
+    """Turns a plain table into a partitioned one.
+
+    The existing table is renamed to <table>_legacy and attached as the
+    partition for everything before next month; indexes and foreign keys are
+    recreated on the new parent table so that they cascade to new partitions.
+    Runs inside the caller's transaction.
+    """
+    now = now or django.utils.timezone.now()
+    boundary = add_months(month_start(now), 1)
+    legacy = table + LEGACY_SUFFIX
+    cursor.execute(
+        "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s "
+        "AND indexdef NOT LIKE 'CREATE UNIQUE%%'", [table])
+    indexes = cursor.fetchall()
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype = 'f'", [table])
+    foreign_keys = cursor.fetchall()
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+    sequence = cursor.fetchone()[0]
+
+    cursor.execute('ALTER TABLE %s RENAME TO %s' % (table, legacy))
+    for name, _ in indexes:
+        cursor.execute('ALTER INDEX %s RENAME TO %s_old' % (name, name[:59]))
+    cursor.execute(
+        'CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+        'PARTITION BY RANGE (%s)' % (table, legacy, column))
+    cursor.execute('ALTER TABLE %s ADD PRIMARY KEY (id, %s)' % (table, column))
+    # The legacy partition may be dropped one day; keep the id sequence.
+    cursor.execute('ALTER SEQUENCE %s OWNED BY %s.id' % (sequence, table))
+    # The saved definitions already refer to the new parent by name.
+    for _, definition in indexes:
+        cursor.execute(definition)
+    for name, definition in foreign_keys:
+        cursor.execute('ALTER TABLE %s ADD CONSTRAINT %s %s' % (
+            table, name, definition))
+    cursor.execute(
+        "ALTER TABLE %s ATTACH PARTITION %s "
+        "FOR VALUES FROM (MINVALUE) TO (%%s)" % (table, legacy),
+        [boundary.isoformat()])
+
+
+def create_partition(cursor, table, month):
+    name = partition_name(table, month)
+    cursor.execute(
+        'CREATE TABLE IF NOT EXISTS %s PARTITION OF %s '
+        'FOR VALUES FROM (%%s) TO (%%s)' % (name, table),
+        [month.isoformat(), add_months(month, 1).isoformat()])
+    return name
+
+
+def downsample_partition(cursor, table, name, bound):
+    """Replaces a TimeseriesStat partition with hourly averages."""
+    rollup = name + ROLLUP_SUFFIX
+    cursor.execute(
+        'CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+        % (rollup, table))
+    cursor.execute(
+        "INSERT INTO %s (key, value, date, bts_id, network_id) "
+        "SELECT key, AVG(value), date_trunc('hour', date), bts_id, network_id "
+        "FROM %s GROUP BY key, date_trunc('hour', date), bts_id, network_id"
+        % (rollup, name))
+    cursor.execute('ALTER TABLE %s DETACH PARTITION %s' % (table, name))
+    cursor.execute('DROP TABLE %s' % name)
+    cursor.execute('ALTER TABLE %s ATTACH PARTITION %s %s' % (
+        table, rollup, bound))
+    return rollup
+
+
+def drop_partition(cursor, table, name):
+    cursor.execute('ALTER TABLE %s DETACH PARTITION %s' % (table, name))
+    cursor.execute('DROP TABLE %s' % name)
+
+
+def retention(table):
+    """(raw months, rollup months) to keep for a table, or None for all."""
+    if table == 'endagaweb_timeseriesstat':
+        return (settings.ENDAGA['TIMESERIES_RAW_RETENTION_MONTHS'],
+                settings.ENDAGA['TIMESERIES_ROLLUP_RETENTION_MONTHS'])
+    return None
+
+
+def maintain(now=None, dry_run=False):
+    """Creates, downsamples and drops partitions as needed.
+
+    Tables that have not been converted to partitioned tables are skipped.
+    Each table is maintained in its own transaction.
+
+    Returns:
+      a list of (action, partition name) tuples describing what was (or, with
+      dry_run, would be) done
+    """
+    now = now or django.utils.timezone.now()
+    current = month_start(now)
+    actions = []
+    for table in sorted(PARTITIONED_TABLES):
+        with transaction.atomic(), connection.cursor() as cursor:
+            if not is_partitioned(cursor, table):
+                continue
+            # Partitions are contiguous, so anything before the latest upper
+            # bound (e.g. the legacy partition's) is already covered.
+            uppers = [p[2] for p in list_partitions(cursor, table)]
+            for offset in range(settings.ENDAGA['PARTITION_MONTHS_AHEAD'] + 1):
+                month = add_months(current, offset)
+                if uppers and month < max(uppers):
+                    continue
+                name = partition_name(table, month)
+                actions.append(('create', name))
+                if not dry_run:
+                    create_partition(cursor, table, month)
+            if retention(table) is None:
+                continue
+            raw_months, rollup_months = retention(table)
+            raw_cutoff = add_months(current, -raw_months)
+            rollup_cutoff = add_months(current, -rollup_months)
+            for name, bound, upper in list_partitions(cursor, table):
+                if 'MINVALUE' in bound:
+                    # The legacy partition.
+                    continue
+                if upper <= rollup_cutoff:
+                    actions.append(('drop', name))
+                    if not dry_run:
+                        drop_partition(cursor, table, name)
+                elif upper <= raw_cutoff and not name.endswith(ROLLUP_SUFFIX):
+                    actions.append(('downsample', name))
+                    if not dry_run:
+                        downsample_partition(cursor, table, name, bound)
+    return actions
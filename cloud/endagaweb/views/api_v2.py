@@ -1,6 +1,7 @@
 """API V2 views.
 
 /numbers/<number> -- POST to deactivate a number
+/broadcast -- POST to send an SMS to every camped subscriber in the network
 
 Copyright (c) 2016-present, Facebook, Inc.
 All rights reserved.
@@ -179,3 +180,28 @@ class Tower(APIView):
         # And finally delete the BTS.
         tower.delete()
         return Response("")
+
+
+class Broadcast(APIView):
+    """Handles /api/v2/broadcast.
+
+    Each tower in the network is sent one batch of its camped subscribers'
+    numbers, which it delivers at the pace its radio allows.
+    """
+
+    # Setup DRF permissions and auth.  This endpoint should only be accessed
+    # via token auth, but for DRF to work properly you must also enable
+    # session auth.
+    permission_classes = (permissions.IsAuthenticated,)
+    authentication_classes = (authentication.SessionAuthentication,
+                              authentication.TokenAuthentication)
+
+    def post(self, request):
+        network = get_network_from_user(request.user)
+        text = request.POST.get('text', '')
+        if not text:
+            return Response("Must post the text to send.",
+                            status=status.HTTP_400_BAD_REQUEST)
+        sender = request.POST.get('sender', '0000')
+        tasks.broadcast_sms.delay(network.id, text, sender)
+        return Response("", status=status.HTTP_202_ACCEPTED)
@@ -40,6 +40,7 @@ from ccm.common.currency import parse_credits, humanize_credits, CURRENCIES
 from endagaweb.models import (UserProfile, Subscriber, UsageEvent,
                               Network, PendingCreditUpdate, Number)
 from endagaweb.util.currency import cents2mc
+from endagaweb.util import event_search
 from endagaweb.forms import dashboard_forms as dform
 from endagaweb import tasks
 from endagaweb.views import django_tables
@@ -562,12 +563,14 @@ class SubscriberAdjustCredit(ProtectedView):
         except ValueError:
             messages.error(request, error_text)
             return adjust_credit_redirect
-        # Validation suceeded, create a PCU and start the update credit task.
+        # Validation suceeded, create a PCU and schedule its delivery.  If the
+        # sub has no BTS the PCU stays pending until it camps somewhere.
         msgid = str(uuid.uuid4())
         credit_update = PendingCreditUpdate(subscriber=sub, uuid=msgid,
                                             amount=amount)
         credit_update.save()
-        tasks.update_credit.delay(sub.imsi, msgid)
+        if sub.bts:
+            tasks.schedule_credit_updates(sub.bts)
         return adjust_credit_redirect
 
     def delete(self, request, imsi=None):
@@ -850,7 +853,7 @@ class ActivityView(ProtectedView):
         elif end_date and not start_date:
             start_date = "2000-01-01 at 01:01AM"
         if query:
-            events = self._search_events(user_profile, query, events)
+            events = event_search.search_events(network, query, events)
         if start_date or end_date:
             # Convert date strings to datetimes and cast them into the
             # UserProfile's timezone.
@@ -878,40 +881,3 @@ class ActivityView(ProtectedView):
                 qs = [Q(kind__icontains=s) for s in services]
                 events = events.filter(reduce(operator.or_, qs))
         return events
-
-    def _search_events(self, profile, query_string, orig_events):
-            """ Searches for events matching space-separated keyword list
-
-            Args:
-                a UserProfile object
-                a space-separated query string
-                a QuerySet containing UsageEvents we want to search through
-
-            Returns:
-                a QuerySet that matches the query string
-            """
-            network = profile.network
-            queries = query_string.split()
-
-            res_events = UsageEvent.objects.none()
-            for query in queries:
-                events = orig_events
-                events = (events.filter(kind__icontains=query)
-                          | events.filter(reason__icontains=query)
-                          | events.filter(subscriber__name__icontains=query)
-                          | events.filter(subscriber__imsi__icontains=query)
-                          | events.filter(subscriber_imsi__icontains=query))
-
-                # Get any numbers that match, and add their associated
-                # subscribers' events to the results
-                potential_subs = (
-                    Number.objects.filter(number__icontains=query)
-                                  .values('subscriber')
-                                  .filter(subscriber__network=network)
-                                  .distinct())
-                if potential_subs:
-                    events |= (UsageEvent.objects
-                                .filter(subscriber__in=potential_subs))
-
-                res_events |= events
-            return res_events
@@ -0,0 +1,254 @@
+"""openbts.cli
+runs OpenBTSCLI commands and parses their output
+
+Copyright (c) 2016-present, Facebook, Inc.
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree. An additional grant
+of patent rights can be found in the PATENTS file in the same directory.
+"""
+
+import atexit
+import errno
+import os
+import re
+import select
+import subprocess
+import threading
+import time
+
+import envoy
+
+from openbts.exceptions import InvalidRequestError
+from openbts.exceptions import MalformedResponseError
+from openbts.exceptions import TimeoutError
+
+
+DEFAULT_CLI_PATH = '/OpenBTS/OpenBTSCLI'
+
+
+class CLISession(object):
+  """Runs commands through one long-lived interactive OpenBTSCLI process.
+
+  Commands are written to the CLI's stdin one at a time, and a response is
+  everything the CLI prints before its next prompt.  If the interactive
+  session can't be used (the CLI won't start, dies or stops answering), the
+  command is run with a one-shot 'OpenBTSCLI -c' instead, and the session
+  isn't retried for retry_interval seconds.
+
+  Responses are cached by command, so callers that poll the same command
+  can share one sample by passing max_age to run().
+
+  Use CLISession.shared() to get the session for a CLI path, which all the
+  components of a process share.
+
+  Args:
+    path: the OpenBTSCLI executable
+    prompt: the prompt printed by the CLI when it is ready for a command
+    retry_interval: seconds to wait before restarting a failed session
+  """
+
+  _shared = {}
+  _shared_lock = threading.Lock()
+
+  def __init__(self, path=DEFAULT_CLI_PATH, prompt='OpenBTS> ',
+               retry_interval=60):
+    self.path = path
+    self.prompt = prompt.encode('utf-8')
+    self.retry_interval = retry_interval
+    self.lock = threading.Lock()
+    self._process = None
+    self._retry_at = 0
+    # command -> (time sampled, output)
+    self._cache = {}
+
+  @classmethod
+  def shared(cls, path=DEFAULT_CLI_PATH):
+    """Gets the process-wide session for a CLI path."""
+    with cls._shared_lock:
+      if path not in cls._shared:
+        cls._shared[path] = cls(path)
+      return cls._shared[path]
+
+  def __repr__(self):
+    return 'CLISession(%s)' % self.path
+
+  def run(self, command, timeout=3, max_age=0):
+    """Runs a command and returns its output.
+
+    Args:
+      command: the CLI command, e.g. 'load'
+      timeout: seconds to wait for the output
+      max_age: reuse the output of the same command if it was sampled less
+               than this many seconds ago
+
+    Raises:
+      InvalidRequestError if the CLI could not run the command
+    """
+    with self.lock:
+      now = time.time()
+      if max_age > 0 and command in self._cache:
+        sampled_at, output = self._cache[command]
+        if now - sampled_at < max_age:
+          return output
+      output = None
+      if now >= self._retry_at:
+        try:
+          output = self._run_in_session(command, timeout)
+        except (OSError, IOError, TimeoutError):
+          self.close()
+          self._retry_at = time.time() + self.retry_interval
+      if output is None:
+        output = self._run_once(command, timeout)
+      self._cache[command] = (time.time(), output)
+      return output
+
+  def close(self):
+    """Stops the CLI process, if it is running."""
+    process, self._process = self._process, None
+    if process is None:
+      return
+    for pipe in (process.stdin, process.stdout):
+      try:
+        pipe.close()
+      except (OSError, IOError):
+        pass
+    if process.poll() is None:
+      process.kill()
+    process.wait()
+
+  def _run_in_session(self, command, timeout):
+    if self._process is None or self._process.poll() is not None:
+      self.close()
+      self._process = subprocess.Popen(
+        [self.path], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT, bufsize=0, close_fds=True)
+      # Discard the banner.
+      self._read_until_prompt(timeout)
+    self._process.stdin.write(command.encode('utf-8') + b'\n')
+    self._process.stdin.flush()
+    return self._read_until_prompt(timeout).decode('utf-8', 'replace')
+
+  def _read_until_prompt(self, timeout):
+    """Reads the CLI output up to the next prompt, which is dropped."""
+    fd = self._process.stdout.fileno()
+    deadline = time.time() + timeout
+    chunks = []
+    tail = b''
+    while not tail.endswith(self.prompt):
+      remaining = deadline - time.time()
+      if remaining <= 0:
+        raise TimeoutError('no prompt from %s' % self.path)
+      try:
+        readable, _, _ = select.select([fd], [], [], remaining)
+      except select.error as e:
+        if e.args[0] == errno.EINTR:
+          continue
+        raise
+      if not readable:
+        continue
+      chunk = os.read(fd, 4096)
+      if not chunk:
+        raise IOError('%s exited' % self.path)
+      chunks.append(chunk)
+      tail = (tail + chunk)[-len(self.prompt):]
+    return b''.join(chunks)[:-len(self.prompt)]
+
+  def _run_once(self, command, timeout):
+    response = envoy.run('%s -c "%s"' % (self.path, command), timeout=timeout)
+    if response.status_code != 0:
+      raise InvalidRequestError(
+        'CLI returned with non-zero status: %d' % response.status_code)
+    return response.std_out
+
+
+@atexit.register
+def _close_shared_sessions():
+  for session in list(CLISession._shared.values()):
+    session.close()
+
+
+# A number, possibly negative, fractional or in scientific notation.
+_NUMBER = r'-?\d*\.?\d+(?:[eE][-+]?\d+)?'
+
+# 'load' output labels, and the fields for the numbers that follow them.
+_LOAD_FIELDS = {
+  'SDCCH load/available': ('sdcch_load', 'sdcch_available'),
+  'TCH/F load/available': ('tchf_load', 'tchf_available'),
+  'PCH load: active, total': ('pch_active', 'pch_total'),
+  'AGCH load: active, pending': ('agch_active', 'agch_pending'),
+  'current PDCHs': ('gprs_current_pdchs',),
+  'utilization': ('gprs_utilization_percentage',),
+}
+
+# 'noise' output labels, each followed by 'is <value> dB'.
+_NOISE_FIELDS = {
+  'noise RSSI': 'noise_rssi_db',
+  'MS RSSI target': 'noise_ms_rssi_target_db',
+}
+
+_GPRS_IMSI = re.compile(r'imsi=(\d{15})')
+_GPRS_IPADDR = re.compile(r'IPs=(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})')
+_GPRS_BYTES = re.compile(r'Bytes:(\d+)up/(\d+)down')
+
+
+def _labelled_numbers(output, labels, separator):
+  """Yields (label, numbers) for each output line starting with a label.
+
+  Lines are matched on their labels rather than on their position, so lines
+  that are missing, reordered or unknown to us don't throw the parser off.
+  """
+  for line in output.splitlines():
+    label, sep, values = line.strip().rpartition(separator)
+    label = label.strip()
+    if sep and label in labels:
+      # We convert to a float first so that this can handle numbers in
+      # scientific notation.
+      yield label, [int(float(n)) for n in re.findall(_NUMBER, values)]
+
+
+def parse_load(output):
+  """Parses the output of the 'load' command into a dict of ints.
+
+  Raises:
+    MalformedResponseError if a field is missing
+  """
+  result = {}
+  for label, numbers in _labelled_numbers(output, _LOAD_FIELDS, ':'):
+    result.update(zip(_LOAD_FIELDS[label], numbers))
+  if len(result) != sum(len(fields) for fields in _LOAD_FIELDS.values()):
+    raise MalformedResponseError(
+      'CLI returned with malformed response: %s' % output)
+  return result
+
+
+def parse_noise(output):
+  """Parses the output of the 'noise' command into a dict of ints.
+
+  Raises:
+    MalformedResponseError if a field is missing
+  """
+  result = {}
+  for label, numbers in _labelled_numbers(output, _NOISE_FIELDS, ' is '):
+    if numbers:
+      result[_NOISE_FIELDS[label]] = numbers[0]
+  if len(result) != len(_NOISE_FIELDS):
+    raise MalformedResponseError(
+      'CLI returned with malformed response: %s' % output)
+  return result
+
+
+def parse_gprs_list(output):
+  """Parses the output of the 'gprs list' command.
+
+  Yields (imsi, ipaddr, uploaded_bytes, downloaded_bytes) for each MS entry
+  which has all of those fields; other entries are skipped.
+  """
+  for ms_block in output.split('MS#')[1:]:
+    imsi = _GPRS_IMSI.search(ms_block)
+    ipaddr = _GPRS_IPADDR.search(ms_block)
+    count = _GPRS_BYTES.search(ms_block)
+    if imsi and ipaddr and count:
+      yield ('IMSI%s' % imsi.group(1), ipaddr.group(1),
+             int(count.group(1)), int(count.group(2)))
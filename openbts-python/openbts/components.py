@@ -9,14 +9,11 @@ LICENSE file in the root directory of this source tree. An additional grant
 of patent rights can be found in the PATENTS file in the same directory.
 """
 
-import re
 import time
 
-import envoy
-
+from openbts import cli
 from openbts.core import BaseComponent
 from openbts.exceptions import InvalidRequestError
-from openbts.exceptions import MalformedResponseError
 
 
 class OpenBTS(BaseComponent):
@@ -109,32 +106,7 @@ class OpenBTS(BaseComponent):
       PCH: a paging channel for service notifications
       AGCH: a channel for transmitting BTS responses to channel requests
     """
-    response = envoy.run('/OpenBTS/OpenBTSCLI -c "load"', timeout=self.cli_timeout)
-    if response.status_code != 0:
-      raise InvalidRequestError(
-        'CLI returned with non-zero status: %d' % response.status_code)
-    items = response.std_out.split()
-
-    try:
-        res = {
-          'sdcch_load': int(items[5].split('/')[0]),
-          'sdcch_available': int(items[5].split('/')[1]),
-          'tchf_load': int(items[8].split('/')[0]),
-          'tchf_available': int(items[8].split('/')[1]),
-          'pch_active': int(items[13].strip(',')),
-          'pch_total': int(items[14]),
-          'agch_active': int(items[19].strip(',')),
-          'agch_pending': int(items[20]),
-          'gprs_current_pdchs': int(items[26]),
-          # We convert to a float first so that this can handle numbers in
-          # scientific notation.
-          'gprs_utilization_percentage': int(float(items[28].strip('%'))),
-        }
-    except (IndexError, ValueError):
-        raise MalformedResponseError(
-            'CLI returned with malformed response: %s' % response.std_out)
-
-    return res
+    return cli.parse_load(self._run_cli('load'))
 
   def get_noise(self):
     """Get the current BTS noise values from the CLI.
@@ -144,19 +116,7 @@ class OpenBTS(BaseComponent):
       'noise_ms_rssi_target_db': -50,
     }
     """
-    response = envoy.run('/OpenBTS/OpenBTSCLI -c "noise"', timeout=self.cli_timeout)
-    if response.status_code != 0:
-      raise InvalidRequestError(
-        'CLI returned with non-zero status: %d' % response.status_code)
-    items = response.std_out.split()
-    try:
-        return {
-          'noise_rssi_db': int(items[3]),
-          'noise_ms_rssi_target_db': int(items[12]),
-        }
-    except (IndexError, ValueError):
-        raise MalformedResponseError(
-            'CLI returned with malformed response: %s' % response.std_out)
+    return cli.parse_noise(self._run_cli('noise'))
 
 
 class SIPAuthServe(BaseComponent):
@@ -219,16 +179,29 @@ class SIPAuthServe(BaseComponent):
     # We get back every field in the SR, most of which are not useful.  We will
     # simplify each subscriber dict to show just a few attributes.  And we'll
     # attach additional info on associated numbers, account balance and the
-    # caller ID.
-    simplified_subscribers = []
+    # caller ID, which are looked up for all the subscribers in one batch.
+    messages = []
     for subscriber in subscribers:
+      messages.extend([
+        self._numbers_message(subscriber['name']),
+        self._sip_buddies_message(subscriber['name'], 'account_balance'),
+        self._sip_buddies_message(subscriber['name'], 'callerid'),
+      ])
+    responses = self._send_and_receive_many(messages, raise_errors=False)
+    simplified_subscribers = []
+    for (i, subscriber) in enumerate(subscribers):
+      (numbers, balance, caller_id) = responses[3 * i:3 * i + 3]
+      for response in (balance, caller_id):
+        if isinstance(response, Exception):
+          raise response
       simplified_subscriber = {
         'name': subscriber['name'],
         'openbts_ipaddr': subscriber['ipaddr'],
         'openbts_port': subscriber['port'],
-        'numbers': self.get_numbers(subscriber['name']),
-        'account_balance': self.get_account_balance(subscriber['name']),
-        'caller_id': self.get_caller_id(subscriber['name']),
+        'numbers': ([] if isinstance(numbers, InvalidRequestError) else
+                    [d['exten'] for d in numbers.data]),
+        'account_balance': balance.data[0]['account_balance'],
+        'caller_id': caller_id.data[0]['callerid'],
       }
       simplified_subscribers.append(simplified_subscriber)
     return simplified_subscribers
@@ -283,18 +256,8 @@ class SIPAuthServe(BaseComponent):
 
     If imsi is None, get all dialdata.
     """
-    fields = ['exten']
-    qualifiers = {}
-    if imsi:
-      qualifiers['dial'] = imsi
-    message = {
-      'command': 'dialdata_table',
-      'action': 'read',
-      'match': qualifiers,
-      'fields': fields,
-    }
     try:
-      response = self._send_and_receive(message)
+      response = self._send_and_receive(self._numbers_message(imsi))
       return [d['exten'] for d in response.data]
     except InvalidRequestError:
       return []
@@ -484,19 +447,25 @@ class SIPAuthServe(BaseComponent):
 
   def get_account_balance(self, imsi):
     """Get the account balance of a subscriber."""
-    fields = ['account_balance']
-    qualifiers = {
-      'name': imsi
-    }
-    message = {
-      'command': 'sip_buddies',
-      'action': 'read',
-      'match': qualifiers,
-      'fields': fields,
-    }
+    message = self._sip_buddies_message(imsi, 'account_balance')
     response = self._send_and_receive(message)
     return response.data[0]['account_balance']
 
+  def get_account_balances(self, imsis):
+    """Get the account balances of several subscribers in one batch.
+
+    Returns:
+      dict of IMSI to account balance
+
+    Raises:
+      InvalidRequestError if an IMSI is not found
+    """
+    messages = [self._sip_buddies_message(imsi, 'account_balance')
+                for imsi in imsis]
+    responses = self._send_and_receive_many(messages)
+    return dict((imsi, response.data[0]['account_balance'])
+                for (imsi, response) in zip(imsis, responses))
+
   def update_account_balance(self, imsi, new_account_balance):
     """Updates a subscriber's account_balance.
 
@@ -509,7 +478,30 @@ class SIPAuthServe(BaseComponent):
     """
     if not isinstance(new_account_balance, str):
       raise TypeError
-    message = {
+    return self._send_and_receive(
+      self._balance_update_message(imsi, new_account_balance))
+
+  def update_account_balances(self, balances):
+    """Updates the account_balance of several subscribers in one batch.
+
+    Args:
+      balances: dict of IMSI to new balance (str)
+
+    Returns:
+      list of Response instances
+
+    Raises:
+      TypeError if a new balance is not a string
+    """
+    if not all(isinstance(b, str) for b in balances.values()):
+      raise TypeError
+    return self._send_and_receive_many(
+      [self._balance_update_message(imsi, balance)
+       for (imsi, balance) in balances.items()])
+
+  @staticmethod
+  def _balance_update_message(imsi, new_account_balance):
+    return {
       'command': 'sip_buddies',
       'action': 'update',
       'match': {
@@ -519,7 +511,31 @@ class SIPAuthServe(BaseComponent):
         'account_balance': new_account_balance
       }
     }
-    return self._send_and_receive(message)
+
+  @staticmethod
+  def _sip_buddies_message(imsi, field):
+    """Message to read a field of a subscriber's sip_buddies entry."""
+    return {
+      'command': 'sip_buddies',
+      'action': 'read',
+      'match': {
+        'name': imsi
+      },
+      'fields': [field],
+    }
+
+  @staticmethod
+  def _numbers_message(imsi=None):
+    """Message to read the numbers of a subscriber, or all dialdata."""
+    qualifiers = {}
+    if imsi:
+      qualifiers['dial'] = imsi
+    return {
+      'command': 'dialdata_table',
+      'action': 'read',
+      'match': qualifiers,
+      'fields': ['exten'],
+    }
 
   def get_gprs_usage(self, target_imsi=None):
     """Get all available GPRS data, or that of a specific IMSI (experimental).
@@ -536,30 +552,9 @@ class SIPAuthServe(BaseComponent):
     Args:
       target_imsi: the subsciber-of-interest
     """
-    response = envoy.run('/OpenBTS/OpenBTSCLI -c "gprs list"', timeout=self.cli_timeout)
-    if response.status_code != 0:
-      raise InvalidRequestError(
-        'CLI returned with non-zero status: %d' % response.status_code)
     result = {}
-    for ms_block in response.std_out.split('MS#'):
-      try:
-        # Get the IMSI.
-        match = re.search(r'imsi=[\d]{15}', ms_block)
-        imsi = 'IMSI%s' % match.group(0).split('=')[1]
-        # Get the IP.
-        match = re.search(r'IPs=\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}', ms_block)
-        ipaddr = match.group(0).split('=')[1]
-        # Get the uploaded and downloaded bytes.
-        match = re.search(r'Bytes:[0-9]+up\/[0-9]+down', ms_block)
-        count = match.group(0).split(':')[1]
-        uploaded_bytes = int(count.split('/')[0].strip('up'))
-        downloaded_bytes = int(count.split('/')[1].strip('down'))
-      except AttributeError:
-        # No match found.
-        continue
-      except ValueError:
-        # Casting to int failed.
-        continue
+    usage = cli.parse_gprs_list(self._run_cli('gprs list'))
+    for imsi, ipaddr, uploaded_bytes, downloaded_bytes in usage:
       # See if we already have an entry for the same IMSI -- we sometimes see
       # duplicates.  If we do have an entry already, sum the byte counts across
       # entries.
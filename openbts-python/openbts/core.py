@@ -9,14 +9,20 @@ LICENSE file in the root directory of this source tree. An additional grant
 of patent rights can be found in the PATENTS file in the same directory.
 """
 
+import itertools
 import json
+try:
+  import queue
+except ImportError:
+  import Queue as queue
 
 import zmq
 
 import threading
 
+from openbts.cli import CLISession
 from openbts.exceptions import (InvalidRequestError, InvalidResponseError,
-                                TimeoutError)
+                                OpenBTSError, TimeoutError)
 from openbts.codes import (SuccessCode, ErrorCode)
 
 
@@ -25,9 +31,16 @@ class BaseComponent(object):
 
   The intent is to create other components that inherit from this base class.
 
+  Single requests go over one REQ socket, one at a time.  Batches of requests
+  are pipelined over a NodeManagerClient, which is created on first use.
+
   kwargs:
     socket_timeout: time to poll the socket for values before raising a
                     TimeoutError
+    pool_size: max number of sockets the NodeManagerClient keeps open
+    cli_timeout: time to wait for OpenBTSCLI output
+    cli_cache_ttl: OpenBTSCLI output younger than this is reused, so that
+                   pollers of the same command in a process share a sample
   """
 
   def __init__(self, **kwargs):
@@ -37,7 +50,11 @@ class BaseComponent(object):
     # response available.
     self.socket_timeout = kwargs.pop('socket_timeout', 10)  # seconds
     self.cli_timeout = kwargs.pop('cli_timeout', 3) # seconds
+    self.cli_cache_ttl = kwargs.pop('cli_cache_ttl', 1) # seconds
+    self.pool_size = kwargs.pop('pool_size', 2)
     self.lock = threading.Lock()
+    self._client = None
+    self.cli = CLISession.shared()
 
   def setup_socket(self):
     """Sets up the ZMQ socket."""
@@ -50,6 +67,11 @@ class BaseComponent(object):
     # RCVTIME0 sets a timeout for socket.recv.
     self.socket.setsockopt(zmq.RCVTIMEO, 500)  # milliseconds
 
+  def _run_cli(self, command):
+    """Runs an OpenBTSCLI command and returns its output."""
+    return self.cli.run(command, timeout=self.cli_timeout,
+                        max_age=self.cli_cache_ttl)
+
   def create_config(self, key, value):
     """Create a config parameter and initialize it.
 
@@ -108,6 +130,47 @@ class BaseComponent(object):
     response = self._send_and_receive(message)
     return response
 
+  def read_configs(self, keys):
+    """Reads several config values with pipelined requests.
+
+    Args:
+      keys: the config parameters to inspect
+
+    Returns:
+      dict of key to Response instance
+
+    Raises:
+      InvalidRequestError if a key does not exist
+    """
+    messages = [{
+      'command': 'config',
+      'action': 'read',
+      'key': key,
+      'value': ''
+    } for key in keys]
+    return dict(zip(keys, self._send_and_receive_many(messages)))
+
+  def update_configs(self, values):
+    """Updates several config values with pipelined requests.
+
+    Args:
+      values: dict of config parameter to new value
+
+    Returns:
+      dict of key to Response instance
+
+    Raises:
+      InvalidRequestError if a key does not exist or a value is invalid
+    """
+    keys = list(values)
+    messages = [{
+      'command': 'config',
+      'action': 'update',
+      'key': key,
+      'value': str(values[key])
+    } for key in keys]
+    return dict(zip(keys, self._send_and_receive_many(messages)))
+
   def delete_config(self, key):
     """Deletes a config value.
 
@@ -174,6 +237,164 @@ class BaseComponent(object):
       self.socket.connect(self.address)
       raise TimeoutError('did not receive a response')
 
+  def _send_and_receive_many(self, messages, raise_errors=True):
+    """Pipelines payloads to NM and returns Response instances in order.
+
+    Unlike _send_and_receive, this doesn't hold the component lock: batches
+    from different threads run concurrently on separate pooled sockets.
+
+    Args:
+      messages: list of message dicts to send to NM
+      raise_errors: if False, a request that failed is returned as its
+          exception instead of raising it
+
+    Returns:
+      list of Response instances (or exceptions) in the order of messages
+
+    Raises:
+      TimeoutError: if a response doesn't arrive in time
+      the error of the first failed request, once all responses are in
+    """
+    if self._client is None:
+      with self.lock:
+        if self._client is None:
+          self._client = NodeManagerClient(
+            self.address, socket_timeout=self.socket_timeout,
+            pool_size=self.pool_size)
+    responses = []
+    for raw_response_data in self._client.request_many(messages):
+      try:
+        responses.append(Response(raw_response_data))
+      except OpenBTSError as e:
+        if raise_errors:
+          raise
+        responses.append(e)
+    return responses
+
+
+class NodeManagerClient(object):
+  """Pipelines requests to a Node Manager over a small pool of sockets.
+
+  NM serves a REP socket.  A DEALER socket can send it several requests
+  without waiting for each reply, so a batch costs about one round trip
+  instead of one per request.  Each request is sent behind its own
+  correlation id, which NM's REP socket echoes back as part of the reply
+  envelope, and replies are matched to requests by that id.
+
+  Sockets are checked out of the pool for a whole batch, so concurrent
+  batches use separate sockets.  As with BaseComponent, a socket that timed
+  out is closed rather than reused, since late replies may still arrive on
+  it.
+
+  Args:
+    address: tcp socket of the NM
+    socket_timeout: seconds to wait for each reply
+    pool_size: max number of sockets open at once
+    pipeline_depth: max number of requests in flight on a socket
+  """
+
+  def __init__(self, address, socket_timeout=10, pool_size=2,
+               pipeline_depth=32):
+    self.address = address
+    self.socket_timeout = socket_timeout
+    self.pool_size = pool_size
+    self.pipeline_depth = pipeline_depth
+    self._context = zmq.Context.instance()
+    self._idle = queue.Queue()
+    self._open = 0
+    self._lock = threading.Lock()
+    self._ids = itertools.count()
+
+  def request_many(self, messages):
+    """Sends the messages and returns the raw replies, in order.
+
+    Raises:
+      TimeoutError: if a reply doesn't arrive in time
+    """
+    socket = self._checkout()
+    ok = False
+    try:
+      replies = self._pipeline(socket, messages)
+      ok = True
+      return replies
+    finally:
+      self._checkin(socket, ok)
+
+  def request(self, message):
+    return self.request_many([message])[0]
+
+  def close(self):
+    """Closes the idle sockets."""
+    while True:
+      try:
+        socket = self._idle.get_nowait()
+      except queue.Empty:
+        return
+      if socket is not None:
+        socket.close()
+        with self._lock:
+          self._open -= 1
+
+  def _pipeline(self, socket, messages):
+    replies = [None] * len(messages)
+    pending = {}
+    sent = 0
+    received = 0
+    while received < len(messages):
+      # Keep the pipeline full.
+      while sent < len(messages) and sent - received < self.pipeline_depth:
+        correlation_id = str(next(self._ids)).encode('ascii')
+        pending[correlation_id] = sent
+        socket.send_multipart([correlation_id, b'',
+                               json.dumps(messages[sent]).encode('utf-8')])
+        sent += 1
+      if not socket.poll(timeout=self.socket_timeout * 1000):
+        raise TimeoutError('did not receive a response')
+      frames = socket.recv_multipart()
+      index = pending.pop(frames[0], None)
+      if index is None:
+        continue
+      replies[index] = frames[-1]
+      received += 1
+    return replies
+
+  def _checkout(self):
+    while True:
+      try:
+        socket = self._idle.get_nowait()
+      except queue.Empty:
+        with self._lock:
+          open_new = self._open < self.pool_size
+          if open_new:
+            self._open += 1
+        if open_new:
+          break
+        # Wait for a socket to come back, or for a slot to free up.
+        socket = self._idle.get()
+      if socket is not None:
+        return socket
+    try:
+      socket = self._context.socket(zmq.DEALER)
+      socket.setsockopt(zmq.LINGER, 0)
+      socket.connect(self.address)
+    except zmq.ZMQError:
+      self._release()
+      raise
+    return socket
+
+  def _checkin(self, socket, ok):
+    if ok:
+      self._idle.put(socket)
+    else:
+      socket.close()
+      self._release()
+
+  def _release(self):
+    with self._lock:
+      self._open -= 1
+    # Wake up a waiting _checkout, so that it opens a new socket.
+    self._idle.put(None)
+
 
 class Response(object):
   """Provides access to the response data.
@@ -0,0 +1,147 @@
+"""Tests for the OpenBTSCLI session and output parsers.
+
+Copyright (c) 2016-present, Facebook, Inc.
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree. An additional grant
+of patent rights can be found in the PATENTS file in the same directory.
+"""
+
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+import unittest
+
+from openbts import cli
+from openbts.cli import CLISession
+from openbts.exceptions import MalformedResponseError
+from openbts.tests import get_fixture_path
+from openbts.tests import mocks
+
+
+# An interactive CLI which answers 'load' and 'noise' from the fixtures,
+# dies on 'exit' and hangs on 'hang'.  It logs each start to a file.
+FAKE_CLI = '''#!%(python)s
+import sys, time
+with open(%(starts)r, 'a') as starts:
+  starts.write('start\\n')
+out = sys.stdout
+out.write('OpenBTS Command Line Interface\\nOpenBTS> ')
+out.flush()
+for line in iter(sys.stdin.readline, ''):
+  command = line.strip()
+  if command == 'exit':
+    sys.exit(0)
+  if command == 'hang':
+    time.sleep(10)
+  if command in ('load', 'noise'):
+    with open(%(fixtures)r + '/' + command + '.txt') as fixture:
+      out.write(fixture.read())
+  else:
+    out.write('unknown command\\n')
+  out.write('OpenBTS> ')
+  out.flush()
+'''
+
+
+class CLISessionTestCase(unittest.TestCase):
+  """Testing the persistent CLI session against a fake OpenBTSCLI."""
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.starts_path = os.path.join(self.tmpdir, 'starts')
+    self.cli_path = os.path.join(self.tmpdir, 'OpenBTSCLI')
+    with open(self.cli_path, 'w') as script:
+      script.write(FAKE_CLI % {
+        'python': sys.executable,
+        'starts': self.starts_path,
+        'fixtures': os.path.dirname(get_fixture_path('load.txt')),
+      })
+    os.chmod(self.cli_path, stat.S_IRWXU)
+    self.session = CLISession(self.cli_path)
+    self.original_envoy = cli.envoy
+    self.mock_envoy = mocks.MockEnvoy(return_text='one-shot\n')
+    cli.envoy = self.mock_envoy
+
+  def tearDown(self):
+    cli.envoy = self.original_envoy
+    self.session.close()
+    shutil.rmtree(self.tmpdir)
+
+  def starts(self):
+    with open(self.starts_path) as starts:
+      return len(starts.readlines())
+
+  def test_one_process(self):
+    """Commands share one CLI process."""
+    for _ in range(3):
+      self.assertEqual(cli.parse_load(self.session.run('load'))['tchf_load'],
+                       1)
+      self.assertEqual(
+        cli.parse_noise(self.session.run('noise'))['noise_rssi_db'], -72)
+    self.assertEqual(self.starts(), 1)
+
+  def test_restart(self):
+    """A CLI that exits is restarted on the next command."""
+    self.session.retry_interval = 0
+    self.session.run('load')
+    self.assertEqual(self.session.run('exit'), 'one-shot\n')
+    self.assertIn('SDCCH', self.session.run('load'))
+    self.assertEqual(self.starts(), 2)
+
+  def test_timeout(self):
+    """A CLI that stops answering is replaced by a one-shot command."""
+    self.assertEqual(self.session.run('hang', timeout=0.5), 'one-shot\n')
+    # The session isn't retried until retry_interval has passed.
+    self.assertEqual(self.session.run('load'), 'one-shot\n')
+    self.assertEqual(self.starts(), 1)
+
+  def test_missing_cli(self):
+    """Without an interactive CLI we fall back to one-shot commands."""
+    session = CLISession(os.path.join(self.tmpdir, 'missing'))
+    self.assertEqual(session.run('load'), 'one-shot\n')
+
+  def test_cache(self):
+    """Outputs are reused within max_age."""
+    first = self.session.run('load', max_age=60)
+    self.session.close()
+    self.session.path = os.path.join(self.tmpdir, 'missing')
+    self.assertEqual(self.session.run('load', max_age=60), first)
+    time.sleep(0.01)
+    self.assertEqual(self.session.run('load', max_age=0.01), 'one-shot\n')
+
+
+class ParserTestCase(unittest.TestCase):
+  """Testing the label-matching output parsers."""
+
+  def test_load_reordered(self):
+    """Load lines are matched by label, in any order and with extra lines."""
+    with open(get_fixture_path('load.txt')) as fixture:
+      lines = fixture.read().splitlines()
+    output = '\n'.join(['WARNING: something new'] + lines[::-1])
+    self.assertEqual(cli.parse_load(output)['sdcch_available'], 4)
+    self.assertEqual(cli.parse_load(output)['gprs_utilization_percentage'],
+                     41)
+
+  def test_load_missing_field(self):
+    """A load output without all the fields is malformed."""
+    with self.assertRaises(MalformedResponseError):
+      cli.parse_load('SDCCH load/available: 2/4\n')
+
+  def test_noise_missing_field(self):
+    """A noise output without all the fields is malformed."""
+    with self.assertRaises(MalformedResponseError):
+      cli.parse_noise('noise RSSI is -72 dB wrt full scale\n')
+
+  def test_gprs_list_skips_partial_entries(self):
+    """MS entries without an IP are skipped."""
+    output = (' MS#1,TLLI=c001f001 Bytes:10up/20down\n'
+              '   GMM Context: imsi=901550000000022 IPs=192.168.99.4\n'
+              ' MS#2,TLLI=c001f002 Bytes:1up/2down\n'
+              '   GMM Context: imsi=901550000000505\n')
+    self.assertEqual(list(cli.parse_gprs_list(output)),
+                     [('IMSI901550000000022', '192.168.99.4', 10, 20)])
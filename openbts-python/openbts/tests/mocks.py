@@ -22,3 +22,15 @@ class MockEnvoy(object):
 
     def run(self, *args, **kwargs):
         return self.Response(self.return_text)
+
+
+class MockCLISession(object):
+    """Mocking the OpenBTSCLI session."""
+
+    def __init__(self, return_text):
+        self.return_text = return_text
+        self.commands = []
+
+    def run(self, command, *args, **kwargs):
+        self.commands.append(command)
+        return self.return_text
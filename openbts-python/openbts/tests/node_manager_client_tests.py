@@ -0,0 +1,159 @@
+"""Tests for the pipelined Node Manager client.
+
+Copyright (c) 2016-present, Facebook, Inc.
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree. An additional grant
+of patent rights can be found in the PATENTS file in the same directory.
+"""
+
+import json
+import threading
+import time
+import unittest
+
+import zmq
+
+from openbts.components import SIPAuthServe
+from openbts.core import BaseComponent
+from openbts.exceptions import InvalidRequestError, TimeoutError
+
+
+class NodeManagerStandIn(object):
+  """A Node Manager on a local REP socket, serving config and sip_buddies.
+
+  Reading the config key 'slow' takes SLOW_DELAY seconds.
+  """
+
+  SLOW_DELAY = 0.3
+
+  def __init__(self):
+    self.config = {'GSM.Identity.MCC': '901', 'GSM.Identity.MNC': '55',
+                   'slow': 'eventually'}
+    self.balances = {'IMSI000123': '1000', 'IMSI000456': '2000'}
+    self.requests = 0
+    self._socket = zmq.Context.instance().socket(zmq.REP)
+    self._socket.setsockopt(zmq.LINGER, 0)
+    port = self._socket.bind_to_random_port('tcp://127.0.0.1')
+    self.address = 'tcp://127.0.0.1:%d' % port
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target=self._serve)
+    self._thread.start()
+
+  def close(self):
+    self._stop.set()
+    self._thread.join()
+    self._socket.close()
+
+  def _serve(self):
+    while not self._stop.is_set():
+      if not self._socket.poll(timeout=50):
+        continue
+      message = json.loads(self._socket.recv())
+      self.requests += 1
+      self._socket.send(json.dumps(self._handle(message)).encode('utf-8'))
+
+  def _handle(self, message):
+    if message['command'] == 'config':
+      key = message['key']
+      if key not in self.config:
+        return {'code': 404}
+      if message['action'] == 'update':
+        self.config[key] = message['value']
+        return {'code': 204, 'dirty': 0}
+      if key == 'slow':
+        time.sleep(self.SLOW_DELAY)
+      return {'code': 200, 'data': {'value': self.config[key]}}
+    imsi = message['match']['name']
+    if imsi not in self.balances:
+      return {'code': 404}
+    if message['action'] == 'update':
+      self.balances[imsi] = message['fields']['account_balance']
+      return {'code': 204}
+    return {'code': 200, 'data': [{'account_balance': self.balances[imsi]}]}
+
+
+class NodeManagerClientTestCase(unittest.TestCase):
+  """Testing pipelined batches against a stand-in Node Manager."""
+
+  def setUp(self):
+    self.nm = NodeManagerStandIn()
+    self.component = BaseComponent(socket_timeout=0.1)
+    self.component.address = self.nm.address
+    self.component.socket.connect(self.nm.address)
+
+  def tearDown(self):
+    self.component._client.close()
+    self.component.socket.close()
+    self.nm.close()
+
+  def test_read_configs(self):
+    """A batch of reads returns each key's response."""
+    keys = ['GSM.Identity.MNC', 'GSM.Identity.MCC'] * 20
+    responses = self.component.read_configs(keys)
+    self.assertEqual(responses['GSM.Identity.MCC'].data['value'], '901')
+    self.assertEqual(responses['GSM.Identity.MNC'].data['value'], '55')
+    self.assertEqual(self.nm.requests, 40)
+
+  def test_update_configs(self):
+    """A batch of updates is applied."""
+    self.component.update_configs({'GSM.Identity.MCC': 1,
+                                   'GSM.Identity.MNC': '01'})
+    responses = self.component.read_configs(['GSM.Identity.MCC'])
+    self.assertEqual(responses['GSM.Identity.MCC'].data, {'value': '1'})
+    self.assertEqual(self.nm.config['GSM.Identity.MNC'], '01')
+
+  def test_error_in_batch(self):
+    """A failed request raises once the whole batch is in."""
+    with self.assertRaises(InvalidRequestError):
+      self.component.read_configs(['unknown', 'GSM.Identity.MCC'])
+    responses = self.component.read_configs(['GSM.Identity.MCC'])
+    self.assertEqual(responses['GSM.Identity.MCC'].data['value'], '901')
+
+  def test_concurrent_batches(self):
+    """Batches from several threads share the socket pool."""
+    results = []
+    def read():
+      results.append(self.component.read_configs(['GSM.Identity.MCC'] * 10))
+    threads = [threading.Thread(target=read) for _ in range(6)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(len(results), 6)
+    self.assertEqual(self.nm.requests, 60)
+    self.assertTrue(self.component._client._open <= self.component.pool_size)
+
+  def test_timeout(self):
+    """A timed out socket is dropped, and the next batch still works."""
+    with self.assertRaises(TimeoutError):
+      self.component.read_configs(['slow'])
+    self.component.socket_timeout = 1
+    self.component._client.socket_timeout = 1
+    responses = self.component.read_configs(['GSM.Identity.MCC'])
+    self.assertEqual(responses['GSM.Identity.MCC'].data['value'], '901')
+
+
+class SIPAuthServeBatchTestCase(unittest.TestCase):
+  """Testing the SIPAuthServe batch helpers."""
+
+  def setUp(self):
+    self.nm = NodeManagerStandIn()
+    self.sipauthserve = SIPAuthServe(address=self.nm.address,
+                                     socket_timeout=1)
+
+  def tearDown(self):
+    if self.sipauthserve._client is not None:
+      self.sipauthserve._client.close()
+    self.sipauthserve.socket.close()
+    self.nm.close()
+
+  def test_balances(self):
+    """Balances are read and updated in batches."""
+    self.sipauthserve.update_account_balances({'IMSI000123': '10'})
+    self.assertEqual(
+      self.sipauthserve.get_account_balances(['IMSI000123', 'IMSI000456']),
+      {'IMSI000123': '10', 'IMSI000456': '2000'})
+    with self.assertRaises(TypeError):
+      self.sipauthserve.update_account_balances({'IMSI000123': 10})
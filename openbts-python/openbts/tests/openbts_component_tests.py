@@ -14,7 +14,6 @@ import time
 import unittest
 import mock
 
-import openbts
 from openbts.components import OpenBTS
 from openbts.exceptions import InvalidRequestError
 from openbts.codes import SuccessCode
@@ -248,23 +247,17 @@ class LoadTest(unittest.TestCase):
 
   @classmethod
   def setUpClass(cls):
-    """We use envoy to call the OpenBTSCLI so we'll monkeypatch that module."""
-    cls.original_envoy = openbts.components.envoy
-    cls.mock_envoy = mocks.MockEnvoy(return_text=None)
-    openbts.components.envoy = cls.mock_envoy
+    """We replace the component's OpenBTSCLI session with a mock."""
+    cls.mock_cli = mocks.MockCLISession(return_text=None)
     cls.openbts = OpenBTS()
+    cls.openbts.cli = cls.mock_cli
     # Setup a path to the CLI output.
     cls.cli_output_path = get_fixture_path('load.txt')
 
-  @classmethod
-  def tearDownClass(cls):
-    """Repair the envoy monkeypatch."""
-    openbts.components.envoy = cls.original_envoy
-
   def test_one(self):
     """We can get load data."""
     with open(self.cli_output_path) as output:
-      self.mock_envoy.return_text = output.read()
+      self.mock_cli.return_text = output.read()
     expected = {
       'sdcch_load': 2,
       'sdcch_available': 4,
@@ -283,7 +276,7 @@ class LoadTest(unittest.TestCase):
     """We can handle gprs utilization in scientific notation."""
     cli_output_path = get_fixture_path('load_low_gprs.txt')
     with open(cli_output_path) as output:
-      self.mock_envoy.return_text = output.read()
+      self.mock_cli.return_text = output.read()
     expected = {
       'sdcch_load': 2,
       'sdcch_available': 4,
@@ -304,23 +297,17 @@ class NoiseTest(unittest.TestCase):
 
   @classmethod
   def setUpClass(cls):
-    """We use envoy to call the OpenBTSCLI so we'll monkeypatch that module."""
-    cls.original_envoy = openbts.components.envoy
-    cls.mock_envoy = mocks.MockEnvoy(return_text=None)
-    openbts.components.envoy = cls.mock_envoy
+    """We replace the component's OpenBTSCLI session with a mock."""
+    cls.mock_cli = mocks.MockCLISession(return_text=None)
     cls.openbts = OpenBTS()
+    cls.openbts.cli = cls.mock_cli
     # Setup a path to the CLI output.
     cls.cli_output_path = get_fixture_path('noise.txt')
 
-  @classmethod
-  def tearDownClass(cls):
-    """Repair the envoy monkeypatch."""
-    openbts.components.envoy = cls.original_envoy
-
   def test_one(self):
     """We can get noise data."""
     with open(self.cli_output_path) as output:
-      self.mock_envoy.return_text = output.read()
+      self.mock_cli.return_text = output.read()
     expected = {
       'noise_rssi_db': -72,
       'noise_ms_rssi_target_db': -55,
@@ -162,6 +162,19 @@ class SIPAuthServeNominalSubscriberTestCase(unittest.TestCase):
       'data': [{'exten': '5551234', 'name': 'sample'}],
       'dirty': 0
     })
+    # Batched requests go through the same mock socket, one at a time.
+    def send_and_receive_many(messages, raise_errors=True):
+      responses = []
+      for message in messages:
+        try:
+          responses.append(
+            self.sipauthserve_connection._send_and_receive(message))
+        except InvalidRequestError as e:
+          if raise_errors:
+            raise
+          responses.append(e)
+      return responses
+    self.sipauthserve_connection._send_and_receive_many = send_and_receive_many
 
   def test_get_all_subscribers(self):
     """Should send a message over zmq and get a response."""
@@ -318,25 +331,19 @@ class GPRSTest(unittest.TestCase):
 
   @classmethod
   def setUpClass(cls):
-    """We use envoy to call the OpenBTSCLI so we'll monkeypatch that module."""
-    cls.original_envoy = openbts.components.envoy
-    cls.mock_envoy = mocks.MockEnvoy(return_text=None)
-    openbts.components.envoy = cls.mock_envoy
+    """We replace the component's OpenBTSCLI session with a mock."""
+    cls.mock_cli = mocks.MockCLISession(return_text=None)
     cls.sipauthserve = SIPAuthServe()
+    cls.sipauthserve.cli = cls.mock_cli
     # Setup a path to the CLI output.
     cls.cli_output_path = get_fixture_path('gprs_list.txt')
 
-  @classmethod
-  def tearDownClass(cls):
-    """Repair the envoy monkeypatch."""
-    openbts.components.envoy = cls.original_envoy
-
   def test_gprs_disabled(self):
-    """Envoy gets an empty reply when GPRS is disabled.
+    """The CLI gets an empty reply when GPRS is disabled.
 
     This also occurs if phones are off and do not have IPs assigned.
     """
-    self.mock_envoy.return_text = '\n'
+    self.mock_cli.return_text = '\n'
     response = self.sipauthserve.get_gprs_usage()
     self.assertEqual(None, response)
     response = self.sipauthserve.get_gprs_usage(target_imsi='IMSI000123')
@@ -346,7 +353,7 @@ class GPRSTest(unittest.TestCase):
     """We can get all available GPRS connection data."""
     # The command 'gprs list' returns a big string when IPs are assigned.
     with open(self.cli_output_path) as output:
-      self.mock_envoy.return_text = output.read()
+      self.mock_cli.return_text = output.read()
     expected_usage = {
       'IMSI901550000000022': {
         'ipaddr': '192.168.99.4',
@@ -374,7 +381,7 @@ class GPRSTest(unittest.TestCase):
   def test_specific_imsi(self):
     """We can get data for a specific IMSI."""
     with open(self.cli_output_path) as output:
-      self.mock_envoy.return_text = output.read()
+      self.mock_cli.return_text = output.read()
     target_imsi = 'IMSI901550000000022'
     expected_usage = {
       'ipaddr': '192.168.99.4',
@@ -387,7 +394,7 @@ class GPRSTest(unittest.TestCase):
   def test_unknown_imsi(self):
     """Unknown IMSIs will return None."""
     with open(self.cli_output_path) as output:
-      self.mock_envoy.return_text = output.read()
+      self.mock_cli.return_text = output.read()
     target_imsi = 'IMSI000123'
     expected_usage = None
     self.assertEqual(expected_usage,
@@ -397,7 +404,7 @@ class GPRSTest(unittest.TestCase):
     """We correctly handle duplicate IMSIs in the output of gprs list."""
     path = get_fixture_path('gprs_list_duplicate_imsis.txt')
     with open(path) as output:
-      self.mock_envoy.return_text = output.read()
+      self.mock_cli.return_text = output.read()
     expected_usage = {
       'IMSI901550000000544': {
         'ipaddr': '192.168.99.1',
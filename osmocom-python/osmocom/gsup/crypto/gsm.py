@@ -8,6 +8,7 @@ of patent rights can be found in the PATENTS file in the same directory.
 """
 
 import abc
+import os
 
 from .utils import CryptoError
 
@@ -55,3 +56,39 @@ class UnsafePreComputedA3A8(GSMA3A8Algo):
         sres = key[16:20]
         cipher_key = key[20:]
         return (rand, sres, cipher_key)
+
+
+class RandomChallengeA3A8(GSMA3A8Algo):
+    """
+    Base class for the A3/A8 algos which run on the subscriber's secret key
+    (Ki), such as COMP128. A fresh random challenge is drawn for every auth
+    tuple, and subclasses only implement the algo itself in compute().
+    """
+
+    KI_LENGTH = 16
+
+    def generate_auth_tuple(self, key):
+        """
+        Args:
+            key - 16 byte long Ki
+        Returns:
+            (rand, sres, cipher_key) tuple
+        Raises:
+            CryptoError if the key is not 16 byte long
+        """
+        if len(key) != self.KI_LENGTH:
+            raise CryptoError('Invalid Ki length: %d' % len(key))
+        rand = os.urandom(16)
+        (sres, cipher_key) = self.compute(key, rand)
+        return (rand, sres, cipher_key)
+
+    @abc.abstractmethod
+    def compute(self, ki, rand):
+        """
+        Args:
+            ki - 16 byte long secret key
+            rand - 16 byte long random challenge
+        Returns:
+            (sres, cipher_key) tuple of 4 and 8 bytes
+        """
+        raise NotImplementedError()
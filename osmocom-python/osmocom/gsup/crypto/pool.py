@@ -0,0 +1,84 @@
+"""
+Copyright (c) 2016-present, Facebook, Inc.
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree. An additional grant
+of patent rights can be found in the PATENTS file in the same directory.
+"""
+
+import time
+
+from collections import deque
+
+
+class AuthTuplePool:
+    """
+    Per-subscriber pools of pre-generated GSM auth tuples, so that a burst
+    of authentications (e.g. after a site restart) is answered without
+    running the A3/A8 algo or reading the subscriber from the store.
+
+    Pools must be invalidated when the subscriber is modified or deleted
+    (the Processor does so on the store's change notifications), so that a
+    deactivated or deleted subscriber isn't handed any more tuples. A pool
+    also expires max_age seconds after it was last refilled.
+
+    The pool isn't thread safe, and should only be used from the event loop
+    thread, except for invalidate() which only takes a single dict
+    operation and can be called from a store's writing thread.
+    """
+
+    def __init__(self, size=8, max_age=300, clock=time.monotonic):
+        self._size = size
+        self._max_age = max_age
+        self._clock = clock
+        # sid -> (expiry, deque of auth tuples)
+        self._pools = {}
+
+    def take(self, sid, count):
+        """
+        Removes and returns up to count tuples from the subscriber's pool,
+        oldest first. Returns an empty list if the pool is empty or expired.
+        """
+        entry = self._pools.get(sid)
+        if entry is None:
+            return []
+        (expiry, tuples) = entry
+        if expiry < self._clock():
+            del self._pools[sid]
+            return []
+        return [tuples.popleft() for _ in range(min(count, len(tuples)))]
+
+    def missing(self, sid):
+        """
+        Returns the number of tuples needed to fill the subscriber's pool.
+        """
+        entry = self._pools.get(sid)
+        if entry is None or entry[0] < self._clock():
+            return self._size
+        return self._size - len(entry[1])
+
+    def put(self, sid, tuples):
+        """
+        Adds freshly generated tuples to the subscriber's pool, dropping the
+        oldest ones if the pool overflows.
+        """
+        entry = self._pools.get(sid)
+        if entry is None or entry[0] < self._clock():
+            pool = deque(maxlen=self._size)
+        else:
+            pool = entry[1]
+        pool.extend(tuples)
+        self._pools[sid] = (self._clock() + self._max_age, pool)
+
+    def invalidate(self, sid=None):
+        """
+        Drops the pool of the subscriber, or all the pools if sid is None.
+        """
+        if sid is None:
+            self._pools.clear()
+        else:
+            self._pools.pop(sid, None)
+
+    def __len__(self):
+        return len(self._pools)
@@ -9,6 +9,10 @@ of patent rights can be found in the PATENTS file in the same directory.
 """
 
 import abc
+import asyncio
+import logging
+
+from .store.base import SubscriberNotFoundError
 from .store.util import SIDUtils
 
 from .store.protos.subscriber_pb2 import GSMSubscription, SubscriberID
@@ -38,40 +42,232 @@ class GSMProcessor(metaclass=abc.ABCMeta):
         """
         raise NotImplementedError()
 
+    def get_gsm_auth_vector_nowait(self, imsi):
+        """
+        Returns the gsm auth tuple if it can be generated without blocking
+        the event loop. By default this is the same as get_gsm_auth_vector.
+
+        Raises:
+            SubscriberNotCachedError if get_gsm_auth_vector_async must be
+            used instead
+        """
+        return self.get_gsm_auth_vector(imsi)
+
+    def get_gsm_auth_vectors_nowait(self, imsi):
+        """
+        Returns a list of one or more gsm auth tuples, to be sent together
+        in one response. By default this is the one tuple returned by
+        get_gsm_auth_vector_nowait.
+
+        Raises:
+            SubscriberNotCachedError if get_gsm_auth_vectors_async must be
+            used instead
+        """
+        return [self.get_gsm_auth_vector_nowait(imsi)]
+
+    async def get_gsm_auth_vectors_async(self, imsi):
+        """
+        Coroutine version of get_gsm_auth_vectors_nowait.
+        """
+        return [await self.get_gsm_auth_vector_async(imsi)]
+
+    async def get_gsm_auth_vector_async(self, imsi):
+        """
+        Coroutine version of get_gsm_auth_vector, for lookups that
+        get_gsm_auth_vector_nowait can't answer.
+        """
+        return self.get_gsm_auth_vector(imsi)
+
+
 class Processor(GSMProcessor):
     """
     Core class which glues together all protocols, crypto algorithms and
     subscriber stores.
     """
 
-    def __init__(self, store):
+    def __init__(self, store, algos=None, pool=None, vectors_per_request=1,
+                 loop=None):
         """
         Init the Processor with all the components.
 
         We use the UnsafePreComputedA3A8 crypto by default for
         GSM authentication. This requires the auth-tuple to be stored directly
-        in the store as the key for the subscriber.
+        in the store as the key for the subscriber. Precomputed tuples are
+        handed out in rotation.
+
+        Args:
+            store: the subscriber store
+            algos: map of GSMSubscription.GSMAuthAlgo to the GSMA3A8Algo
+                implementing it, added to the precomputed algo
+            pool: optional AuthTuplePool. Auth requests from the event loop
+                are then answered from the pool, which is refilled in the
+                background. Stores that support add_change_listener()
+                invalidate the pool of a subscriber when it is modified or
+                deleted.
+            vectors_per_request: number of auth tuples sent in each
+                SEND_AUTH_INFO response
+            loop: the event loop the pool is used from, by default the
+                current one. Store changes, which may be made on any thread,
+                are applied to the pool on this loop.
         """
         self._store = store
+        self._algos = {
+            GSMSubscription.PRECOMPUTED_AUTH_TUPLES: UnsafePreComputedA3A8(),
+        }
+        self._algos.update(algos or {})
+        self._pool = pool
+        self._vectors_per_request = vectors_per_request
+        # sid -> index of the next precomputed tuple to hand out
+        self._rotation = {}
+        self._refilling = set()
+        # Bumped on every store change, so that a refill which read the
+        # subscriber before the change doesn't put stale tuples in the pool
+        self._changes = 0
+        if pool is not None and hasattr(store, 'add_change_listener'):
+            loop = loop or asyncio.get_event_loop()
+            store.add_change_listener(
+                lambda sid: loop.call_soon_threadsafe(
+                    self._subscriber_changed, sid))
 
     def get_gsm_auth_vector(self, imsi):
         """
         Returns the gsm auth tuple for the subsciber by querying the store
         for the crypto algo and secret keys.
         """
-        sid = SIDUtils.to_str(SubscriberID(id=imsi, type=SubscriberID.IMSI))
+        sid = self._to_sid(imsi)
         subs = self._store.get_subscriber_data(sid)
+        return self._gen_auth_tuples(sid, subs, 1)[0]
+
+    def get_gsm_auth_vector_nowait(self, imsi):
+        """
+        Stores that can block (see AsyncStore) only answer from memory here.
+        """
+        return self._get_auth_vectors_nowait(imsi, 1)[0]
+
+    async def get_gsm_auth_vector_async(self, imsi):
+        return (await self._get_auth_vectors_async(imsi, 1))[0]
 
+    def get_gsm_auth_vectors_nowait(self, imsi):
+        return self._get_auth_vectors_nowait(imsi, self._vectors_per_request)
+
+    async def get_gsm_auth_vectors_async(self, imsi):
+        return await self._get_auth_vectors_async(
+            imsi, self._vectors_per_request)
+
+    async def warm_up(self, sids=None):
+        """
+        Fills the auth tuple pools of the subscribers, or of all the
+        subscribers in the store if sids is None.
+        """
+        if self._pool is None:
+            return
+        if sids is None:
+            sids = self._store.list_subscribers()
+        for (i, sid) in enumerate(sids):
+            if i % 100 == 0:
+                # Let the auth requests in meanwhile
+                await asyncio.sleep(0)
+            if sid not in self._refilling:
+                self._refilling.add(sid)
+                await self._refill(sid)
+
+    def _get_auth_vectors_nowait(self, imsi, count):
+        sid = self._to_sid(imsi)
+        vectors = self._take_from_pool(sid, count)
+        if vectors:
+            return vectors
+        get_subscriber_data = getattr(self._store, 'get_subscriber_data_nowait',
+                                      self._store.get_subscriber_data)
+        return self._gen_auth_tuples(sid, get_subscriber_data(sid), count)
+
+    async def _get_auth_vectors_async(self, imsi, count):
+        sid = self._to_sid(imsi)
+        vectors = self._take_from_pool(sid, count)
+        if vectors:
+            return vectors
+        subs = await self._get_subscriber_data_async(sid)
+        return self._gen_auth_tuples(sid, subs, count)
+
+    async def _get_subscriber_data_async(self, sid):
+        if hasattr(self._store, 'get_subscriber_data_async'):
+            return await self._store.get_subscriber_data_async(sid)
+        return self._store.get_subscriber_data(sid)
+
+    def _take_from_pool(self, sid, count):
+        """
+        Takes up to count tuples from the pool, and schedules a refill of
+        the pool if it is running low.
+        """
+        if self._pool is None:
+            return []
+        vectors = self._pool.take(sid, count)
+        if sid not in self._refilling and self._pool.missing(sid) >= count:
+            self._refilling.add(sid)
+            asyncio.ensure_future(self._refill(sid))
+        return vectors
+
+    async def _refill(self, sid):
+        """
+        Generates the tuples missing from the subscriber's pool. Algos other
+        than the precomputed one run on the default executor, so that they
+        don't stall the event loop.
+        """
+        changes = self._changes
+        try:
+            subs = await self._get_subscriber_data_async(sid)
+            (algo, keys) = self._auth_keys(sid, subs, self._pool.missing(sid))
+            if subs.gsm.auth_algo == GSMSubscription.PRECOMPUTED_AUTH_TUPLES:
+                tuples = self._run_algo(algo, keys)
+            else:
+                tuples = await asyncio.get_event_loop().run_in_executor(
+                    None, self._run_algo, algo, keys)
+            if changes == self._changes:
+                self._pool.put(sid, tuples)
+        except (CryptoError, SubscriberNotFoundError) as err:
+            # Don't keep handing out tuples of a subscriber that is gone
+            logging.info("Not refilling auth tuples for %s: %s", sid, err)
+            self._pool.invalidate(sid)
+        finally:
+            self._refilling.discard(sid)
+
+    def _subscriber_changed(self, sid):
+        self._changes += 1
+        self._pool.invalidate(sid)
+
+    @staticmethod
+    def _to_sid(imsi):
+        return SIDUtils.to_str(SubscriberID(id=imsi, type=SubscriberID.IMSI))
+
+    def _gen_auth_tuples(self, sid, subs, count):
+        (algo, keys) = self._auth_keys(sid, subs, count)
+        return self._run_algo(algo, keys)
+
+    @staticmethod
+    def _run_algo(algo, keys):
+        return [algo.generate_auth_tuple(key) for key in keys]
+
+    def _auth_keys(self, sid, subs, count):
+        """
+        Returns the algo and the list of count keys to run it on, rotating
+        through the precomputed tuples of the subscriber.
+        """
         if subs.gsm.state != GSMSubscription.ACTIVE:
             raise CryptoError("GSM service not active for %s" % sid)
 
-        # The only GSM crypto algo we support now
-        if subs.gsm.auth_algo != GSMSubscription.PRECOMPUTED_AUTH_TUPLES:
+        algo = self._algos.get(subs.gsm.auth_algo)
+        if algo is None:
             raise CryptoError("Unknown crypto (%s) for %s" %
                               (subs.gsm.auth_algo, sid))
-        gsm_crypto = UnsafePreComputedA3A8()
 
-        if len(subs.gsm.auth_tuples) == 0:
-            raise CryptoError("Auth key not present for %s" % sid)
+        if subs.gsm.auth_algo != GSMSubscription.PRECOMPUTED_AUTH_TUPLES:
+            if not subs.gsm.auth_key:
+                raise CryptoError("Auth key not present for %s" % sid)
+            return (algo, [subs.gsm.auth_key] * count)
 
-        return gsm_crypto.generate_auth_tuple(subs.gsm.auth_tuples[0])
+        tuples = subs.gsm.auth_tuples
+        if len(tuples) == 0:
+            raise CryptoError("Auth key not present for %s" % sid)
+        start = self._rotation.get(sid, 0) % len(tuples)
+        self._rotation[sid] = (start + count) % len(tuples)
+        return (algo, [tuples[(start + i) % len(tuples)]
+                       for i in range(count)])
@@ -7,13 +7,15 @@ LICENSE file in the root directory of this source tree. An additional grant
 of patent rights can be found in the PATENTS file in the same directory.
 """
 
+import asyncio
 import logging
+import re
 import struct
 
 from enum import IntEnum, unique
 
 from ..crypto.utils import CryptoError
-from ..store.base import SubscriberNotFoundError
+from ..store.base import SubscriberNotCachedError, SubscriberNotFoundError
 
 
 @unique
@@ -75,6 +77,27 @@ class ErrorCauseType(IntEnum):
     PROTOCOL_ERR = 0x6f
 
 
+# Lookup tables, so that decoding doesn't call the IntEnum constructors
+_MSG_TYPES = {int(msg_type): msg_type for msg_type in MsgType}
+_IE_TYPES = {int(ie_type): ie_type for ie_type in IEType}
+
+# Precompiled layouts of the fixed size IEs
+_AUTH_TUPLE = struct.Struct('2B16s2B4s2B8s')
+_PDP_INFO_ANY_APN = struct.pack(
+    '11B',
+    IEType.PDP_CONTEXT_ID, 1, 1,
+    IEType.PDP_TYPE, 2, 0x1, 0x21,
+    IEType.APN_NAME, 2, 1, 0x2A)
+
+# The (up to) two IMSI digits encoded in each byte value
+_IMSI_DIGITS = [str(byt & 0x0f) + ('' if byt >> 4 == 0x0f
+                                   else str(byt >> 4 & 0x0f))
+                for byt in range(256)]
+
+# IMSIs are ASCII digits; str.isdigit() also accepts other scripts' digits
+_IMSI_RE = re.compile(r'^[0-9]+$')
+
+
 class GSUPCodecError(Exception):
     """
     Exception class used for encoder or decoder errors.
@@ -129,31 +152,23 @@ class InformationElement:
         If the length is odd, then the last bytes is encoded as
             1111, Last digit: 4-7 bits
         """
-        imsi = ""
-        byt = 0
-        for byt in val:
-            imsi += str(byt & 0x0f)
-            if (byt >> 4) != 0x0f:
-                imsi += str(byt >> 4 & 0x0f)
-        return imsi
+        return ''.join([_IMSI_DIGITS[byt] for byt in val])
 
     @staticmethod
     def encode_imsi(val, buf, offset, min_len, max_len):
         """
         Encode the string IMSI into bytes.
         """
-        if not val.isdigit():
+        if not _IMSI_RE.match(val):
             raise GSUPCodecError("IMSI has non-digits: %s" % val)
         length = int((len(val)+1)/2)  # round down for odd
         if length < min_len or length > max_len:
             raise GSUPCodecError("Invalid IMSI length: %s" % val)
-        for i in range(length):
-            digit1 = int(val[2*i]) & 0x0f
-            if 2*i+1 < len(val):
-                digit2 = (int(val[2*i+1]) << 4) & 0xf0
-            else:
-                digit2 = 0xf0
-            buf[offset + i] = digit1 | digit2
+        if len(val) % 2:
+            val += 'f'
+        # Swap the digits of each pair, and let fromhex pack the nibbles
+        buf[offset:offset + length] = bytes.fromhex(
+            ''.join(map(''.join, zip(val[1::2], val[::2]))))
         return length
 
     @staticmethod
@@ -200,8 +215,7 @@ class InformationElement:
         Returns:
             Map containing (rand, sres, kc) elements
         """
-        (_, _, rand, _, _, sres, _, _, key) = struct.unpack(
-            '2B16s2B4s2B8s', val)
+        (_, _, rand, _, _, sres, _, _, key) = _AUTH_TUPLE.unpack(val)
         return (rand, sres, key)
 
     @staticmethod
@@ -220,8 +234,8 @@ class InformationElement:
             raise GSUPCodecError(
                 "Bad auth tuple to encode: rand: %s, sres: %s, key: %s"
                 % (rand, sres, key))
-        struct.pack_into(
-            '2B16s2B4s2B8s', buf, offset,
+        _AUTH_TUPLE.pack_into(
+            buf, offset,
             IEType.RAND, 16, rand, IEType.SRES, 4, sres,
             IEType.KC_KEY, 8, key)
         return 34
@@ -233,12 +247,7 @@ class InformationElement:
         Encode the PDP info. By default we just encode the APN
         as '*' for the subscriber to allow all APNs.
         """
-        fmt = '11B'
-        struct.pack_into(
-            fmt, buf, offset,
-            IEType.PDP_CONTEXT_ID, 1, 1,
-            IEType.PDP_TYPE, 2, 0x1, 0x21,
-            IEType.APN_NAME, 2, 1, 0x2A)
+        buf[offset:offset + 11] = _PDP_INFO_ANY_APN
         return 11
 
 
@@ -283,6 +292,11 @@ class GPRSSubcriberUpdateProtocol:
             MsgType.INSERT_SUBS_DATA_RES:
                 [(IEType.IMSI, IEPresence.MANDATORY)],
             }
+        # _mandatory_ies contains the IEs to validate for each message type
+        self._mandatory_ies = {
+            msg_type: tuple(ie_type for (ie_type, presence) in msg_ies
+                            if presence == IEPresence.MANDATORY)
+            for (msg_type, msg_ies) in self._msg_fmts.items()}
         # _ie_fmts contains the info to encode/decode an IE
         # ietype: InformationElement(
         #    min length, max length,
@@ -332,36 +346,45 @@ class GPRSSubcriberUpdateProtocol:
         if len(msg) == 0:
             raise GSUPCodecError("Zero length GSUP msg")
 
-        if msg[0] not in self._msg_fmts:
+        msg_type = _MSG_TYPES.get(msg[0])
+        if msg_type is None:
             raise GSUPCodecError("Unknown GSUP msg: %s" % msg.tobytes())
-        msg_type = MsgType(msg[0])
 
         ies = {}
         offset = 1
-        while (offset + 1) < len(msg):  # type and length available
+        msg_len = len(msg)
+        while (offset + 1) < msg_len:  # type and length available
             ie_length = msg[offset + 1]
-            if msg[offset] not in self._ie_fmts:
+            ie_fmt = self._ie_fmts.get(msg[offset])
+            if ie_fmt is None:
                 logging.warning("Unknown IE: 0x%x, GSUP msg: %s",
                                 msg[offset], msg.tobytes())
                 # Optional IEs could be ignored. We would validate for
                 # absence of mandatory IEs later.
                 offset += ie_length + 2
                 continue
-            ie_type = IEType(msg[offset])
+            ie_type = _IE_TYPES[msg[offset]]
             offset += 2
 
-            if (offset + ie_length) > len(msg):
+            if (offset + ie_length) > msg_len:
                 raise GSUPCodecError(
                     "Invalid IE length: %d, name: %s, GSUP msg: %s"
                     % (ie_length, ie_type, msg.tobytes()))
 
-            ies[ie_type] = self._ie_fmts[ie_type].decode(
-                msg[offset:offset+ie_length])
+            val = ie_fmt.decode(msg[offset:offset+ie_length])
+            if ie_type not in ies:
+                ies[ie_type] = val
+            elif isinstance(ies[ie_type], list):
+                ies[ie_type].append(val)
+            else:
+                # Repeated IE, such as the AUTH_TUPLEs of SEND_AUTH_INFO_RSP
+                ies[ie_type] = [ies[ie_type], val]
             offset += ie_length
 
         self._validate_msg(msg_type, ies)
 
-        logging.debug("Received GSUP msg: > %s, IEs: %s", msg_type, ies)
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("Received GSUP msg: > %s, IEs: %s", msg_type, ies)
         return (msg_type, ies)
 
     def get_max_bytes(self, ies):
@@ -374,8 +397,9 @@ class GPRSSubcriberUpdateProtocol:
             Size
         """
         size = 1
-        for (ie_type, _) in ies.items():
-            size += self._ie_fmts[ie_type].max_length + 2
+        for (ie_type, ie_val) in ies.items():
+            count = len(ie_val) if isinstance(ie_val, list) else 1
+            size += (self._ie_fmts[ie_type].max_length + 2) * count
         return size
 
     def encode(self, buf, offset, msg_type, ies):
@@ -388,13 +412,15 @@ class GPRSSubcriberUpdateProtocol:
             buf (memoryview): Output buffer
             offset (int): starts the encoding at offset in buf
             msg_type (MsgType): as the name implies
-            ies (map): IEType -> val map
+            ies (map): IEType -> val map. IEs which are repeated in the
+                msg, such as several AUTH_TUPLEs, are given as a list of vals.
         Returns:
             Encoded size.
         Raises:
             GSUPCodecError on failure.
         """
-        logging.debug("Encoding GSUP msg: < %s, IEs: %s", msg_type, ies)
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("Encoding GSUP msg: < %s, IEs: %s", msg_type, ies)
 
         self._validate_msg(msg_type, ies)
 
@@ -402,10 +428,14 @@ class GPRSSubcriberUpdateProtocol:
         offset += 1
 
         for (ie_type, ie_val) in ies.items():
-            buf[offset] = ie_type
-            ie_len = self._ie_fmts[ie_type].encode(ie_val, buf, offset + 2)
-            buf[offset + 1] = ie_len
-            offset += 2 + ie_len
+            ie_fmt = self._ie_fmts[ie_type]
+            if not isinstance(ie_val, list):
+                ie_val = (ie_val, )
+            for val in ie_val:
+                buf[offset] = ie_type
+                ie_len = ie_fmt.encode(val, buf, offset + 2)
+                buf[offset + 1] = ie_len
+                offset += 2 + ie_len
         return offset
 
     def _validate_msg(self, msg_type, ies_present):
@@ -418,9 +448,8 @@ class GPRSSubcriberUpdateProtocol:
         Returns:
             bool: True if msg is valid
         """
-        msg_ies = self._msg_fmts[msg_type]
-        for (ie_type, presence) in msg_ies:
-            if presence == IEPresence.MANDATORY and ie_type not in ies_present:
+        for ie_type in self._mandatory_ies[msg_type]:
+            if ie_type not in ies_present:
                 raise GSUPCodecError(
                     "Mandatory IE (%s) not present in msg: %s"
                     % (ie_type, msg_type))
@@ -492,23 +521,48 @@ class GSUPManager:
 
     def _msg_send_auth_info_req(self, req_ies):
         imsi = req_ies[IEType.IMSI]
-        resp_ies = {IEType.IMSI: imsi}
+        try:
+            auth_tuples = \
+                self._gsm_processor.get_gsm_auth_vectors_nowait(imsi)
+        except SubscriberNotCachedError:
+            # Don't hold up the other peers while the store is read.
+            asyncio.ensure_future(self._send_auth_info_async(imsi))
+        except (CryptoError, SubscriberNotFoundError) as err:
+            self._send_auth_info_err(imsi, err)
+        else:
+            self._send_auth_info_rsp(imsi, auth_tuples)
 
+    async def _send_auth_info_async(self, imsi):
         try:
-            (rand, sres, key) = self._gsm_processor.get_gsm_auth_vector(imsi)
-        except CryptoError as err:
+            auth_tuples = \
+                await self._gsm_processor.get_gsm_auth_vectors_async(imsi)
+        except (CryptoError, SubscriberNotFoundError) as err:
+            self._send_auth_info_err(imsi, err)
+        except Exception as err:  # pylint: disable=broad-except
+            # Nothing awaits this task, so answer the peer rather than leave
+            # its request hanging.
+            logging.exception("Auth info lookup failed for %s", imsi)
+            self._send_auth_info_err(imsi, err)
+        else:
+            self._send_auth_info_rsp(imsi, auth_tuples)
+
+    def _send_auth_info_err(self, imsi, err):
+        resp_ies = {IEType.IMSI: imsi}
+        if isinstance(err, CryptoError):
             logging.error("Auth error for %s: %s", imsi, err)
             resp_ies[IEType.CAUSE] = ErrorCauseType.NETWORK_FAILURE
-            self.send_msg(MsgType.SEND_AUTH_INFO_ERR, resp_ies)
-        except SubscriberNotFoundError:
+        elif isinstance(err, SubscriberNotFoundError):
             logging.warning("Auth error for %s: subscriber not found", imsi)
             resp_ies[IEType.CAUSE] = ErrorCauseType.IMSI_UNKNOWN
-            self.send_msg(MsgType.SEND_AUTH_INFO_ERR, resp_ies)
         else:
-            # All good. Send the Auth Info Response.
-            logging.info("Successful auth for %s", imsi)
-            resp_ies[IEType.AUTH_TUPLE] = (rand, sres, key)
-            self.send_msg(MsgType.SEND_AUTH_INFO_RSP, resp_ies)
+            resp_ies[IEType.CAUSE] = ErrorCauseType.NETWORK_FAILURE
+        self.send_msg(MsgType.SEND_AUTH_INFO_ERR, resp_ies)
+
+    def _send_auth_info_rsp(self, imsi, auth_tuples):
+        # All good. Send the Auth Info Response.
+        logging.info("Successful auth for %s", imsi)
+        resp_ies = {IEType.IMSI: imsi, IEType.AUTH_TUPLE: auth_tuples}
+        self.send_msg(MsgType.SEND_AUTH_INFO_RSP, resp_ies)
 
     # pylint: disable=no-self-use
     def _msg_auth_failure_report(self, req_ies):
@@ -23,6 +23,13 @@ from . import gsup
 
 # IPA Misc
 IPA_HEADER_LEN = 3
+IPA_HEADER = struct.Struct('!HB')
+
+# Initial size of the read buffer of a connection, and the size of the
+# reusable send buffers of an IPAWriter. Larger messages get their own.
+IPA_READ_BUF_SIZE = 64 * 1024
+IPA_WRITE_BUF_SIZE = 512
+IPA_MAX_FREE_WRITE_BUFS = 4
 
 # IPA Stream ID
 IPA_STREAM_CCM = 0xfe
@@ -78,7 +85,11 @@ class OsmoIPAccessProtocol(asyncio.Protocol, ABC):
     def __init__(self, gsup_callback=None, ctrl_callback=None):
         self._gsup_callback = gsup_callback
         self._ctrl_callback = ctrl_callback
-        self._readbuf = bytearray()
+        # Ring of received bytes: [_read_start, _read_end) are unparsed
+        self._readbuf = bytearray(IPA_READ_BUF_SIZE)
+        self._readview = memoryview(self._readbuf)
+        self._read_start = 0
+        self._read_end = 0
 
     def connection_made(self, transport):
         """
@@ -109,6 +120,11 @@ class OsmoIPAccessProtocol(asyncio.Protocol, ABC):
         Unparsed bytes will be left in readbuf and will be parsed when
         more data is received in the future.
 
+        The readbuf is reused for the lifetime of the connection: the
+        unparsed tail is only moved to the front when the new data doesn't
+        fit after it. The payload memoryviews handed to the managers are
+        therefore only valid during the call.
+
         Strips away outer headers of the IPA packet:
         - payload length
         - IPA Stream ID
@@ -119,21 +135,27 @@ class OsmoIPAccessProtocol(asyncio.Protocol, ABC):
         Returns:
             None
         """
-        logging.debug("Bytes read: %s", data)
-        self._readbuf.extend(data)
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("Bytes read: %s", data)
+        if self._read_end + len(data) > len(self._readbuf):
+            self._compact_readbuf(len(data))
+        end = self._read_end + len(data)
+        self._readbuf[self._read_end:end] = data
+        self._read_end = end
 
         # Use memoryview to prevent copies when slicing
-        memview = memoryview(self._readbuf)
-        remain = len(memview)
-        begin = 0  # beginning of message
+        memview = self._readview
+        begin = self._read_start  # beginning of message
+        remain = end - begin
 
         while remain >= IPA_HEADER_LEN:
             # Parse the header
-            (payload_len, ipa_stream_id) = struct.unpack_from('!HB', memview, begin)
+            (payload_len, ipa_stream_id) = IPA_HEADER.unpack_from(memview,
+                                                                  begin)
             msg_len = IPA_HEADER_LEN + payload_len
             if remain < msg_len:
                 # Need more data for the payload
-                return
+                break
 
             # Handle the IPA message
             payload = memview[(begin + IPA_HEADER_LEN):(begin + msg_len)]
@@ -149,8 +171,27 @@ class OsmoIPAccessProtocol(asyncio.Protocol, ABC):
             begin += msg_len
             remain -= msg_len
 
-        # Get the unparsed bytes
-        self._readbuf = bytearray(memview[begin:])
+        if begin == end:
+            # Everything parsed, start over at the front
+            self._read_start = self._read_end = 0
+        else:
+            self._read_start = begin
+
+    def _compact_readbuf(self, incoming):
+        """
+        Make room for incoming bytes after the unparsed ones, by moving the
+        unparsed bytes to the front of the readbuf, or to a larger readbuf
+        if they wouldn't fit.
+        """
+        unparsed = self._readview[self._read_start:self._read_end].tobytes()
+        if len(unparsed) + incoming > len(self._readbuf):
+            # Leave the old buffer to any views still held on it
+            self._readbuf = bytearray(
+                max(2 * len(self._readbuf), len(unparsed) + incoming))
+            self._readview = memoryview(self._readbuf)
+        self._readbuf[:len(unparsed)] = unparsed
+        self._read_start = 0
+        self._read_end = len(unparsed)
 
     @abstractmethod
     def connection_lost(self, exc):
@@ -278,6 +319,9 @@ class IPAWriter:
     """
     IPAWriter prepends the appropriate IPA header for higher layer protocols.
     The writer is inited with specific header elements (stream id, etc.)
+
+    Write buffers are taken from a small pool of preallocated buffers, and
+    go back to the pool once the transport is done with them.
     """
 
     def __init__(self, transport, stream_id, osmo_extn=None):
@@ -287,6 +331,10 @@ class IPAWriter:
         self._header_len = IPA_HEADER_LEN
         if self._osmo_extn is not None:  # occupies one more byte
             self._header_len += 1
+            self._header = struct.Struct('!HBB')
+        else:
+            self._header = IPA_HEADER
+        self._free_bufs = []
 
     def get_write_buf(self, length):
         """
@@ -299,7 +347,15 @@ class IPAWriter:
         Returns:
             memoryview: Allocated buf of header + length bytes.
         """
-        buf = memoryview(bytearray(length + self._header_len))
+        size = length + self._header_len
+        if size <= IPA_WRITE_BUF_SIZE:
+            if self._free_bufs:
+                buf = self._free_bufs.pop()
+            else:
+                buf = memoryview(bytearray(IPA_WRITE_BUF_SIZE))
+            buf = buf[:size]
+        else:
+            buf = memoryview(bytearray(size))
         self.reset_length(buf, length)
         return buf, self._header_len
 
@@ -315,14 +371,27 @@ class IPAWriter:
             None
         """
         if self._osmo_extn is not None:  # Ctrl extn is 0x00
-            struct.pack_into('!HBB', buf, 0, length + 1,
-                             self._stream_id, self._osmo_extn)
+            self._header.pack_into(buf, 0, length + 1,
+                                   self._stream_id, self._osmo_extn)
         else:
-            struct.pack_into('!HB', buf, 0, length, self._stream_id)
+            self._header.pack_into(buf, 0, length, self._stream_id)
 
     def write(self, buf):
-        """ Write the buffer to the underlying socket """
+        """
+        Write the buffer to the underlying socket. A buffer from the pool
+        is reused once written, unless the transport had to queue it: some
+        transports keep a reference instead of copying.
+        """
         self._transport.write(buf)
+        pool_buf = getattr(buf, 'obj', None)
+        if (pool_buf is None or len(pool_buf) != IPA_WRITE_BUF_SIZE or
+                len(self._free_bufs) >= IPA_MAX_FREE_WRITE_BUFS):
+            return
+        try:
+            if self._transport.get_write_buffer_size() == 0:
+                self._free_bufs.append(memoryview(pool_buf))
+        except NotImplementedError:
+            pass
 
 
 class IPAConnectionManager:
@@ -430,11 +499,13 @@ class OsmoCtrlManager:
         self._ctrl_callback.process_response(response)
 
     @staticmethod
-    def generate_msg(var, val=None):
+    def generate_msg(var, val=None, msg_id=None):
         """
         Generate SET/GET command message: returns (msg_id, cmd).
+        A random message ID is used unless msg_id is given.
         """
-        msg_id = random.randint(10000, 20000)
+        if msg_id is None:
+            msg_id = random.randint(10000, 20000)
         if val is not None:
             return msg_id, "%s %s %s %s" % (SET_CMD, msg_id, var, val)
         return msg_id, "%s %s %s" % (GET_CMD, msg_id, var)
@@ -443,13 +514,11 @@ class OsmoCtrlManager:
         """
         Encodes and sends the message to the IPA layer.
         """
-        buf_size = len(message)
+        data = message.encode('utf-8')
         # offset accounts for header_len
-        (buf, offset) = self._ipa_writer.get_write_buf(buf_size)
+        (buf, offset) = self._ipa_writer.get_write_buf(len(data))
 
-        msg_byte_list = memoryview(bytearray(message.encode('utf-8'))).tolist()
-        for i, byte in enumerate(msg_byte_list):
-            buf[offset+i] = byte
+        buf[offset:offset + len(data)] = data
 
         # Write the encoded msg
         self._ipa_writer.write(buf)
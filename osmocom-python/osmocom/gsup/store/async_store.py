@@ -0,0 +1,242 @@
+"""
+Copyright (c) 2016-present, Facebook, Inc.
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree. An additional grant
+of patent rights can be found in the PATENTS file in the same directory.
+"""
+
+import asyncio
+import logging
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .util import SIDUtils
+
+from .base import DuplicateSubscriberError, SubscriberNotFoundError
+from .base import SubscriberNotCachedError
+
+
+class AsyncStore:
+    """
+    A subscriber store for use from an asyncio event loop, such as the one
+    running the GSUP server.
+
+    Reads are served from an in-memory index of all the subscribers, which
+    is loaded when the store is created. The index is only modified from the
+    event loop thread, so lookups need no locking. Everything that touches
+    the persistent store runs on a single dedicated executor thread, so a
+    slow disk never stalls the event loop:
+
+    - lookups that miss the index are read from the persistent store
+    - updates and deletes are applied to the index immediately, queued, and
+      written to the persistent store in batches: all the writes that are
+      queued while a batch is being written go out together in the next
+      transaction
+
+    Subscriber data returned by the store is shared with the index, and must
+    not be modified by the caller.
+
+    Prerequisite: persistent_store must support write_subscribers() (see
+    SqliteStore), and must be usable from the executor thread (for sqlite,
+    use a file or a shared-cache memory database).
+    """
+
+    def __init__(self, persistent_store):
+        self._persistent_store = persistent_store
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        # sid -> SubscriberData, or None for a pending delete
+        self._pending = OrderedDict()
+        self._waiters = []
+        self._flushing = False
+        self._index = self._executor.submit(self._read_all).result()
+        self._change_listeners = []
+
+    def close(self):
+        """
+        Stops the executor thread, after writing any batch in progress.
+        Writes that are still queued are dropped; await flush() first.
+        """
+        self._executor.shutdown(wait=True)
+
+    def add_change_listener(self, listener):
+        """
+        Registers listener to be called with the subscriber id as soon as a
+        subscriber is modified or deleted, or with None after a resync.
+        Listeners run on the event loop thread.
+        """
+        self._change_listeners.append(listener)
+
+    def get_subscriber_data_nowait(self, subscriber_id):
+        """
+        Returns the subscriber data for the subscriber from memory.
+
+        Raises:
+            SubscriberNotFoundError if the subscriber is being deleted
+            SubscriberNotCachedError if the subscriber is not in memory
+        """
+        data = self._index.get(subscriber_id)
+        if data is not None:
+            return data
+        if subscriber_id in self._pending:
+            raise SubscriberNotFoundError(subscriber_id)
+        raise SubscriberNotCachedError(subscriber_id)
+
+    async def get_subscriber_data_async(self, subscriber_id):
+        """
+        Returns the subscriber data for the subscriber, reading it from the
+        persistent store if it is not in memory.
+
+        Raises:
+            SubscriberNotFoundError if the subscriber is not present
+        """
+        try:
+            return self.get_subscriber_data_nowait(subscriber_id)
+        except SubscriberNotCachedError:
+            pass
+        data = await asyncio.get_event_loop().run_in_executor(
+            self._executor, self._persistent_store.get_subscriber_data,
+            subscriber_id)
+        # Don't clobber anything written while we were reading.
+        if subscriber_id in self._pending:
+            return self.get_subscriber_data_nowait(subscriber_id)
+        return self._index.setdefault(subscriber_id, data)
+
+    def get_subscriber_data(self, subscriber_id):
+        """
+        Blocking lookup, for callers outside the event loop.
+        """
+        try:
+            return self.get_subscriber_data_nowait(subscriber_id)
+        except SubscriberNotCachedError:
+            return self._executor.submit(
+                self._persistent_store.get_subscriber_data,
+                subscriber_id).result()
+
+    def list_subscribers(self):
+        """
+        Method that returns the list of subscribers in memory.
+        """
+        return list(self._index)
+
+    async def add_subscriber(self, subscriber_data):
+        """
+        Method that adds the subscriber. Additions are not batched so that
+        duplicates are reported by the persistent store.
+
+        Raises:
+            DuplicateSubscriberError if the subscriber is already present
+        """
+        sid = SIDUtils.to_str(subscriber_data.sid)
+        if sid in self._index:
+            raise DuplicateSubscriberError(sid)
+        # Order the addition after any queued writes for the same sid.
+        await self.flush()
+        await asyncio.get_event_loop().run_in_executor(
+            self._executor, self._persistent_store.add_subscriber,
+            subscriber_data)
+        self._index[sid] = subscriber_data
+
+    async def update_subscriber(self, subscriber_data):
+        """
+        Method that updates the subscriber. The update is visible to readers
+        immediately, and the coroutine completes once it has been written.
+
+        Raises:
+            SubscriberNotFoundError if the subscriber is not present
+        """
+        sid = SIDUtils.to_str(subscriber_data.sid)
+        # Make sure the subscriber exists, reading it in if needed.
+        await self.get_subscriber_data_async(sid)
+        self._index[sid] = subscriber_data
+        self._notify_change(sid)
+        await self._queue_write(sid, subscriber_data)
+
+    async def delete_subscriber(self, subscriber_id):
+        """
+        Method that deletes a subscriber, if present.
+        """
+        self._index.pop(subscriber_id, None)
+        self._notify_change(subscriber_id)
+        await self._queue_write(subscriber_id, None)
+
+    async def resync(self, subscribers):
+        """
+        Method that resyncs the store with the mentioned list of
+        subscribers, leaving the current state of subscribers intact.
+        """
+        await self.flush()
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(
+            self._executor, self._persistent_store.resync, subscribers)
+        self._index = await loop.run_in_executor(
+            self._executor, self._read_all)
+        self._notify_change()
+
+    async def flush(self):
+        """
+        Waits until all the queued writes have been written.
+        """
+        if self._pending or self._flushing:
+            waiter = asyncio.Future()
+            self._waiters.append(waiter)
+            if not self._flushing:
+                self._start_flush()
+            await waiter
+
+    async def _queue_write(self, subscriber_id, data):
+        self._pending[subscriber_id] = data
+        self._pending.move_to_end(subscriber_id)
+        await self.flush()
+
+    def _start_flush(self):
+        """
+        Hands the queued writes to the executor as one batch. Writes queued
+        while the batch is being written wait for the next batch.
+        """
+        batch = list(self._pending.items())
+        waiters = self._waiters
+        self._pending = OrderedDict()
+        self._waiters = []
+        self._flushing = True
+        future = asyncio.get_event_loop().run_in_executor(
+            self._executor, self._persistent_store.write_subscribers, batch)
+        future.add_done_callback(
+            lambda f: self._flush_done(f, batch, waiters))
+
+    def _flush_done(self, future, batch, waiters):
+        exc = future.exception()
+        if exc is not None:
+            logging.error("Failed to write %d subscribers: %s",
+                          len(batch), exc)
+        for waiter in waiters:
+            if waiter.done():
+                continue
+            if exc is not None:
+                waiter.set_exception(exc)
+            else:
+                waiter.set_result(None)
+        self._flushing = False
+        if self._pending:
+            self._start_flush()
+        else:
+            # Only waiting for the batch that just finished.
+            for waiter in self._waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+            self._waiters = []
+
+    def _notify_change(self, subscriber_id=None):
+        for listener in self._change_listeners:
+            listener(subscriber_id)
+
+    def _read_all(self):
+        """
+        Reads every subscriber from the persistent store. Runs on the
+        executor thread.
+        """
+        store = self._persistent_store
+        return {SIDUtils.to_str(sub.sid): sub for sub in
+                store.get_subscribers_data(store.list_subscribers())}
@@ -24,6 +24,22 @@ class BaseStore(metaclass=abc.ABCMeta):
     Implementations of BaseStore should be thread safe.
     """
 
+    def __init__(self):
+        self._change_listeners = []
+
+    def add_change_listener(self, listener):
+        """
+        Registers listener to be called with the subscriber id once a
+        subscriber has been modified or deleted, or with None when any
+        subscriber may have changed (e.g. after a resync). Listeners run on
+        the writing thread.
+        """
+        self._change_listeners.append(listener)
+
+    def _notify_change(self, subscriber_id=None):
+        for listener in self._change_listeners:
+            listener(subscriber_id)
+
     @abc.abstractmethod
     def add_subscriber(self, subscriber_data):
         """
@@ -114,6 +130,14 @@ class SubscriberNotFoundError(Exception):
     pass
 
 
+class SubscriberNotCachedError(Exception):
+    """
+    Exception thrown by non-blocking lookups when the subscriber is not in
+    memory, and answering would require a (blocking) read of the store
+    """
+    pass
+
+
 class DuplicateSubscriberError(Exception):
     """
     Exception thrown when a subscriber is requested to be added to the store,
@@ -8,7 +8,6 @@ of patent rights can be found in the PATENTS file in the same directory.
 """
 
 import copy
-import json
 import threading
 
 from collections import OrderedDict
@@ -18,66 +17,131 @@ from .util import SIDUtils
 
 from .base import BaseStore
 from .base import DuplicateSubscriberError, SubscriberNotFoundError
-from .sqlite import SqliteStore
 
 
 class CachedStore(BaseStore):
     """
     A thread-safe cached persistent store of the subscriber database.
-    Prerequisite: persistent_store need to be thread safe
+    Prerequisite: persistent_store need to be thread safe, and must only be
+    modified through this store.
+
+    Cache hits take no lock: every change to the cache is a single dict
+    operation, which is atomic under the GIL, so readers run concurrently
+    with each other and with writers. Misses read the persistent store
+    without holding any lock. Writers are serialized by a separate mutex,
+    and only take the cache lock for the brief moment they swap entries in
+    or out.
+
+    Cached subscriber data is never modified in place: get_subscriber_data
+    returns a shared read-only snapshot, and edit_subscriber hands out a
+    private copy which replaces the snapshot once it has been persisted.
+
+    The store also keeps the set of all subscriber ids in memory, so
+    list_subscribers and lookups of unknown subscribers don't touch the
+    persistent store. Both the id set and the cache are warmed up in bulk
+    when the store is created.
     """
 
     def __init__(self, persistent_store, cache_capacity=512):
+        super().__init__()
         self._lock = threading.Lock()
+        self._write_mutex = threading.Lock()
         self._cache = OrderedDict()
         self._cache_capacity = cache_capacity
         self._persistent_store = persistent_store
+        # Bumped (with the cache lock held) after every write, so that a
+        # reader which loaded a subscriber concurrently knows not to cache it
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._sids = OrderedDict()
+        self.warm_up()
+
+    def warm_up(self):
+        """
+        Loads the subscriber ids and the first cache_capacity subscribers
+        from the persistent store.
+        """
+        with self._write_mutex:
+            sids = self._persistent_store.list_subscribers()
+            subscribers = self._persistent_store.get_subscribers_data(
+                sids[:self._cache_capacity])
+            with self._lock:
+                self._sids = OrderedDict.fromkeys(sids)
+                self._cache_clear()
+                for subscriber_data in subscribers:
+                    self._cache_put(SIDUtils.to_str(subscriber_data.sid),
+                                    subscriber_data)
+                self._generation += 1
+
+    def stats(self):
+        """
+        Returns the cache counters. Hits are counted without a lock, so the
+        hit count is approximate while readers run concurrently.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._cache),
+            'capacity': self._cache_capacity,
+        }
 
     def add_subscriber(self, subscriber_data):
         """
         Method that adds the subscriber.
         """
         sid = SIDUtils.to_str(subscriber_data.sid)
-        with self._lock:
-            if sid in self._cache:
+        with self._write_mutex:
+            if sid in self._sids:
                 raise DuplicateSubscriberError(sid)
 
             self._persistent_store.add_subscriber(subscriber_data)
-            self._cache_put(sid, subscriber_data)
+            with self._lock:
+                self._sids[sid] = None
+                self._cache_put(sid, subscriber_data)
+                self._generation += 1
 
     @contextmanager
     def edit_subscriber(self, subscriber_id):
         """
-        Context manager to modify the subscriber data.
+        Context manager to modify the subscriber data. Readers keep seeing
+        the previous data until the edit has been persisted.
         """
-        with self._lock:
-            if subscriber_id in self._cache:
-                data = self._cache_get(subscriber_id)
-                subscriber_data = copy.deepcopy(data)
-            else:
-                subscriber_data = \
-                    self._persistent_store.get_subscriber_data(subscriber_id)
+        with self._write_mutex:
+            subscriber_data = copy.deepcopy(
+                self.get_subscriber_data(subscriber_id))
             yield subscriber_data
             self._persistent_store.update_subscriber(subscriber_data)
-            self._cache_put(subscriber_id, subscriber_data)
+            with self._lock:
+                self._cache_put(subscriber_id, subscriber_data)
+                self._generation += 1
+        self._notify_change(subscriber_id)
 
     def delete_subscriber(self, subscriber_id):
         """
         Method that deletes a subscriber, if present.
         """
-        with self._lock:
-            if subscriber_id in self._cache:
-                del self._cache[subscriber_id]
-
+        with self._write_mutex:
             self._persistent_store.delete_subscriber(subscriber_id)
+            with self._lock:
+                self._sids.pop(subscriber_id, None)
+                self._cache.pop(subscriber_id, None)
+                self._generation += 1
+        self._notify_change(subscriber_id)
 
     def delete_all_subscribers(self):
         """
         Method that removes all the subscribers from the store
         """
-        with self._lock:
-            self._cache_clear()
+        with self._write_mutex:
             self._persistent_store.delete_all_subscribers()
+            with self._lock:
+                self._sids.clear()
+                self._cache_clear()
+                self._generation += 1
+        self._notify_change()
 
     def resync(self, subscribers):
         """
@@ -85,47 +149,78 @@ class CachedStore(BaseStore):
         subscribers. The resync leaves the current state of subscribers
         intact.
 
+        Rather than dropping the whole cache, cached subscribers are replaced
+        with their resynced data and removed subscribers are evicted.
+
         Args:
             subscribers - list of subscribers to be in the store.
         """
-        with self._lock:
-            self._cache_clear()
+        with self._write_mutex:
+            # The persistent store copies the current state into subscribers.
             self._persistent_store.resync(subscribers)
+            resynced = OrderedDict(
+                (SIDUtils.to_str(sub.sid), sub) for sub in subscribers)
+            with self._lock:
+                for sid in list(self._cache):
+                    if sid in resynced:
+                        self._cache[sid] = resynced[sid]
+                    else:
+                        del self._cache[sid]
+                self._sids = OrderedDict.fromkeys(resynced)
+                self._generation += 1
+        self._notify_change()
 
     def get_subscriber_data(self, subscriber_id):
         """
-        Method that returns the subscriber data for the subscriber.
+        Method that returns the subscriber data for the subscriber. The
+        returned data is shared, and must not be modified.
         """
+        subscriber_data = self._cache_get(subscriber_id)
+        if subscriber_data is not None:
+            self.hits += 1
+            return subscriber_data
+        generation = self._generation
+        if subscriber_id not in self._sids:
+            raise SubscriberNotFoundError(subscriber_id)
+
+        subscriber_data = \
+            self._persistent_store.get_subscriber_data(subscriber_id)
         with self._lock:
-            if subscriber_id in self._cache:
-                return self._cache_get(subscriber_id)
-            else:
-                subscriber_data = \
-                    self._persistent_store.get_subscriber_data(subscriber_id)
+            self.misses += 1
+            if generation == self._generation:
                 self._cache_put(subscriber_id, subscriber_data)
-                return subscriber_data
+        return subscriber_data
 
     def list_subscribers(self):
         """
         Method that returns the list of subscribers stored.
-        Note: this method is not cached since it's easier to get the whole list
-        from persistent store
         """
-        return self._persistent_store.list_subscribers()
+        return list(self._sids)
 
     def _cache_get(self, k):
         """
-        Get from the LRU cache. Move the last hit entry to the end.
+        Get from the LRU cache, or None. Move the last hit entry to the end.
+        The entry may be evicted concurrently, in which case this is still a
+        hit on the data we got.
         """
-        self._cache.move_to_end(k)
-        return self._cache[k]
+        v = self._cache.get(k)
+        if v is not None:
+            try:
+                self._cache.move_to_end(k)
+            except KeyError:
+                pass
+        return v
 
     def _cache_put(self, k, v):
         """
         Put to the LRU cache. Evict the first item if full.
+        Requires the cache lock.
         """
-        if self._cache_capacity == len(self._cache):
-            evicted_item = self._cache.popitem(last=False)
+        if k in self._cache:
+            self._cache.move_to_end(k)
+        elif self._cache_capacity == len(self._cache):
+            self._cache.popitem(last=False)
+            self.evictions += 1
         self._cache[k] = v
 
     def _cache_list(self):
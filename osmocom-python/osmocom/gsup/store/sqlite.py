@@ -25,9 +25,15 @@ class SqliteStore(BaseStore):
 
     Processes using this store shouldn't be forked since the sqlite connections
     can't be shared by multiple processes.
+
+    File databases are run in WAL mode, so that readers are not blocked by
+    a resync or a batch of writes. Each row keeps the subscriber's state
+    in a column of its own next to the full subscriber data, so a resync
+    can carry the state over without decoding every subscriber.
     """
 
     def __init__(self, db_location):
+        super().__init__()
         self._db_location = db_location
         self._tlocal = threading.local()
         self._create_store()
@@ -38,31 +44,68 @@ class SqliteStore(BaseStore):
         Returns a thread local connection to the sqlite db.
         """
         if not getattr(self._tlocal, 'conn', None):
-            self._tlocal.conn = sqlite3.connect(self._db_location, uri=True)
+            conn = sqlite3.connect(self._db_location, uri=True)
+            # Safe with WAL: a power loss may only lose the last commits.
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._tlocal.conn = conn
         return self._tlocal.conn
 
     def _create_store(self):
         """
-        Create the sqlite table if it doesn't exist already.
+        Create the sqlite table if it doesn't exist already, and add the
+        state column to tables created before it existed.
         """
+        # Persistent for file dbs; memory dbs just keep their own journal.
+        self.conn.execute("PRAGMA journal_mode = WAL")
         with self.conn:
             self.conn.execute("CREATE TABLE IF NOT EXISTS subscriberdb"
-                              "(subscriber_id text PRIMARY KEY, data text)")
+                              "(subscriber_id text PRIMARY KEY, data text, "
+                              "state blob)")
+            columns = [row[1] for row in
+                       self.conn.execute("PRAGMA table_info(subscriberdb)")]
+            if 'state' in columns:
+                return
+            self.conn.execute("ALTER TABLE subscriberdb ADD COLUMN state blob")
+            res = self.conn.execute("SELECT subscriber_id, data "
+                                    "FROM subscriberdb")
+            self.conn.executemany(
+                "UPDATE subscriberdb SET state = ? WHERE subscriber_id = ?",
+                [(self._parse(data).state.SerializeToString(), sid)
+                 for (sid, data) in res.fetchall()])
+
+    @staticmethod
+    def _parse(data_str):
+        subscriber_data = SubscriberData()
+        subscriber_data.ParseFromString(data_str)
+        return subscriber_data
+
+    @staticmethod
+    def _row(subscriber_data):
+        """
+        Returns the (subscriber_id, data, state) column values for the
+        subscriber.
+        """
+        state_str = b''
+        if subscriber_data.HasField('state'):
+            state_str = subscriber_data.state.SerializeToString()
+        return (SIDUtils.to_str(subscriber_data.sid),
+                subscriber_data.SerializeToString(), state_str)
 
     def add_subscriber(self, subscriber_data):
         """
         Method that adds the subscriber.
         """
-        sid = SIDUtils.to_str(subscriber_data.sid)
-        data_str = subscriber_data.SerializeToString()
+        row = self._row(subscriber_data)
+        sid = row[0]
         with self.conn:
             res = self.conn.execute("SELECT data FROM subscriberdb WHERE "
                                     "subscriber_id = ?", (sid, ))
             if res.fetchone():
                 raise DuplicateSubscriberError(sid)
 
-            self.conn.execute("INSERT INTO subscriberdb(subscriber_id, data) "
-                              "VALUES (?, ?)", (sid, data_str))
+            self.conn.execute("INSERT INTO subscriberdb"
+                              "(subscriber_id, data, state) "
+                              "VALUES (?, ?, ?)", row)
 
     @contextmanager
     def edit_subscriber(self, subscriber_id):
@@ -75,13 +118,13 @@ class SqliteStore(BaseStore):
             row = res.fetchone()
             if not row:
                 raise SubscriberNotFoundError(subscriber_id)
-            subscriber_data = SubscriberData()
-            subscriber_data.ParseFromString(row[0])
+            subscriber_data = self._parse(row[0])
             yield subscriber_data
-            data_str = subscriber_data.SerializeToString()
-            self.conn.execute("UPDATE subscriberdb SET data = ? "
+            (_, data_str, state_str) = self._row(subscriber_data)
+            self.conn.execute("UPDATE subscriberdb SET data = ?, state = ? "
                               "WHERE subscriber_id = ?",
-                              (data_str, subscriber_id))
+                              (data_str, state_str, subscriber_id))
+        self._notify_change(subscriber_id)
 
     def delete_subscriber(self, subscriber_id):
         """
@@ -90,6 +133,7 @@ class SqliteStore(BaseStore):
         with self.conn:
             self.conn.execute("DELETE FROM subscriberdb WHERE "
                               "subscriber_id = ?", (subscriber_id, ))
+        self._notify_change(subscriber_id)
 
     def delete_all_subscribers(self):
         """
@@ -97,6 +141,7 @@ class SqliteStore(BaseStore):
         """
         with self.conn:
             self.conn.execute("DELETE FROM subscriberdb")
+        self._notify_change()
 
     def get_subscriber_data(self, subscriber_id):
         """
@@ -108,9 +153,28 @@ class SqliteStore(BaseStore):
             row = res.fetchone()
             if not row:
                 raise SubscriberNotFoundError(subscriber_id)
-        subscriber_data = SubscriberData()
-        subscriber_data.ParseFromString(row[0])
-        return subscriber_data
+        return self._parse(row[0])
+
+    def get_subscribers_data(self, subscriber_ids):
+        """
+        Method that returns the subscriber data for several subscribers,
+        skipping those that are not present.
+
+        Args:
+            subscriber_ids - list of unique identifiers for subscribers
+        Returns:
+            list of SubscriberData protobuf messages
+        """
+        rows = []
+        with self.conn:
+            # Stay well below sqlite's limit on bound parameters.
+            for i in range(0, len(subscriber_ids), 500):
+                chunk = subscriber_ids[i:i + 500]
+                res = self.conn.execute(
+                    "SELECT data FROM subscriberdb WHERE subscriber_id IN "
+                    "(%s)" % ', '.join('?' * len(chunk)), chunk)
+                rows.extend(row[0] for row in res)
+        return [self._parse(row) for row in rows]
 
     def list_subscribers(self):
         """
@@ -133,40 +197,82 @@ class SqliteStore(BaseStore):
             SubscriberNotFoundError if the subscriber is not present
 
         """
-        sid = SIDUtils.to_str(subscriber_data.sid)
-        data_str = subscriber_data.SerializeToString()
+        (sid, data_str, state_str) = self._row(subscriber_data)
         with self.conn:
-            res = self.conn.execute("UPDATE subscriberdb SET data = ? "
-                                    "WHERE subscriber_id = ?", (data_str, sid))
+            res = self.conn.execute("UPDATE subscriberdb SET data = ?, "
+                                    "state = ? WHERE subscriber_id = ?",
+                                    (data_str, state_str, sid))
             if not res.rowcount:
                 raise SubscriberNotFoundError(sid)
+        self._notify_change(sid)
+
+    def write_subscribers(self, changes):
+        """
+        Method that applies a batch of subscriber writes in one transaction.
+        Subscribers are inserted or replaced, so the batch can be built
+        without reading the current rows.
+
+        Args:
+            changes - list of (subscriber_id, data) tuples, where data is a
+                SubscriberData protobuf message, or None to delete the
+                subscriber
+        """
+        upserts = [(sid, ) + self._row(data)[1:]
+                   for (sid, data) in changes if data is not None]
+        deletes = [(sid, ) for (sid, data) in changes if data is None]
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO subscriberdb"
+                                  "(subscriber_id, data, state) "
+                                  "VALUES (?, ?, ?)", upserts)
+            self.conn.executemany("DELETE FROM subscriberdb WHERE "
+                                  "subscriber_id = ?", deletes)
+        for (sid, _) in changes:
+            self._notify_change(sid)
 
     def resync(self, subscribers):
         """
         Method that should resync the store with the mentioned list of
         subscribers. The resync leaves the current state of subscribers
-        intact.
+        intact, and copies it into the passed subscribers.
+
+        Only the state column of existing rows is decoded. Rows whose data
+        is unchanged are left alone, and only the subscribers that are gone
+        are deleted, so a resync which changes little writes little.
 
         Args:
             subscribers - list of subscribers to be in the store.
         """
         with self.conn:
-            # Capture the current state of the subscribers
-            res = self.conn.execute("SELECT subscriber_id, data FROM subscriberdb")
-            current_state = {}
-            for row in res:
-                sub = SubscriberData()
-                sub.ParseFromString(row[1])
-                current_state[row[0]] = sub.state
-
-            # Clear all subscribers
-            self.conn.execute("DELETE FROM subscriberdb")
+            res = self.conn.execute("SELECT subscriber_id, data, state "
+                                    "FROM subscriberdb")
+            current = {sid: (data, state) for (sid, data, state) in res}
 
-            # Add the subscribers with the current state
+            upserts = []
             for sub in subscribers:
                 sid = SIDUtils.to_str(sub.sid)
-                if sid in current_state:
-                    sub.state.CopyFrom(current_state[sid])
-                data_str = sub.SerializeToString()
-                self.conn.execute("INSERT INTO subscriberdb(subscriber_id, data) "
-                                  "VALUES (?, ?)", (sid, data_str))
+                if sid in current:
+                    (data_str, state_str) = current.pop(sid)
+                    if state_str is None:
+                        # Written by a version without the state column
+                        state_str = \
+                            self._parse(data_str).state.SerializeToString()
+                    if state_str:
+                        sub.state.ParseFromString(state_str)
+                    else:
+                        sub.ClearField('state')
+                    new_data_str = sub.SerializeToString()
+                    if new_data_str == data_str:
+                        continue
+                    row = (sid, new_data_str, state_str)
+                else:
+                    row = self._row(sub)
+                upserts.append(row)
+
+            self.conn.executemany("DELETE FROM subscriberdb WHERE "
+                                  "subscriber_id = ?",
+                                  [(sid, ) for sid in current])
+            self.conn.executemany("INSERT OR REPLACE INTO subscriberdb"
+                                  "(subscriber_id, data, state) "
+                                  "VALUES (?, ?, ?)", upserts)
+        for sid in list(current) + [row[0] for row in upserts]:
+            self._notify_change(sid)
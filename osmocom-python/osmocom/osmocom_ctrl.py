@@ -10,11 +10,13 @@ of patent rights can be found in the PATENTS file in the same directory.
 import argparse
 import asyncio
 import functools
+import itertools
 import logging
 import sys
+import threading
 import warnings
 
-from .gsup.protocols.ipa import OsmoIPAClient, OsmoCtrlManager
+from .gsup.protocols.ipa import OsmoIPAClient, OsmoCtrlManager, TRAP_CMD
 
 
 # IPA Constants and References
@@ -227,6 +229,215 @@ class OsmoCtrlClient(OsmoIPAClient):
         super().connection_lost(exc)  # rare case of calling super() after cleaning up locally
 
 
+class CtrlConnection(OsmoIPAClient):
+    """
+    A persistent CTRL connection, with any number of GET/SET requests
+    outstanding at once. Responses are matched to their requests by message
+    ID, so the server may answer them in any order. TRAPs are handed to
+    `trap_callback(var, val)`.
+    """
+    def __init__(self, trap_callback=None):
+        super().__init__(ctrl_callback=self)
+        self._trap_callback = trap_callback
+        self._pending = {}
+        self.transport = None
+        self.lost = False
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        self.transport = transport
+
+    def send(self, msg_id, message):
+        """
+        Sends a GET/SET message, returns a future for the value in the reply.
+        """
+        if self.lost:
+            raise ConnectionError('CTRL connection lost')
+        future = asyncio.Future()
+        self._pending[msg_id] = future
+        self._ctrl_manager.generate_packet(message)
+        return future
+
+    def discard(self, msg_id):
+        """ Stop waiting for the reply to a message, if it hasn't come """
+        self._pending.pop(msg_id, None)
+
+    def is_pending(self, msg_id):
+        return msg_id in self._pending
+
+    def process_response(self, response):
+        """ OsmoCtrlManager callback for every CTRL message received """
+        if response['msg_type'] == TRAP_CMD:
+            if self._trap_callback is not None:
+                self._trap_callback(response['var'], response['val'])
+            return
+        future = self._pending.pop(response['id'], None)
+        if future is None or future.done():
+            logging.warning('Dropping CTRL reply to unknown request id: %d',
+                            response['id'])
+        elif response['msg_type'] == "ERROR":
+            future.set_exception(OsmoCtrlError(
+                'Request id: {}, returned error response: {}'.format(
+                    response['id'], response['error'])))
+        else:
+            future.set_result(response['val'])
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+    def connection_lost(self, exc):
+        self.lost = True
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError('CTRL connection lost'))
+        super().connection_lost(exc)
+
+
+class AsyncCtrlClient:
+    """
+    asyncio client for the CTRL interface. All requests share one IPA
+    connection, which is opened on first use and reopened on the next
+    request after it has been lost.
+
+        client = AsyncCtrlClient()
+        mcc = await client.get('mcc')
+        values = await client.get_many(['mcc', 'mnc', 'short-name'])
+        client.subscribe('bts.0.oml-connection-state', on_change)
+    """
+    def __init__(self, host=HOST, port=PORT, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._ids = itertools.count(1)
+        self._connecting = None
+        self._traps = {}
+
+    async def connect(self):
+        """
+        Returns the open connection, opening it if needed. Concurrent
+        callers share one connection attempt.
+        """
+        if self._connecting is None or self._is_stale(self._connecting):
+            loop = asyncio.get_event_loop()
+            self._connecting = asyncio.ensure_future(loop.create_connection(
+                functools.partial(CtrlConnection, self._dispatch_trap),
+                self.host, self.port))
+        (_, protocol) = await asyncio.shield(self._connecting)
+        return protocol
+
+    @staticmethod
+    def _is_stale(connecting):
+        if not connecting.done():
+            return False
+        if connecting.cancelled() or connecting.exception() is not None:
+            return True
+        return connecting.result()[1].lost
+
+    async def get(self, var):
+        """ Returns the value of a CTRL variable """
+        return await self._request(var, None)
+
+    async def set(self, var, val):
+        """ Sets a CTRL variable, returns the value from the reply """
+        return await self._request(var, val)
+
+    async def get_many(self, variables):
+        """
+        Returns a dict of the values of CTRL variables, which are requested
+        all at once.
+        """
+        values = await asyncio.gather(*[self.get(var) for var in variables])
+        return dict(zip(variables, values))
+
+    async def _request(self, var, val):
+        protocol = await self.connect()
+        msg_id = next(self._ids)
+        while protocol.is_pending(msg_id):
+            msg_id = next(self._ids)
+        (msg_id, msg) = OsmoCtrlManager.generate_msg(var, val, msg_id)
+        future = protocol.send(msg_id, msg)
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        finally:
+            protocol.discard(msg_id)
+
+    def subscribe(self, var, callback):
+        """
+        Calls `callback(var, val)` for every TRAP of the variable, or for
+        every TRAP if var is None. TRAPs are only received while the
+        connection is open, see connect().
+        """
+        self._traps.setdefault(var, []).append(callback)
+
+    def unsubscribe(self, var, callback):
+        self._traps[var].remove(callback)
+
+    def _dispatch_trap(self, var, val):
+        for callback in self._traps.get(var, []) + self._traps.get(None, []):
+            try:
+                callback(var, val)
+            except Exception:
+                logging.exception('CTRL TRAP callback failed for %s', var)
+
+    def close(self):
+        if self._connecting is not None and self._connecting.done() \
+                and not self._is_stale(self._connecting):
+            self._connecting.result()[1].close()
+        self._connecting = None
+
+
+class CtrlClient:
+    """
+    Blocking facade over AsyncCtrlClient, for callers without an event
+    loop. The client runs on its own event loop thread, so requests from
+    any number of threads share the connection; TRAP callbacks are called
+    from that thread.
+    """
+    def __init__(self, host=HOST, port=PORT, timeout=5.0):
+        self._client = AsyncCtrlClient(host, port, timeout)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        daemon=True)
+        self._thread.start()
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def connect(self):
+        self._run(self._client.connect())
+
+    def get(self, var):
+        return self._run(self._client.get(var))
+
+    def set(self, var, val):
+        return self._run(self._client.set(var, val))
+
+    def get_many(self, variables):
+        return self._run(self._client.get_many(variables))
+
+    def subscribe(self, var, callback):
+        """ Subscribes to TRAPs, and connects to start receiving them """
+        self._loop.call_soon_threadsafe(self._client.subscribe, var, callback)
+        self.connect()
+
+    def unsubscribe(self, var, callback):
+        self._loop.call_soon_threadsafe(self._client.unsubscribe, var,
+                                        callback)
+
+    async def _close(self):
+        self._client.close()
+        # Let the transport finish closing before the loop stops
+        await asyncio.sleep(0)
+
+    def close(self):
+        self._run(self._close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
 class Error(Exception):
     """Base class for exceptions in this module."""
     pass
@@ -8,9 +8,11 @@ of patent rights can be found in the PATENTS file in the same directory.
 """
 
 from contextlib import contextmanager
+import codecs
 import re
 import select
 import socket
+import threading
 import time
 
 from .exceptions import VTYException, VTYChainedException
@@ -20,26 +22,39 @@ class BaseVTY(object):
     EOL = '\r\n'
     BUF_SIZE = 4096 #libosmocore vty buf size
     TIMEOUT = 3.0
+    PIPELINE_DEPTH = 32 #max commands in flight in sendrecv_many
     SOCKET_ERRORS = (socket.error, socket.herror, socket.timeout)
 
-    def __init__(self, app_name, host='127.0.0.1', port=4242, timeout=None):
+    def __init__(self, app_name, host='127.0.0.1', port=4242, timeout=None,
+                 persistent=False):
         """Interface for Osmocom VTY application.
 
         `app_name` is the name that appears on the VTY shell
         and is used to determine when we have reached the end of
         a repsonse.
+
+        A `persistent` VTY keeps its connection open when the outermost
+        context exits, and reconnects on the next use if the connection
+        was dropped. The connection is shared by the threads using the VTY,
+        one context at a time.
         """
         self.app_name = app_name
         self.host = host
         self.port = port
+        self.persistent = persistent
 
         self.is_enable_mode = False
         self.is_configure_mode = False
         self._socket_obj = None
         self._context_depth = 0
+        self._enable_depth = 0
+        self._lock = threading.RLock()
         self._buf = ''
+        self._scan_pos = 0 #where the search for the next EOM resumes
+        self._decoder = None
 
         self.EOM = self.EOL + self.app_name
+        self._bare_prompts = (self.app_name + '>', self.app_name + '#')
 
         if timeout is not None:
             self.TIMEOUT = timeout
@@ -66,7 +81,15 @@ class BaseVTY(object):
         except self.SOCKET_ERRORS as e:
             self._socket_obj = None
             raise VTYChainedException(e)
+        self._buf = ''
+        self._scan_pos = 0
+        self._decoder = codecs.getincrementaldecoder('utf-8')('ignore')
+        self.is_enable_mode = False
         self.sendrecv('')
+        if self._enable_depth:
+            # We reconnected within an enable_mode context
+            self.sendrecv('enable')
+            self.is_enable_mode = True
 
 
     def close(self):
@@ -78,31 +101,75 @@ class BaseVTY(object):
 
     def sendrecv(self, command):
         """Sends a command to the VTY and return the response"""
-        if not self._socket_obj:
-            raise VTYException('Connection not open')
+        return self.sendrecv_many([command])[0]
 
-        with self._socket() as s:
-            s.sendall(bytearray(command + '\r', 'utf-8'))
-            has_data = lambda : len(select.select([s], [], [], self.TIMEOUT)[0])
-            while self.EOM not in self._buf and has_data():
-                recv = bytearray(s.recv(self.BUF_SIZE)).decode('utf-8', 'ignore')
+    def sendrecv_many(self, commands):
+        """Sends the commands to the VTY and returns their responses in
+        order. Up to PIPELINE_DEPTH commands are kept in flight, so a batch
+        of commands doesn't wait for a round trip per command.
+        """
+        with self._lock:
+            if self.persistent and not self._socket_obj:
+                self.open()
+            if not self._socket_obj:
+                raise VTYException('Connection not open')
+
+            responses = []
+            with self._socket() as s:
+                sent = 0
+                while len(responses) < len(commands):
+                    # Top up the pipeline once half of it has drained
+                    if sent - len(responses) <= self.PIPELINE_DEPTH // 2:
+                        window = commands[sent:len(responses) +
+                                          self.PIPELINE_DEPTH]
+                        if window:
+                            s.sendall(bytearray(
+                                ''.join(c + '\r' for c in window), 'utf-8'))
+                            sent += len(window)
+                    responses.append(
+                        self._read_response(s, commands[len(responses)]))
+
+        for (command, ret) in zip(commands, responses):
+            if 'Unknown command' in ret:
+                raise ValueError('Invalid command: %s' % command)
+        return responses
+
+    def _read_response(self, s, command):
+        """Reads the response to the next command sent. A response is the
+        text between the line echoing the command and the next prompt. Bare
+        prompt lines, which the VTY may print before echoing a command, are
+        skipped.
+        """
+        while True:
+            end = self._buf.find(self.EOM, self._scan_pos)
+            while end < 0:
+                # Don't search the text we have already searched again
+                self._scan_pos = max(0, len(self._buf) - len(self.EOM) + 1)
+                if not select.select([s], [], [], self.TIMEOUT)[0]:
+                    raise VTYException(
+                        "Connection stopped responding or timed out: %s"
+                        % self._buf)
+                recv = s.recv(self.BUF_SIZE)
                 if not len(recv):
                     raise VTYException('Connection died during recv')
-                self._buf += recv
-
-            if self.EOM not in self._buf:
-                raise VTYException("Connection stopped responding or timed out: %s", self._buf)
-
-        # Find the the response by seeking past the command to the next line and reading until the first EOM.
-        resp_start = self._buf.find(command) + len(command + self.EOL)
-        resp_end = resp_start + self._buf[resp_start:].find(self.EOM)
-        ret = self._buf[resp_start:resp_end].strip()
-        self._buf = self._buf[resp_end:].lstrip()
-
-        if 'Unknown command' in ret:
-            raise ValueError('Invalid command: %s' % command)
-
-        return ret
+                self._buf += self._decoder.decode(bytes(recv))
+                end = self._buf.find(self.EOM, self._scan_pos)
+
+            # Keep the prompt that starts the next response in the buffer
+            segment = self._buf[:end]
+            self._buf = self._buf[end + len(self.EOL):]
+            self._scan_pos = 0
+            if not command or segment.rstrip() not in self._bare_prompts:
+                return segment.partition(self.EOL)[2].strip()
+
+    def _is_alive(self):
+        """Checks that an idle connection hasn't been closed by the VTY"""
+        try:
+            if not select.select([self._socket_obj], [], [], 0)[0]:
+                return True
+            return len(self._socket_obj.recv(1, socket.MSG_PEEK)) > 0
+        except self.SOCKET_ERRORS:
+            return False
 
     def running_config(self):
         """Reads and parses the running configuration into
@@ -176,14 +243,23 @@ class BaseVTY(object):
 
     @contextmanager
     def enable_mode(self):
-        """Context manager to raise mode to VTY_ENABLE."""
-        self.sendrecv('enable')
-        self.is_enable_mode = True
+        """Context manager to raise mode to VTY_ENABLE. Nested contexts
+        share the outermost one's enable and disable, so that a batch of
+        operations can run in enable mode.
+        """
+        if self._enable_depth == 0:
+            self.sendrecv('enable')
+            self.is_enable_mode = True
+        self._enable_depth += 1
         try:
             yield
         finally:
-            self.sendrecv('disable')
-            self.is_enable_mode = False
+            self._enable_depth -= 1
+            if self._enable_depth == 0 and self.is_enable_mode:
+                self.is_enable_mode = False
+                # Nothing to disable if the connection was lost
+                if self._socket_obj:
+                    self.sendrecv('disable')
 
     @contextmanager
     def configure_mode(self):
@@ -214,16 +290,30 @@ class BaseVTY(object):
 
     def __enter__(self):
         """For constructing VTY connection context"""
-        if self._context_depth == 0:
-            self.open()
+        self._lock.acquire()
+        try:
+            if self._context_depth == 0:
+                if not self.persistent:
+                    self.open()
+                elif not self._socket_obj or not self._is_alive():
+                    if self._socket_obj:
+                        self.close()
+                    self.open()
+        except:
+            self._lock.release()
+            raise
         self._context_depth += 1
         return self
 
     def __exit__(self, type, value, traceback):
         """For exiting VTY connection context"""
         self._context_depth -= 1
-        if self._context_depth == 0 and self._socket_obj:
-            self.close()
+        try:
+            if (self._context_depth == 0 and self._socket_obj and
+                    not self.persistent):
+                self.close()
+        finally:
+            self._lock.release()
         return False
 
     def _parse_show(self, resp):
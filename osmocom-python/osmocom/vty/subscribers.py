@@ -8,15 +8,20 @@ of patent rights can be found in the PATENTS file in the same directory.
 """
 import re
 import sqlite3
+import threading
 
 from .base import BaseVTY
 from .util import parse_imsi, format_imsi
 
 class Subscribers(BaseVTY):
 
-    def __init__(self, host='127.0.0.1', port=4242, hlr_loc='/home/vagrant/osmocom/hlr.sqlite3', timeout=None):
-        super(Subscribers, self).__init__('OpenBSC', host, port, timeout)
+    def __init__(self, host='127.0.0.1', port=4242, hlr_loc='/home/vagrant/osmocom/hlr.sqlite3', timeout=None,
+                 persistent=False):
+        super(Subscribers, self).__init__('OpenBSC', host, port, timeout,
+                                          persistent)
         self.hlr_loc = hlr_loc
+        self._hlr_con = None
+        self._hlr_lock = threading.Lock()
         self.PARSE_SHOW= [
             re.compile('ID: (?P<id>\d+), Authorized: (?P<authorized>\d+)'),
             re.compile('Extension: (?P<extension>\d+)'),
@@ -40,8 +45,6 @@ class Subscribers(BaseVTY):
         Returns a list subscriber objects with the following values:
            IMSI, TMSI, IMEI, AUTH, CREATED, ACCESSED, TMSI_ASSIGNED
        """
-        con = sqlite3.connect(self.hlr_loc)
-        con.row_factory = sqlite3.Row
         query = ("SELECT s.imsi as IMSI,"
                     "s.tmsi as TMSI,"
                     "e.imei as IMEI,"
@@ -59,16 +62,56 @@ class Subscribers(BaseVTY):
             query += " AND strftime('%s','now') - ACCESSED < " + str(int(access_period))
 
         subscribers = []
-        for row in con.execute(query):
+        for row in self._hlr_query(query):
             subscriber = dict(list(zip(list(row.keys()), row)))
 
             # Ensure that the IMSI is 15 digits
             subscriber['IMSI'] = format_imsi(subscriber['IMSI'])
 
             subscribers.append(subscriber)
-        con.close()
         return subscribers
 
+    def hlr_subscribers(self):
+        """Gets every subscriber in the HLR with a single query, reading the
+        HLR database directly rather than through the VTY.
+
+        Returns a list of dictionaries with the following values:
+           imsi (15 digits, no prefix), extension, authorized, last_seen
+           (seconds since the epoch of the last update, as a string)
+        """
+        query = ("SELECT imsi, extension, authorized,"
+                    "strftime('%s', updated) as last_seen "
+                 "FROM Subscriber")
+        subscribers = []
+        for row in self._hlr_query(query):
+            subscribers.append({
+                'imsi': format_imsi(row['imsi']),
+                'extension': row['extension'],
+                'authorized': str(row['authorized']),
+                'last_seen': row['last_seen']})
+        return subscribers
+
+    def _hlr_query(self, query):
+        """Runs a query against the HLR database and returns all the rows.
+
+        The database is opened read-only, and the connection is kept and
+        shared by the threads using this object. osmo-nitb owns the
+        database, so a failed query drops the connection and the next one
+        reconnects.
+        """
+        with self._hlr_lock:
+            if self._hlr_con is None:
+                self._hlr_con = sqlite3.connect(
+                    'file:%s?mode=ro' % self.hlr_loc, uri=True,
+                    check_same_thread=False)
+                self._hlr_con.row_factory = sqlite3.Row
+            try:
+                return self._hlr_con.execute(query).fetchall()
+            except sqlite3.Error:
+                self._hlr_con.close()
+                self._hlr_con = None
+                raise
+
 
     def create(self, imsi):
         """Create a subscriber with a given IMSI.
@@ -132,6 +175,30 @@ class Subscribers(BaseVTY):
 
         return data
 
+    def show_many(self, key, values):
+        """Like `show`, for a batch of subscribers. The show commands are
+        pipelined over the connection, so the batch doesn't pay a round
+        trip per subscriber.
+
+        Returns a list of subscriber dictionaries in the order of `values`,
+        with None for subscribers that were not found.
+        """
+        if key not in ['extension', 'imsi', 'id', 'tmsi']:
+            raise KeyError('invalid lookup key')
+        if key == 'imsi':
+            values = [parse_imsi(value) for value in values]
+        resps = self.sendrecv_many(
+            ['show subscriber %s %s' % (key, value) for value in values])
+        subscribers = []
+        for resp in resps:
+            if 'No subscriber found' in resp:
+                subscribers.append(None)
+                continue
+            data = self._parse_show(resp)
+            data['imsi'] = format_imsi(data['imsi'])
+            subscribers.append(data)
+        return subscribers
+
     def __set(self, imsi, field, value):
         """Generic method for issuing set commands.
         Handles entering enabled mode for updating the HLR.
@@ -31,7 +31,13 @@ setup(
             'osmocom.gsup.crypto',
             'osmocom.gsup.protocols',
             'osmocom.vty'],
-  scripts=['scripts/osmocom_hlr'],
+  scripts=['scripts/osmocom_hlr', 'scripts/gsup_loadgen',
+           'scripts/cached_store_bench',
+           'scripts/sqlite_resync_bench',
+           'scripts/gsup_codec_bench'],
+  # The GSUP server uses async def and await, which need Python 3.5; the
+  # other client packages still run on 3.4.
+  python_requires='>=3.5',
   install_requires=['grpcio==1.0.4',
                     'aiohttp>=0.17.2'],
   extras_require={'dev': ['grpcio-tools>=1.0.0',
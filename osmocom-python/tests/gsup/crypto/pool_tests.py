@@ -0,0 +1,66 @@
+"""
+Copyright (c) 2016-present, Facebook, Inc.
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree. An additional grant
+of patent rights can be found in the PATENTS file in the same directory.
+"""
+
+import unittest
+
+from osmocom.gsup.crypto.pool import AuthTuplePool
+
+
+class AuthTuplePoolTests(unittest.TestCase):
+    """
+    Test class for the auth tuple pool
+    """
+
+    def setUp(self):
+        self._now = 0
+        self._pool = AuthTuplePool(size=3, max_age=10,
+                                   clock=lambda: self._now)
+
+    def test_take(self):
+        """
+        Test if tuples are taken oldest first, and the pool tops up to size
+        """
+        self.assertEqual(self._pool.take('IMSI1', 2), [])
+        self.assertEqual(self._pool.missing('IMSI1'), 3)
+        self._pool.put('IMSI1', ['a', 'b'])
+        self.assertEqual(self._pool.missing('IMSI1'), 1)
+        self._pool.put('IMSI1', ['c', 'd'])
+        self.assertEqual(self._pool.take('IMSI1', 2), ['b', 'c'])
+        self.assertEqual(self._pool.take('IMSI1', 2), ['d'])
+        self.assertEqual(self._pool.missing('IMSI1'), 3)
+
+    def test_expiry(self):
+        """
+        Test if pools expire max_age after their last refill
+        """
+        self._pool.put('IMSI1', ['a', 'b'])
+        self._now = 8
+        self._pool.put('IMSI1', ['c'])
+        self._now = 15
+        self.assertEqual(self._pool.take('IMSI1', 1), ['a'])
+        self._now = 19
+        self.assertEqual(self._pool.missing('IMSI1'), 3)
+        self.assertEqual(self._pool.take('IMSI1', 1), [])
+        self.assertEqual(len(self._pool), 0)
+
+    def test_invalidate(self):
+        """
+        Test if pools can be dropped one by one or all together
+        """
+        self._pool.put('IMSI1', ['a'])
+        self._pool.put('IMSI2', ['b'])
+        self._pool.invalidate('IMSI1')
+        self.assertEqual(self._pool.take('IMSI1', 1), [])
+        self.assertEqual(len(self._pool), 1)
+        self._pool.invalidate()
+        self.assertEqual(len(self._pool), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
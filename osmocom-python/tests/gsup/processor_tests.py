@@ -7,10 +7,13 @@ LICENSE file in the root directory of this source tree. An additional grant
 of patent rights can be found in the PATENTS file in the same directory.
 """
 
+import asyncio
 import unittest
 
 from unittest.mock import Mock
 
+from osmocom.gsup.crypto.gsm import RandomChallengeA3A8
+from osmocom.gsup.crypto.pool import AuthTuplePool
 from osmocom.gsup.crypto.utils import CryptoError
 from osmocom.gsup import processor
 from osmocom.gsup.store.base import SubscriberNotFoundError
@@ -33,6 +36,7 @@ class ProcessorTests(unittest.TestCase):
 
     def setUp(self):
         store = SqliteStore('file::memory:')
+        self._store = store
 
         self._processor = processor.Processor(store)
 
@@ -79,5 +83,112 @@ class ProcessorTests(unittest.TestCase):
         with self.assertRaises(CryptoError):
             self._processor.get_gsm_auth_vector('33333')
 
+    def test_gsm_auth_rotation(self):
+        """
+        Test if the precomputed tuples are handed out in rotation
+        """
+        tuples = [bytes([i]) * 28 for i in range(3)]
+        self._store.add_subscriber(SubscriberData(
+            sid=SIDUtils.to_pb('IMSI44444'),
+            gsm=GSMSubscription(state=GSMSubscription.ACTIVE,
+                                auth_tuples=tuples)))
+        rands = [self._processor.get_gsm_auth_vector('44444')[0]
+                 for _ in range(4)]
+        self.assertEqual(rands, [t[:16] for t in tuples + tuples[:1]])
+
+    def test_gsm_auth_ki_algo(self):
+        """
+        Test if key based algos are looked up by the subscriber's auth algo
+        """
+        class XorA3A8(RandomChallengeA3A8):
+            def compute(self, ki, rand):
+                mixed = bytes(a ^ b for (a, b) in zip(ki, rand))
+                return (mixed[:4], mixed[4:12])
+
+        self._store.add_subscriber(SubscriberData(
+            sid=SIDUtils.to_pb('IMSI44444'),
+            gsm=GSMSubscription(state=GSMSubscription.ACTIVE,
+                                auth_algo=1, auth_key=bytes(16))))
+        with self.assertRaises(CryptoError):
+            self._processor.get_gsm_auth_vector('44444')
+
+        self._processor = processor.Processor(self._store,
+                                              algos={1: XorA3A8()})
+        (rand, sres, key) = self._processor.get_gsm_auth_vector('44444')
+        self.assertEqual(sres + key, rand[:12])
+
+    def test_gsm_auth_pool(self):
+        """
+        Test if auth requests are served from the pool after a warm up
+        """
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        self._processor = processor.Processor(
+            self._store, pool=AuthTuplePool(size=4), vectors_per_request=2,
+            loop=loop)
+        loop.run_until_complete(self._processor.warm_up())
+
+        get_subscriber_data = self._store.get_subscriber_data
+        self._store.get_subscriber_data = Mock(
+            side_effect=AssertionError("read the store"))
+
+        async def auth():
+            return self._processor.get_gsm_auth_vectors_nowait('11111')
+
+        self.assertEqual(loop.run_until_complete(auth()),
+                         [_dummy_auth_tuple()] * 2)
+        self._store.get_subscriber_data = get_subscriber_data
+
+    def test_gsm_auth_pool_deleted(self):
+        """
+        Test if a deleted subscriber isn't served from the pool
+        """
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        pool = AuthTuplePool(size=4)
+        self._processor = processor.Processor(
+            self._store, pool=pool, vectors_per_request=2, loop=loop)
+        loop.run_until_complete(self._processor.warm_up())
+
+        async def auth():
+            return self._processor.get_gsm_auth_vectors_nowait('11111')
+
+        self._store.delete_subscriber('IMSI11111')
+        # The pool belongs to the event loop, so the change waits for it
+        self.assertEqual(pool.missing('IMSI11111'), 0)
+        with self.assertRaises(SubscriberNotFoundError):
+            loop.run_until_complete(auth())
+
+    def test_gsm_auth_pool_deactivated(self):
+        """
+        Test if a deactivated subscriber isn't served from the pool, even by
+        a refill that read the subscriber before it was deactivated
+        """
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        self._processor = processor.Processor(
+            self._store, pool=AuthTuplePool(size=4), vectors_per_request=2,
+            loop=loop)
+
+        get_subscriber_data = self._store.get_subscriber_data
+
+        def read_then_deactivate(sid):
+            subs = get_subscriber_data(sid)
+            with self._store.edit_subscriber(sid) as new_subs:
+                new_subs.gsm.state = GSMSubscription.INACTIVE
+            return subs
+
+        self._store.get_subscriber_data = Mock(
+            side_effect=read_then_deactivate)
+        loop.run_until_complete(self._processor.warm_up(['IMSI11111']))
+        self._store.get_subscriber_data = get_subscriber_data
+
+        async def auth():
+            return self._processor.get_gsm_auth_vectors_nowait('11111')
+
+        with self.assertRaises(CryptoError):
+            loop.run_until_complete(auth())
+
+
 if __name__ == "__main__":
     unittest.main()
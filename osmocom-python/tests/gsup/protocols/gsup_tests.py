@@ -7,6 +7,7 @@ LICENSE file in the root directory of this source tree. An additional grant
 of patent rights can be found in the PATENTS file in the same directory.
 """
 
+import asyncio
 import unittest
 
 from unittest.mock import Mock
@@ -18,6 +19,7 @@ from osmocom.gsup.protocols.gsup import \
 from osmocom.gsup.protocols.gsup import \
     MsgType, IEType, ErrorCauseType, GSUPCodecError
 from osmocom.gsup.protocols.ipa import IPAWriter
+from osmocom.gsup.store.base import SubscriberNotCachedError
 from osmocom.gsup.store.base import SubscriberNotFoundError
 
 
@@ -80,6 +82,16 @@ class CodecTests(unittest.TestCase):
             },
             b'\n\x01\x03\x00Q\xf5\x03" \x10ni\x89\xbel\xeeqTT7p\xae\x80\xb1' +
             b'\xef\r!\x04\xd4\xac\x8bS"\x08\x9f\xf54.\xb9]\x88\x00')
+        self._compare_msg(
+            MsgType.SEND_AUTH_INFO_RSP,
+            {
+                IEType.IMSI: '00155',
+                # Repeated IE
+                IEType.AUTH_TUPLE: [_dummy_auth_tuple()] * 2,
+            },
+            b'\n\x01\x03\x00Q\xf5' +
+            (b'\x03" \x10ni\x89\xbel\xeeqTT7p\xae\x80\xb1' +
+             b'\xef\r!\x04\xd4\xac\x8bS"\x08\x9f\xf54.\xb9]\x88\x00') * 2)
         self._compare_msg(
             MsgType.UPDATE_LOCATION_REQ,
             {
@@ -107,12 +119,38 @@ class CodecTests(unittest.TestCase):
                 out_buf, 0, MsgType.SEND_AUTH_INFO_REQ,
                 {IEType.IMSI: 'asd'})
 
+        # Non-ASCII digits
+        with self.assertRaises(GSUPCodecError):
+            self._gsup.encode(
+                out_buf, 0, MsgType.SEND_AUTH_INFO_REQ,
+                {IEType.IMSI: '\u0661\u0662\u0663'})
+
         # Really really long IMSI
         with self.assertRaises(GSUPCodecError):
             self._gsup.encode(
                 out_buf, 0, MsgType.SEND_AUTH_INFO_REQ,
                 {IEType.IMSI: '123456789123456789123456789'})
 
+    def test_imsi_lengths(self):
+        """
+        Test if IMSIs of every length survive the encode/decode round trip
+        """
+        imsi = '001010123456789'
+        for length in range(1, len(imsi) + 1):
+            ies = {IEType.IMSI: imsi[:length]}
+            out_buf = memoryview(bytearray(100))
+            out_len = self._gsup.encode(
+                out_buf, 0, MsgType.UPDATE_LOCATION_RES, ies)
+            self.assertEqual(out_buf[2], (length + 1) // 2)
+            self.assertEqual(self._gsup.decode(out_buf[:out_len]),
+                             (MsgType.UPDATE_LOCATION_RES, ies))
+
+        # Non ASCII digits
+        with self.assertRaises(GSUPCodecError):
+            self._gsup.encode(
+                bytearray(100), 0, MsgType.SEND_AUTH_INFO_REQ,
+                {IEType.IMSI: '\u0661\u0662'})
+
     def test_encoding_bad_auth_tuple(self):
         """
         Invalid Auth Tuple (rand not 16 bytes)
@@ -175,6 +213,18 @@ class MockProcessor(GSMProcessor):
             raise SubscriberNotFoundError
 
 
+class MockAsyncProcessor(MockProcessor):
+
+    def get_gsm_auth_vector_nowait(self, imsi):
+        raise SubscriberNotCachedError
+
+    async def get_gsm_auth_vector_async(self, imsi):
+        await asyncio.sleep(0)
+        if imsi == '4':
+            raise RuntimeError('store failed')
+        return self.get_gsm_auth_vector(imsi)
+
+
 class ManagerTests(unittest.TestCase):
     """
     Tests for the GSUP Manager
@@ -281,5 +331,45 @@ class ManagerTests(unittest.TestCase):
                 IEType.IMSI: '1',
             })
 
+    def test_auth_not_cached(self):
+        """
+        Test if lookups that would block are answered from the event loop
+        """
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        self._manager._gsm_processor = MockAsyncProcessor()
+
+        async def input_msgs():
+            for imsi in ('1', '2', '4'):
+                self._input_msg(
+                    MsgType.SEND_AUTH_INFO_REQ,
+                    {
+                        IEType.IMSI: imsi,
+                    })
+            # Nothing is sent until the lookups complete.
+            self._out_msgs.assert_not_called()
+            await asyncio.sleep(0.01)
+
+        loop.run_until_complete(input_msgs())
+        self._out_msgs.assert_any_call(
+            MsgType.SEND_AUTH_INFO_RSP,
+            {
+                IEType.IMSI: '1',
+                IEType.AUTH_TUPLE: _dummy_auth_tuple(),
+            })
+        self._out_msgs.assert_any_call(
+            MsgType.SEND_AUTH_INFO_ERR,
+            {
+                IEType.IMSI: '2',
+                IEType.CAUSE: ErrorCauseType.NETWORK_FAILURE,
+            })
+        # Unexpected errors are answered too, rather than left hanging.
+        self._out_msgs.assert_any_call(
+            MsgType.SEND_AUTH_INFO_ERR,
+            {
+                IEType.IMSI: '4',
+                IEType.CAUSE: ErrorCauseType.NETWORK_FAILURE,
+            })
+
 if __name__ == "__main__":
     unittest.main()
@@ -9,11 +9,17 @@ of patent rights can be found in the PATENTS file in the same directory.
 
 import asyncio
 import functools
+import socket
+import struct
+import threading
 import unittest
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
-from osmocom.gsup.protocols.ipa import OsmoCtrlManager, OsmoIPAServer
+from osmocom.gsup.protocols import ipa
+from osmocom.gsup.protocols.ipa import (IPA_STREAM_CCM, IPAWriter,
+                                        OsmoCtrlManager, OsmoIPAServer)
 from osmocom.osmocom_ctrl import OsmoCtrlClient, CtrlProcessor, MsgIdError, OsmoCtrlError
+from osmocom.osmocom_ctrl import AsyncCtrlClient, CtrlClient
 
 
 class IPATests(unittest.TestCase):
@@ -88,6 +94,54 @@ class IPATests(unittest.TestCase):
                           self.length, self.stream_id, self.payload)
 
 
+class IPABufferTests(unittest.TestCase):
+    """
+    Test class for the reuse of the IPA read and write buffers
+    """
+
+    def setUp(self):
+        self._transport = Mock(spec=asyncio.Transport)
+        self._transport.get_write_buffer_size.return_value = 0
+        self._pongs = 0
+
+        def count_pongs(memview):
+            self.assertEqual(memview.tobytes(), b'\x00\x01\xfe\x01')
+            self._pongs += 1
+
+        self._transport.write.side_effect = count_pongs
+
+    def test_write_buf_reuse(self):
+        """
+        Test if written buffers are reused, unless the transport queued them
+        """
+        writer = IPAWriter(self._transport, IPA_STREAM_CCM)
+        (buf, offset) = writer.get_write_buf(1)
+        buf[offset] = ipa.IPA_CCM_PONG
+        writer.write(buf)
+        self.assertIs(writer.get_write_buf(1)[0].obj, buf.obj)
+
+        self._transport.get_write_buffer_size.return_value = 10
+        (buf, offset) = writer.get_write_buf(1)
+        buf[offset] = ipa.IPA_CCM_PONG
+        writer.write(buf)
+        self.assertIsNot(writer.get_write_buf(1)[0].obj, buf.obj)
+
+    def test_read_buf_wraps(self):
+        """
+        Test if messages split across a compaction or growth of the read
+        buffer are parsed
+        """
+        with patch.object(ipa, 'IPA_READ_BUF_SIZE', 6):
+            protocol = OsmoIPAServer(None)
+        protocol.connection_made(self._transport)
+
+        stream = b'\x00\x01\xfe\x00' * 10
+        for step in (3, 5, 7, 40):
+            for offset in range(0, len(stream), step):
+                protocol.data_received(stream[offset:offset + step])
+        self.assertEqual(self._pongs, 40)
+
+
 class OsmoCtrlClientTests(unittest.TestCase):
     """
     Test class specific to osmo IPA client protocols
@@ -176,5 +230,157 @@ class OsmoCtrlManagerTests(unittest.TestCase):
                 response['value'] = None
         return response
 
+class FakeCtrlServer:
+    """
+    A CTRL server on a local socket. GETs of 'slow' are answered after the
+    other requests, and a SET of 'trap' is followed by a TRAP.
+    """
+    def __init__(self):
+        self.values = {'mcc': '901', 'mnc': '55', 'slow': 'done'}
+        self.connections = []
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.bind(('127.0.0.1', 0))
+        self._server.listen(4)
+        self.port = self._server.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self._server.close()
+        for conn in self.connections:
+            conn.close()
+
+    def _accept(self):
+        while True:
+            try:
+                (conn, _) = self._server.accept()
+            except OSError:
+                return
+            self.connections.append(conn)
+            threading.Thread(target=self._serve, args=(conn, ),
+                             daemon=True).start()
+
+    def _send(self, conn, lock, msg):
+        data = bytes([ipa.IPA_OSMO_CTRL]) + msg.encode('utf-8')
+        with lock:
+            conn.sendall(struct.pack('!HB', len(data), ipa.IPA_STREAM_OSMO) +
+                         data)
+
+    def _serve(self, conn):
+        lock = threading.Lock()
+        buf = b''
+        while True:
+            try:
+                data = conn.recv(4096)
+            except OSError:
+                return
+            if not data:
+                return
+            buf += data
+            while len(buf) >= 3:
+                (length, _) = struct.unpack('!HB', buf[:3])
+                if len(buf) < 3 + length:
+                    break
+                (payload, buf) = (buf[4:3 + length], buf[3 + length:])
+                self._handle(conn, lock, payload.decode('utf-8').split())
+
+    def _handle(self, conn, lock, cmd):
+        (action, msg_id, var) = cmd[:3]
+        if action == 'SET':
+            self.values[var] = cmd[3]
+            self._send(conn, lock, 'SET_REPLY %s %s %s' % (msg_id, var, cmd[3]))
+            if var == 'trap':
+                self._send(conn, lock, 'TRAP 0 trap %s' % cmd[3])
+        elif var not in self.values:
+            self._send(conn, lock, 'ERROR %s Command not found' % msg_id)
+        elif var == 'slow':
+            threading.Timer(0.05, self._send, (
+                conn, lock, 'GET_REPLY %s slow done' % msg_id)).start()
+        else:
+            self._send(conn, lock, 'GET_REPLY %s %s %s' % (
+                msg_id, var, self.values[var]))
+
+
+class AsyncCtrlClientTests(unittest.TestCase):
+    """
+    Test class for the multiplexing CTRL client
+    """
+
+    def setUp(self):
+        self._server = FakeCtrlServer()
+        self.addCleanup(self._server.close)
+        self._loop = asyncio.new_event_loop()
+        self.addCleanup(self._loop.close)
+        asyncio.set_event_loop(self._loop)
+        self.addCleanup(asyncio.set_event_loop, None)
+        self._client = AsyncCtrlClient(port=self._server.port, timeout=1.0)
+        # Let the transport finish closing
+        self.addCleanup(lambda: self._run(asyncio.sleep(0)))
+        self.addCleanup(self._client.close)
+
+    def _run(self, coro):
+        return self._loop.run_until_complete(coro)
+
+    def test_get_set(self):
+        """ GET and SET over a single connection """
+        self.assertEqual(self._run(self._client.get('mcc')), '901')
+        self.assertEqual(self._run(self._client.set('mnc', '01')), '01')
+        self.assertEqual(self._run(self._client.get('mnc')), '01')
+        self.assertEqual(len(self._server.connections), 1)
+
+    def test_multiplexed(self):
+        """ Replies out of order are matched to their requests """
+        values = self._run(self._client.get_many(['slow', 'mcc', 'mnc']))
+        self.assertEqual(values, {'slow': 'done', 'mcc': '901', 'mnc': '55'})
+        self.assertEqual(len(self._server.connections), 1)
+
+    def test_error(self):
+        """ ERROR replies fail only their own request """
+        with self.assertRaises(OsmoCtrlError):
+            self._run(self._client.get('nonexistent'))
+        self.assertEqual(self._run(self._client.get('mcc')), '901')
+
+    def test_trap(self):
+        """ TRAPs are passed to the subscribed callbacks """
+        traps = []
+        self._client.subscribe('trap', lambda var, val: traps.append(val))
+        self._client.subscribe('mcc', lambda var, val: traps.append(var))
+        self._run(self._client.set('trap', 'fired'))
+        self._run(self._client.get('mcc'))
+        self.assertEqual(traps, ['fired'])
+
+    def test_reconnect(self):
+        """ A lost connection is reopened on the next request """
+        self._run(self._client.get('mcc'))
+        self._server.connections[0].shutdown(socket.SHUT_RDWR)
+        self._run(asyncio.sleep(0.05))
+        self.assertEqual(self._run(self._client.get('mcc')), '901')
+        self.assertEqual(len(self._server.connections), 2)
+
+
+class CtrlClientTests(unittest.TestCase):
+    """
+    Test class for the blocking CTRL client facade
+    """
+
+    def setUp(self):
+        self._server = FakeCtrlServer()
+        self.addCleanup(self._server.close)
+        self._client = CtrlClient(port=self._server.port, timeout=1.0)
+        self.addCleanup(self._client.close)
+
+    def test_threads_share_connection(self):
+        """ Requests from several threads share one connection """
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            self._client.get_many(['mcc', 'slow']))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [{'mcc': '901', 'slow': 'done'}] * 4)
+        self.assertEqual(self._client.set('mcc', '001'), '001')
+        self.assertEqual(len(self._server.connections), 1)
+
+
 if __name__ == "__main__":
     unittest.main()
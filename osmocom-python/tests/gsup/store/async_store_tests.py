@@ -0,0 +1,160 @@
+"""
+Copyright (c) 2016-present, Facebook, Inc.
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree. An additional grant
+of patent rights can be found in the PATENTS file in the same directory.
+"""
+
+import asyncio
+import itertools
+import unittest
+
+from unittest.mock import patch
+
+from osmocom.gsup.store.util import SIDUtils
+from osmocom.gsup.store.async_store import AsyncStore
+from osmocom.gsup.store.base import DuplicateSubscriberError
+from osmocom.gsup.store.base import SubscriberNotCachedError
+from osmocom.gsup.store.base import SubscriberNotFoundError
+from osmocom.gsup.store.sqlite import SqliteStore
+from osmocom.gsup.store.protos.subscriber_pb2 import (GSMSubscription,
+                                                      SubscriberData)
+
+_db_ids = itertools.count()
+
+
+class AsyncStoreTests(unittest.TestCase):
+    """
+    Test class for the AsyncStore subscriber storage
+    """
+
+    def setUp(self):
+        # The executor thread needs to see the same memory db.
+        self._sqlite = SqliteStore(
+            'file:async_store_tests_%d?mode=memory&cache=shared'
+            % next(_db_ids))
+        self._sqlite.add_subscriber(
+            SubscriberData(sid=SIDUtils.to_pb('IMSI11111')))
+        self._loop = asyncio.new_event_loop()
+        self._store = AsyncStore(self._sqlite)
+
+    def tearDown(self):
+        self._store.close()
+        self._loop.close()
+
+    def _run(self, coro):
+        return self._loop.run_until_complete(coro)
+
+    def test_index_loaded(self):
+        """
+        Existing subscribers are served from memory without blocking
+        """
+        self.assertEqual(self._store.list_subscribers(), ['IMSI11111'])
+        sub = self._store.get_subscriber_data_nowait('IMSI11111')
+        self.assertEqual(SIDUtils.to_str(sub.sid), 'IMSI11111')
+        with self.assertRaises(SubscriberNotCachedError):
+            self._store.get_subscriber_data_nowait('IMSI22222')
+
+    def test_miss(self):
+        """
+        Misses are read from the persistent store, and then cached
+        """
+        self._sqlite.add_subscriber(
+            SubscriberData(sid=SIDUtils.to_pb('IMSI22222')))
+        sub = self._run(self._store.get_subscriber_data_async('IMSI22222'))
+        self.assertEqual(SIDUtils.to_str(sub.sid), 'IMSI22222')
+        self.assertEqual(
+            self._store.get_subscriber_data_nowait('IMSI22222'), sub)
+        with self.assertRaises(SubscriberNotFoundError):
+            self._run(self._store.get_subscriber_data_async('IMSI33333'))
+
+    def test_add_subscriber(self):
+        """
+        Additions are persisted, and duplicates are rejected
+        """
+        sub = SubscriberData(sid=SIDUtils.to_pb('IMSI22222'))
+        self._run(self._store.add_subscriber(sub))
+        self.assertEqual(self._sqlite.list_subscribers(),
+                         ['IMSI11111', 'IMSI22222'])
+        with self.assertRaises(DuplicateSubscriberError):
+            self._run(self._store.add_subscriber(sub))
+
+    def test_update_subscriber(self):
+        """
+        Updates are visible immediately and persisted
+        """
+        sub = SubscriberData(sid=SIDUtils.to_pb('IMSI11111'))
+        sub.gsm.state = GSMSubscription.ACTIVE
+        self._run(self._store.update_subscriber(sub))
+        self.assertEqual(
+            self._sqlite.get_subscriber_data('IMSI11111').gsm.state,
+            GSMSubscription.ACTIVE)
+        with self.assertRaises(SubscriberNotFoundError):
+            self._run(self._store.update_subscriber(
+                SubscriberData(sid=SIDUtils.to_pb('IMSI33333'))))
+
+    def test_delete_subscriber(self):
+        """
+        Deleted subscribers are gone from memory and the persistent store
+        """
+        self._run(self._store.delete_subscriber('IMSI11111'))
+        self.assertEqual(self._sqlite.list_subscribers(), [])
+        with self.assertRaises(SubscriberNotFoundError):
+            self._run(self._store.get_subscriber_data_async('IMSI11111'))
+
+    def test_change_listeners(self):
+        """
+        Listeners hear of changes as soon as readers see them
+        """
+        changes = []
+        self._store.add_change_listener(changes.append)
+        self._run(self._store.update_subscriber(
+            SubscriberData(sid=SIDUtils.to_pb('IMSI11111'))))
+        self._run(self._store.delete_subscriber('IMSI11111'))
+        self._run(self._store.resync([]))
+        self.assertEqual(changes, ['IMSI11111', 'IMSI11111', None])
+
+    def test_writes_are_batched(self):
+        """
+        Writes queued while a batch is being written share a transaction
+        """
+        subs = []
+        for i in range(10):
+            sub = SubscriberData(sid=SIDUtils.to_pb('IMSI2000%d' % i))
+            self._sqlite.add_subscriber(sub)
+            subs.append(sub)
+        self._run(self._store.resync(
+            [SubscriberData(sid=SIDUtils.to_pb('IMSI11111'))] + subs))
+        for sub in subs:
+            sub.gsm.state = GSMSubscription.ACTIVE
+
+        async def update_all():
+            await asyncio.gather(
+                *[self._store.update_subscriber(sub) for sub in subs])
+
+        with patch.object(self._sqlite, 'write_subscribers',
+                          wraps=self._sqlite.write_subscribers) as writes:
+            self._run(update_all())
+        # The first write goes out alone, the rest wait for it.
+        self.assertEqual(writes.call_count, 2)
+        self.assertEqual(sum(len(args[0]) for (args, _)
+                             in writes.call_args_list), 10)
+        for sub in subs:
+            sid = SIDUtils.to_str(sub.sid)
+            self.assertEqual(self._sqlite.get_subscriber_data(sid).gsm.state,
+                             GSMSubscription.ACTIVE)
+
+    def test_resync(self):
+        """
+        Resync replaces the subscribers in memory and on disk
+        """
+        sub = SubscriberData(sid=SIDUtils.to_pb('IMSI22222'))
+        self._run(self._store.resync([sub]))
+        self.assertEqual(self._store.list_subscribers(), ['IMSI22222'])
+        self.assertEqual(self._sqlite.list_subscribers(), ['IMSI22222'])
+
+
+if __name__ == "__main__":
+    unittest.main()
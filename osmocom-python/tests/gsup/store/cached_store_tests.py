@@ -123,6 +123,24 @@ class StoreTests(unittest.TestCase):
             with self._store.edit_subscriber('IMSI3000') as subs:
                 pass
 
+    def test_change_listeners(self):
+        """
+        Test if listeners hear of changes once they are cached
+        """
+        (sid1, _) = self._add_subscriber('IMSI11111')
+        changes = []
+
+        def listener(sid):
+            changes.append((sid, self._store.get_subscriber_data(sid1)
+                            if sid else None))
+
+        self._store.add_change_listener(listener)
+        with self._store.edit_subscriber(sid1) as subs:
+            subs.gsm.state = GSMSubscription.ACTIVE
+        self.assertEqual(changes[0][1].gsm.state, GSMSubscription.ACTIVE)
+        self._store.resync([])
+        self.assertEqual([sid for (sid, _) in changes], [sid1, None])
+
     def test_lru_cache_invl(self):
         """
         Test if LRU eviction works as expected
@@ -156,3 +174,54 @@ class StoreTests(unittest.TestCase):
         self._store.delete_all_subscribers()
         self.assertEqual(self._store.list_subscribers(), [])
         self.assertEqual(self._store._cache_list(), [])
+
+    def test_warm_up(self):
+        """
+        Test if a new store loads the ids and fills the cache in bulk
+        """
+        for sid in ('IMSI11111', 'IMSI22222', 'IMSI33333', 'IMSI44444'):
+            self._add_subscriber(sid)
+        store = CachedStore(self._store._persistent_store, 3)
+        self.assertEqual(store.list_subscribers(),
+                         ['IMSI11111', 'IMSI22222', 'IMSI33333', 'IMSI44444'])
+        self.assertEqual(store._cache_list(),
+                         ['IMSI11111', 'IMSI22222', 'IMSI33333'])
+        store.get_subscriber_data('IMSI11111')
+        store.get_subscriber_data('IMSI44444')
+        self.assertEqual(store.stats()['hits'], 1)
+        self.assertEqual(store.stats()['misses'], 1)
+        self.assertEqual(store.stats()['evictions'], 1)
+
+    def test_edit_snapshot(self):
+        """
+        Test if readers keep their snapshot while a subscriber is edited
+        """
+        (sid1, _) = self._add_subscriber('IMSI11111')
+        before = self._store.get_subscriber_data(sid1)
+        with self._store.edit_subscriber(sid1) as subs:
+            subs.gsm.state = GSMSubscription.ACTIVE
+            # Not visible until the edit completes
+            self.assertEqual(self._store.get_subscriber_data(sid1), before)
+        self.assertNotEqual(before.gsm.state, GSMSubscription.ACTIVE)
+        self.assertEqual(self._store.get_subscriber_data(sid1).gsm.state,
+                         GSMSubscription.ACTIVE)
+
+    def test_resync(self):
+        """
+        Test if resync only evicts removed subscribers
+        """
+        (sid1, _) = self._add_subscriber('IMSI11111')
+        (sid2, _) = self._add_subscriber('IMSI22222')
+
+        new_sub1 = SubscriberData(sid=SIDUtils.to_pb(sid1))
+        new_sub1.gsm.state = GSMSubscription.ACTIVE
+        new_sub3 = SubscriberData(sid=SIDUtils.to_pb('IMSI33333'))
+        self._store.resync([new_sub1, new_sub3])
+
+        self.assertEqual(self._store.list_subscribers(), [sid1, 'IMSI33333'])
+        self.assertEqual(self._store._cache_list(), [sid1])
+        sub1 = self._store.get_subscriber_data(sid1)
+        self.assertEqual(sub1.gsm.state, GSMSubscription.ACTIVE)
+        with self.assertRaises(SubscriberNotFoundError):
+            self._store.get_subscriber_data(sid2)
+
@@ -7,6 +7,9 @@ LICENSE file in the root directory of this source tree. An additional grant
 of patent rights can be found in the PATENTS file in the same directory.
 """
 
+import os
+import sqlite3
+import tempfile
 import unittest
 
 from osmocom.gsup.store.util import SIDUtils
@@ -105,6 +108,50 @@ class StoreTests(unittest.TestCase):
             with self._store.edit_subscriber('IMSI3000') as subs:
                 pass
 
+    def test_resync(self):
+        """
+        Test if resync only writes the rows that changed
+        """
+        (sid1, sub1) = self._add_subscriber('IMSI11111')
+        (sid2, sub2) = self._add_subscriber('IMSI22222')
+        self._add_subscriber('IMSI33333')
+        sub2.gsm.state = GSMSubscription.ACTIVE
+        sub4 = SubscriberData(sid=SIDUtils.to_pb('IMSI44444'))
+
+        changes = self._store.conn.total_changes
+        self._store.resync([sub1, sub2, sub4])
+        # sub2 updated, sub3 deleted, sub4 inserted; sub1 untouched
+        self.assertEqual(self._store.conn.total_changes - changes, 3)
+        self.assertEqual(sorted(self._store.list_subscribers()),
+                         [sid1, sid2, 'IMSI44444'])
+        self.assertEqual(self._store.get_subscriber_data(sid2).gsm.state,
+                         GSMSubscription.ACTIVE)
+
+    def test_schema_upgrade(self):
+        """
+        Test if a table without the state column is upgraded in place
+        """
+        sub = SubscriberData(sid=SIDUtils.to_pb('IMSI11111'))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'subscribers.db')
+            conn = sqlite3.connect(path)
+            with conn:
+                conn.execute("CREATE TABLE subscriberdb"
+                             "(subscriber_id text PRIMARY KEY, data text)")
+                conn.execute("INSERT INTO subscriberdb VALUES (?, ?)",
+                             ('IMSI11111', sub.SerializeToString()))
+            conn.close()
+
+            store = SqliteStore(path)
+            res = store.conn.execute("SELECT state FROM subscriberdb")
+            self.assertEqual(res.fetchall(), [(b'', )])
+            self.assertEqual(store.get_subscriber_data('IMSI11111'), sub)
+            res = store.conn.execute("PRAGMA journal_mode")
+            self.assertEqual(res.fetchone(), ('wal', ))
+            store.resync([sub])
+            self.assertEqual(store.list_subscribers(), ['IMSI11111'])
+            store.conn.close()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -18,6 +18,7 @@ class MockSocketTestCase(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         cls.original_socket = osmocom.vty.base.socket
+        cls.original_socket_class = osmocom.vty.base.socket.socket
         cls.mock_socket = mock.MagicMock()
         osmocom.vty.base.socket.socket = mock.Mock()
         osmocom.vty.base.socket.socket.return_value = cls.mock_socket
@@ -41,6 +42,7 @@ class MockSocketTestCase(unittest.TestCase):
     @classmethod
     def tearDownClass(cls):
         osmocom.vty.base.socket = cls.original_socket
+        osmocom.vty.base.socket.socket = cls.original_socket_class
 
     def setUp(self):
         # We mock socket.sendall to capture what is sent to the tty
@@ -12,6 +12,9 @@ from .base import MockSocketTestCase
 
 from . import get_fixture_path
 import json
+import select
+import socket
+import threading
 import unittest
 import mock
 
@@ -301,6 +304,7 @@ class DroppedConnectionTestCase(MockSocketTestCase):
         cls.vty = osmocom.vty.base.BaseVTY('OpenBSC')
 
         cls.original_socket_obj = osmocom.vty.base.socket
+        cls.original_socket_class = osmocom.vty.base.socket.socket
         cls.mock_socket_obj = mock.MagicMock()
         osmocom.vty.base.socket.socket = mock.Mock()
         osmocom.vty.base.socket.socket.return_value = cls.mock_socket_obj
@@ -313,6 +317,7 @@ class DroppedConnectionTestCase(MockSocketTestCase):
     def tearDownClass(cls):
         osmocom.vty.base.select = cls.original_select
         osmocom.vty.base.socket = cls.original_socket_obj
+        osmocom.vty.base.socket.socket = cls.original_socket_class
 
     def setUp(self):
         osmocom.vty.base.select.select = self.select_fixture
@@ -376,3 +381,103 @@ class DroppedConnectionTestCase(MockSocketTestCase):
                 v.sendrecv('')
             self.assertEqual(self.vty._socket_obj, None)
         self.assertEqual(self.vty._socket_obj, None)
+
+
+class FakeVTYServer(object):
+    """A minimal VTY on a local socket, which echoes each command and
+    answers it with one line of output.
+    """
+    def __init__(self):
+        self.connections = []
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.bind(('127.0.0.1', 0))
+        self._server.listen(4)
+        self.port = self._server.getsockname()[1]
+        thread = threading.Thread(target=self._accept)
+        thread.daemon = True
+        thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            self.connections.append(conn)
+            thread = threading.Thread(target=self._serve, args=(conn, ))
+            thread.daemon = True
+            thread.start()
+
+    def _serve(self, conn):
+        conn.sendall(b'Welcome to the OpenBSC control interface\r\nOpenBSC> ')
+        buf = b''
+        while True:
+            try:
+                data = conn.recv(4096)
+            except OSError:
+                return
+            if not data:
+                return
+            buf += data
+            while b'\r' in buf:
+                (cmd, buf) = buf.split(b'\r', 1)
+                out = b'\r\nout ' + cmd if cmd else b''
+                conn.sendall(cmd + out + b'\r\nOpenBSC> ')
+
+    def close(self):
+        self._server.close()
+        for conn in self.connections:
+            conn.close()
+
+
+class PersistentConnectionTestCase(unittest.TestCase):
+    def setUp(self):
+        # The mock socket test cases leave select mocked out
+        patcher = mock.patch.object(osmocom.vty.base, 'select', select)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.server = FakeVTYServer()
+        self.addCleanup(self.server.close)
+        self.vty = osmocom.vty.base.BaseVTY('OpenBSC', port=self.server.port,
+                                            persistent=True)
+        self.addCleanup(self.vty.close)
+
+    def test_connection_reused(self):
+        """Tests that a persistent VTY keeps its connection across
+        contexts."""
+        with self.vty as v:
+            self.assertEqual(v.sendrecv('show version'), 'out show version')
+        self.assertTrue(self.vty._socket_obj is not None)
+        with self.vty as v:
+            self.assertEqual(v.sendrecv('show network'), 'out show network')
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_reconnect(self):
+        """Tests that a persistent VTY reconnects when the VTY has
+        dropped the connection."""
+        with self.vty as v:
+            v.sendrecv('show version')
+        self.server.connections[0].shutdown(socket.SHUT_RDWR)
+        with self.vty as v:
+            self.assertEqual(v.sendrecv('show network'), 'out show network')
+        self.assertEqual(len(self.server.connections), 2)
+
+    def test_pipelined(self):
+        """Tests that pipelined responses are matched to their commands."""
+        commands = ['show subscriber id %d' % i for i in range(100)]
+        with self.vty as v:
+            self.assertEqual(v.sendrecv_many(commands),
+                             ['out ' + c for c in commands])
+
+    def test_nested_enable_mode(self):
+        """Tests that nested enable contexts only enable once."""
+        with self.vty as v:
+            with mock.patch.object(v, 'sendrecv',
+                                   wraps=v.sendrecv) as sendrecv:
+                with v.enable_mode():
+                    with v.enable_mode():
+                        self.assertTrue(v.is_enable_mode)
+                    self.assertTrue(v.is_enable_mode)
+                self.assertFalse(v.is_enable_mode)
+        self.assertEqual([c[0][0] for c in sendrecv.call_args_list],
+                         ['enable', 'disable'])
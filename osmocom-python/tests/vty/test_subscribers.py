@@ -7,6 +7,11 @@ LICENSE file in the root directory of this source tree. An additional grant
 of patent rights can be found in the PATENTS file in the same directory.
 """
 
+import os
+import sqlite3
+import tempfile
+import unittest
+
 import osmocom.vty.subscribers
 
 from .base import MockSocketTestCase
@@ -191,3 +196,80 @@ class SubscriberDeleteErrorTestCase(MockSocketTestCase):
         self.assertEqual(self.sendall_buffer, 'enable\r\n' +
         'subscriber imsi 901550000000001 delete\r\n' +
         'disable\r\n')
+
+
+class SubscriberGetManyTestCase(MockSocketTestCase):
+    fixture_file = get_fixture_path('subscriber_get_many.txt')
+
+    def test_show_many(self):
+        """Test getting a batch of subscribers in one pipelined send."""
+        with osmocom.vty.subscribers.Subscribers() as s:
+            self.sendall_buffer = ''
+            data = s.show_many('imsi', ['IMSI901550000000001',
+                                        '901550000000002',
+                                        '001501252002526'])
+        self.assertEqual(self.sendall_buffer,
+                         'show subscriber imsi 901550000000001\r' +
+                         'show subscriber imsi 901550000000002\r' +
+                         'show subscriber imsi 001501252002526\r\n')
+        self.assertEqual(len(data), 3)
+        self.assertEqual(data[0]['name'], 'Omar')
+        self.assertEqual(data[0]['imsi'], '901550000000001')
+        self.assertIsNone(data[1])
+        self.assertEqual(data[2]['name'], 'Shaddi')
+        self.assertEqual(data[2]['authorized'], '0')
+        self.assertEqual(data[2]['imsi'], '001501252002526')
+
+
+class SubscriberHLRTestCase(unittest.TestCase):
+    """Reads of the HLR database, which don't go through the VTY."""
+
+    def setUp(self):
+        fd, self.hlr_loc = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        self.addCleanup(os.remove, self.hlr_loc)
+        con = sqlite3.connect(self.hlr_loc)
+        con.executescript("""
+            CREATE TABLE Subscriber (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created TIMESTAMP NOT NULL, updated TIMESTAMP NOT NULL,
+                imsi NUMERIC UNIQUE NOT NULL, name TEXT,
+                extension TEXT UNIQUE, authorized INTEGER NOT NULL DEFAULT 0,
+                tmsi TEXT UNIQUE, lac INTEGER NOT NULL DEFAULT 0,
+                expire_lu TIMESTAMP DEFAULT NULL);
+            CREATE TABLE Equipment (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, imei NUMERIC UNIQUE);
+            CREATE TABLE EquipmentWatch (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                subscriber_id NUMERIC NOT NULL, equipment_id NUMERIC NOT NULL);
+            INSERT INTO Subscriber (created, updated, imsi, extension,
+                                    authorized, tmsi)
+                VALUES ('2016-01-01 00:00:00', '2016-01-02 00:00:00',
+                        901550000000001, '5722543', 1, '1234'),
+                       ('2016-01-01 00:00:00', '2016-01-03 00:00:00',
+                        1501252002526, '5722544', 0, NULL);
+            INSERT INTO Equipment (imei) VALUES (35513605174839);
+            INSERT INTO EquipmentWatch (subscriber_id, equipment_id)
+                VALUES (1, 1);
+            """)
+        con.commit()
+        con.close()
+        self.s = osmocom.vty.subscribers.Subscribers(hlr_loc=self.hlr_loc)
+
+    def test_hlr_subscribers(self):
+        """Test reading all the subscribers in one query."""
+        self.assertEqual(self.s.hlr_subscribers(), [
+            {'imsi': '901550000000001', 'extension': '5722543',
+             'authorized': '1', 'last_seen': '1451692800'},
+            {'imsi': '001501252002526', 'extension': '5722544',
+             'authorized': '0', 'last_seen': '1451779200'}])
+
+    def test_connection_shared(self):
+        """Test that HLR reads share one read-only connection."""
+        self.s.hlr_subscribers()
+        con = self.s._hlr_con
+        camped = self.s.camped_subscribers()
+        self.assertEqual([sub['IMSI'] for sub in camped], ['901550000000001'])
+        self.assertIs(self.s._hlr_con, con)
+        with self.assertRaises(sqlite3.OperationalError):
+            con.execute("DELETE FROM Subscriber")
@@ -32,7 +32,7 @@ def encode_num(num):
     # Below, ext=1 for some reason; use unknown numbering type, unknown
     # numbering plan.
     enc_num = (
-        to_hex2(len(snuml)/2 + 1) +  # length of number
+        to_hex2(len(snuml)//2 + 1) +  # length of number
         "81" +
         ''.join(snuml)
     )
@@ -40,8 +40,11 @@ def encode_num(num):
 
 
 def clean(s):
+    """Drops control characters and surrounding whitespace from strings, and
+    formats ints as hex."""
     if isinstance(s, str):
-        return filter(lambda x: x in string.printable, s).strip()
+        return ''.join([c for c in s
+                        if c.isprintable() or c in string.whitespace]).strip()
     elif isinstance(s, int):
         return "%X" % s
     else:
@@ -9,32 +9,68 @@ of patent rights can be found in the PATENTS file in the same directory.
 """
 
 import sys
+from collections.abc import Mapping
 
 from smspdu import SMS_SUBMIT
 
-from .rpdu import RPDU
-from .SMS_Helper import clean, smspdu_charstring_to_hex
+from .rpdu import RPData
+from .SMS_Helper import clean
+
+
+# Chatplan variable -> function of the ParsedSMS giving its value.
+EXPORTS = (
+    ("vbts_text", lambda p: clean(p.sms_submit.user_data)),
+    ("vbts_tp_user_data",
+     lambda p: p.sms_submit.tp_ud.encode('latin-1').hex().upper()),
+    ("vbts_tp_data_coding_scheme", lambda p: "%X" % p.sms_submit.tp_dcs),
+    ("vbts_tp_protocol_id", lambda p: "%X" % p.sms_submit.tp_pid),
+    ("vbts_tp_dest_address", lambda p: clean(p.sms_submit.tp_da)),
+    ("vbts_tp_dest_address_type", lambda p: "%X" % p.sms_submit.tp_toa),
+    ("vbts_tp_message_type", lambda p: "%X" % p.sms_submit.tp_mti),
+    ("vbts_rp_dest_address", lambda p: p.rp_data.rp_destination_address),
+    ("vbts_rp_originator_address",
+     lambda p: p.rp_data.rp_originator_address),
+    ("vbts_rp_originator_address_type",
+     lambda p: p.rp_data.rp_originator_address_type),
+    ("vbts_rp_message_reference", lambda p: p.rp_data.rp_message_reference),
+    ("vbts_rp_message_type", lambda p: p.rp_data.rp_mti),
+)
+
+_EXPORTS = dict(EXPORTS)
+
+
+class ParsedSMS(Mapping):
+    """An MO SMS, as a read-only mapping of the EXPORTS variables.
+
+    The RP-DATA is split into fields up front, but the SMS-SUBMIT it carries
+    is only decoded when a TP variable is first read.
+    """
+
+    __slots__ = ('rp_data', '_sms_submit')
+
+    def __init__(self, rp_message):
+        self.rp_data = RPData(rp_message)
+        self._sms_submit = None
+
+    @property
+    def sms_submit(self):
+        if self._sms_submit is None:
+            self._sms_submit = SMS_SUBMIT.fromPDU(
+                self.rp_data.tpdu, self.rp_data.rp_originator_address)
+        return self._sms_submit
+
+    def __getitem__(self, key):
+        return _EXPORTS[key](self)
+
+    def __iter__(self):
+        return (key for (key, _) in EXPORTS)
+
+    def __len__(self):
+        return len(EXPORTS)
 
 
 def parse(rp_message):
-    rpdu = RPDU.fromPDU(rp_message)
-    sms_submit = SMS_SUBMIT.fromPDU(rpdu.user_data, rpdu.rp_originator_address)
-    exports = [
-        ("vbts_text", sms_submit.user_data),
-        ("vbts_tp_user_data", smspdu_charstring_to_hex(sms_submit.tp_ud)),
-        ("vbts_tp_data_coding_scheme", sms_submit.tp_dcs),
-        ("vbts_tp_protocol_id", sms_submit.tp_pid),
-        ("vbts_tp_dest_address", sms_submit.tp_da),
-        ("vbts_tp_dest_address_type", sms_submit.tp_toa),
-        ("vbts_tp_message_type", sms_submit.tp_mti),
-        ("vbts_rp_dest_address", rpdu.rp_destination_address),
-        ("vbts_rp_originator_address", rpdu.rp_originator_address),
-        ("vbts_rp_originator_address_type", rpdu.rp_originator_address_type),
-        ("vbts_rp_message_reference", rpdu.rp_message_reference),
-        ("vbts_rp_message_type", rpdu.rp_mti)
-    ]
-    exports = [(x, clean(y)) for (x, y) in exports]
-    return exports
+    return list(ParsedSMS(rp_message).items())
 
 if __name__ == '__main__':
     h = "001000038100000e05df04810011000005cbb7fb0c02"
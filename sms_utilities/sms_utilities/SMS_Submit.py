@@ -12,6 +12,7 @@ import random
 import sys
 
 from smspdu import SMS_SUBMIT
+from smspdu import concat
 
 from . import SMS_Helper
 
@@ -38,16 +39,30 @@ def gen_rp_header(ref, empty):
     return rp_header
 
 
-def gen_msg(to, text, empty=False):
+def gen_rp_data(tpdu, empty=False):
     # Note we are constructing a RPDU which encapsulates a TPDU.
     ref = str(SMS_Helper.to_hex2(random.randint(0, 255)))
     rp_header = gen_rp_header(ref, empty)
-    tpdu = gen_tpdu(ref, to, text, empty)
-    tp_len = len("".join(tpdu)) / 2  # In octets.
-    body = rp_header + [SMS_Helper.to_hex2(tp_len)] + tpdu
+    tp_len = len(tpdu) // 2  # In octets.
+    body = rp_header + [SMS_Helper.to_hex2(tp_len), tpdu]
     return "".join(body)
 
 
+def gen_msg(to, text, empty=False):
+    tpdu = gen_tpdu(None, to, text, empty)
+    return gen_rp_data("".join(tpdu), empty)
+
+
+def gen_msgs(to, text, empty=False):
+    """Like gen_msg, but a text too long for one SMS is split into the
+    parts of a concatenated SMS, each in its own RPDU.
+    """
+    if empty:
+        return [gen_msg(to, text, empty)]
+    return [gen_rp_data(tpdu.toPDU())
+            for tpdu in concat.create_submit(None, to, text)]
+
+
 if __name__ == '__main__':
     to = "101"
     msg = "Test Message"
@@ -9,6 +9,21 @@ of patent rights can be found in the PATENTS file in the same directory.
 """
 
 
+# RP-DATA (MS to network), 3GPP TS 24.011 section 7.3.1.2, as (field name,
+# length prefixed). A length prefixed field is an octet giving the length of
+# its contents, followed by the contents.
+RP_DATA_LAYOUT = (
+    ('rp_mti', False),
+    ('rp_message_reference', False),
+    ('rp_originator_address', True),
+    ('rp_destination_address', True),
+    ('user_data', True),
+)
+
+# The two BCD digits of an address octet, low semi-octet first.
+_SEMI_OCTETS = ['%x%x' % (b & 0xf, b >> 4) for b in range(256)]
+
+
 def strip_fs(s):
     if len(s) == 0:
         return s
@@ -19,48 +34,112 @@ def strip_fs(s):
 
 
 def reverse_byte_order(o):
-    i = 0
-    res = ''
-    while i < len(o):
-        res += o[i+1]
-        res += o[i]
-        i += 2
-    return res
-
-
-def n_bytes(h, n):
-    (hex_str, index) = h
-    return (hex_str[index:index+n], (hex_str, index+n))
-
-
-def get_rp_message_type(h):
-    return n_bytes(h, 2)
-
-
-def get_rp_message_reference(h):
-    return n_bytes(h, 2)
-
-
-def get_rp_address(h):
-    (num_octets, h) = n_bytes(h, 2)
-    num_octets = int(num_octets, 16)
-    (rp_dest_address_type, h) = n_bytes(h, 2)
-    # Minus for address type, *2 as octets.
-    (rp_dest_address, h) = n_bytes(h, (num_octets-1)*2)
-    return (rp_dest_address_type,
-            strip_fs(reverse_byte_order(rp_dest_address)), h)
-
-
-def get_rp_destination_address(h):
-    return n_bytes(h, 2)
-
-
-def get_rp_user_data(h):
-    (num_octets, h) = n_bytes(h, 2)
-    num_octets = int(num_octets, 16)*2
-    if (len(h[0]) - h[1]) != num_octets:
+    return ''.join([b + a for (a, b) in zip(o[::2], o[1::2])])
+
+
+def parse_fields(octets):
+    """Walks RP_DATA_LAYOUT over the octets of a message, in one pass.
+
+    Returns a dict of field name to the (start, end) offsets of the field's
+    contents.
+    """
+    spans = {}
+    index = 0
+    for (name, length_prefixed) in RP_DATA_LAYOUT:
+        if not length_prefixed:
+            start, end = index, index + 1
+        elif index < len(octets):
+            start = index + 1
+            end = start + octets[index]
+        else:
+            raise Exception("MALFORMED MESSAGE: Missing %s" % name)
+        if end > len(octets) and name != 'user_data':
+            raise Exception("MALFORMED MESSAGE: Truncated %s" % name)
+        spans[name] = (start, end)
+        index = end
+    if index != len(octets):
         raise Exception("MALFORMED MESSAGE: Bad RP-User-Data length")
-    return h
+    return spans
+
+
+class RPData(object):
+    """An RP-DATA message, from its hex string or its octets.
+
+    The message is converted to octets and split into fields in one pass;
+    each field is only decoded when it is read.
+    """
+
+    __slots__ = ('_hex', '_octets', '_spans')
+
+    def __init__(self, rp_message):
+        if isinstance(rp_message, str):
+            try:
+                octets = bytes.fromhex(rp_message)
+            except ValueError:
+                raise Exception("MALFORMED MESSAGE: Not a hex string")
+            # Hex fields are sliced from the message, unless fromhex skipped
+            # whitespace in it.
+            if len(rp_message) != 2 * len(octets):
+                rp_message = None
+        else:
+            octets = bytes(rp_message)
+            rp_message = None
+        self._hex = rp_message
+        self._octets = memoryview(octets)
+        self._spans = parse_fields(self._octets)
+
+    def _field_hex(self, start, end):
+        if self._hex is not None:
+            return self._hex[2 * start:2 * end]
+        return self._octets[start:end].hex()
+
+    def _address(self, name):
+        """Returns the type and digits of an address field.
+
+        An empty address, like the originator of an MO message, has the
+        RPDU default type.
+        """
+        (start, end) = self._spans[name]
+        if start == end:
+            return ("81", "")
+        digits = ''.join([_SEMI_OCTETS[b]
+                          for b in self._octets[start + 1:end]])
+        return (self._field_hex(start, start + 1), strip_fs(digits))
+
+    @property
+    def rp_mti(self):
+        return self._field_hex(*self._spans['rp_mti'])
+
+    @property
+    def rp_message_reference(self):
+        return self._field_hex(*self._spans['rp_message_reference'])
+
+    @property
+    def rp_originator_address_type(self):
+        return self._address('rp_originator_address')[0]
+
+    @property
+    def rp_originator_address(self):
+        return self._address('rp_originator_address')[1]
+
+    @property
+    def rp_destination_address_type(self):
+        return self._address('rp_destination_address')[0]
+
+    @property
+    def rp_destination_address(self):
+        return self._address('rp_destination_address')[1]
+
+    @property
+    def user_data(self):
+        """The TPDU, as a hex string."""
+        return self._field_hex(*self._spans['user_data'])
+
+    @property
+    def tpdu(self):
+        """The TPDU, as a memoryview of its octets."""
+        (start, end) = self._spans['user_data']
+        return self._octets[start:end]
 
 
 class RPDU:
@@ -83,17 +162,9 @@ class RPDU:
 
     @classmethod
     def fromPDU(cls, rp_message):
-        rp_message = (rp_message, 0)
-        (rp_message_type, rp_message) = get_rp_message_type(rp_message)
-        (rp_message_reference, rp_message) = (
-            get_rp_message_reference(rp_message))
-        (rp_originator_address_type, rp_originator_address, rp_message) = (
-            get_rp_address(rp_message))
-        (rp_dest_address_type, rp_dest_address, rp_message) = (
-            get_rp_address(rp_message))
-
-        rp_user_data = get_rp_user_data(rp_message)
-        rp_user_data = rp_user_data[0][rp_user_data[1]:]
-        return cls(rp_message_type, rp_message_reference,
-                   rp_originator_address, rp_dest_address, rp_user_data)
-
+        rp_data = RPData(rp_message)
+        return cls(rp_data.rp_mti, rp_data.rp_message_reference,
+                   rp_data.rp_originator_address,
+                   rp_data.rp_destination_address, rp_data.user_data,
+                   rp_data.rp_destination_address_type,
+                   rp_data.rp_originator_address_type)
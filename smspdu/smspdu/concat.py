@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2016-present, Facebook, Inc.
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree. An additional grant
+of patent rights can be found in the PATENTS file in the same directory.
+"""
+
+'''Concatenated SMS (3GPP TS 23.040 9.2.3.24.1).
+
+Texts too long for one SMS are split into parts that each carry a
+concatenation user data header, and are joined back up by the handset.
+segment() splits a text, create_deliver() and create_submit() build the
+PDUs of the parts, and Reassembler joins up the parts of received messages.
+'''
+
+import random
+import threading
+import time
+
+from collections import OrderedDict
+
+from .gsm0338 import is_gsm7, split_septets
+from .pdu import SMS_DELIVER, SMS_SUBMIT
+
+# TP-DCS values for the default alphabet and UCS-2
+GSM7 = 0x00
+UCS2 = 0x08
+
+# TP-DCS -> (length of a single message, length of each part of a
+# concatenated message), in septets for GSM7 and UTF-16 code units for UCS2.
+# A part loses six of its 140 octets to the header: the UDHL and a 5 octet
+# concatenation IE.
+LIMITS = {
+    GSM7: (160, 153),
+    UCS2: (70, 67),
+}
+
+# the sequence number of a part is a single octet
+MAX_PARTS = 255
+
+# concatenation IEs, with 8 and 16 bit reference numbers
+IE_CONCAT_8BIT = 0x00
+IE_CONCAT_16BIT = 0x08
+
+
+def _split_utf16(text, limit):
+    '''Splits text into runs of at most limit UTF-16 code units each,
+    keeping surrogate pairs whole.
+    '''
+    if not text or max(text) <= '\uffff':
+        return [text[i:i + limit] for i in range(0, len(text), limit)] or ['']
+    runs = []
+    start = units = 0
+    for i, c in enumerate(text):
+        n = 2 if c > '\uffff' else 1
+        if units + n > limit:
+            runs.append(text[start:i])
+            start, units = i, 0
+        units += n
+    runs.append(text[start:])
+    return runs
+
+
+def segment(text):
+    '''Split the unicode text into the parts of a concatenated SMS.
+
+    Return (tp_dcs, parts). The text is sent in the GSM 03.38 default
+    alphabet if it can be, and as UCS-2 otherwise. A text that fits in a
+    single message is returned as the only part.
+
+    Raise ValueError if the text needs more than MAX_PARTS parts.
+    '''
+    if is_gsm7(text):
+        tp_dcs, split = GSM7, split_septets
+    else:
+        tp_dcs, split = UCS2, _split_utf16
+    single, per_part = LIMITS[tp_dcs]
+    parts = split(text, single)
+    if len(parts) > 1:
+        parts = split(text, per_part)
+    if len(parts) > MAX_PARTS:
+        raise ValueError('message too long (%d>%d parts)' %
+                         (len(parts), MAX_PARTS))
+    return tp_dcs, parts
+
+
+def concat_headers(ref, total, seq):
+    '''The user data headers of part seq (from 1) of total parts.
+    '''
+    return [(IE_CONCAT_8BIT, [ref, total, seq])]
+
+
+def _create(cls, sender, recipient, text, ref, **kw):
+    tp_dcs, parts = segment(text)
+    if len(parts) == 1:
+        return [cls.create(sender, recipient, text, tp_dcs=tp_dcs, **kw)]
+    if ref is None:
+        ref = random.randint(0, 255)
+    return [cls.create(sender, recipient, part, tp_dcs=tp_dcs,
+                       user_data_headers=concat_headers(ref, len(parts), seq),
+                       **kw)
+            for seq, part in enumerate(parts, 1)]
+
+
+def create_deliver(sender, recipient, text, ref=None, **kw):
+    '''Create the SMS_DELIVERs of a text, one per part.
+
+    "ref" is the concatenated message reference number, random if not
+    given; other arguments are passed on to SMS_DELIVER.create().
+    '''
+    return _create(SMS_DELIVER, sender, recipient, text, ref, **kw)
+
+
+def create_submit(sender, recipient, text, ref=None, **kw):
+    '''Create the SMS_SUBMITs of a text, one per part.
+
+    "ref" is the concatenated message reference number, random if not
+    given; other arguments are passed on to SMS_SUBMIT.create().
+    '''
+    return _create(SMS_SUBMIT, sender, recipient, text, ref, **kw)
+
+
+def concat_info(user_data_headers):
+    '''Return (ref, total, seq) from the concatenation header of a message,
+    or None if it isn't part of a concatenated message.
+    '''
+    for ie, val in user_data_headers:
+        if ie == IE_CONCAT_8BIT and len(val) == 3:
+            ref, total, seq = val
+        elif ie == IE_CONCAT_16BIT and len(val) == 4:
+            ref, total, seq = (val[0] << 8) | val[1], val[2], val[3]
+        else:
+            continue
+        if 1 <= seq <= total and total > 1:
+            return ref, total, seq
+    return None
+
+
+class Reassembler(object):
+    '''Collects the parts of received concatenated messages.
+
+    Parts are grouped by the sender and the reference number of their
+    message. A message whose last part hasn't arrived within timeout seconds
+    of its first is evicted, as is the oldest message when more than
+    max_pending are waiting for parts.
+
+    Safe to use from several threads.
+    '''
+
+    def __init__(self, timeout=600, max_pending=1000, clock=time.time):
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.clock = clock
+        self.lock = threading.Lock()
+        # (sender, ref, total) -> (time of first part, {seq: text})
+        self._pending = OrderedDict()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, sender, sms):
+        '''Add a received SMS_SUBMIT or SMS_DELIVER from sender.
+
+        Return the whole text once every part of its message has arrived,
+        or None while parts are outstanding. A message that isn't
+        concatenated is returned as it is.
+        '''
+        info = concat_info(sms.user_data_headers)
+        if info is None:
+            return sms.user_data
+        ref, total, seq = info
+        key = (sender, ref, total)
+        with self.lock:
+            now = self.clock()
+            self._evict(now)
+            if key not in self._pending:
+                self._pending[key] = (now, {})
+                if len(self._pending) > self.max_pending:
+                    self._pending.popitem(last=False)
+            parts = self._pending[key][1]
+            parts[seq] = sms.user_data
+            if len(parts) < total:
+                return None
+            del self._pending[key]
+        return ''.join(parts[i] for i in range(1, total + 1))
+
+    def evict(self):
+        '''Evict the messages that have timed out, and return their keys.
+        '''
+        with self.lock:
+            return self._evict(self.clock())
+
+    def _evict(self, now):
+        evicted = []
+        for key, (first_seen, _) in self._pending.items():
+            if now - first_seen < self.timeout:
+                break
+            evicted.append(key)
+        for key in evicted:
+            del self._pending[key]
+        return evicted
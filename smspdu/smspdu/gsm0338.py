@@ -23,6 +23,14 @@ gencodec.py.
 # Ref: http://mail.python.org/pipermail/python-list/2002-October/167271.html
 
 import codecs
+import re
+
+try:
+    unichr
+except NameError:
+    # Python 3
+    unichr = chr
+    unicode = str
 
 ### Codec APIs
 
@@ -37,68 +45,113 @@ class CharCodec(codecs.Codec):
 
 
 class Codec(codecs.Codec):
+    """GSM 03.38 default alphabet codec.
+
+    Encoding and decoding go through precompiled str.translate tables (see
+    the bottom of this module), so whole messages are mapped in one call.
+    Extension table characters encode to an escape and a second char.
+    """
+
     def encode(self, input, errors='strict'):
-        result = []
-        for n, c in enumerate(input):
-            try:
-                value = encoding_map[ord(c)]
-                if value > 255:
-                    result.append(value >> 8)
-                result.append(value & 0xff)
-            except KeyError:
-                try:
-                    extra = extra_encoding_map[ord(c)]
-                    result.extend([0x001b, extra])
-                except KeyError:
-                    if errors == 'strict':
-                        raise UnicodeEncodeError('GSM-0338', input, n, n + 1,
-                                                 'character not in map')
-                    elif errors == 'replace':
-                        result.append(0x3f)  # ?
-                    elif errors == 'ignore':
-                        pass
-                    else:
-                        raise UnicodeError("unknown error handling")
-        return ''.join([chr(x) for x in result])
+        if not isinstance(input, unicode):
+            # Python 2 str
+            input = input.decode('latin-1')
+        bad = _UNENCODABLE.search(input)
+        if bad is not None:
+            if errors == 'strict':
+                n = bad.start()
+                raise UnicodeEncodeError('GSM-0338', input, n, n + 1,
+                                         'character not in map')
+            elif errors == 'replace':
+                input = _UNENCODABLE.sub('?', input)
+            elif errors == 'ignore':
+                input = _UNENCODABLE.sub('', input)
+            else:
+                raise UnicodeError("unknown error handling")
+        return input.translate(_ENCODE_TABLE)
 
     def decode(self, input, errors='strict'):
-        result = []
+        if not isinstance(input, unicode):
+            input = memoryview(input).tobytes().decode('latin-1')
+        if '\x1b' not in input:
+            result = _decode_unescaped(input, input, 0)
+            return result, len(result)
+        parts = []
         index = 0
-        while index < len(input):
-            c = input[index]
-            index += 1
-            if c == '\x1b':
-                if index < len(input):
-                    c = input[index]
-                    index += 1
-                    # try looking up the escaped encoding map but revert
-                    # to the normal encoding map give up if the input is
-                    # crap (the correct behavior in at least one case)
-                    oc = ord(c)
-                    if oc in extra_decoding_map:
-                        result.append(extra_decoding_map[oc])
-                    elif oc in decoding_map:
-                        result.append(decoding_map[oc])
-                    else:
-                        raise ValueError('invalid escape code 0x%02x' % oc)
-                elif errors == 'replace':
-                    result.append(ord('?'))
-                elif errors == 'ignore':
-                    pass
+        for escape in _ESCAPE.finditer(input):
+            parts.append(_decode_unescaped(input, input[index:escape.start()],
+                                           index))
+            index = escape.end()
+            c = escape.group(1)
+            if c:
+                # try looking up the escaped encoding map but revert
+                # to the normal encoding map give up if the input is
+                # crap (the correct behavior in at least one case)
+                oc = ord(c)
+                if oc in extra_decoding_map:
+                    parts.append(unichr(extra_decoding_map[oc]))
+                elif oc in decoding_map:
+                    parts.append(unichr(decoding_map[oc]))
                 else:
-                    raise ValueError('truncated data')
+                    raise ValueError('invalid escape code 0x%02x' % oc)
+            elif errors == 'replace':
+                parts.append('?')
+            elif errors == 'ignore':
+                pass
             else:
-                try:
-                    result.append(decoding_map[ord(c)])
-                except KeyError:
-                    # error handling: unassigned byte, must be > 0x7f
-                    raise UnicodeDecodeError('GSM-0338', input, index, index + 1,
-                                             'ordinal not in range(128)')
-        try:
-            return "".join([chr(x) for x in result]), len(result)
-        except Exception as e:
-            print("err", result)
-            raise e
+                raise ValueError('truncated data')
+        parts.append(_decode_unescaped(input, input[index:], index))
+        result = ''.join(parts)
+        return result, len(result)
+
+
+def _decode_unescaped(input, text, offset):
+    """Decodes text, a run of input at offset with no escapes in it."""
+    bad = _UNDECODABLE.search(text)
+    if bad is not None:
+        # error handling: unassigned byte, must be > 0x7f
+        index = offset + bad.start() + 1
+        raise UnicodeDecodeError('GSM-0338',
+                                 input.encode('latin-1', 'replace'),
+                                 index, index + 1,
+                                 'ordinal not in range(128)')
+    return text.translate(_DECODE_TABLE)
+
+
+def is_gsm7(text):
+    """Whether text can be encoded with the GSM 03.38 default alphabet,
+    without encoding it.
+    """
+    return _UNENCODABLE.search(text) is None
+
+
+def septet_count(text):
+    """The number of septets text encodes to, without encoding it.
+
+    Extension table characters take two septets. Characters that can't be
+    encoded count as one, as they would with errors='replace'.
+    """
+    return len(text) + len(_EXTENDED.findall(text))
+
+
+def split_septets(text, limit):
+    """Splits text into runs of at most limit septets each, keeping every
+    extension table character whole.
+    """
+    extended = set(_EXTENDED.findall(text))
+    if not extended:
+        return [text[i:i + limit] for i in range(0, len(text), limit)] or ['']
+    runs = []
+    start = septets = 0
+    for i, c in enumerate(text):
+        n = 2 if c in extended else 1
+        if septets + n > limit:
+            runs.append(text[start:i])
+            start, septets = i, 0
+        septets += n
+    runs.append(text[start:])
+    return runs
+
 
 class StreamWriter(Codec, codecs.StreamWriter):
     pass
@@ -275,6 +328,32 @@ decoding_map = {0x0000: 0x0040,  # COMMERCIAL AT
 encoding_map = codecs.make_encoding_map(decoding_map)
 extra_encoding_map = codecs.make_encoding_map(extra_decoding_map)
 
+### Translation Tables
+
+def _encoded(value):
+    if value > 255:
+        return unichr(value >> 8) + unichr(value & 0xff)
+    return unichr(value)
+
+# unicode ordinal -> GSM chars; the main map wins over the extension table
+_ENCODE_TABLE = dict((k, '\x1b' + unichr(v))
+                     for k, v in extra_encoding_map.items())
+_ENCODE_TABLE.update((k, _encoded(v)) for k, v in encoding_map.items())
+
+# GSM ordinal -> unicode char, for everything but escapes
+_DECODE_TABLE = dict((k, unichr(v)) for k, v in decoding_map.items()
+                     if k < 256)
+
+
+def _char_class(ordinals):
+    return ''.join(re.escape(unichr(o)) for o in sorted(ordinals))
+
+_UNENCODABLE = re.compile('[^%s]' % _char_class(_ENCODE_TABLE))
+_EXTENDED = re.compile('[%s]' % _char_class(
+    k for k, v in _ENCODE_TABLE.items() if len(v) == 2))
+_UNDECODABLE = re.compile('[^%s]' % _char_class(_DECODE_TABLE))
+_ESCAPE = re.compile('\x1b(.?)', re.DOTALL)
+
 if __name__ == '__main__':
     import string
     c = Codec()
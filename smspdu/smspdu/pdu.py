@@ -19,11 +19,18 @@ See http://www.dreamfabric.com/sms/ for a description which lacks some of
 the detail of the book.
 """
 
+import binascii
 import re
 import time
 import unicodedata
 from . import gsm0338
 
+try:
+    unicode
+except NameError:
+    # Python 3
+    unicode = str
+
 SMS_TYPES = 'SMS-DELIVER SMS-SUBMIT SMS-STATUS-REPORT RESERVED'.split()
 
 
@@ -39,27 +46,54 @@ class TruncatedPDUError(PDUDecodeError):
     pass
 
 
-class PDUData(list):
+class PDUData(object):
+    '''A read cursor over the octets of a TPDU.
+
+    The TPDU may be given as a hex string (any str on Python 2) or as raw
+    octets (bytes, bytearray or memoryview). It is converted to octets once,
+    and every read advances an offset into them, so decoding is linear in
+    the PDU length.
+    '''
+
+    def __init__(self, tpdu):
+        if isinstance(tpdu, (str, unicode)):
+            try:
+                # a trailing odd nybble isn't part of any octet
+                tpdu = bytearray.fromhex(tpdu[:len(tpdu) & ~1])
+            except ValueError:
+                raise PDUDecodeError('PDU is not hex encoded: %r' % tpdu)
+        self._data = bytearray(tpdu)
+        self._pos = 0
+
+    def remaining(self):
+        return len(self._data) - self._pos
+
+    def take(self, num):
+        '''Return the next num octets as a bytearray.'''
+        start = self._pos
+        end = start + int(num)
+        if end > len(self._data):
+            raise TruncatedPDUError('PDU is truncated')
+        self._pos = end
+        return self._data[start:end]
 
     def int(self):
-        return int(self.bytes(1), 16)
+        return self.take(1)[0]
 
     def byte(self):
         return self.bytes(1)
 
     def bytes(self, num):
-        try:
-            return ''.join([self.pop(0) + self.pop(0) for i in range(int(num))])
-        except IndexError:
-            raise TruncatedPDUError('PDU is truncated')
+        return binascii.hexlify(self.take(num)).decode('ascii').upper()
 
     def octets(self, num=None):
-        if num is not None:
-            buf = self.bytes(num)
-        else:
-            buf = self.bytes(len(self) / 2)
-        return ''.join([chr(int(c1 + c2, 16))
-                       for c1, c2 in zip(buf[::2], buf[1::2])])
+        if num is None:
+            num = self.remaining()
+        octets = bytes(self.take(num))
+        if str is bytes:
+            # Python 2 keeps octets in a str, as it always has
+            return octets
+        return octets.decode('latin-1')
 
 
 class SMS_GENERIC(object):
@@ -297,8 +331,9 @@ class SMS_GENERIC(object):
 
         elif codec == 'ucs2':
             # UCS2
-            user_data = str(user_data.encode('utf_16_be', 'replace'))
-            length = len(user_data)
+            user_data = user_data.encode('utf_16_be',
+                                         'replace').decode('latin-1')
+            length = len(user_data) + len(tp_ud)
             if length > 140:
                 raise ValueError('UCS-2 message too long (%d>140 chars)' %
                                  length)
@@ -976,10 +1011,9 @@ def guess_dcs(message):
     '''
     # figure encoding and add TP-DCS, TP-UDL and TP-UD (enforcing the 140
     # octet maximum length of TP-UD)
-    c = gsm0338.Codec()
-    try:
+    if gsm0338.is_gsm7(message):
         # GSM-0338 (7-bit)
-        length = len(c.encode(message))
+        length = gsm0338.septet_count(message)
 
         # TP-User-Data-Length -- number of septets (characters)
         if length > 160:
@@ -987,7 +1021,7 @@ def guess_dcs(message):
                              length)
 
         return 0
-    except UnicodeError:
+    else:
         # UCS2 (well, UTF-16) big-endian
         length = len(message.encode('utf_16_be'))
         if length > 140:
@@ -1011,11 +1045,10 @@ def generate_mwi_dcs(type, active, message):
         return message, dcs | 0xC0
 
     message, x = attempt_encoding(message)
-    try:
-        gsm0338.Codec().encode(message)
+    if gsm0338.is_gsm7(message):
         # code with GSM 0338
         return message, dcs | 0xD0
-    except UnicodeError:
+    else:
         # code with UCS2
         return message, dcs | 0xE0
 
@@ -1056,13 +1089,18 @@ def parse_udhi(data, debug=False):
 
 
 def unpack8bit(bytes):
-    bytes = [ord(x) for x in bytes]
-    return ''.join([chr(x) for x in bytes])
+    if isinstance(bytes, str):
+        return bytes
+    if isinstance(bytes, unicode):
+        return bytes.encode('latin-1')  # Python 2
+    return memoryview(bytes).tobytes().decode('latin-1')
 
 
 def unpackUCS2(buf):
     # XXX(omar) hocus pocus
-    return buf.encode('latin1').decode('UTF-16-be')
+    if isinstance(buf, unicode):
+        buf = buf.encode('latin1')
+    return buf.decode('UTF-16-be')
 
 
 def decompress_user_data(bytes):
@@ -1231,10 +1269,17 @@ def unpack7bit(bytes, hl=0):
     """ Unpack a 7 bit ASCII string that's been packed into an 8 bit string
         Of course, it's &^$*&$ little endian.
 
+        The input is a str of octets (chars 0-255) or a bytes-like object;
+        the septets are returned as a str. Each octet is read once, with the
+        masks for the current bit offset looked up in _sevenBitMasksUnpack.
+
         See http://www.dreamfabric.com/sms/hello.html for an example
     """
-    bytes = [ord(x) for x in bytes]
-    out = []
+    if isinstance(bytes, unicode):
+        bytes = bytes.encode('latin-1')
+    octets = bytearray(bytes)
+    n = len(octets)
+    out = bytearray()
     if hl == 0:
         curOff = 0
     else:
@@ -1248,25 +1293,22 @@ def unpack7bit(bytes, hl=0):
         # capable of displaying the SM itself although the TP-UD Header
         # in the TP-UD field may not be understood. Please kill me now.
         curOff = (7 - ((8 * hl + 1) % 7)) % 7
-    while bytes:
+    i = 0
+    while i < n:
         masks = _sevenBitMasksUnpack[curOff]
         if len(masks) == 1:
-            mask, shift = masks[0]
-            out.append((bytes[0] & mask) >> shift)
+            out.append(octets[i] & 0x7F)
         else:
             (mask0, shift0), (mask1, shift1) = masks
-            if len(bytes) == 1:
-                b = ((bytes[0] & mask0) >> shift0)
+            b = (octets[i] & mask0) >> shift0
+            i += 1
+            if i == n:
                 if b:
                     out.append(b)
                 break
-            else:
-                out.append(((bytes[0] & mask0) >> shift0) |
-                           ((bytes[1] & mask1) << shift1))
-                bytes = bytes[1:]
+            out.append(b | ((octets[i] & mask1) << shift1))
         curOff = (curOff + 7) % 8
-    bytes = ''.join([chr(x) for x in out])
-    return bytes
+    return out.decode('latin-1')
 
 
 _sevenBitMasksPack = (
@@ -1486,6 +1528,10 @@ def replace_gsm_doubles(u):
     return ''.join([REPLACE.get(c, c) for c in u])
 
 
+# control codes that attempt_encoding replaces
+_CONTROL_CODES = re.compile('[\x00-\x09\x0b\x0c\x0e-\x1f]')
+
+
 def attempt_encoding(u, limit=160):
     '''Given the input unicode string attempt to encode it for SMS delivery.
 
@@ -1508,11 +1554,17 @@ def attempt_encoding(u, limit=160):
     Returns two things: the potentially-translated and truncated string and
     the string containing any excess characters.
     '''
+    # Most messages are plain GSM-0338 and fit; check that without
+    # encoding them.
+    if (gsm0338.is_gsm7(u) and not _CONTROL_CODES.search(u) and
+            gsm0338.septet_count(u) <= limit):
+        return (u, '')
+
     # Attempt to encode with GSM-0338 + translations
     gsm = gsm0338.Codec()
     l = []
     e = []
-    s = ''
+    n = 0
     for c in u:
         # replace all control codes
         if ord(c) < 0x20 and c not in '\r\n':
@@ -1531,8 +1583,8 @@ def attempt_encoding(u, limit=160):
             except UnicodeError:
                 # translated but we still can't GSM encode
                 break
-        s += t
-        if len(s) > limit:
+        n += len(t)
+        if n > limit:
             e.append(c)
         else:
             l.append(c)
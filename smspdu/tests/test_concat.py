@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2016-present, Facebook, Inc.
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree. An additional grant
+of patent rights can be found in the PATENTS file in the same directory.
+"""
+import time
+import unittest
+
+from smspdu import SMS_DELIVER, SMS_SUBMIT
+from smspdu import concat
+from smspdu.gsm0338 import split_septets
+
+BROADCAST = ('Community meeting on Saturday at 10am in the market hall. '
+             'All subscribers welcome! ' * 12)
+BROADCAST_UCS2 = 'Собрание в субботу в 10 утра. ' * 30
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Concat_Test(unittest.TestCase):
+
+    def test_single_part(self):
+        self.assertEqual(concat.segment('a' * 160), (concat.GSM7, ['a' * 160]))
+        self.assertEqual(concat.segment('Ж' * 70), (concat.UCS2, ['Ж' * 70]))
+        self.assertEqual(concat.segment(''), (concat.GSM7, ['']))
+        s = concat.create_deliver('123', '456', 'hello')
+        self.assertEqual(len(s), 1)
+        self.assertEqual(s[0].user_data_headers, [])
+
+    def test_segment_gsm7(self):
+        tp_dcs, parts = concat.segment('a' * 161)
+        self.assertEqual(tp_dcs, concat.GSM7)
+        self.assertEqual([len(p) for p in parts], [153, 8])
+
+    def test_segment_escapes(self):
+        # the euro sign takes two septets, and can't be split
+        tp_dcs, parts = concat.segment('a' * 152 + '€' + 'b' * 10)
+        self.assertEqual(tp_dcs, concat.GSM7)
+        self.assertEqual(parts, ['a' * 152, '€' + 'b' * 10])
+        self.assertEqual(split_septets('[]' * 3, 3), ['[', ']', '[', ']',
+                                                      '[', ']'])
+
+    def test_segment_ucs2(self):
+        tp_dcs, parts = concat.segment('Ж' * 71)
+        self.assertEqual(tp_dcs, concat.UCS2)
+        self.assertEqual([len(p) for p in parts], [67, 4])
+        # a surrogate pair takes two code units, and can't be split
+        tp_dcs, parts = concat.segment('Ж' * 66 + '\U0001f600' * 3)
+        self.assertEqual(parts, ['Ж' * 66, '\U0001f600' * 3])
+
+    def test_too_long(self):
+        concat.segment('a' * 153 * concat.MAX_PARTS)
+        self.assertRaises(ValueError, concat.segment,
+                          'a' * (153 * concat.MAX_PARTS + 1))
+
+    def test_deliver_parts(self):
+        pdus = concat.create_deliver('123', '456', 'x' * 400, ref=42)
+        self.assertEqual(len(pdus), 3)
+        for seq, pdu in enumerate(pdus, 1):
+            s = SMS_DELIVER.fromPDU(pdu.toPDU(), '456')
+            self.assertEqual(s.tp_oa, '123')
+            self.assertEqual(s.tp_dcs, concat.GSM7)
+            self.assertEqual(s.user_data_headers,
+                             [(concat.IE_CONCAT_8BIT, [42, 3, seq])])
+            self.assertTrue(s.tp_udl <= 160)
+
+    def test_submit_parts_ucs2(self):
+        pdus = concat.create_submit(None, '456', BROADCAST_UCS2)
+        refs = set()
+        text = ''
+        for pdu in pdus:
+            s = SMS_SUBMIT.fromPDU(pdu.toPDU(), 'sender')
+            self.assertTrue(len(s.tp_ud) <= 140)
+            refs.add(s.user_data_headers[0][1][0])
+            text += s.user_data
+        self.assertEqual(len(refs), 1)
+        self.assertEqual(text, BROADCAST_UCS2)
+
+    def test_concat_info(self):
+        self.assertEqual(concat.concat_info([(0, [7, 3, 2])]), (7, 3, 2))
+        self.assertEqual(concat.concat_info([(8, [1, 2, 3, 1])]),
+                         (0x102, 3, 1))
+        self.assertEqual(concat.concat_info([]), None)
+        self.assertEqual(concat.concat_info([(0, [7, 3, 4])]), None)
+
+    def test_reassemble(self):
+        r = concat.Reassembler()
+        pdus = [SMS_SUBMIT.fromPDU(p.toPDU(), 'sender') for p in
+                concat.create_submit(None, '456', BROADCAST, ref=5)]
+        # parts may arrive out of order, and from other senders in between
+        for pdu in reversed(pdus[1:]):
+            self.assertEqual(r.add('IMSI001', pdu), None)
+        self.assertEqual(r.add('IMSI002', pdus[0]), None)
+        self.assertEqual(r.add('IMSI001', pdus[0]), BROADCAST)
+        self.assertEqual(len(r), 1)
+        single = SMS_SUBMIT.create(None, '456', 'hi')
+        self.assertEqual(r.add('IMSI001', single), 'hi')
+
+    def test_reassembly_timeout(self):
+        clock = FakeClock()
+        r = concat.Reassembler(timeout=60, clock=clock)
+        first, second = [SMS_SUBMIT.fromPDU(p.toPDU(), 'sender') for p in
+                         concat.create_submit(None, '456', 'y' * 200)]
+        r.add('IMSI001', first)
+        clock.now += 30
+        self.assertEqual(r.evict(), [])
+        clock.now += 30
+        ref = first.user_data_headers[0][1][0]
+        self.assertEqual(r.evict(), [('IMSI001', ref, 2)])
+        # the first part is gone, so the second part starts over
+        self.assertEqual(r.add('IMSI001', second), None)
+        self.assertEqual(len(r), 1)
+
+    def test_reassembly_max_pending(self):
+        r = concat.Reassembler(max_pending=2)
+        first = SMS_SUBMIT.fromPDU(
+            concat.create_submit(None, '456', 'z' * 200)[0].toPDU(), 'sender')
+        for sender in ('a', 'b', 'c'):
+            r.add(sender, first)
+        self.assertEqual([key[0] for key in r._pending], ['b', 'c'])
+
+    def test_broadcast_throughput(self):
+        # building the parts of a 7 part broadcast for 200 recipients
+        start = time.time()
+        count = 0
+        for i in range(200):
+            count += len(concat.create_deliver('101', '5551%04d' % i,
+                                               BROADCAST))
+        elapsed = time.time() - start
+        self.assertEqual(count, 200 * 7)
+        self.assertTrue(count / elapsed > 1000, '%.0f PDUs/s' %
+                        (count / elapsed))
+
+    def test_ucs2_broadcast_throughput(self):
+        start = time.time()
+        count = 0
+        for i in range(200):
+            count += len(concat.create_deliver('101', '5551%04d' % i,
+                                               BROADCAST_UCS2))
+        elapsed = time.time() - start
+        self.assertEqual(count, 200 * 14)
+        self.assertTrue(count / elapsed > 1000, '%.0f PDUs/s' %
+                        (count / elapsed))
+
+    def test_segment_throughput(self):
+        body = BROADCAST * 20
+        start = time.time()
+        for i in range(100):
+            concat.segment(body)
+        self.assertTrue(time.time() - start < 2)
+
+    def test_reassembly_throughput(self):
+        pdus = [SMS_SUBMIT.fromPDU(p.toPDU(), 'sender') for p in
+                concat.create_submit(None, '456', BROADCAST, ref=1)]
+        r = concat.Reassembler()
+        start = time.time()
+        for i in range(2000):
+            for pdu in pdus:
+                text = r.add('IMSI%d' % i, pdu)
+        elapsed = time.time() - start
+        self.assertEqual(text, BROADCAST)
+        self.assertEqual(len(r), 0)
+        self.assertTrue(len(pdus) * 2000 / elapsed > 10000)
+
+
+if __name__ == '__main__':
+    unittest.main()
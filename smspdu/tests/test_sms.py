@@ -54,6 +54,19 @@ class SMS_PDU_Test(unittest.TestCase):
         output = 'hellohello'
         self.assertEqual(unpack7bit(input), output)
 
+    def test_decoding_7_bit_bytes(self):
+        from smspdu.pdu import unpack7bit
+        input = bytes([0xE8, 0x32, 0x9B, 0xFD, 0x46, 0x97, 0xD9, 0xEC, 0x37])
+        self.assertEqual(unpack7bit(input), 'hellohello')
+        self.assertEqual(unpack7bit(memoryview(input)), 'hellohello')
+
+    def test_decoding_7_bit_header(self):
+        from smspdu.pdu import pack7bit, unpack7bit
+        # pack7bit counts the UDH length octet, unpack7bit doesn't
+        for headerlen in range(1, 7):
+            l, packed = pack7bit('abcdefgh', headerlen + 1)
+            self.assertEqual(unpack7bit(packed, headerlen), 'abcdefgh')
+
     def test_nibbleswap(self):
         from smspdu.pdu import nibbleswap
         input_bytes = [0xE8, 0x32, 0x9B, 0xFD, 0x46, 0x97, 0xD9, 0xEC, 0x37]
@@ -117,6 +130,26 @@ class SMS_PDU_Test(unittest.TestCase):
         self.assertEqual(c.encode('hello'), 'hello')
         self.assertEqual(c.encode('\u20AC'), '\x1b\x65')
         self.assertRaises(UnicodeError, c.encode, '\u20AD')
+        self.assertEqual(c.encode('a\u20ADb', 'replace'), 'a?b')
+        self.assertEqual(c.encode('a\u20ADb', 'ignore'), 'ab')
+
+    def test_gsm_decode(self):
+        c = smspdu.gsm0338()
+        self.assertEqual(c.decode('hello'), ('hello', 5))
+        self.assertEqual(c.decode('\x1b\x65 \x1b\x1b\x00'),
+                         ('\u20AC \xa0@', 4))
+        self.assertEqual(c.decode(b'\x1b\x3c\x02\x1b\x3e'), ('[$]', 3))
+        self.assertRaises(ValueError, c.decode, 'abc\x1b')
+        self.assertEqual(c.decode('abc\x1b', 'replace'), ('abc?', 4))
+        self.assertRaises(UnicodeDecodeError, c.decode, 'ab\x80')
+
+    def test_gsm_septet_count(self):
+        from smspdu.gsm0338 import is_gsm7, septet_count
+        self.assertTrue(is_gsm7('hello [world] \u20AC'))
+        self.assertFalse(is_gsm7('h\u20ADllo'))
+        c = smspdu.gsm0338()
+        for message in ('hello', 'hello [world] \u20AC', '{}|~^\\\x0c', ''):
+            self.assertEqual(septet_count(message), len(c.encode(message)))
 
     def test_tpdu_decode(self):
         s = smspdu.SMS_SUBMIT.fromPDU(
@@ -125,6 +158,18 @@ class SMS_PDU_Test(unittest.TestCase):
         self.assertEqual(s.tp_address, '61416271170')
         self.assertEqual(s.user_data, 'hellohello')
 
+    def test_tpdu_decode_bytes(self):
+        s = smspdu.SMS_SUBMIT.fromPDU(
+            bytes.fromhex('11010b911614261771f000000b0ae8329bfd4697d9ec37'),
+            '447924449999', 'test')
+        self.assertEqual(s.tp_address, '61416271170')
+        self.assertEqual(s.user_data, 'hellohello')
+
+    def test_tpdu_decode_truncated(self):
+        from smspdu.pdu import TruncatedPDUError
+        self.assertRaises(TruncatedPDUError, smspdu.SMS_SUBMIT.fromPDU,
+                          '11010b911614261771f000', '447924449999')
+
     def test_tpdu_decode_sample_deliver(self):
         s = smspdu.SMS_DELIVER.fromPDU(
             '040BC87238880900F10000993092516195800AE8329BFD4697D9EC37',